@@ -1,13 +1,18 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 import time
 
 from config import Config
 from database import DatabaseManager
-from sql_generator import SQLGenerator
+from history_store import get_history_store
+from pipeline import PipelineError
+from service_client import get_query_client
+from sql_parser import SQLParseError, parse_sql
+from lazy import lazy_import
+from tracing import span, span_rows, start_metrics_server
+
+px = lazy_import("plotly.express")
 
 # Page configuration
 config = Config()
@@ -18,13 +23,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Optional standalone Prometheus endpoint for this process's stage timings
+if config.METRICS_PORT:
+    start_metrics_server(config.METRICS_PORT)
+
 # Initialize session state
 if 'db_manager' not in st.session_state:
     st.session_state.db_manager = DatabaseManager()
-if 'sql_generator' not in st.session_state:
-    st.session_state.sql_generator = SQLGenerator()
-if 'query_history' not in st.session_state:
-    st.session_state.query_history = []
+if 'query_client' not in st.session_state:
+    st.session_state.query_client = get_query_client()
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 
@@ -38,16 +45,76 @@ def login():
     if st.button("Sign in"):
         if username == config.LOGIN_USERNAME and password == config.LOGIN_PASSWORD:
             st.session_state.authenticated = True
+            st.session_state.user = username
             st.rerun()
         else:
             st.error("Invalid username or password")
 
     return False
 
+def current_user():
+    return st.session_state.get("user") or config.LOGIN_USERNAME
+
+def render_history():
+    """Searchable persistent history; any entry can be re-run from its cached result."""
+    store = get_history_store()
+    user = current_user()
+    total = store.count(user)
+    if not total:
+        return
+
+    st.subheader("📝 Query History")
+    search = st.text_input("Search history", key="history_search")
+    with span("ui.history", search=bool(search)):
+        entries = store.search(user, search, limit=50) if search else store.recent(user, limit=50)
+    st.caption(f"Showing {len(entries)} of {total} queries")
+    if not entries:
+        return
+
+    history_df = pd.DataFrame(entries)
+    history_df["created_at"] = pd.to_datetime(history_df["created_at"], unit="s")
+    st.dataframe(
+        history_df[["id", "created_at", "question", "sql", "row_count", "total_ms"]],
+        use_container_width=True,
+        hide_index=True,
+    )
+
+    by_id = {entry["id"]: entry for entry in entries}
+    selected = st.selectbox(
+        "Re-run a previous query",
+        list(by_id),
+        format_func=lambda entry_id: f"#{entry_id} - {by_id[entry_id]['question'][:80]}",
+    )
+    if st.button("↻ Re-run"):
+        entry = by_id[selected]
+        try:
+            with span("ui.rerun"):
+                result_df, _, cached = st.session_state.query_client.rerun(entry["sql"], entry["fingerprint"])
+        except PipelineError as e:
+            st.error(str(e))
+            return
+        st.caption("From cached result." if cached else "Re-executed against the database.")
+        with span("render.dataframe", rows=len(result_df)):
+            st.dataframe(result_df, use_container_width=True)
+
+def render_timings(run_span):
+    """Collapsible per-stage timing breakdown for the current run."""
+    with st.expander("⏱️ Timings", expanded=False):
+        rows = span_rows(run_span)
+        if len(rows) > 1:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption(f"No pipeline stages ran in this run ({run_span.duration_ms:.0f} ms total).")
+
 def main():
     if not login():
         return
 
+    with span("app.run") as run_span:
+        render_page()
+    render_timings(run_span)
+
+def render_page():
     # Header
     st.title("📊 Analytics AI Tool")
     st.markdown("Convert natural language to SQL queries and visualize your data instantly!")
@@ -71,11 +138,14 @@ def main():
         
         # Database info
         st.subheader("📋 Database Tables")
-        tables = st.session_state.db_manager.get_all_tables()
+        try:
+            tables = st.session_state.query_client.schema()
+        except PipelineError as e:
+            st.error(str(e))
+            tables = {}
         if tables:
-            for table in tables:
+            for table, schema in tables.items():
                 with st.expander(f"📊 {table}"):
-                    schema = st.session_state.db_manager.get_table_schema(table)
                     if schema:
                         schema_df = pd.DataFrame(schema)
                         st.dataframe(schema_df, use_container_width=True)
@@ -91,18 +161,18 @@ def main():
         # Query input
         user_query = st.text_area(
             "Enter your question in plain English:",
-            placeholder="e.g., Show me the top 10 products by sales amount",
+            placeholder="e.g., Show total bookings by platform for the last 30 days",
             height=100
         )
         
         # Example queries
         st.subheader("💡 Example Queries")
         example_queries = [
-            "Show me total sales by product",
-            "What are the top 5 customers by age?",
-            "Show sales trends over time",
-            "Which region has the highest sales?",
-            "Show average sales amount by month"
+            "Show total bookings by platform",
+            "What are the top 5 countries by daily active users?",
+            "Show daily bookings over time",
+            "Which payer type has the highest bookings?",
+            "Show average slot spins per user by engagement_7d"
         ]
         
         selected_example = st.selectbox("Or select an example:", [""] + example_queries)
@@ -124,31 +194,20 @@ def main():
             return
         
         with st.spinner("Generating SQL query..."):
-            # Get schema information
-            tables = st.session_state.db_manager.get_all_tables()
-            schema_info = {}
-            for table in tables:
-                schema_info[table] = st.session_state.db_manager.get_table_schema(table)
-            
-            if not schema_info:
-                st.error("No database schema found. Please connect to database and create tables.")
+            # Generate SQL from the live schema (validated as read-only by the client)
+            try:
+                with span("ui.generate_sql") as generate_span:
+                    sql_query = st.session_state.query_client.generate_sql(user_query, schema_prompt=True)
+            except PipelineError as e:
+                st.error(str(e))
                 return
             
-            # Generate SQL
-            sql_query = st.session_state.sql_generator.generate_sql(user_query, schema_info)
-            
-            if not sql_query:
-                st.error("Failed to generate SQL query.")
+            # Cap the outer query's rows (adds or lowers its LIMIT)
+            try:
+                sql_query = parse_sql(sql_query).with_limit(limit_results)
+            except SQLParseError as e:
+                st.error(f"Could not parse the generated SQL: {e}")
                 return
-            
-            # Validate SQL
-            if not st.session_state.sql_generator.validate_sql(sql_query):
-                st.error("Generated query contains potentially dangerous operations.")
-                return
-            
-            # Add LIMIT if not present
-            if "LIMIT" not in sql_query.upper():
-                sql_query += f" LIMIT {limit_results}"
         
         # Display generated SQL
         st.subheader("🔍 Generated SQL Query")
@@ -157,34 +216,52 @@ def main():
         # Show explanation
         if show_explanation:
             with st.spinner("Generating explanation..."):
-                explanation = st.session_state.sql_generator.explain_sql(sql_query)
-                if explanation:
+                try:
+                    with span("ui.explain_sql"):
+                        explanation = st.session_state.query_client.explain_sql(sql_query)
                     st.info(f"**Query Explanation:** {explanation}")
+                except PipelineError as e:
+                    st.error(str(e))
         
         # Execute query
         with st.spinner("Executing query..."):
-            result_df = st.session_state.db_manager.execute_query(sql_query)
+            try:
+                with span("ui.execute") as execute_span:
+                    result_df, fingerprint = st.session_state.query_client.execute(sql_query)
+            except PipelineError as e:
+                st.error(str(e))
+                result_df = None
             
             if result_df is not None and not result_df.empty:
                 # Display results
                 st.subheader("📊 Query Results")
-                st.dataframe(result_df, use_container_width=True)
+                with span("render.dataframe", rows=len(result_df)):
+                    st.dataframe(result_df, use_container_width=True)
                 
                 # Auto-generate visualizations
                 if auto_visualize and len(result_df.columns) >= 2:
                     st.subheader("📈 Visualizations")
-                    generate_visualizations(result_df)
+                    with span("render.visualizations"):
+                        generate_visualizations(result_df)
                 
                 # Save to query history
-                st.session_state.query_history.append({
-                    'timestamp': datetime.now(),
-                    'natural_query': user_query,
-                    'sql_query': sql_query,
-                    'result_count': len(result_df)
-                })
+                get_history_store().add(
+                    current_user(),
+                    user_query,
+                    sql_query,
+                    fingerprint=fingerprint,
+                    row_count=len(result_df),
+                    timings={
+                        "generate_ms": generate_span.duration_ms,
+                        "execute_ms": execute_span.duration_ms,
+                        "total_ms": generate_span.duration_ms + execute_span.duration_ms,
+                    },
+                    source="app",
+                )
                 
                 # Download option
-                csv = result_df.to_csv(index=False)
+                with span("render.export_csv"):
+                    csv = result_df.to_csv(index=False)
                 st.download_button(
                     label="📥 Download Results as CSV",
                     data=csv,
@@ -198,10 +275,7 @@ def main():
                 st.error("Query execution failed.")
     
     # Query history
-    if st.session_state.query_history:
-        st.subheader("📝 Query History")
-        history_df = pd.DataFrame(st.session_state.query_history)
-        st.dataframe(history_df, use_container_width=True)
+    render_history()
 
 def generate_visualizations(df):
     """Generate automatic visualizations based on data types"""
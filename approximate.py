@@ -0,0 +1,327 @@
+"""
+Approximate ("fast estimate") execution over user-hash samples of user_days.
+
+``build_samples`` materializes 1% and 10% samples of ``user_days`` once
+(``python run.py sample``). Users are chosen by a stable hash of ``user_id``
+into ``BUCKETS`` buckets, so a sampled user keeps all of their days: per-user
+metrics, ``COUNT(DISTINCT user_id)`` and retention-style questions stay
+consistent, and the 1% sample is a subset of the 10% one. The bucket is kept in
+the ``_sample_bucket`` column.
+
+``rewrite_for_sample`` turns an eligible aggregate query into
+
+- the point-estimate query: ``user_days`` replaced by the sample, ``SUM``,
+  ``COUNT`` and ``TOTAL`` scaled up by the sampling rate (``AVG`` and ratios of
+  sums need no scaling), result column names unchanged;
+- the replicate query: the same aggregates per group and per
+  ``_sample_bucket % REPLICATES`` replicate (each a disjoint set of users).
+
+``confidence_intervals`` adds ``<column>_low`` / ``<column>_high`` columns
+from the spread of the replicate estimates (the random-groups variance
+estimator, which accounts for rows of one user being correlated).
+
+Eligible: a single SELECT whose outer FROM is just ``user_days``, with SUM /
+COUNT / AVG / TOTAL aggregates, ``COUNT(DISTINCT ...)`` only over
+``user_id``, and no MIN/MAX, window functions, DISTINCT, compound SELECTs or
+grouping by ``user_id``. Anything else runs exactly (``NotApproximable``).
+"""
+
+import math
+import sqlite3
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from sql_parser import closing_paren, parse_sql
+from tracing import span
+
+BASE_TABLE = "user_days"
+SAMPLE_PERCENTS = (1, 10)
+BUCKETS = 10_000
+BUCKET_COLUMN = "_sample_bucket"
+REPLICATES = 10
+REPLICATE_COLUMN = "_replicate"
+META_TABLE = "sample_meta"
+# Two-sided 95% Student t quantile for REPLICATES - 1 degrees of freedom
+T_95 = 2.262
+
+_SCALED = {"sum", "count", "total"}
+_UNSCALED = {"avg"}
+_EXTREMES = {"min", "max", "group_concat", "string_agg", "median"}
+_CLAUSES = ("FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "WINDOW")
+
+
+class NotApproximable(ValueError):
+    """The query cannot be answered from a sample; the message says why."""
+
+
+def sample_table(percent: int) -> str:
+    return f"{BASE_TABLE}_sample_{percent}pct"
+
+
+def user_bucket(user_id: Any) -> int:
+    """Stable bucket in ``[0, BUCKETS)`` for a user id (the same on every platform and run)."""
+    return zlib.crc32(str(user_id).encode("utf-8")) % BUCKETS
+
+
+def build_samples(db_path: str, percents=SAMPLE_PERCENTS, force: bool = False) -> List[Dict[str, Any]]:
+    """Create the sample tables in the SQLite database at ``db_path``.
+
+    The largest sample is read from ``user_days``, smaller ones from it.
+    Existing samples are kept unless ``force``. Returns one
+    ``sample_meta`` row per sample.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.create_function("user_bucket", 1, user_bucket, deterministic=True)
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {META_TABLE} (table_name TEXT PRIMARY KEY, percent INTEGER, "
+            "base_rows INTEGER, sample_rows INTEGER, built_at TEXT)"
+        )
+        existing = {row[0] for row in conn.execute(f"SELECT table_name FROM {META_TABLE}")}
+        base_rows = conn.execute(f"SELECT COUNT(*) FROM {BASE_TABLE}").fetchone()[0]
+        source = None
+        for percent in sorted(percents, reverse=True):
+            table = sample_table(percent)
+            if table in existing and not force:
+                source = table
+                continue
+            with span("approximate.build_sample", percent=percent) as s:
+                threshold = BUCKETS * percent // 100
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+                if source is None:
+                    conn.execute(
+                        f"CREATE TABLE {table} AS SELECT * FROM "
+                        f"(SELECT *, user_bucket(user_id) AS {BUCKET_COLUMN} FROM {BASE_TABLE}) "
+                        f"WHERE {BUCKET_COLUMN} < {threshold}"
+                    )
+                else:
+                    conn.execute(f"CREATE TABLE {table} AS SELECT * FROM {source} WHERE {BUCKET_COLUMN} < {threshold}")
+                conn.execute(f"CREATE INDEX idx_{table}_day ON {table} (event_day_pst)")
+                sample_rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {META_TABLE} VALUES (?, ?, ?, ?, ?)",
+                    (table, percent, base_rows, sample_rows, time.strftime("%Y-%m-%dT%H:%M:%S")),
+                )
+                conn.commit()
+                s.set(rows=sample_rows)
+            source = table
+        conn.execute("ANALYZE")
+        conn.commit()
+        return [
+            dict(zip(("table_name", "percent", "base_rows", "sample_rows", "built_at"), row))
+            for row in conn.execute(f"SELECT * FROM {META_TABLE} ORDER BY percent")
+        ]
+    finally:
+        conn.close()
+
+
+class SampledQuery:
+    """An eligible query rewritten for one sample."""
+
+    def __init__(self, sql: str, replicate_sql: str, percent: int,
+                 key_columns: List[str], estimate_columns: List[Tuple[str, bool]]):
+        self.sql = sql
+        self.replicate_sql = replicate_sql
+        self.percent = percent
+        self.key_columns = key_columns
+        # (result column, additive): additive columns are 0 in replicates without the group
+        self.estimate_columns = estimate_columns
+
+
+def rewrite_for_sample(sql: str, percent: int) -> SampledQuery:
+    """Rewrite ``sql`` for the ``percent`` sample; raises ``NotApproximable``."""
+    parsed = parse_sql(sql)
+    if len(parsed.statements) != 1 or parsed.statement_type != "SELECT":
+        raise NotApproximable("only single SELECT statements can be estimated")
+    tokens = parsed.statements[0]
+    outer = _outer_indexes(tokens)
+    clauses = {}
+    for i in outer:
+        token = tokens[i]
+        if token.depth == 0 and token.is_keyword(*_CLAUSES, "UNION", "INTERSECT", "EXCEPT"):
+            if token.is_keyword("UNION", "INTERSECT", "EXCEPT"):
+                raise NotApproximable("compound SELECTs are not supported")
+            clauses.setdefault(token.upper, i)
+    if "FROM" not in clauses:
+        raise NotApproximable("the query does not read a table")
+    if "WINDOW" in clauses or any(tokens[i].is_keyword("OVER") for i in outer):
+        raise NotApproximable("window functions are not supported")
+    if tokens[1].is_keyword("DISTINCT"):
+        raise NotApproximable("SELECT DISTINCT lists values and cannot be estimated")
+
+    from_end = min([clauses[c] for c in _CLAUSES[1:] if c in clauses] + [len(tokens)])
+    from_tokens = tokens[clauses["FROM"] + 1:from_end]
+    refs = [ref for ref in parsed.table_refs if from_tokens and ref[1] == from_tokens[0].start]
+    if (len(refs) != 1 or refs[0][0] != BASE_TABLE
+            or any(t.value == "," or t.is_keyword("JOIN") for t in from_tokens if t.depth == 0)):
+        raise NotApproximable(f"the outer query must read {BASE_TABLE} alone (no joins or derived tables)")
+    group_end = min([clauses[c] for c in ("HAVING", "ORDER", "LIMIT") if c in clauses] + [len(tokens)])
+    if "GROUP" in clauses and any(
+        t.kind == "word" and t.value.lower() == "user_id" for t in tokens[clauses["GROUP"]:group_end]
+    ):
+        raise NotApproximable("per-user results need every user")
+
+    # Aggregate calls of the outer query: (name, start token, closing paren token)
+    calls = []
+    for i in outer:
+        token = tokens[i]
+        if token.kind != "word" or i + 1 >= len(tokens) or tokens[i + 1].value != "(":
+            continue
+        name = token.value.lower()
+        if name in _EXTREMES:
+            raise NotApproximable(f"{name.upper()} cannot be estimated from a sample")
+        if name not in _SCALED | _UNSCALED:
+            continue
+        close = closing_paren(tokens, i + 1)
+        if tokens[i + 2].is_keyword("DISTINCT") and not any(
+            t.kind == "word" and t.value.lower() == "user_id" for t in tokens[i + 3:close]
+        ):
+            raise NotApproximable("COUNT(DISTINCT ...) can only be estimated over user_id")
+        calls.append((name, i, close))
+
+    items = _select_items(tokens, 1, clauses["FROM"])
+    key_columns: List[str] = []
+    estimate_columns: List[Tuple[str, bool]] = []
+    aliases_to_add: Dict[int, str] = {}
+    for first, last in items:
+        if tokens[first].value == "*" and first == last:
+            raise NotApproximable("SELECT * lists rows and cannot be estimated")
+        item_calls = [c for c in calls if first <= c[1] <= last]
+        name, expression_last = _item_name(sql, tokens, first, last)
+        if not item_calls:
+            key_columns.append(name)
+            continue
+        if expression_last == last:
+            aliases_to_add[last] = name
+        single = len(item_calls) == 1 and item_calls[0][1] == first and item_calls[0][2] == expression_last
+        estimate_columns.append((name, single and item_calls[0][0] in _SCALED))
+    if not estimate_columns:
+        raise NotApproximable("not an aggregate query")
+
+    def render(scale, end: int, extra_column: str = "") -> str:
+        """Rewritten text of tokens ``[0, end)``, aggregates scaled by ``scale``."""
+        stop = tokens[end - 1].end
+        edits = []  # (position, resume position, inserted text); stable-sorted by position
+        for name, start, close in calls:
+            if name in _SCALED and tokens[close].end <= stop:
+                edits.append((tokens[start].start, tokens[start].start, "("))
+                edits.append((tokens[close].end, tokens[close].end, f" * {scale})"))
+        for last, alias in aliases_to_add.items():
+            quoted = alias.replace('"', '""')
+            edits.append((tokens[last].end, tokens[last].end, f' AS "{quoted}"'))
+        if extra_column:
+            at = tokens[clauses["FROM"] - 1].end
+            edits.append((at, at, extra_column))
+        _, ref_start, ref_end, ref_alias = refs[0]
+        edits.append((ref_start, ref_end, sample_table(percent) + ("" if ref_alias else f" AS {BASE_TABLE}")))
+        pieces = []
+        position = tokens[0].start
+        for at, resume, text in sorted(edits, key=lambda e: e[0]):
+            pieces.append(sql[position:at])
+            pieces.append(text)
+            position = resume
+        pieces.append(sql[position:stop])
+        return "".join(pieces)
+
+    scale = 100 // percent if 100 % percent == 0 else 100 / percent
+    point_sql = render(scale, len(tokens))
+    # The replicate id goes last in the select list so GROUP BY positions stay valid;
+    # HAVING, ORDER BY and LIMIT are dropped (groups are matched to the point estimate)
+    replicate_sql = render(scale * REPLICATES, group_end,
+                           f", {BUCKET_COLUMN} % {REPLICATES} AS {REPLICATE_COLUMN}")
+    replicate_group = f"{BUCKET_COLUMN} % {REPLICATES}"
+    replicate_sql += f", {replicate_group}" if "GROUP" in clauses else f" GROUP BY {replicate_group}"
+    return SampledQuery(point_sql, replicate_sql, percent, key_columns, estimate_columns)
+
+
+def confidence_intervals(point: pd.DataFrame, replicates: pd.DataFrame, query: SampledQuery,
+                         critical: float = T_95) -> pd.DataFrame:
+    """``point`` with ``<column>_low`` / ``<column>_high`` after every estimated column."""
+    keys = query.key_columns
+    result = point.copy()
+    if any(k not in replicates.columns or k not in point.columns for k in keys):
+        return result  # group columns could not be matched; no intervals rather than wrong ones
+    for column, additive in query.estimate_columns:
+        if column not in replicates.columns or column not in result.columns:
+            continue
+        values = pd.to_numeric(replicates[column], errors="coerce")
+        frame = replicates[keys + [REPLICATE_COLUMN]].assign(_value=values)
+        if keys:
+            wide = frame.set_index(keys + [REPLICATE_COLUMN])["_value"].unstack(REPLICATE_COLUMN)
+        else:
+            wide = frame.set_index(REPLICATE_COLUMN)["_value"].to_frame().T
+        wide = wide.reindex(columns=range(REPLICATES))
+        if additive:
+            wide = wide.fillna(0)
+        half_width = critical * wide.std(axis=1, ddof=1) / math.sqrt(REPLICATES)
+        non_negative = bool((values.dropna() >= 0).all())
+        if keys:
+            half_width = half_width.rename("_half").reset_index()
+            merged = result[keys].merge(half_width, on=keys, how="left")["_half"].to_numpy()
+        else:
+            merged = [half_width.iloc[0] if len(half_width) else float("nan")] * len(result)
+        estimate = pd.to_numeric(result[column], errors="coerce")
+        position = result.columns.get_loc(column) + 1
+        low = estimate - merged
+        result.insert(position, f"{column}_low", low.clip(lower=0) if non_negative else low)
+        result.insert(position + 1, f"{column}_high", estimate + merged)
+    return result
+
+
+def choose_sample(samples: List[Dict[str, Any]], min_rows: int) -> Optional[Dict[str, Any]]:
+    """Smallest sample with at least ``min_rows`` rows (else the largest); None without samples."""
+    if not samples:
+        return None
+    ordered = sorted(samples, key=lambda s: s["percent"])
+    for sample in ordered:
+        if sample["sample_rows"] >= min_rows:
+            return sample
+    return ordered[-1]
+
+
+# -- token helpers --------------------------------------------------------------
+
+def _outer_indexes(tokens) -> List[int]:
+    """Indexes of tokens outside subqueries."""
+    indexes = []
+    skip_until = None
+    for i, token in enumerate(tokens):
+        if skip_until is not None:
+            if i <= skip_until:
+                continue
+            skip_until = None
+        if token.value == "(" and i + 1 < len(tokens) and tokens[i + 1].is_keyword("SELECT", "WITH", "VALUES"):
+            skip_until = closing_paren(tokens, i)
+            continue
+        indexes.append(i)
+    return indexes
+
+
+def _select_items(tokens, start: int, end: int) -> List[Tuple[int, int]]:
+    """(first, last) token index of each select-list item between ``start`` and ``end``."""
+    items = []
+    first = start
+    for i in range(start, end):
+        if tokens[i].value == "," and tokens[i].depth == 0:
+            items.append((first, i - 1))
+            first = i + 1
+    items.append((first, end - 1))
+    return items
+
+
+def _item_name(sql: str, tokens, first: int, last: int) -> Tuple[str, int]:
+    """Result column name of a select item and the index of its expression's last token
+    (before the alias, if any)."""
+    token = tokens[last]
+    name = token.value[1:-1] if token.kind == "quoted" else token.value
+    if last > first and token.kind in ("word", "quoted") and not token.is_keyword() and tokens[last - 1].value != ".":
+        if tokens[last - 1].is_keyword("AS"):
+            return name, last - 2
+        if tokens[last - 1].value == ")" or tokens[last - 1].kind in ("word", "quoted"):
+            return name, last - 1
+    if token.kind in ("word", "quoted") and (first == last or tokens[last - 1].value == "."):
+        return name, last
+    return sql[tokens[first].start:token.end], last
@@ -0,0 +1,198 @@
+"""
+Batch mode: run a file of natural-language questions end to end.
+
+Questions are read from JSONL (``{"question": ..., "id"?: ..., "sql"?: ...}``
+per line) or CSV (a ``question`` column, optional ``id``/``sql``). Each one
+goes through generation, validation, execution and optionally insights,
+concurrently but with separate bounds on LLM and DB work. Results are written
+as Parquet or CSV next to a per-question timing and token report.
+
+Generated SQL, query results and insights all go through the shared disk
+cache, so re-running an unchanged question set only reads from the cache.
+
+    python run.py batch weekly_kpis.jsonl --out batch_output --insights
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+import pipeline
+from cache import result_fingerprint
+from config import Config
+from pipeline import PipelineError
+from result_summary import estimate_tokens
+
+REPORT_FIELDS = [
+    "id", "question", "status", "error", "sql", "rows", "fingerprint", "output_file",
+    "generate_ms", "validate_ms", "execute_ms", "insights_ms", "total_ms",
+    "sql_cached", "prompt_tokens", "completion_tokens", "insights_tokens_est",
+]
+
+
+def load_questions(path: str) -> List[Dict[str, Any]]:
+    """Read questions from a .jsonl/.json-lines or .csv file."""
+    items: List[Dict[str, Any]] = []
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                items.append({k.strip().lower(): (v or "").strip() for k, v in row.items() if k})
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    item = json.loads(line)
+                    items.append(item if isinstance(item, dict) else {"question": str(item)})
+
+    questions = []
+    for i, item in enumerate(items, start=1):
+        question = str(item.get("question") or "").strip()
+        if not question:
+            continue
+        questions.append({
+            "id": str(item.get("id") or f"q{i:03d}"),
+            "question": question,
+            "sql": (item.get("sql") or "").strip() or None,
+        })
+    duplicates = sorted(i for i, count in Counter(q["id"] for q in questions).items() if count > 1)
+    if duplicates:
+        raise ValueError(f"Duplicate question id(s) in {path}: {', '.join(duplicates)}")
+    return questions
+
+
+def _slug(text: str) -> str:
+    """File name for a question id; ids that are not already safe names get a hash suffix,
+    so "a/b" and "a b" do not share a file."""
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", text).strip("_")[:60] or "result"
+    if slug != text:
+        slug += "-" + hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
+    return slug
+
+
+class BatchRunner:
+    """Runs questions concurrently with bounded LLM and DB concurrency."""
+
+    def __init__(self, out_dir: str, fmt: str = "parquet", insights: bool = False,
+                 llm_concurrency: int = 4, db_concurrency: int = 4, use_cache: bool = True):
+        if fmt not in ("parquet", "csv"):
+            raise ValueError("fmt must be 'parquet' or 'csv'")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.insights = insights
+        self.use_cache = use_cache
+        self.llm_slots = threading.BoundedSemaphore(llm_concurrency)
+        self.db_slots = threading.BoundedSemaphore(db_concurrency)
+        self.workers = llm_concurrency + db_concurrency
+
+    def run(self, questions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        os.makedirs(os.path.join(self.out_dir, "results"), exist_ok=True)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch") as pool:
+            report = list(pool.map(self.run_one, questions))
+        self.write_report(report)
+        return report
+
+    def run_one(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        row: Dict[str, Any] = {"id": item["id"], "question": item["question"], "status": "ok"}
+        started = time.perf_counter()
+        try:
+            sql = item.get("sql")
+            if sql:
+                row["sql_cached"] = True
+            else:
+                t0 = time.perf_counter()
+                with self.llm_slots:
+                    sql, usage = pipeline.generate_sql_with_usage(item["question"], use_cache=self.use_cache)
+                row["generate_ms"] = _ms(t0)
+                row["sql_cached"] = bool(usage.get("cached"))
+                row["prompt_tokens"] = usage.get("prompt_tokens")
+                row["completion_tokens"] = usage.get("completion_tokens")
+            row["sql"] = sql
+
+            t0 = time.perf_counter()
+            pipeline.validate_sql(sql)
+            row["validate_ms"] = _ms(t0)
+
+            t0 = time.perf_counter()
+            with self.db_slots:
+                df = pipeline.execute_sql(sql, use_cache=self.use_cache)
+            row["execute_ms"] = _ms(t0)
+            row["rows"] = int(len(df))
+            row["fingerprint"] = result_fingerprint(df)
+            row["output_file"] = self.write_result(item["id"], df)
+
+            if self.insights and not df.empty:
+                t0 = time.perf_counter()
+                with self.llm_slots:
+                    spec = pipeline.generate_result_insights(df, item["question"], row["fingerprint"])
+                row["insights_ms"] = _ms(t0)
+                if isinstance(spec, dict):
+                    text = json.dumps(spec)
+                    row["insights_tokens_est"] = estimate_tokens(text)
+                    with open(os.path.join(self.out_dir, "results", f"{_slug(item['id'])}.insights.json"), "w") as f:
+                        f.write(text)
+                else:
+                    row["status"] = "insights_failed"
+                    row["error"] = str(spec)
+        except PipelineError as e:
+            row["status"] = "error"
+            row["error"] = str(e)
+        except Exception as e:
+            row["status"] = "error"
+            row["error"] = f"{type(e).__name__}: {e}"
+        row["total_ms"] = _ms(started)
+        return row
+
+    def write_result(self, question_id: str, df: pd.DataFrame) -> str:
+        path = os.path.join(self.out_dir, "results", f"{_slug(question_id)}.{self.fmt}")
+        if self.fmt == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        return path
+
+    def write_report(self, report: List[Dict[str, Any]]):
+        with open(os.path.join(self.out_dir, "report.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(report)
+
+        totals = {
+            "questions": len(report),
+            "succeeded": sum(1 for r in report if r["status"] == "ok"),
+            "failed": sum(1 for r in report if r["status"] != "ok"),
+            "sql_cache_hits": sum(1 for r in report if r.get("sql_cached")),
+            "prompt_tokens": sum(r.get("prompt_tokens") or 0 for r in report),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in report),
+            "total_ms_sum": round(sum(r.get("total_ms") or 0 for r in report), 2),
+        }
+        with open(os.path.join(self.out_dir, "report.json"), "w", encoding="utf-8") as f:
+            json.dump({"summary": totals, "questions": report}, f, indent=2, default=str)
+
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
+
+
+def run_batch(path: str, out_dir: str, fmt: str = "parquet", insights: bool = False,
+              llm_concurrency: Optional[int] = None, db_concurrency: Optional[int] = None,
+              use_cache: bool = True) -> List[Dict[str, Any]]:
+    """Run every question in ``path`` and write results plus report.csv/report.json to ``out_dir``."""
+    runner = BatchRunner(
+        out_dir,
+        fmt=fmt,
+        insights=insights,
+        llm_concurrency=llm_concurrency or min(Config.SERVICE_LLM_WORKERS, 8),
+        db_concurrency=db_concurrency or Config.SERVICE_DB_WORKERS,
+        use_cache=use_cache,
+    )
+    return runner.run(load_questions(path))
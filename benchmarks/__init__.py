@@ -0,0 +1 @@
+"""Benchmarks and load tests. Run modules from the repo root, e.g. ``python -m benchmarks.service_load``."""
@@ -0,0 +1,531 @@
+"""
+Concurrent-session load test of the whole question-to-insights path.
+
+Simulates ``N`` analysts at once. Each one is a thread, as each Streamlit
+session runs its script in its own thread. Each asks questions from the
+recorded example mix (``benchmarks.queries``) through the same stages as
+``simple_app.main``:
+
+- ``generate_ms``  SQL generation (``pipeline.generate_sql_with_usage``)
+- ``validate_ms``  ``pipeline.validate_sql``
+- ``estimate_ms``  the cost guardrail (``pipeline.estimate_cost``)
+- ``execute_ms``   ``pipeline.execute_sql`` and the result fingerprint
+- ``decode_ms``    the part of execute spent building the result frame
+                   (``clean_result`` type coercion and dtype compaction)
+- ``render_ms``    plot frame, column profile and trend series
+- ``insights_ms``  streamed insights, including the chart figures they ask for
+- ``total_ms``     the whole question
+
+The LLM is ``StubLLM``, a local OpenAI-compatible endpoint. It answers SQL
+prompts with the recorded SQL and insight prompts with a JSON spec built from
+the result summary. Its latency is a lognormal time to first token followed by
+a fixed token rate, so LLM waits hold threads and connections the way a real
+endpoint does.
+
+Concurrency ramps through ``--ramp``. Each step runs for ``--duration``
+seconds and records p50/p95/p99 per stage, throughput, and peak RSS and thread
+counts. The report also gives the largest step whose p99 ``total_ms`` met
+``--slo-p99-ms``. Disk caches are bypassed unless ``--cache`` is given.
+Identical questions in flight still share one LLM call or scan, as in
+production. The report is written as JSON and, with ``--html``, as a
+self-contained page.
+
+    python -m benchmarks.app_load --rows 1000000 --ramp 1 2 4 8 16 32 --duration 30 \\
+        --output app_load.json --html app_load.html
+"""
+
+import argparse
+import html
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from benchmarks.queries import RECORDED_QUERIES
+from benchmarks.service_load import percentile
+from config import Config
+from lazy import is_available
+
+STAGES = ("generate_ms", "validate_ms", "estimate_ms", "execute_ms", "decode_ms",
+          "render_ms", "insights_ms", "total_ms")
+DECODE_SPANS = ("pipeline.coerce_types", "frame.compact")
+DEFAULT_RAMP = [1, 2, 4, 8, 16]
+SQL_ANCHOR = "User Request:"
+SUMMARY_ANCHOR = "Summary of the query results in JSON format:"
+
+
+class LoadError(Exception):
+    """A simulated question failed in a way the app would show as an error."""
+
+
+class StubLLM:
+    """Local OpenAI-compatible ``/chat/completions`` endpoint with modelled latency."""
+
+    def __init__(self, first_token_ms: float = 700, tokens_per_second: float = 60,
+                 jitter: float = 0.35, seed: int = 0):
+        self.first_token_ms = first_token_ms
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self.calls = 0
+
+    def start(self) -> str:
+        """Serve on a free local port in a background thread; returns the base URL."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                stub.handle(self, payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stub-llm", daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def first_token_delay(self) -> float:
+        with self._lock:
+            self.calls += 1
+            return self.first_token_ms / 1000 * self._random.lognormvariate(0, self.jitter)
+
+    def handle(self, request: BaseHTTPRequestHandler, payload: Dict[str, Any]):
+        prompt = (payload.get("messages") or [{}])[-1].get("content", "")
+        content = insights_response(prompt) if SUMMARY_ANCHOR in prompt else sql_response(prompt)
+        tokens = max(1, len(content) // 4)
+        delay = self.first_token_delay()
+        if not payload.get("stream"):
+            time.sleep(delay + tokens / self.tokens_per_second)
+            body = json.dumps({
+                "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": tokens},
+            }).encode("utf-8")
+            request.send_response(200)
+            request.send_header("Content-Type", "application/json")
+            request.send_header("Content-Length", str(len(body)))
+            request.end_headers()
+            request.wfile.write(body)
+            return
+        request.send_response(200)
+        request.send_header("Content-Type", "text/event-stream")
+        request.end_headers()
+        time.sleep(delay)
+        # Four-token chunks, paced at the token rate
+        for start in range(0, len(content), 16):
+            chunk = {"choices": [{"delta": {"content": content[start:start + 16]}}]}
+            request.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            request.wfile.flush()
+            time.sleep(4 / self.tokens_per_second)
+        request.wfile.write(b"data: [DONE]\n\n")
+
+
+def sql_response(prompt: str) -> str:
+    """The recorded SQL for the question in a SQL-generation prompt."""
+    position = prompt.rfind(SQL_ANCHOR)
+    question = prompt[position + len(SQL_ANCHOR):].strip() if position >= 0 else ""
+    sql = RECORDED_QUERIES.get(question) or next(iter(RECORDED_QUERIES.values()))
+    return sql.strip()
+
+
+def insights_response(prompt: str) -> str:
+    """An insights/chart JSON spec shaped like the model's, from the prompt's result summary."""
+    try:
+        summary = json.loads(prompt.split(SUMMARY_ANCHOR, 1)[1].strip())
+    except (ValueError, IndexError):
+        summary = {}
+    columns = summary.get("columns") or []
+    numeric = list(summary.get("numeric") or {})
+    dimensions = [c for c in columns if c not in numeric]
+    metric = numeric[0] if numeric else None
+    insights = [
+        f"The result has {summary.get('rows', 0):,} rows across {len(columns)} columns.",
+        *(f"{name} ranges from {stats.get('min')} to {stats.get('max')} with a median of {stats.get('median')}."
+          for name, stats in list((summary.get("numeric") or {}).items())[:3]),
+        "The largest groups account for most of the total; the remaining groups trail well behind.",
+    ]
+    charts = []
+    if metric and "event_day_pst" in columns:
+        charts.append({"type": "line", "x": "event_day_pst", "y": metric, "title": f"{metric} by day"})
+    elif metric and dimensions:
+        charts.append({"type": "bar", "x": dimensions[0], "y": metric, "title": f"{metric} by {dimensions[0]}"})
+        charts.append({"type": "pie", "names": dimensions[0], "values": metric, "title": f"Share of {metric}"})
+    elif metric:
+        charts.append({"type": "histogram", "x": metric, "title": f"Distribution of {metric}"})
+    return json.dumps({"insights": insights, "charts": charts}, indent=2)
+
+
+def _status_value(field: str) -> Optional[int]:
+    """A numeric field of /proc/self/status (Linux only)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb() -> float:
+    kb = _status_value("VmRSS")
+    if kb is None:
+        # Peak rather than current outside Linux; ru_maxrss is bytes on macOS, KiB elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        kb = peak / 1024 if sys.platform == "darwin" else peak
+    return kb / 1024
+
+
+class ResourceSampler:
+    """Samples RSS and thread counts in the background while a step runs."""
+
+    def __init__(self, interval: float = 0.25):
+        self.interval = interval
+        self.samples: List[Dict[str, float]] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="load-sampler", daemon=True)
+
+    def __enter__(self) -> "ResourceSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self.samples.append({
+                "rss_mb": rss_mb(),
+                "python_threads": threading.active_count(),
+                # Includes threads Python does not know about (SQLite, BLAS, ...)
+                "os_threads": _status_value("Threads") or threading.active_count(),
+            })
+            if self._stop.wait(self.interval):
+                return
+
+    def summary(self) -> Dict[str, float]:
+        result: Dict[str, float] = {}
+        for key in ("rss_mb", "python_threads", "os_threads"):
+            values = [sample[key] for sample in self.samples]
+            result[f"{key}_max"] = round(max(values), 1) if values else 0.0
+            result[f"{key}_mean"] = round(sum(values) / len(values), 1) if values else 0.0
+        return result
+
+
+def run_question(question: str, use_cache: bool, with_figures: bool) -> Dict[str, float]:
+    """Run one question through every app stage; returns per-stage timings in ms."""
+    import pipeline
+    from cache import result_fingerprint
+    from render_cache import build_chart_figure, build_trend_series, column_profile, prepare_plot_frame
+    from tracing import span
+
+    with span("load.question") as root:
+        with span("load.generate"):
+            sql, _ = pipeline.generate_sql_with_usage(question, use_cache=use_cache)
+        with span("load.validate"):
+            pipeline.validate_sql(sql)
+        with span("load.estimate"):
+            if Config.COST_POLICY != "off":
+                pipeline.estimate_cost(sql)
+        with span("load.execute"):
+            df = pipeline.execute_sql(sql, use_cache)
+            fingerprint = result_fingerprint(df)
+        with span("load.render"):
+            plot_df = prepare_plot_frame(df)
+            column_profile(df, {})
+            build_trend_series(df)
+        with span("load.insights"):
+            for kind, payload in pipeline.stream_result_insights(df, question, fingerprint, use_cache):
+                if kind == "error":
+                    raise LoadError(payload)
+                if kind == "chart" and with_figures:
+                    figure = build_chart_figure(plot_df, payload)
+                    if figure is not None:
+                        figure.to_json()
+
+    timings = {f"{child.name.split('.', 1)[1]}_ms": child.duration_ms for child in root.children}
+    timings["decode_ms"] = sum(_durations(root, DECODE_SPANS))
+    timings["total_ms"] = root.duration_ms
+    return timings
+
+
+def _durations(node, names) -> List[float]:
+    found = [node.duration_ms or 0.0] if node.name in names else []
+    for child in node.children:
+        found.extend(_durations(child, names))
+    return found
+
+
+def run_step(users: int, duration: float, questions: List[str], seed: int, think_ms: float,
+             use_cache: bool, with_figures: bool) -> Dict[str, Any]:
+    """Run ``users`` concurrent sessions for ``duration`` seconds."""
+    stop = threading.Event()
+    results: List[Dict[str, float]] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+
+    def session(user: int):
+        rng = random.Random(seed * 1000 + user)
+        while not stop.is_set():
+            question = rng.choice(questions)
+            try:
+                timings = run_question(question, use_cache, with_figures)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+            else:
+                with lock:
+                    results.append(timings)
+            if think_ms:
+                stop.wait(rng.expovariate(1000 / think_ms))
+
+    threads = [threading.Thread(target=session, args=(i,), name=f"load-user-{i}") for i in range(users)]
+    with ResourceSampler() as sampler:
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        stop.wait(duration)
+        stop.set()
+        # Questions in progress finish; throughput is measured over the full wall time
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    stages = {}
+    for stage in STAGES:
+        values = [timings[stage] for timings in results if stage in timings]
+        stages[stage] = {
+            "mean": round(sum(values) / len(values), 1),
+            "p50": round(percentile(values, 50), 1),
+            "p95": round(percentile(values, 95), 1),
+            "p99": round(percentile(values, 99), 1),
+            "max": round(max(values), 1),
+        } if values else None
+    return {
+        "users": users,
+        "elapsed_s": round(elapsed, 2),
+        "questions": len(results),
+        "errors": len(errors),
+        "sample_errors": sorted(set(errors))[:5],
+        "throughput_qpm": round(len(results) / elapsed * 60, 2) if elapsed else 0.0,
+        "stages": stages,
+        "resources": sampler.summary(),
+    }
+
+
+def sizing(steps: List[Dict[str, Any]], slo_p99_ms: float) -> Dict[str, Any]:
+    """Largest step that met the p99 latency SLO without errors."""
+    within = [
+        step for step in steps
+        if step["stages"]["total_ms"] and step["stages"]["total_ms"]["p99"] <= slo_p99_ms and not step["errors"]
+    ]
+    best = max(within, key=lambda step: step["users"]) if within else None
+    return {
+        "slo_p99_total_ms": slo_p99_ms,
+        "max_users_within_slo": best["users"] if best else 0,
+        "throughput_qpm_at_max": best["throughput_qpm"] if best else 0.0,
+        "rss_mb_at_max": best["resources"]["rss_mb_max"] if best else None,
+    }
+
+
+def configure(db_path: str, stub_url: Optional[str]):
+    """Point the pipeline at the benchmark database and, unless a real endpoint is used, the stub LLM."""
+    Config.DATABASE_URL = f"sqlite:///{os.path.abspath(db_path)}"
+    Config.DATABASE_TYPE = "sqlite"
+    Config.DB_DOWNLOAD_URL = ""  # never fetch analytics.db mid-run
+    if stub_url:
+        Config.OPENAI_BASE_URL = stub_url
+        Config.API_KEY = "load-test"
+        os.environ["OPENAI_API_KEY"] = "load-test"
+
+
+def run_load(args) -> Dict[str, Any]:
+    from benchmarks.suite import ensure_database
+
+    db_path = args.db or ensure_database(args.rows)
+    stub = None if args.llm_url else StubLLM(args.llm_first_token_ms, args.llm_tokens_per_second, seed=args.seed)
+    configure(db_path, stub.start() if stub else None)
+    if args.llm_url:
+        Config.OPENAI_BASE_URL = args.llm_url.rstrip("/")
+
+    questions = list(RECORDED_QUERIES)
+    with_figures = is_available("plotly")
+    report: Dict[str, Any] = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "database": db_path,
+            "database_bytes": os.path.getsize(db_path),
+            "questions": len(questions),
+            "duration_s": args.duration,
+            "think_ms": args.think_ms,
+            "cache": args.cache,
+            "figures": with_figures,
+            "llm": args.llm_url or {
+                "stub": True,
+                "first_token_ms": args.llm_first_token_ms,
+                "tokens_per_second": args.llm_tokens_per_second,
+            },
+            "rss_mb_idle": round(rss_mb(), 1),
+        },
+        "steps": [],
+    }
+    try:
+        for question in questions[:len(questions) if args.warmup else 0]:
+            run_question(question, args.cache, with_figures)
+        for users in args.ramp:
+            print(f"{users} concurrent users for {args.duration:g}s...", file=sys.stderr)
+            step = run_step(users, args.duration, questions, args.seed, args.think_ms, args.cache, with_figures)
+            report["steps"].append(step)
+            total = step["stages"]["total_ms"] or {}
+            print(f"  {step['questions']} questions, {step['errors']} errors, "
+                  f"{step['throughput_qpm']} q/min, p50 {total.get('p50')} ms, p99 {total.get('p99')} ms, "
+                  f"RSS {step['resources']['rss_mb_max']} MB", file=sys.stderr)
+            if args.stop_on_breach and (not total or total["p99"] > args.slo_p99_ms):
+                break
+    finally:
+        if stub:
+            stub.stop()
+    report["sizing"] = sizing(report["steps"], args.slo_p99_ms)
+    return report
+
+
+def _svg_chart(steps: List[Dict[str, Any]], series: Dict[str, List[float]], unit: str,
+               width: int = 520, height: int = 240) -> str:
+    """A small inline SVG line chart of ``series`` against the concurrency steps."""
+    colors = ("#1f77b4", "#ff7f0e", "#d62728", "#2ca02c")
+    users = [step["users"] for step in steps]
+    top = max([v for values in series.values() for v in values] + [1.0])
+    pad, right, bottom = 50, 110, 30
+
+    def x(i: int) -> float:
+        return pad + (width - pad - right) * (i / max(len(users) - 1, 1))
+
+    def y(v: float) -> float:
+        return height - bottom - (height - bottom - 10) * v / top
+
+    parts = [f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg" font-size="11">',
+             f'<line x1="{pad}" y1="{height - bottom}" x2="{width - right}" y2="{height - bottom}" stroke="#999"/>',
+             f'<line x1="{pad}" y1="10" x2="{pad}" y2="{height - bottom}" stroke="#999"/>',
+             f'<text x="{pad - 4}" y="14" text-anchor="end">{top:,.0f}</text>',
+             f'<text x="{pad - 4}" y="{height - bottom}" text-anchor="end">0</text>',
+             f'<text x="4" y="{height / 2}">{html.escape(unit)}</text>']
+    for i, n in enumerate(users):
+        parts.append(f'<text x="{x(i):.1f}" y="{height - 12}" text-anchor="middle">{n}</text>')
+    for k, (name, values) in enumerate(series.items()):
+        color = colors[k % len(colors)]
+        points = " ".join(f"{x(i):.1f},{y(v):.1f}" for i, v in enumerate(values))
+        parts.append(f'<polyline fill="none" stroke="{color}" stroke-width="2" points="{points}"/>')
+        parts.append(f'<text x="{width - right + 8}" y="{20 + 14 * k}" fill="{color}">{html.escape(name)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def render_html(report: Dict[str, Any]) -> str:
+    """Self-contained HTML page for a load-test report."""
+    steps = [step for step in report["steps"] if step["stages"]["total_ms"]]
+    sizing_info = report["sizing"]
+    latency = {f"total {p}": [step["stages"]["total_ms"][p] for step in steps] for p in ("p50", "p95", "p99")}
+    throughput = {"questions/min": [step["throughput_qpm"] for step in steps]}
+    memory = {"RSS max (MB)": [step["resources"]["rss_mb_max"] for step in steps]}
+
+    header = "".join(f"<th>{html.escape(stage)} p50 / p95 / p99</th>" for stage in STAGES)
+    rows = []
+    for step in report["steps"]:
+        cells = "".join(
+            f"<td>{s['p50']:,.0f} / {s['p95']:,.0f} / {s['p99']:,.0f}</td>" if s else "<td>–</td>"
+            for s in (step["stages"][stage] for stage in STAGES)
+        )
+        resources = step["resources"]
+        rows.append(
+            f"<tr><td>{step['users']}</td><td>{step['questions']}</td><td>{step['errors']}</td>"
+            f"<td>{step['throughput_qpm']:,.1f}</td>{cells}<td>{resources['rss_mb_max']:,.0f}</td>"
+            f"<td>{resources['python_threads_max']:.0f} / {resources['os_threads_max']:.0f}</td></tr>"
+        )
+    errors = "".join(
+        f"<li>{step['users']} users: {html.escape(error)}</li>"
+        for step in report["steps"] for error in step["sample_errors"]
+    )
+    meta = html.escape(json.dumps(report["meta"], indent=2, default=str))
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>App load test</title>
+<style>
+body {{ font-family: sans-serif; margin: 24px; color: #222; }}
+table {{ border-collapse: collapse; font-size: 12px; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+th {{ background: #f4f4f4; }}
+.charts {{ display: flex; flex-wrap: wrap; gap: 24px; }}
+</style></head><body>
+<h1>App load test</h1>
+<p><b>{sizing_info['max_users_within_slo']}</b> concurrent users met the p99 SLO of
+{sizing_info['slo_p99_total_ms']:,.0f} ms per question, at
+{sizing_info['throughput_qpm_at_max']:,.1f} questions/min
+(peak RSS {sizing_info['rss_mb_at_max'] or 0:,.0f} MB).</p>
+<div class="charts">
+<div><h3>Question latency (ms) by concurrent users</h3>{_svg_chart(steps, latency, "ms")}</div>
+<div><h3>Throughput by concurrent users</h3>{_svg_chart(steps, throughput, "q/min")}</div>
+<div><h3>Memory by concurrent users</h3>{_svg_chart(steps, memory, "MB")}</div>
+</div>
+<h3>Stages (ms)</h3>
+<table><tr><th>users</th><th>questions</th><th>errors</th><th>q/min</th>{header}
+<th>RSS max (MB)</th><th>threads (Python / OS)</th></tr>
+{"".join(rows)}</table>
+{f"<h3>Errors</h3><ul>{errors}</ul>" if errors else ""}
+<h3>Run</h3><pre>{meta}</pre>
+</body></html>
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the whole app with concurrent simulated sessions")
+    parser.add_argument("--db", help="SQLite database (default: a synthetic one with --rows rows)")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Synthetic user_days rows when --db is not given")
+    parser.add_argument("--ramp", type=int, nargs="+", default=DEFAULT_RAMP, help="Concurrent users per step")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per step")
+    parser.add_argument("--think-ms", type=float, default=0,
+                        help="Mean pause between a user's questions (0: ask back to back)")
+    parser.add_argument("--slo-p99-ms", type=float, default=20_000, help="p99 question latency target")
+    parser.add_argument("--stop-on-breach", action="store_true", help="Stop ramping after the first step over the SLO")
+    parser.add_argument("--cache", action="store_true", help="Use the disk caches (bypassed by default)")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false",
+                        help="Skip the single-user pass over every question")
+    parser.add_argument("--llm-url", help="Real OpenAI-compatible endpoint instead of the local stub")
+    parser.add_argument("--llm-first-token-ms", type=float, default=700, help="Stub median time to first token")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=60, help="Stub generation rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--html", help="Write the HTML report to this path")
+    args = parser.parse_args(argv)
+
+    report = run_load(args)
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.html:
+        with open(args.html, "w", encoding="utf-8") as f:
+            f.write(render_html(report))
+
+
+if __name__ == "__main__":
+    main()
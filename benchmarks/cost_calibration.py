@@ -0,0 +1,150 @@
+"""
+Calibration report for ``cost_estimator``: estimated vs. actual cost.
+
+For every synthetic ``user_days`` database and every query in
+``benchmarks.queries.RECORDED_QUERIES`` it compares the estimate
+(``rows_scanned``, ``result_rows``, ``est_ms``) with the measured execution
+time (median of ``--repeats``) and the actual row count. The report includes
+the rows/second throughput that fits the measurements best, which is the
+value to put in ``COST_ROWS_PER_SECOND`` for this machine.
+
+    python -m benchmarks.cost_calibration --sizes 100000 1000000 --output cost_calibration.json
+
+Run ``ANALYZE`` on a database first (``--analyze``) to calibrate with
+``sqlite_stat1`` statistics, as in production.
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.queries import RECORDED_QUERIES
+from benchmarks.suite import DEFAULT_DATA_DIR, DEFAULT_SIZES, ensure_database
+from config import Config
+from cost_estimator import CostEstimator
+
+
+def measure(conn: sqlite3.Connection, sql: str, repeats: int) -> Dict[str, Any]:
+    """Median execution time (ms) and row count of ``sql``."""
+    timings = []
+    rows = 0
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        rows = len(conn.execute(sql).fetchall())
+        timings.append((time.perf_counter() - t0) * 1000)
+    return {"actual_ms": round(statistics.median(timings), 3), "actual_rows": rows}
+
+
+def calibrate(databases: Dict[str, str], repeats: int = 3,
+              queries: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    queries = queries or RECORDED_QUERIES
+    rows: List[Dict[str, Any]] = []
+    for label, path in databases.items():
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            estimator = CostEstimator(lambda s: conn.execute(s).fetchall())
+            for name, sql in queries.items():
+                print(f"[{label}] {name}", file=sys.stderr)
+                estimate = estimator.estimate(sql)
+                if estimate is None:
+                    continue
+                actual = measure(conn, sql, repeats)
+                rows.append({
+                    "database": label,
+                    "query": name,
+                    "rows_scanned": estimate["rows_scanned"],
+                    "est_ms": estimate["est_ms"],
+                    "actual_ms": actual["actual_ms"],
+                    "time_ratio": _ratio(estimate["est_ms"], actual["actual_ms"]),
+                    "result_rows": estimate["result_rows"],
+                    "actual_rows": actual["actual_rows"],
+                    "rows_ratio": _ratio(estimate["result_rows"], actual["actual_rows"]),
+                    "level": estimate["level"],
+                    "full_scan": estimate["full_scan"],
+                })
+        finally:
+            conn.close()
+    return {"summary": summarize(rows), "queries": rows}
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Fitted throughput and the spread of estimate/actual ratios."""
+    scanned = sum(r["rows_scanned"] for r in rows)
+    seconds = sum(r["actual_ms"] for r in rows) / 1000
+    time_ratios = [r["time_ratio"] for r in rows if r["time_ratio"]]
+    rows_ratios = [r["rows_ratio"] for r in rows if r["rows_ratio"]]
+    return {
+        "configured_rows_per_second": Config.COST_ROWS_PER_SECOND,
+        # Least squares through the origin would let one slow query dominate; total/total is steadier
+        "fitted_rows_per_second": int(scanned / seconds) if seconds else None,
+        "time_ratio_median": round(statistics.median(time_ratios), 3) if time_ratios else None,
+        "time_within_2x": _share(time_ratios),
+        "rows_ratio_median": round(statistics.median(rows_ratios), 3) if rows_ratios else None,
+        "rows_within_2x": _share(rows_ratios),
+    }
+
+
+def _ratio(estimated: float, actual: float) -> Optional[float]:
+    if not actual:
+        return None
+    return round(estimated / actual, 3)
+
+
+def _share(ratios: List[float]) -> Optional[float]:
+    if not ratios:
+        return None
+    return round(sum(1 for r in ratios if 0.5 <= r <= 2) / len(ratios), 3)
+
+
+def print_report(report: Dict[str, Any]):
+    header = f"{'database':<16} {'query':<28} {'scanned':>10} {'est ms':>9} {'act ms':>9} {'ratio':>6} {'est rows':>9} {'rows':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in report["queries"]:
+        print(f"{r['database']:<16} {r['query'][:28]:<28} {r['rows_scanned']:>10,} {r['est_ms']:>9.1f} "
+              f"{r['actual_ms']:>9.1f} {r['time_ratio'] or 0:>6.2f} {r['result_rows']:>9,} {r['actual_rows']:>8,}")
+    summary = report["summary"]
+    print()
+    print(f"Configured COST_ROWS_PER_SECOND: {summary['configured_rows_per_second']:,}")
+    if summary["fitted_rows_per_second"]:
+        print(f"Fitted rows/second:              {summary['fitted_rows_per_second']:,}")
+    print(f"Time estimates within 2x:        {summary['time_within_2x']}")
+    print(f"Result-size estimates within 2x: {summary['rows_within_2x']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare cost estimates with actual query timings")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Synthetic user_days sizes (rows) to generate and calibrate on")
+    parser.add_argument("--db", action="append", default=[],
+                        help="Calibrate on an existing database instead (repeatable)")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--analyze", action="store_true", help="Run ANALYZE on each database first")
+    parser.add_argument("--output", default="cost_calibration.json")
+    args = parser.parse_args(argv)
+
+    Config.TRACE_ENABLED = False
+    if args.db:
+        databases = {os.path.basename(p): p for p in args.db}
+    else:
+        databases = {f"{rows}_rows": ensure_database(rows, args.data_dir) for rows in args.sizes}
+    if args.analyze:
+        for path in databases.values():
+            with sqlite3.connect(path) as conn:
+                conn.execute("ANALYZE")
+
+    report = calibrate(databases, args.repeats)
+    print_report(report)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
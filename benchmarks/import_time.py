@@ -0,0 +1,109 @@
+"""
+Import-time budget check.
+
+Imports the given modules in a fresh interpreter with ``-X importtime``,
+summarises where the time goes and exits non-zero when startup regresses:
+either the total exceeds ``--budget-ms`` or a module that is supposed to be
+lazy (plotly, openai, sqlalchemy, streamlit by default) was imported eagerly.
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --modules pipeline service --budget-ms 800
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "config", "cache", "database", "sql_generator", "pipeline",
+    "service", "service_client", "render_cache", "batch",
+]
+DEFAULT_DEFERRED = ["plotly", "openai", "sqlalchemy", "streamlit"]
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "1500"))
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(modules: List[str], repeats: int = 3) -> Dict:
+    """Run the imports ``repeats`` times and keep the fastest run (least noise)."""
+    best = None
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "; ".join(f"import {m}" for m in modules)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            errors = [l for l in proc.stderr.splitlines() if not l.startswith("import time:")]
+            raise RuntimeError("Import failed:\n" + "\n".join(errors[-20:]))
+
+        entries = []
+        for line in proc.stderr.splitlines():
+            match = _LINE.match(line)
+            if match:
+                self_us, cumulative_us, indent, name = match.groups()
+                entries.append({
+                    "module": name,
+                    "self_us": int(self_us),
+                    "cumulative_us": int(cumulative_us),
+                    "depth": len(indent) // 2,
+                })
+        # Top-level entries (depth 0) partition the total import time
+        total_us = sum(e["cumulative_us"] for e in entries if e["depth"] == 0)
+        if best is None or total_us < best["total_us"]:
+            best = {"total_us": total_us, "entries": entries}
+    return best
+
+
+def summarise(result: Dict, modules: List[str], deferred: List[str], budget_ms: float, top: int) -> Dict:
+    entries = result["entries"]
+    loaded = {e["module"] for e in entries}
+    eager = sorted(d for d in deferred if d in loaded)
+    per_requested = {
+        e["module"]: round(e["cumulative_us"] / 1000, 1)
+        for e in entries if e["module"] in modules
+    }
+    heaviest = sorted(entries, key=lambda e: e["self_us"], reverse=True)[:top]
+    total_ms = round(result["total_us"] / 1000, 1)
+    return {
+        "total_ms": total_ms,
+        "budget_ms": budget_ms,
+        "within_budget": total_ms <= budget_ms,
+        "eagerly_imported_deferred_modules": eager,
+        "requested_modules_cumulative_ms": per_requested,
+        "heaviest_self_ms": {e["module"]: round(e["self_us"] / 1000, 1) for e in heaviest},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when import time regresses past a budget")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--deferred", nargs="*", default=DEFAULT_DEFERRED,
+                        help="Packages that must not be imported eagerly")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args(argv)
+
+    summary = summarise(measure(args.modules, args.repeats), args.modules, args.deferred, args.budget_ms, args.top)
+    print(json.dumps(summary, indent=2))
+
+    failed = False
+    if not summary["within_budget"]:
+        print(f"FAIL: import time {summary['total_ms']} ms exceeds budget {args.budget_ms} ms", file=sys.stderr)
+        failed = True
+    if summary["eagerly_imported_deferred_modules"]:
+        print(f"FAIL: deferred modules imported eagerly: {summary['eagerly_imported_deferred_modules']}", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Recorded SQL for the GSN Casino example queries shown in ``simple_app.main``.
+
+Benchmarks replay these instead of calling the LLM, so they need no network
+access. Time windows are anchored on ``MAX(event_day_pst)`` rather than the
+wall clock, so results are reproducible on any snapshot of ``user_days``.
+"""
+
+LATEST_DAY = "(SELECT MAX(event_day_pst) FROM user_days)"
+
+RECORDED_QUERIES = {
+    "Get DAU (daily active users) in last 7 days": f"""
+SELECT event_day_pst, COUNT(DISTINCT user_id) AS dau
+FROM user_days
+WHERE event_day_pst >= date({LATEST_DAY}, '-6 days')
+GROUP BY event_day_pst
+ORDER BY event_day_pst
+""",
+    "Get average DAU in last 7 days": f"""
+SELECT AVG(dau) AS avg_dau
+FROM (
+    SELECT event_day_pst, COUNT(DISTINCT user_id) AS dau
+    FROM user_days
+    WHERE event_day_pst >= date({LATEST_DAY}, '-6 days')
+    GROUP BY event_day_pst
+)
+""",
+    "Get non-payer DAU in last 7 days": f"""
+SELECT event_day_pst, COUNT(DISTINCT user_id) AS non_payer_dau
+FROM user_days
+WHERE event_day_pst >= date({LATEST_DAY}, '-6 days')
+  AND payer_type IS NULL
+GROUP BY event_day_pst
+ORDER BY event_day_pst
+""",
+    "Show total revenue by payer type in last 30 days": f"""
+SELECT COALESCE(payer_type, 'Non-Payer') AS payer_type, SUM(bookings) AS total_revenue
+FROM user_days
+WHERE event_day_pst >= date({LATEST_DAY}, '-29 days')
+GROUP BY COALESCE(payer_type, 'Non-Payer')
+ORDER BY total_revenue DESC
+""",
+    "Get top 10 users by slot spins in last 7 days": f"""
+SELECT user_id, SUM(slot_spins) AS total_spins
+FROM user_days
+WHERE event_day_pst >= date({LATEST_DAY}, '-6 days')
+GROUP BY user_id
+ORDER BY total_spins DESC
+LIMIT 10
+""",
+    "Show daily revenue trends for last 30 days": f"""
+SELECT event_day_pst, SUM(bookings) AS total_revenue
+FROM user_days
+WHERE event_day_pst >= date({LATEST_DAY}, '-29 days')
+GROUP BY event_day_pst
+ORDER BY event_day_pst
+""",
+    "Get regular users (engagement_7d = 7) count by platform": """
+SELECT platform, COUNT(DISTINCT user_id) AS regular_users
+FROM user_days
+WHERE engagement_7d = 7
+GROUP BY platform
+ORDER BY regular_users DESC
+""",
+    "Calculate average coins used per spin by payer group": """
+SELECT
+    CASE
+        WHEN payer_type IN ('Blue', 'BlueLapse', 'Orca', 'OrcaLapse', 'Whale', 'WhaleLapse') THEN 'High Payer'
+        WHEN payer_type IS NULL THEN 'Non-Payer'
+        ELSE 'Low Payer'
+    END AS payer_group,
+    SUM(slot_coins_used) * 1.0 / NULLIF(SUM(slot_spins), 0) AS avg_coins_per_spin
+FROM user_days
+GROUP BY payer_group
+ORDER BY avg_coins_per_spin DESC
+""",
+    "Show high payer vs low payer revenue comparison": """
+SELECT
+    CASE
+        WHEN payer_type IN ('Blue', 'BlueLapse', 'Orca', 'OrcaLapse', 'Whale', 'WhaleLapse') THEN 'High Payer'
+        ELSE 'Low Payer'
+    END AS payer_group,
+    SUM(bookings) AS total_revenue
+FROM user_days
+WHERE payer_type IS NOT NULL
+GROUP BY payer_group
+""",
+    "Get mobile platform DAU vs web platform DAU": f"""
+SELECT
+    event_day_pst,
+    COUNT(DISTINCT CASE WHEN platform IN ('ios', 'android', 'amazon') THEN user_id END) AS mobile_dau,
+    COUNT(DISTINCT CASE WHEN platform NOT IN ('ios', 'android', 'amazon') THEN user_id END) AS web_dau
+FROM user_days
+WHERE event_day_pst >= date({LATEST_DAY}, '-6 days')
+GROUP BY event_day_pst
+ORDER BY event_day_pst
+""",
+}
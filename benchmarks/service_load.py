@@ -0,0 +1,146 @@
+"""
+Load test for the headless query service.
+
+Fires ``--concurrency`` simultaneous clients at the service, each replaying the
+recorded example queries through ``POST /execute`` (no LLM or network needed),
+and reports throughput and latency percentiles.
+
+    python -m benchmarks.service_load --concurrency 64 --requests 640
+
+Without ``--url`` an in-process service is started on a free local port.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.queries import RECORDED_QUERIES
+
+
+async def _post(host: str, port: int, path: str, payload: Dict) -> Tuple[int, bytes]:
+    """One HTTP/1.1 POST on a fresh connection (kept dependency-free on purpose)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        (
+            f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+        ).encode("latin-1") + body
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    data = await reader.readexactly(length) if length else await reader.read()
+    writer.close()
+    return status, data
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+async def run_load(url: str, concurrency: int, total_requests: int, max_rows: int) -> Dict:
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    queries = list(RECORDED_QUERIES.values())
+    latencies: List[float] = []
+    errors: List[str] = []
+    counter = iter(range(total_requests))
+
+    async def worker():
+        for i in counter:
+            sql = queries[i % len(queries)]
+            start = time.perf_counter()
+            try:
+                status, data = await _post(host, port, "/execute", {"sql": sql, "max_rows": max_rows})
+                if status != 200:
+                    errors.append(f"HTTP {status}: {data[:200]!r}")
+                    continue
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "url": url,
+        "concurrency": concurrency,
+        "requests": total_requests,
+        "succeeded": len(latencies),
+        "errors": len(errors),
+        "sample_errors": errors[:5],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies), 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2) if latencies else 0.0,
+        },
+    }
+
+
+def start_local_service(port: int = 0, db_workers: Optional[int] = None) -> str:
+    """Start service.serve() on a background event loop and return its base URL."""
+    import socket
+
+    import service
+
+    if not port:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+    ready = threading.Event()
+    svc = service.QueryService(db_workers=db_workers)
+    thread = threading.Thread(
+        target=lambda: asyncio.run(service.serve("127.0.0.1", port, svc, ready)),
+        daemon=True,
+    )
+    thread.start()
+    if not ready.wait(30):
+        raise RuntimeError("Query service did not start")
+    return f"http://127.0.0.1:{port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the headless query service")
+    parser.add_argument("--url", help="Base URL of a running service (default: start one in-process)")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=640)
+    parser.add_argument("--max-rows", type=int, default=100)
+    parser.add_argument("--db-workers", type=int, default=None)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args(argv)
+
+    url = args.url or start_local_service(db_workers=args.db_workers)
+    report = asyncio.run(run_load(url, args.concurrency, args.requests, args.max_rows))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
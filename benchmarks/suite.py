@@ -0,0 +1,255 @@
+"""
+End-to-end benchmark suite over the recorded example queries.
+
+For every ``user_days`` database size and every query in
+``benchmarks.queries.RECORDED_QUERIES`` (no LLM or network needed) it measures
+each stage the app runs after SQL generation:
+
+- ``execute_ms``  SQLite execution and row fetch
+- ``decode_ms``   building the DataFrame and ``pipeline.clean_result``
+- ``profile_ms``  ``render_cache.column_profile`` + ``result_summary.summarize_result``
+- ``figure_ms``   ``prepare_plot_frame`` + ``build_chart_figure`` + ``to_json``
+                  (null when plotly is not installed)
+- ``peak_mb``     tracemalloc peak over one extra, separately run pass
+
+Databases are generated with ``synthetic_data`` (fixed seed) on first use and
+reused afterwards. The disk caches are bypassed. Results are written as JSON;
+``compare`` flags regressions between two result files.
+
+    python -m benchmarks.suite run --sizes 100000 1000000 --output bench.json
+    python -m benchmarks.suite compare baseline.json bench.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from benchmarks.queries import RECORDED_QUERIES
+from benchmarks.service_load import percentile
+from config import Config
+from lazy import is_available
+from pipeline import clean_result
+from render_cache import build_chart_figure, column_profile, prepare_plot_frame
+from result_summary import summarize_result
+
+STAGES = ("execute_ms", "decode_ms", "profile_ms", "figure_ms")
+DEFAULT_SIZES = [100_000, 1_000_000]
+DEFAULT_DATA_DIR = os.path.join(Config.CACHE_DIR, "bench_data")
+
+
+def ensure_database(rows: int, data_dir: str = DEFAULT_DATA_DIR) -> str:
+    """Path to a synthetic user_days database with ``rows`` rows, generating it if missing."""
+    from synthetic_data import write_sqlite
+
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"user_days_{rows}.db")
+    if not os.path.exists(path):
+        print(f"Generating {rows:,}-row user_days at {path}...", file=sys.stderr)
+        partial = path + ".partial"
+        if os.path.exists(partial):
+            os.remove(partial)
+        write_sqlite(partial, rows)
+        os.replace(partial, path)
+    return path
+
+
+def default_chart(df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+    """The chart the insights step would typically ask for: metric by first dimension."""
+    numeric = df.select_dtypes(include=["number"]).columns.tolist()
+    dimensions = [c for c in df.columns if c not in numeric]
+    if not numeric:
+        return None
+    if "event_day_pst" in df.columns:
+        return {"type": "line", "x": "event_day_pst", "y": numeric[0], "title": "benchmark"}
+    if dimensions:
+        return {"type": "bar", "x": dimensions[0], "y": numeric[0], "title": "benchmark"}
+    return {"type": "histogram", "x": numeric[0], "title": "benchmark"}
+
+
+def run_query_once(conn: sqlite3.Connection, sql: str, with_figure: bool) -> Dict[str, Any]:
+    """Run every stage once; returns per-stage timings in ms and the row count."""
+    timings: Dict[str, Any] = {}
+
+    t0 = time.perf_counter()
+    cursor = conn.execute(sql)
+    rows = cursor.fetchall()
+    columns = [d[0] for d in cursor.description]
+    timings["execute_ms"] = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    df = clean_result(pd.DataFrame.from_records(rows, columns=columns))
+    timings["decode_ms"] = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    column_profile(df, {})
+    summarize_result(df)
+    timings["profile_ms"] = (time.perf_counter() - t0) * 1000
+
+    timings["figure_ms"] = None
+    chart = default_chart(df)
+    if with_figure and chart is not None:
+        t0 = time.perf_counter()
+        fig = build_chart_figure(prepare_plot_frame(df), chart)
+        if fig is not None:
+            fig.to_json()
+        timings["figure_ms"] = (time.perf_counter() - t0) * 1000
+
+    timings["rows"] = len(df)
+    return timings
+
+
+def bench_query(conn: sqlite3.Connection, sql: str, repeats: int, warmup: int, with_figure: bool) -> Dict[str, Any]:
+    for _ in range(warmup):
+        run_query_once(conn, sql, with_figure)
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    rows = 0
+    for _ in range(repeats):
+        timings = run_query_once(conn, sql, with_figure)
+        rows = timings["rows"]
+        for stage in STAGES:
+            if timings[stage] is not None:
+                samples[stage].append(timings[stage])
+
+    # Peak memory on a separate pass: tracemalloc slows allocation-heavy code
+    tracemalloc.start()
+    try:
+        run_query_once(conn, sql, with_figure)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result: Dict[str, Any] = {"rows": rows, "peak_mb": round(peak / 2**20, 3)}
+    for stage, values in samples.items():
+        result[stage] = {
+            "p50": round(percentile(values, 50), 3),
+            "p95": round(percentile(values, 95), 3),
+            "max": round(max(values), 3),
+        } if values else None
+    return result
+
+
+def run_suite(databases: Dict[str, str], repeats: int = 5, warmup: int = 1,
+              queries: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    queries = queries or RECORDED_QUERIES
+    with_figure = is_available("plotly")
+    results: Dict[str, Any] = {}
+    for label, path in databases.items():
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            results[label] = {}
+            for name, sql in queries.items():
+                print(f"[{label}] {name}", file=sys.stderr)
+                results[label][name] = bench_query(conn, sql, repeats, warmup, with_figure)
+        finally:
+            conn.close()
+    return {"meta": _meta(repeats, warmup, with_figure, databases), "results": results}
+
+
+def _meta(repeats: int, warmup: int, with_figure: bool, databases: Dict[str, str]) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "warmup": warmup,
+        "figures": with_figure,
+        "databases": databases,
+    }
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.2,
+            min_delta_ms: float = 1.0) -> List[Dict[str, Any]]:
+    """List metrics whose p50 (or peak memory) grew by more than ``threshold``.
+
+    Timing changes smaller than ``min_delta_ms`` are ignored as noise.
+    """
+    regressions = []
+    for label, queries in current["results"].items():
+        for name, metrics in queries.items():
+            base = baseline["results"].get(label, {}).get(name)
+            if not base:
+                continue
+            for stage in STAGES:
+                if not metrics.get(stage) or not base.get(stage):
+                    continue
+                old, new = base[stage]["p50"], metrics[stage]["p50"]
+                if new - old > min_delta_ms and new > old * (1 + threshold):
+                    regressions.append({"database": label, "query": name, "metric": f"{stage}.p50",
+                                        "baseline": old, "current": new, "change": f"{new / old - 1:+.0%}" if old else "new"})
+            old, new = base.get("peak_mb"), metrics.get("peak_mb")
+            if old and new and new > old * (1 + threshold) and new - old > 1.0:
+                regressions.append({"database": label, "query": name, "metric": "peak_mb",
+                                    "baseline": old, "current": new, "change": f"{new / old - 1:+.0%}"})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the example queries end to end")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the suite and write a JSON result file")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                            help="Synthetic user_days sizes (rows) to generate and benchmark")
+    run_parser.add_argument("--db", action="append", default=[],
+                            help="Benchmark an existing database instead (repeatable)")
+    run_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    run_parser.add_argument("--repeats", type=int, default=5)
+    run_parser.add_argument("--warmup", type=int, default=1)
+    run_parser.add_argument("--output", default="bench.json")
+
+    compare_parser = subparsers.add_parser("compare", help="Flag regressions between two result files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown to flag (0.2 = 20%%)")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        # Span export (JSONL writes) would otherwise be measured along with the stages
+        Config.TRACE_ENABLED = False
+        if args.db:
+            databases = {os.path.basename(p): p for p in args.db}
+        else:
+            databases = {f"{rows}_rows": ensure_database(rows, args.data_dir) for rows in args.sizes}
+        report = run_suite(databases, args.repeats, args.warmup)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold, args.min_delta_ms)
+    if not regressions:
+        print("No regressions.")
+        return
+    print(f"{len(regressions)} regression(s):")
+    for r in regressions:
+        print(f"  [{r['database']}] {r['query']}: {r['metric']} {r['baseline']} -> {r['current']} ({r['change']})")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
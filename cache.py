@@ -0,0 +1,139 @@
+"""
+Shared on-disk cache with per-entry TTL.
+
+Values are pickled into a small SQLite file under ``Config.CACHE_DIR`` so they
+survive Streamlit reruns, browser sessions and process restarts, and can be
+shared by every worker on the same host.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+import pandas as pd
+
+from config import Config
+
+_MISSING = object()
+
+
+class DiskCache:
+    def __init__(self, path: Optional[str] = None, default_ttl: Optional[int] = None):
+        self.path = path or os.path.join(Config.CACHE_DIR, "cache.sqlite")
+        self.default_ttl = Config.CACHE_TTL_SECONDS if default_ttl is None else default_ttl
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite handles cross-process locking."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the cached value for key, or default if missing or expired."""
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(key)
+            return default
+        try:
+            return pickle.loads(value)
+        except Exception:
+            self.delete(key)
+            return default
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        """Store value under key; ttl <= 0 means no expiry."""
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl and ttl > 0 else None
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expires_at),
+            )
+
+    def delete(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        """Drop expired entries and return how many were removed."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at < ?",
+                (time.time(),),
+            )
+        return cur.rowcount
+
+    def get_or_set(self, key: str, compute: Callable[[], Any], ttl: Optional[int] = None) -> Any:
+        """Return the cached value or compute, store and return it (None is not cached)."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = compute()
+        if value is not None:
+            self.set(key, value, ttl)
+        return value
+
+
+_cache: Optional[DiskCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> DiskCache:
+    """Process-wide shared cache instance."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DiskCache()
+    return _cache
+
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """Build a stable cache key from a namespace and JSON-serialisable parts."""
+    payload = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    digest = hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+def result_fingerprint(df: pd.DataFrame) -> str:
+    """Fast content fingerprint of a DataFrame.
+
+    Hashes the column buffers with pandas' vectorised row hashing rather than
+    serialising the frame, so it stays cheap for large results.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    header = [[str(c), str(t)] for c, t in zip(df.columns, df.dtypes)]
+    h.update(json.dumps(header).encode("utf-8"))
+    h.update(str(len(df)).encode("ascii"))
+    try:
+        row_hashes = pd.util.hash_pandas_object(df, index=False)
+        h.update(row_hashes.to_numpy().tobytes())
+    except TypeError:
+        # Unhashable cell values (lists, dicts): fall back to a text rendering
+        h.update(df.to_csv(index=False).encode("utf-8"))
+    return h.hexdigest()
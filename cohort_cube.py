@@ -0,0 +1,656 @@
+"""
+Precomputed install-cohort × tenure cube over user_days.
+
+Cohort, tenure and LTV-curve questions group ``user_days`` by install cohort
+and days since install, which means date arithmetic over every row of the
+history. ``build_cube`` materializes those aggregates once into ``cohort_cube``:
+
+    grain               'week' (cohorts start on Monday) or 'month'
+    cohort_start        first day of the install cohort
+    days_since_install  event_day_pst - install_first_date_pst, in days
+    payer_group         'High Payer' / 'Low Payer' / 'Non-Payer' (as in the SQL prompt)
+    platform
+    active_users        users active that day (one user_days row per user and day)
+    bookings, transactions, bookings_lifetime_sum
+    bookings_count, ...         non-NULL values of each metric (for AVG and COUNT)
+    ltv_p50, ltv_p90, ltv_p99   bookings_lifetime percentiles of the cell's users
+
+Every cell reads rows from at most one cohort length of event days after its
+``anchor_day`` (cohort_start + days_since_install), so ``refresh_cube`` only
+rebuilds the cells whose anchor lies within a cohort length before a new or
+restated day. ``ingest.refresh`` calls it in the same transaction that loads the
+days, and the cube then records the newest day it covers.
+
+``CohortRouter.route`` answers generated SQL from the cube when the cube is
+current and the query is a single-table aggregate whose dimensions are
+functions of the cube's: ``julianday(event_day_pst) -
+julianday(install_first_date_pst)`` (days since install, also inside CASE or
+CAST), expressions of ``install_first_date_pst`` that are constant within
+each week or month cohort (checked over the calendar), expressions of
+``payer_type`` that are constant within each payer group (checked over the
+known payer types) and ``platform``. COUNT(*), COUNT, SUM, TOTAL and AVG of bookings,
+transactions and bookings_lifetime are supported. COUNT(DISTINCT user_id)
+is supported when the query fixes days since install, so each user is counted
+once. Rows without an install date are not in the cube, so a query is only
+routed when an AND-ed WHERE condition on the install date or days since
+install already excludes them. Anything else runs on user_days as usual.
+
+    python run.py cube
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from config import Config
+from sql_parser import SQLParseError, closing_paren, parse_sql, split_tokens, sql_literal
+from tracing import span
+
+BASE_TABLE = "user_days"
+CUBE_TABLE = "cohort_cube"
+META_TABLE = "cohort_cube_meta"
+GRAINS = ("month", "week")
+# Cohort start of an install date, as SQLite expressions
+COHORT_SQL = {
+    "week": "date({column}, '-6 days', 'weekday 1')",
+    "month": "date({column}, 'start of month')",
+}
+# Longest distance (days) between a cohort's first and last install day
+COHORT_SPAN_DAYS = {"week": 6, "month": 30}
+PERCENTILES = (50, 90, 99)
+# Anchor days rebuilt per pass of a full build
+BUILD_WINDOW_DAYS = 60
+
+PAYER_GROUPS = {
+    "High Payer": ("Blue", "BlueLapse", "Orca", "OrcaLapse", "Whale", "WhaleLapse"),
+    "Low Payer": ("Bass", "BassLapse", "Dolphin", "DolphinLapse", "Minnow", "MinnowLapse"),
+}
+NON_PAYER = "Non-Payer"
+OTHER_PAYER = "Other"
+
+_DSI_PATTERN = ["julianday", "(", "event_day_pst", ")", "-", "julianday", "(", "install_first_date_pst", ")"]
+_DSI_SQL = "CAST(days_since_install AS REAL)"
+_DIMENSION_COLUMNS = {"install_first_date_pst", "payer_type", "platform"}
+_METRIC_COLUMNS = {"bookings": "bookings", "transactions": "transactions",
+                   "bookings_lifetime": "bookings_lifetime_sum"}
+_AGGREGATES = {"count", "sum", "total", "avg", "min", "max", "group_concat", "string_agg", "median"}
+_CLAUSES = ("FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT")
+# Words that let a condition on install_first_date_pst hold for rows where it is NULL
+_NULL_TOLERANT = {"is", "null", "coalesce", "ifnull", "nullif", "iif", "case", "or", "not"}
+
+QueryFn = Callable[[str], List[Tuple[Any, ...]]]
+
+
+class NotRoutable(ValueError):
+    """The query cannot be answered from the cube."""
+
+
+def payer_group_sql(column: str = "payer_type") -> str:
+    whens = " ".join(
+        f"WHEN {column} IN ({', '.join(sql_literal(t) for t in types)}) THEN {sql_literal(group)}"
+        for group, types in PAYER_GROUPS.items()
+    )
+    return f"CASE {whens} WHEN {column} IS NULL THEN '{NON_PAYER}' ELSE '{OTHER_PAYER}' END"
+
+
+# -- building -----------------------------------------------------------------------
+
+def cube_exists(conn: sqlite3.Connection) -> bool:
+    return bool(conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (META_TABLE,)
+    ).fetchone())
+
+
+def build_cube(db_path: str, force: bool = False) -> Dict[str, Any]:
+    """Create (or with ``force`` rebuild) the cube in one transaction; returns its metadata."""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    try:
+        if cube_exists(conn) and not force:
+            return cube_meta(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {CUBE_TABLE}")
+            conn.execute(f"DROP TABLE IF EXISTS {META_TABLE}")
+            _create_tables(conn)
+            first, last = conn.execute(
+                f"SELECT MIN(event_day_pst), MAX(event_day_pst) FROM {BASE_TABLE}"
+            ).fetchone()
+            if first:
+                first_day, last_day = _day(first), _day(last)
+                others: Set[str] = set()
+                for grain in GRAINS:
+                    # Anchors start at most one cohort length before the first event day
+                    lo = first_day - timedelta(days=COHORT_SPAN_DAYS[grain])
+                    while lo <= last_day:
+                        hi = min(lo + timedelta(days=BUILD_WINDOW_DAYS - 1), last_day)
+                        others |= _rebuild(conn, grain, lo, hi)
+                        lo = hi + timedelta(days=1)
+                installs = conn.execute(
+                    f"SELECT MIN(cohort_start), MAX(cohort_start) FROM {CUBE_TABLE} WHERE grain = 'week'"
+                ).fetchone()
+                conn.execute(
+                    f"INSERT INTO {META_TABLE} VALUES (?, ?, ?, ?, ?)",
+                    (last_day.isoformat(), installs[0], installs[1], json.dumps(sorted(others)),
+                     time.strftime("%Y-%m-%dT%H:%M:%S")),
+                )
+            conn.execute(f"ANALYZE {CUBE_TABLE}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cube_meta(conn)
+    finally:
+        conn.close()
+
+
+def refresh_cube(conn: sqlite3.Connection, days: List[str]):
+    """Rebuild the cells that read any of ``days`` (new or restated), inside the caller's transaction."""
+    if not days or not cube_exists(conn):
+        return
+    meta = cube_meta(conn)
+    others = set(meta["other_payer_types"])
+    with span("cohort_cube.refresh", days=len(days)):
+        for grain in GRAINS:
+            span_days = COHORT_SPAN_DAYS[grain]
+            for lo, hi in _day_ranges(sorted(_day(d) for d in days), span_days):
+                others |= _rebuild(conn, grain, lo - timedelta(days=span_days), hi)
+        installs = conn.execute(
+            f"SELECT MIN(cohort_start), MAX(cohort_start) FROM {CUBE_TABLE} WHERE grain = 'week'"
+        ).fetchone()
+        conn.execute(
+            f"UPDATE {META_TABLE} SET last_day = MAX(last_day, ?), first_install = ?, last_install = ?, "
+            "other_payer_types = ?",
+            (max(days), installs[0], installs[1], json.dumps(sorted(others))),
+        )
+
+
+def cube_meta(conn: sqlite3.Connection) -> Dict[str, Any]:
+    cursor = conn.execute(f"SELECT * FROM {META_TABLE}")
+    row = cursor.fetchone()
+    if row is None:
+        return {"last_day": None, "first_install": None, "last_install": None, "other_payer_types": []}
+    meta = dict(zip([d[0] for d in cursor.description], row))
+    meta["other_payer_types"] = json.loads(meta["other_payer_types"] or "[]")
+    meta["cells"] = conn.execute(f"SELECT COUNT(*) FROM {CUBE_TABLE}").fetchone()[0]
+    return meta
+
+
+def _create_tables(conn: sqlite3.Connection):
+    percentiles = ", ".join(f"ltv_p{p} REAL" for p in PERCENTILES)
+    conn.execute(
+        f"CREATE TABLE {CUBE_TABLE} (grain TEXT NOT NULL, cohort_start TEXT NOT NULL, "
+        "days_since_install INTEGER NOT NULL, payer_group TEXT NOT NULL, platform TEXT, anchor_day TEXT NOT NULL, "
+        "active_users INTEGER NOT NULL, bookings REAL, transactions INTEGER, bookings_lifetime_sum REAL, "
+        "bookings_count INTEGER, transactions_count INTEGER, bookings_lifetime_count INTEGER, "
+        f"{percentiles})"
+    )
+    conn.execute(f"CREATE INDEX idx_{CUBE_TABLE}_anchor ON {CUBE_TABLE} (grain, anchor_day)")
+    conn.execute(f"CREATE INDEX idx_{CUBE_TABLE}_cell ON {CUBE_TABLE} (grain, cohort_start, days_since_install)")
+    conn.execute(
+        f"CREATE TABLE {META_TABLE} (last_day TEXT, first_install TEXT, last_install TEXT, "
+        "other_payer_types TEXT, built_at TEXT)"
+    )
+
+
+def _rebuild(conn: sqlite3.Connection, grain: str, lo: date, hi: date) -> Set[str]:
+    """Recompute the ``grain`` cells anchored in [lo, hi]; returns payer types outside the known groups."""
+    with span("cohort_cube.rebuild", grain=grain, first=lo.isoformat(), last=hi.isoformat()) as s:
+        conn.execute(
+            f"DELETE FROM {CUBE_TABLE} WHERE grain = ? AND anchor_day BETWEEN ? AND ?",
+            (grain, lo.isoformat(), hi.isoformat()),
+        )
+        cohort = COHORT_SQL[grain].format(column="install_first_date_pst")
+        df = pd.read_sql_query(
+            f"""
+            SELECT * FROM (
+                SELECT cohort_start, days_since_install, payer_group, platform,
+                       date(cohort_start, printf('%+d days', days_since_install)) AS anchor_day,
+                       bookings, transactions, bookings_lifetime, other_payer_type
+                FROM (
+                    SELECT {cohort} AS cohort_start,
+                           CAST(julianday(event_day_pst) - julianday(install_first_date_pst) AS INTEGER)
+                               AS days_since_install,
+                           {payer_group_sql()} AS payer_group,
+                           CASE WHEN {payer_group_sql()} = '{OTHER_PAYER}' THEN payer_type END AS other_payer_type,
+                           platform, bookings, transactions, bookings_lifetime
+                    FROM {BASE_TABLE}
+                    WHERE event_day_pst BETWEEN ? AND ? AND install_first_date_pst IS NOT NULL
+                )
+            ) WHERE anchor_day BETWEEN ? AND ?
+            """,
+            conn,
+            params=(lo.isoformat(), (hi + timedelta(days=COHORT_SPAN_DAYS[grain])).isoformat(),
+                    lo.isoformat(), hi.isoformat()),
+        )
+        if df.empty:
+            s.set(rows=0, cells=0)
+            return set()
+        keys = ["cohort_start", "days_since_install", "payer_group", "platform", "anchor_day"]
+        groups = df.groupby(keys, dropna=False, sort=False)
+        cells = groups.agg(
+            active_users=("bookings", "size"),
+            bookings=("bookings", "sum"),
+            transactions=("transactions", "sum"),
+            bookings_lifetime_sum=("bookings_lifetime", "sum"),
+            **{f"{column}_count": (column, "count") for column in _METRIC_COLUMNS},
+        )
+        quantiles = groups["bookings_lifetime"].quantile([p / 100 for p in PERCENTILES]).unstack()
+        for p in PERCENTILES:
+            cells[f"ltv_p{p}"] = quantiles[p / 100]
+        cells = cells.reset_index()
+        cells.insert(0, "grain", grain)
+        columns = ", ".join(cells.columns)
+        values = cells.astype(object).where(cells.notna(), None)
+        conn.executemany(
+            f"INSERT INTO {CUBE_TABLE} ({columns}) VALUES ({', '.join('?' * len(cells.columns))})",
+            values.itertuples(index=False, name=None),
+        )
+        s.set(rows=len(df), cells=len(cells))
+        return set(df["other_payer_type"].dropna().unique())
+
+
+def _day_ranges(days: List[date], gap: int) -> List[Tuple[date, date]]:
+    """Merge sorted days into ranges, joining days closer than ``gap`` days."""
+    ranges: List[Tuple[date, date]] = []
+    for day in days:
+        if ranges and (day - ranges[-1][1]).days <= gap:
+            ranges[-1] = (ranges[-1][0], day)
+        else:
+            ranges.append((day, day))
+    return ranges
+
+
+def _day(value: Any) -> date:
+    return date.fromisoformat(str(value)[:10])
+
+
+# -- routing ------------------------------------------------------------------------
+
+class CohortRouter:
+    """Rewrites matching queries on user_days to read ``cohort_cube`` instead.
+
+    ``query_fn(sql)`` runs a statement and returns rows as tuples. The cube's
+    metadata is cached for ``Config.SCHEMA_CACHE_SECONDS``; queries are only
+    routed while the cube covers the newest day in user_days.
+    """
+
+    def __init__(self, query_fn: QueryFn):
+        self.query_fn = query_fn
+        self._meta: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._meta = (0.0, None)
+
+    def meta(self) -> Optional[Dict[str, Any]]:
+        """Cube metadata while the cube is current, otherwise None."""
+        with self._lock:
+            loaded_at, meta = self._meta
+            if time.monotonic() - loaded_at < Config.SCHEMA_CACHE_SECONDS:
+                return meta
+        meta = None
+        try:
+            rows = self.query_fn(
+                f"SELECT last_day, first_install, last_install, other_payer_types FROM {META_TABLE}"
+            ) if self.query_fn(f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{META_TABLE}'") else []
+            if rows and rows[0][0] and rows[0][0] == self._latest_day():
+                last_day, first_install, last_install, others = rows[0]
+                meta = {"last_day": last_day, "first_install": first_install, "last_install": last_install,
+                        "other_payer_types": json.loads(others or "[]")}
+        except Exception:
+            meta = None  # no cube
+        with self._lock:
+            self._meta = (time.monotonic(), meta)
+        return meta
+
+    def route(self, sql: str) -> Optional[str]:
+        """Equivalent query on the cube, or None when ``sql`` has to run on user_days."""
+        meta = self.meta()
+        if meta is None:
+            return None
+        with span("cohort_cube.route") as s:
+            try:
+                routed = _CubeRewrite(sql, meta, self.query_fn).sql()
+            except (NotRoutable, SQLParseError) as e:
+                s.set(routed=False, reason=str(e))
+                return None
+            s.set(routed=True)
+            return routed
+
+    def _latest_day(self) -> Optional[str]:
+        if self.query_fn("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'partition_catalog'"):
+            # Partitioned databases know their newest day without scanning the view
+            value = self.query_fn("SELECT MAX(last_day) FROM partition_catalog")[0][0]
+        else:
+            value = self.query_fn(f"SELECT MAX(event_day_pst) FROM {BASE_TABLE}")[0][0]
+        return str(value)[:10] if value else None
+
+
+class _CubeRewrite:
+    """One query's translation to the cube (raises NotRoutable)."""
+
+    def __init__(self, sql: str, meta: Dict[str, Any], query_fn: QueryFn):
+        self.sql_text = sql
+        self.meta = meta
+        self.query_fn = query_fn
+        self.grains = set(GRAINS)
+        self.counts_users = False
+
+    def sql(self) -> str:
+        parsed = parse_sql(self.sql_text)
+        if len(parsed.statements) != 1 or parsed.tables != {BASE_TABLE} or len(parsed.table_refs) != 1:
+            raise NotRoutable("only single-table queries on user_days")
+        if parsed.table_refs[0][3] is not None:
+            raise NotRoutable("table alias")
+        tokens = parsed.statements[0]
+        if not tokens[0].is_keyword("SELECT") or sum(1 for t in tokens if t.is_keyword("SELECT")) > 1:
+            raise NotRoutable("subqueries")
+        if any(t.is_keyword("OVER", "DISTINCT") and (t.upper == "OVER" or tokens[1] is t) for t in tokens) \
+                or any(t.value == "." for t in tokens):
+            raise NotRoutable("window functions, SELECT DISTINCT or qualified columns")
+        clauses = {}
+        for i, token in enumerate(tokens):
+            if token.depth == 0 and token.is_keyword(*_CLAUSES, "UNION", "INTERSECT", "EXCEPT", "WINDOW"):
+                if token.upper in ("UNION", "INTERSECT", "EXCEPT", "WINDOW") or token.upper in clauses:
+                    raise NotRoutable(f"{token.upper} clause")
+                clauses[token.upper] = i
+        bounds = sorted(clauses.values()) + [len(tokens)]
+
+        def clause(name: str, skip: int = 1) -> Optional[List[int]]:
+            if name not in clauses:
+                return None
+            start = clauses[name]
+            end = bounds[bounds.index(start) + 1]
+            return list(range(start + skip, end))
+
+        items = split_tokens(tokens, list(range(1, clauses["FROM"])), ",")
+        select = [self._split_alias(tokens, item) for item in items]
+        group = split_tokens(tokens, clause("GROUP", 2) or [], ",")
+        aliases = {alias.lower(): expr for expr, alias in select if alias}
+
+        select_sql = []
+        group_keys: Set[str] = set()
+        group_sql = []
+        fixed_dsi = False
+        for item in group:
+            expr = self._resolve(tokens, item, select, aliases)
+            group_keys.add(_key(tokens, expr))
+            fixed_dsi = fixed_dsi or _is_plain_dsi(tokens, expr)
+            if expr is item:
+                group_sql.append(self._dimension(tokens, item))
+            else:
+                group_sql.append(self._text(tokens, item))  # alias or position
+        where_sql = []
+        where = clause("WHERE")
+        excludes_no_install = False
+        if where:
+            has_or = any(tokens[i].depth == 0 and tokens[i].is_keyword("OR") for i in where)
+            for conjunct in ([where] if has_or else split_tokens(tokens, where, "AND")):
+                fixed_dsi = fixed_dsi or _fixes_dsi(tokens, conjunct)
+                excludes_no_install = excludes_no_install or (not has_or and _rejects_null_install(tokens, conjunct))
+                where_sql.append(f"({self._dimension(tokens, conjunct)})")
+        if not excludes_no_install:
+            raise NotRoutable("no filter on install date or days since install (rows without one are not in the cube)")
+        for expr, alias in select:
+            if len(expr) == 1 and tokens[expr[0]].value == "*":
+                raise NotRoutable("SELECT *")
+            if _has_aggregate(tokens, expr):
+                text = self._aggregate(tokens, expr)
+            else:
+                if _key(tokens, expr) not in group_keys:
+                    raise NotRoutable("selected column is not grouped")
+                text = self._dimension(tokens, expr)
+            name = alias or self._text(tokens, expr)
+            select_sql.append(f'{text} AS "{name.replace(chr(34), chr(34) * 2)}"')
+        if not group and not any(_has_aggregate(tokens, expr) for expr, _ in select):
+            raise NotRoutable("not an aggregate query")
+        if self.counts_users and not fixed_dsi:
+            raise NotRoutable("COUNT(DISTINCT user_id) across several days since install")
+
+        having = clause("HAVING")
+        order_sql = []
+        for item in split_tokens(tokens, clause("ORDER", 2) or [], ","):
+            expr = item
+            while len(expr) > 1 and tokens[expr[-1]].is_keyword("ASC", "DESC", "NULLS", "FIRST", "LAST"):
+                expr = expr[:-1]
+            suffix = self._text(tokens, item[len(expr):]) if len(expr) < len(item) else ""
+            if self._resolve(tokens, expr, select, aliases) is not expr:
+                order_sql.append(self._text(tokens, item))
+            elif _has_aggregate(tokens, expr):
+                order_sql.append(f"{self._aggregate(tokens, expr)} {suffix}".rstrip())
+            else:
+                order_sql.append(f"{self._dimension(tokens, expr)} {suffix}".rstrip())
+        if not self.grains:
+            raise NotRoutable("install date expressions do not follow week or month cohorts")
+
+        grain = "month" if "month" in self.grains else "week"
+        parts = [f"SELECT {', '.join(select_sql)} FROM {CUBE_TABLE} WHERE grain = '{grain}'"]
+        parts.extend(f"AND {condition}" for condition in where_sql)
+        if group_sql:
+            parts.append(f"GROUP BY {', '.join(group_sql)}")
+        if having:
+            parts.append(f"HAVING {self._aggregate(tokens, having)}")
+        if order_sql:
+            parts.append(f"ORDER BY {', '.join(order_sql)}")
+        limit = clause("LIMIT", 0)
+        if limit:
+            parts.append(self._text(tokens, limit))
+        return " ".join(parts)
+
+    # -- expressions ------------------------------------------------------------------
+
+    def _aggregate(self, tokens, expr: List[int]) -> str:
+        """Text of an expression over aggregates, with each aggregate read from the cube's metrics."""
+        edits = []
+        i = expr[0]
+        while i <= expr[-1]:
+            token = tokens[i]
+            if token.kind == "word" and token.value.lower() in _AGGREGATES and i + 1 <= expr[-1] \
+                    and tokens[i + 1].value == "(":
+                close = closing_paren(tokens, i + 1)
+                edits.append((token.start, tokens[close].end, self._metric(tokens, token.value.lower(), i + 2, close)))
+                i = close + 1
+                continue
+            if _is_column(tokens, i):
+                raise NotRoutable(f"column {token.value} outside an aggregate")
+            i += 1
+        return _apply(self.sql_text, tokens[expr[0]].start, tokens[expr[-1]].end, edits)
+
+    def _metric(self, tokens, function: str, start: int, close: int) -> str:
+        args = [t.value.lower() for t in tokens[start:close]]
+        if function == "count" and args in (["*"], ["1"], ["user_id"]):
+            return "SUM(active_users)"
+        if function == "count" and args == ["distinct", "user_id"]:
+            self.counts_users = True
+            return "SUM(active_users)"
+        if len(args) == 1 and args[0] in _METRIC_COLUMNS:
+            column = _METRIC_COLUMNS[args[0]]
+            if function == "count":
+                return f"SUM({args[0]}_count)"
+            if function == "sum":
+                return f"SUM({column})"
+            if function == "total":
+                return f"TOTAL({column})"
+            if function == "avg":
+                return f"(SUM({column}) * 1.0 / SUM({args[0]}_count))"
+        raise NotRoutable(f"{function}({' '.join(args)}) is not in the cube")
+
+    def _dimension(self, tokens, expr: List[int]) -> str:
+        """Text of a non-aggregate expression in terms of the cube's dimensions."""
+        edits = []
+        columns: Set[str] = set()
+        install_tokens = []
+        uses_dsi = False
+        i = expr[0]
+        while i <= expr[-1]:
+            if i + len(_DSI_PATTERN) - 1 <= expr[-1] \
+                    and [t.value.lower() for t in tokens[i:i + len(_DSI_PATTERN)]] == _DSI_PATTERN:
+                end = i + len(_DSI_PATTERN) - 1
+                edits.append((tokens[i].start, tokens[end].end, _DSI_SQL))
+                uses_dsi = True
+                i = end + 1
+                continue
+            token = tokens[i]
+            if token.kind == "word" and token.value.lower() in _AGGREGATES and i + 1 < len(tokens) \
+                    and tokens[i + 1].value == "(":
+                raise NotRoutable("aggregate in a grouping or filter expression")
+            if _is_column(tokens, i):
+                column = token.value.lower()
+                if column not in _DIMENSION_COLUMNS:
+                    raise NotRoutable(f"column {token.value} is not a cube dimension")
+                columns.add(column)
+                if column == "install_first_date_pst":
+                    install_tokens.append(token)
+            i += 1
+        text = self._text(tokens, expr)
+        if "payer_type" in columns:
+            if columns != {"payer_type"} or uses_dsi:
+                raise NotRoutable("payer_type combined with other columns")
+            return self._payer_expression(text)
+        if "install_first_date_pst" in columns:
+            if columns != {"install_first_date_pst"} or uses_dsi:
+                raise NotRoutable("install date combined with other columns")
+            self._check_cohort_expression(text)
+            edits.extend((t.start, t.end, "cohort_start") for t in install_tokens)
+        return _apply(self.sql_text, tokens[expr[0]].start, tokens[expr[-1]].end, edits)
+
+    def _payer_expression(self, text: str) -> str:
+        """``text`` (over payer_type) as a CASE over payer_group; it must be constant within each group."""
+        groups = [(t, g) for g, types in PAYER_GROUPS.items() for t in types]
+        groups += [(None, NON_PAYER)] + [(t, OTHER_PAYER) for t in self.meta["other_payer_types"]]
+        values = ", ".join(f"({sql_literal(t)}, {sql_literal(g)})" for t, g in groups)
+        try:
+            rows = self.query_fn(
+                f"WITH t(payer_type, payer_group) AS (VALUES {values}) SELECT payer_group, ({text}) FROM t"
+            )
+        except Exception:
+            raise NotRoutable("payer_type expression could not be evaluated")
+        by_group: Dict[str, Set[Any]] = {}
+        for group, value in rows:
+            by_group.setdefault(group, set()).add(value)
+        if any(len(v) > 1 for v in by_group.values()):
+            raise NotRoutable("payer_type expression splits a payer group")
+        whens = " ".join(f"WHEN {sql_literal(g)} THEN {sql_literal(next(iter(v)))}" for g, v in by_group.items())
+        return f"CASE payer_group {whens} END"
+
+    def _check_cohort_expression(self, text: str):
+        """Drop the grains whose cohorts ``text`` (over install_first_date_pst) is not constant within."""
+        first, last = self.meta["first_install"], self.meta["last_install"]
+        if not first:
+            raise NotRoutable("empty cube")
+        for grain in list(self.grains):
+            cohort = COHORT_SQL[grain].format(column="install_first_date_pst")
+            end = f"date('{last}', '+6 days')"
+            if grain == "month":
+                end = f"date({end}, 'start of month', '+1 month', '-1 day')"
+            check = (
+                f"WITH RECURSIVE d(install_first_date_pst) AS ("
+                f"SELECT {COHORT_SQL[grain].format(column=sql_literal(first))} UNION ALL "
+                f"SELECT date(install_first_date_pst, '+1 day') FROM d WHERE install_first_date_pst < {end}) "
+                f"SELECT 1 FROM (SELECT {cohort} AS c, ({text}) AS v FROM d) GROUP BY c "
+                "HAVING COUNT(DISTINCT v) > 1 OR COUNT(v) BETWEEN 1 AND COUNT(*) - 1 LIMIT 1"
+            )
+            try:
+                split = bool(self.query_fn(check))
+            except Exception:
+                raise NotRoutable("install date expression could not be evaluated")
+            if split:
+                self.grains.discard(grain)
+
+    def _resolve(self, tokens, item: List[int], select, aliases) -> List[int]:
+        """Select-list expression an alias or position refers to; ``item`` itself otherwise."""
+        if len(item) == 1:
+            token = tokens[item[0]]
+            if token.kind == "number" and token.value.isdigit() and 1 <= int(token.value) <= len(select):
+                return select[int(token.value) - 1][0]
+            if token.kind in ("word", "quoted") and _unquote(token).lower() in aliases:
+                return aliases[_unquote(token).lower()]
+        return item
+
+    def _split_alias(self, tokens, item: List[int]) -> Tuple[List[int], Optional[str]]:
+        last = tokens[item[-1]]
+        if len(item) > 2 and last.kind in ("word", "quoted") and tokens[item[-2]].is_keyword("AS"):
+            return item[:-2], _unquote(last)
+        if len(item) > 1 and last.kind in ("word", "quoted") and not last.is_keyword():
+            before = tokens[item[-2]]
+            if before.value == ")" or (before.kind in ("word", "quoted") and not before.is_keyword()):
+                return item[:-1], _unquote(last)
+        return item, None
+
+    def _text(self, tokens, item: List[int]) -> str:
+        return self.sql_text[tokens[item[0]].start:tokens[item[-1]].end]
+
+
+def _is_column(tokens, i: int) -> bool:
+    token = tokens[i]
+    if token.kind == "quoted":
+        return True
+    return token.kind == "word" and not token.is_keyword() and not (
+        i + 1 < len(tokens) and tokens[i + 1].value == "("
+    )
+
+
+def _has_aggregate(tokens, expr: List[int]) -> bool:
+    return any(
+        tokens[i].kind == "word" and tokens[i].value.lower() in _AGGREGATES
+        and i + 1 < len(tokens) and tokens[i + 1].value == "("
+        for i in expr
+    )
+
+
+def _key(tokens, expr: List[int]) -> str:
+    return "".join(tokens[i].value.lower() for i in expr)
+
+
+def _rejects_null_install(tokens, conjunct: List[int]) -> bool:
+    """Whether a WHERE condition is never true for rows without an install date."""
+    values = {tokens[i].value.lower() for i in conjunct}
+    return "install_first_date_pst" in values and not values & _NULL_TOLERANT
+
+
+def _is_plain_dsi(tokens, expr: List[int]) -> bool:
+    """Whether ``expr`` is days since install itself (optionally in parentheses or CAST to a number)."""
+    values = [tokens[i].value.lower() for i in expr]
+    while True:
+        if values == _DSI_PATTERN:
+            return True
+        if len(values) > 2 and values[0] == "(" and values[-1] == ")":
+            values = values[1:-1]
+        elif len(values) > 5 and values[:2] == ["cast", "("] and values[-1] == ")" \
+                and values[-3] == "as" and values[-2] in ("integer", "int", "real"):
+            values = values[2:-3]
+        else:
+            return False
+
+
+def _fixes_dsi(tokens, conjunct: List[int]) -> bool:
+    """Whether a WHERE conjunct pins days since install to one value (``dsi = <number>``)."""
+    for j, i in enumerate(conjunct):
+        if tokens[i].value in ("=", "==") and tokens[i].depth == 0:
+            left, right = conjunct[:j], conjunct[j + 1:]
+            for side, other in ((left, right), (right, left)):
+                if _is_plain_dsi(tokens, side) and len(other) == 1 and tokens[other[0]].kind == "number":
+                    return True
+    return False
+
+
+def _apply(sql: str, start: int, end: int, edits: List[Tuple[int, int, str]]) -> str:
+    pieces = []
+    position = start
+    for edit_start, edit_end, text in sorted(edits):
+        pieces.append(sql[position:edit_start])
+        pieces.append(text)
+        position = edit_end
+    pieces.append(sql[position:end])
+    return "".join(pieces)
+
+
+def _unquote(token) -> str:
+    return token.value[1:-1] if token.kind == "quoted" else token.value
+
@@ -1,22 +1,41 @@
+import logging
 import os
-from dotenv import load_dotenv, find_dotenv
 
-env_path = find_dotenv()
-if env_path:
-    print(f"[DEBUG] .env found at: {env_path}")
-    load_dotenv(env_path)
-else:
-    print("[DEBUG] .env not found; relying on system environment variables")
+logger = logging.getLogger(__name__)
+
+_env_loaded = False
+
+
+def load_env():
+    """Load .env from the working directory or the project root (idempotent).
+
+    Checks the two known locations instead of ``find_dotenv()``, which walks
+    the call stack and parent directories on every import.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    _env_loaded = True
+    for directory in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        env_path = os.path.join(directory, ".env")
+        if os.path.isfile(env_path):
+            from dotenv import load_dotenv
+            load_dotenv(env_path)
+            logger.debug(".env found at: %s", env_path)
+            return
+    logger.debug(".env not found; relying on system environment variables")
+
+
+load_env()
+
 
 class Config:
     API_KEY = os.getenv("OPENAI_API_KEY")
-    print(f"[DEBUG] OPENAI_API_KEY loaded: {bool(API_KEY)}")
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///analytics.db")
     DATABASE_TYPE = os.getenv("DATABASE_TYPE", "sqlite")
     LOGIN_USERNAME = os.getenv("LOGIN_USERNAME", "analytics_user")
     LOGIN_PASSWORD = os.getenv("LOGIN_PASSWORD", "change_me")
     DB_DOWNLOAD_URL = os.getenv("DB_DOWNLOAD_URL") or "https://dl.dropboxusercontent.com/scl/fi/cbl7rjyb59ype02ybuaub/analytics.db?rlkey=9i120uadvqgs5wq64pc3kd6fj&st=shpogi23&dl=1"
-    print(f"[DEBUG] DB_DOWNLOAD_URL loaded: {bool(DB_DOWNLOAD_URL)}")
     
     @staticmethod
     def get_direct_drive_url(share_url: str) -> str:
@@ -27,10 +46,110 @@ class Config:
         return share_url
     
     # OpenAI Configuration
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+    OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
     OPENAI_MODEL = "llama3-8b-8192"
+    CASINO_SQL_MODEL = os.getenv("CASINO_SQL_MODEL", "gpt-3.5-turbo")
+    INSIGHTS_MODEL = os.getenv("INSIGHTS_MODEL", "gpt-3.5-turbo")
     MAX_TOKENS = 1000
     TEMPERATURE = 0.1
+
+    # Latency-aware model routing (model_router.py). Entries are comma-separated
+    # "model" or "model@base_url". Simple requests (short template-like
+    # questions, small prompts) try LLM_FAST_MODELS first. Complex ones go
+    # straight to the purpose's own model (CASINO_SQL_MODEL, INSIGHTS_MODEL,
+    # OPENAI_MODEL) or LLM_FALLBACK_MODELS. Errors and timeouts fall through to
+    # the next candidate; routes are ordered by their rolling latency and error
+    # rate over the last LLM_STATS_WINDOW calls, and a route that fails
+    # LLM_TRIP_ERRORS times in a row is skipped for LLM_COOLDOWN_SECONDS.
+    LLM_FAST_MODELS = os.getenv("LLM_FAST_MODELS", "")
+    LLM_FALLBACK_MODELS = os.getenv("LLM_FALLBACK_MODELS", "")
+    LLM_FAST_TIMEOUT_SECONDS = float(os.getenv("LLM_FAST_TIMEOUT_SECONDS", "15"))
+    LLM_FAST_MAX_PROMPT_TOKENS = int(os.getenv("LLM_FAST_MAX_PROMPT_TOKENS", "3000"))
+    LLM_SIMPLE_MAX_WORDS = int(os.getenv("LLM_SIMPLE_MAX_WORDS", "20"))
+    LLM_STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+    LLM_TRIP_ERRORS = int(os.getenv("LLM_TRIP_ERRORS", "3"))
+    LLM_COOLDOWN_SECONDS = int(os.getenv("LLM_COOLDOWN_SECONDS", "60"))
+
+    # Headless query service (service.py). When QUERY_SERVICE_URL is set the
+    # Streamlit apps call the service over HTTP instead of running in-process.
+    QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL", "")
+    SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+    SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8765"))
+    SERVICE_DB_WORKERS = int(os.getenv("SERVICE_DB_WORKERS", "8"))
+    SERVICE_LLM_WORKERS = int(os.getenv("SERVICE_LLM_WORKERS", "16"))
     
+    # Shared disk cache (insights, chart figures, ...)
+    CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+    CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", str(24 * 3600)))
+    # Query results larger than this are not written to the disk cache
+    RESULT_CACHE_MAX_ROWS = int(os.getenv("RESULT_CACHE_MAX_ROWS", "200000"))
+    # Store results with compact dtypes (categoricals, int32/float32, parsed
+    # dates; see frame_compaction.py) so cached and session copies stay small
+    COMPACT_RESULTS = os.getenv("COMPACT_RESULTS", "true").lower() not in ("0", "false", "no")
+    # How long the table/column catalog used to validate SQL is reused
+    SCHEMA_CACHE_SECONDS = int(os.getenv("SCHEMA_CACHE_SECONDS", "300"))
+
+    # Incremental refresh (ingest.py): directory or HTTP(S) URL with manifest.json
+    # and one delta file per new event_day_pst. ANALYZE after a refresh reads at
+    # most INGEST_ANALYZE_LIMIT rows per index; the data version is re-read every
+    # DATA_VERSION_CHECK_SECONDS to invalidate cached results of refreshed days.
+    INGEST_SOURCE = os.getenv("INGEST_SOURCE", "")
+    INGEST_ANALYZE_LIMIT = int(os.getenv("INGEST_ANALYZE_LIMIT", "1000"))
+    DATA_VERSION_CHECK_SECONDS = int(os.getenv("DATA_VERSION_CHECK_SECONDS", "15"))
+
+    # Single-flight (single_flight.py): identical LLM calls and queries running at
+    # the same time share one computation; a process waits at most
+    # SINGLE_FLIGHT_WAIT_SECONDS for another process's identical call.
+    SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() not in ("0", "false", "no")
+    SINGLE_FLIGHT_WAIT_SECONDS = int(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "600"))
+
+    # Monthly partitions (partitions.py): a month is sealed (read-only, ready to
+    # compact) once the newest day is more than PARTITION_SEAL_DAYS past its end;
+    # restatements of older days are rejected after that.
+    PARTITION_SEAL_DAYS = int(os.getenv("PARTITION_SEAL_DAYS", "7"))
+
+    # Cohort cube (cohort_cube.py, built with `python run.py cube`): cohort and
+    # tenure aggregates are answered from the cube while it covers the newest day
+    COHORT_CUBE_ENABLED = os.getenv("COHORT_CUBE_ENABLED", "true").lower() not in ("0", "false", "no")
+
+    # Segment index (segment_index.py, built with `python run.py segments`): DAU
+    # and segment counts are computed from per-day user bitmaps while the index
+    # covers the newest day; decoded bitmaps are cached up to SEGMENT_CACHE_MB.
+    SEGMENT_INDEX_ENABLED = os.getenv("SEGMENT_INDEX_ENABLED", "true").lower() not in ("0", "false", "no")
+    SEGMENT_CACHE_MB = int(os.getenv("SEGMENT_CACHE_MB", "256"))
+
+    # Pre-execution cost guardrails (cost_estimator.py). COST_POLICY decides what
+    # happens above COST_CONFIRM_ROWS: "warn", "confirm" (ask first), "narrow"
+    # (restrict to the last COST_NARROW_DAYS days) or "off".
+    COST_POLICY = os.getenv("COST_POLICY", "confirm").lower()
+    COST_WARN_ROWS = int(os.getenv("COST_WARN_ROWS", "2000000"))
+    COST_CONFIRM_ROWS = int(os.getenv("COST_CONFIRM_ROWS", "10000000"))
+    COST_NARROW_DAYS = int(os.getenv("COST_NARROW_DAYS", "30"))
+    # Scan throughput used to turn rows into milliseconds: the rows/second that
+    # benchmarks/cost_calibration.py fits on the recorded queries (about 1.65-1.7M)
+    COST_ROWS_PER_SECOND = float(os.getenv("COST_ROWS_PER_SECOND", "1700000"))
+
+    # Approximate mode (approximate.py): the smallest user_days sample with at
+    # least this many rows answers "fast estimate" queries; smaller tables run exactly
+    APPROX_MIN_SAMPLE_ROWS = int(os.getenv("APPROX_MIN_SAMPLE_ROWS", "200000"))
+
+    # Conversational mode (conversation.py): results kept per session for follow-ups
+    CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "10"))
+    CONVERSATION_MAX_ROWS = int(os.getenv("CONVERSATION_MAX_ROWS", "1000000"))
+
+    # Multi-question mode (multi_question.py)
+    MULTI_QUESTION_MAX = int(os.getenv("MULTI_QUESTION_MAX", "12"))
+    MULTI_QUESTION_CONCURRENCY = int(os.getenv("MULTI_QUESTION_CONCURRENCY", "6"))
+
+    # Stage tracing (tracing.py): JSONL span log and Prometheus-style metrics.
+    # METRICS_PORT=0 keeps the standalone /metrics endpoint off (service.py
+    # always serves /metrics on its own port).
+    TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() not in ("0", "false", "no")
+    TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(CACHE_DIR, "traces.jsonl"))
+    TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
     # Streamlit Configuration
     PAGE_TITLE = "Analytics AI Tool"
     PAGE_ICON = "📊"
@@ -0,0 +1,210 @@
+"""
+Conversational execution mode: follow-up questions run against the previous result.
+
+Each turn's result is materialized in a session-scoped in-memory SQLite
+database as ``turn_<n>``, and ``prev_result`` is a view on the latest one. The
+follow-up prompt describes ``prev_result`` (columns, types, row count) next to
+the recent questions and SQL, so refinements such as "now just iOS" or
+"average of that" become a query over a few hundred rows instead of another
+scan of ``user_days``. When the generated SQL cannot run on the prior result
+(missing column, mixed references) the question is regenerated against the
+base table.
+
+Results larger than ``Config.CONVERSATION_MAX_ROWS`` are not materialized; the
+follow-up then goes to the base table.
+
+A turn answered from a prior result is stored through the client under the
+fingerprint it records (so export, insights and history re-runs find it), and
+its ``replay_sql`` inlines the prior turns it read as CTEs, so it also runs
+without the session tables.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from config import Config
+from frame_compaction import with_day_strings
+from pipeline import PipelineError, clean_result
+from service_client import unattended_sql
+from sql_generator import CASINO_SQL_PROMPT
+from sql_parser import parse_sql
+from tracing import span
+
+PREV_RESULT = "prev_result"
+_PROMPT_ANCHOR = "User Request: {user_query}"
+
+
+class Conversation:
+    """Question history and materialized results of one chat session."""
+
+    def __init__(self, client=None, max_turns: Optional[int] = None, context_turns: int = 3):
+        if client is None:
+            from service_client import LocalQueryClient
+            client = LocalQueryClient()
+        self.client = client
+        self.max_turns = max_turns or Config.CONVERSATION_MAX_TURNS
+        self.context_turns = context_turns
+        self.turns: List[Dict[str, Any]] = []
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    @property
+    def prev_table(self) -> Optional[str]:
+        """Table holding the latest result, or None if it was not materialized."""
+        return self.turns[-1]["table"] if self.turns else None
+
+    def ask(self, question: str) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+        """Answer a (follow-up) question; returns the result and the turn record."""
+        started = time.perf_counter()
+        with span("conversation.ask", turn=len(self.turns) + 1) as s:
+            session_tables = self._session_catalog()
+            df = sql = None
+            if session_tables:
+                try:
+                    sql = self.client.generate_sql(question, self.build_prompt(), extra_tables=session_tables)
+                except PipelineError:
+                    # e.g. a column prev_result does not have
+                    sql = None
+            else:
+                sql = self.client.generate_sql(question, self.build_prompt(with_prev_result=False))
+            tables = parse_sql(sql).tables if sql else set()
+            if tables and tables <= set(session_tables):
+                try:
+                    df = self._execute_local(sql)
+                    source = PREV_RESULT
+                except sqlite3.Error:
+                    df = None
+            if df is None:
+                if sql is None or tables & set(session_tables):
+                    # Not answerable from the prior result alone: ask again for the base table
+                    sql = self.client.generate_sql(question, self.build_prompt(with_prev_result=False))
+                sql = unattended_sql(self.client, sql)
+                df, fingerprint = self.client.execute(sql)
+                source = "user_days"
+                replay_sql = sql
+            else:
+                replay_sql = self._replay_sql(sql, tables)
+                fingerprint = self._store(df, replay_sql)
+            s.set(source=source, rows=len(df))
+
+        turn = {
+            "question": question,
+            "sql": sql,
+            "source": source,
+            "replay_sql": replay_sql,
+            "rows": len(df),
+            "fingerprint": fingerprint,
+            "table": self._materialize(df),
+            "ms": (time.perf_counter() - started) * 1000,
+        }
+        self.turns.append(turn)
+        self._evict()
+        return df, turn
+
+    def build_prompt(self, with_prev_result: bool = True) -> str:
+        """Casino SQL prompt template extended with the recent turns and the prior result's schema."""
+        lines = []
+        recent = self.turns[-self.context_turns:]
+        if recent:
+            lines.append("CONVERSATION HISTORY (most recent last):")
+            for i, turn in enumerate(recent, 1):
+                lines.append(f"Q{i}: {turn['question']}")
+                lines.append(f"SQL{i}: {turn['sql']}")
+            lines.append("")
+        if with_prev_result and self.prev_table:
+            lines.append(
+                f"PREVIOUS RESULT: the result of the last query is available as the table {PREV_RESULT} "
+                f"({self.turns[-1]['rows']:,} rows) with columns:"
+            )
+            lines.extend(f"- {name} ({dtype or 'TEXT'})" for name, dtype in self._columns(self.prev_table))
+            lines.append(
+                f"If the request only filters, re-aggregates, sorts or ranks that result, query {PREV_RESULT} "
+                "instead of user_days (it is much faster). Use user_days when the request needs columns "
+                f"or rows that {PREV_RESULT} does not contain. Never reference both tables in one query."
+            )
+            lines.append("")
+        if lines:
+            lines.append("CURRENT QUESTION (consider the above context):")
+        return CASINO_SQL_PROMPT.replace(_PROMPT_ANCHOR, "\n".join(lines) + "\n" + _PROMPT_ANCHOR)
+
+    def reset(self):
+        with self._lock:
+            for turn in self.turns:
+                if turn["table"]:
+                    self._conn.execute(f"DROP TABLE IF EXISTS {turn['table']}")
+            self._conn.execute(f"DROP VIEW IF EXISTS {PREV_RESULT}")
+        self.turns = []
+
+    def close(self):
+        self._conn.close()
+
+    def _execute_local(self, sql: str) -> pd.DataFrame:
+        with span("conversation.execute_prev_result") as s, self._lock:
+            cursor = self._conn.execute(sql)
+            columns = [d[0] for d in cursor.description]
+            df = clean_result(pd.DataFrame.from_records(cursor.fetchall(), columns=columns))
+            s.set(rows=len(df))
+        return df
+
+    def _replay_sql(self, sql: str, tables: Set[str]) -> str:
+        """``sql`` with the session tables it reads inlined as CTEs of their turns' replay SQL."""
+        sources = {turn["table"]: turn for turn in self.turns if turn["table"]}
+        if self.prev_table:
+            sources[PREV_RESULT] = self.turns[-1]
+        ctes = ", ".join(
+            f"{table} AS (\n{sources[table]['replay_sql'].strip().rstrip(';')}\n)" for table in sorted(tables)
+        )
+        tokens = parse_sql(sql).statements[0]
+        if not tokens[0].is_keyword("WITH"):
+            return f"WITH {ctes}\n{sql}"
+        head = tokens[1] if len(tokens) > 1 and tokens[1].is_keyword("RECURSIVE") else tokens[0]
+        return f"{sql[:head.end]} {ctes},{sql[head.end:]}"
+
+    def _store(self, df: pd.DataFrame, replay_sql: str) -> str:
+        """Keep a locally computed result where the client's export, insights and re-runs look for it."""
+        try:
+            return self.client.store_result(df)
+        except PipelineError:
+            # e.g. too large to upload to the query service: let it compute the result itself
+            return self.client.execute(replay_sql)[1]
+
+    def _materialize(self, df: pd.DataFrame) -> Optional[str]:
+        if len(df) > Config.CONVERSATION_MAX_ROWS or df.columns.empty:
+            with self._lock:
+                self._conn.execute(f"DROP VIEW IF EXISTS {PREV_RESULT}")
+            return None
+        self._counter += 1
+        table = f"turn_{self._counter}"
+        with span("conversation.materialize", rows=len(df)), self._lock:
+            # Days stay YYYY-MM-DD text so follow-up SQL compares them like user_days
+            with_day_strings(df).to_sql(table, self._conn, index=False)
+            self._conn.execute(f"DROP VIEW IF EXISTS {PREV_RESULT}")
+            self._conn.execute(f"CREATE VIEW {PREV_RESULT} AS SELECT * FROM {table}")
+            self._conn.commit()
+        return table
+
+    def _session_catalog(self) -> Dict[str, List[str]]:
+        """Materialized tables (and the prev_result view) with their column names."""
+        if not self.prev_table:
+            return {}
+        catalog = {turn["table"]: [name for name, _ in self._columns(turn["table"])]
+                   for turn in self.turns if turn["table"]}
+        catalog[PREV_RESULT] = catalog[self.prev_table]
+        return catalog
+
+    def _columns(self, table: str) -> List[Tuple[str, str]]:
+        with self._lock:
+            return [(row[1], row[2]) for row in self._conn.execute(f"PRAGMA table_info({table})")]
+
+    def _evict(self):
+        """Keep at most ``max_turns`` turns (and their tables)."""
+        while len(self.turns) > self.max_turns:
+            turn = self.turns.pop(0)
+            if turn["table"]:
+                with self._lock:
+                    self._conn.execute(f"DROP TABLE IF EXISTS {turn['table']}")
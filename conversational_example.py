@@ -4,84 +4,33 @@ This shows how to add session-based conversation history
 """
 
 import streamlit as st
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+from config import load_env
+from conversation import Conversation
+from pipeline import PipelineError
 
-load_dotenv()
+load_env()
 
-# Initialize conversation history in session state
-if 'conversation_history' not in st.session_state:
-    st.session_state.conversation_history = []
+# One conversation (history + materialized results) per Streamlit session
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = Conversation()
 
-def generate_conversational_sql(user_query: str, api_key: str = None) -> str:
-    """Generate SQL with conversation context"""
-    try:
-        client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
-        
-        # Build conversation context from history
-        context = ""
-        if st.session_state.conversation_history:
-            context = "\nCONVERSATION HISTORY:\n"
-            for i, item in enumerate(st.session_state.conversation_history[-3:]):  # Last 3 exchanges
-                context += f"Q{i+1}: {item['question']}\n"
-                context += f"SQL{i+1}: {item['sql']}\n\n"
-            context += "CURRENT QUESTION (consider the above context):\n"
-        
-        prompt = f"""
-You are a GSN Casino BigQuery SQL expert. Generate optimized SQL queries for GSN Casino data.
-
-RULES:
-- Always reference: dwh-prod-gsn-casino.gsn_agg.user_days
-- Always filter by event_day_pst to limit scanned data
-- Use clear BigQuery syntax
-- If the user refers to "previous query" or "that", use the conversation history
-- For follow-up questions like "average of it" or "median", modify the previous SQL
-
-TABLE SCHEMA (dwh-prod-gsn-casino.gsn_agg.user_days):
-- event_day_pst: Date
-- user_id: Unique user id
-- bookings: User's revenue
-- transactions: Number of transactions
-- payer_type: Type of payer
-- slot_spins: Number of spins in a day
-- platform: ios, android, amazon (mobile), others (web/webstore)
-- engagement_7d: Days active in last 7 days
-
-{context}
-{user_query}
+def ask_conversational(user_query: str):
+    """Answer a question with conversation context.
 
-SQL Query:
-"""
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a GSN Casino BigQuery SQL expert. Generate contextual SQL queries based on conversation history."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.1
-        )
-        
-        sql_query = response.choices[0].message.content.strip()
-        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
-        
-        # Save to conversation history
-        st.session_state.conversation_history.append({
-            'question': user_query,
-            'sql': sql_query
-        })
-        
-        # Keep only last 10 conversations to manage token usage
-        if len(st.session_state.conversation_history) > 10:
-            st.session_state.conversation_history = st.session_state.conversation_history[-10:]
-        
-        return sql_query
-        
-    except Exception as e:
+    Follow-ups that only refine the previous answer ("now just iOS", "average
+    of it") run against the previous result instead of re-scanning user_days.
+    Returns ``(result_df, turn)`` or ``(None, None)`` on failure.
+    """
+    try:
+        return st.session_state.conversation.ask(user_query)
+    except PipelineError as e:
         st.error(f"SQL generation failed: {str(e)}")
-        return None
+        return None, None
+
+def generate_conversational_sql(user_query: str) -> str:
+    """Generate (and run) SQL with conversation context; returns the SQL."""
+    _, turn = ask_conversational(user_query)
+    return turn["sql"] if turn else None
 
 def show_conversation_examples():
     """Show example of conversational flow"""
@@ -109,4 +58,11 @@ def show_conversation_examples():
 
 if __name__ == "__main__":
     st.title("🎰 Conversational SQL Generator")
+    question = st.text_input("Ask a question or a follow-up")
+    if st.button("Ask") and question:
+        result_df, turn = ask_conversational(question)
+        if turn:
+            st.code(turn["sql"], language="sql")
+            st.caption(f"{turn['rows']:,} rows from {turn['source']} in {turn['ms']:.0f} ms")
+            st.dataframe(result_df)
     show_conversation_examples()
@@ -0,0 +1,433 @@
+"""
+Pre-execution cost estimation for generated SQL (SQLite).
+
+Before a query runs, ``CostEstimator.estimate`` combines
+
+- ``EXPLAIN QUERY PLAN``: which tables are scanned in full and which are
+  searched through an index, and in what loop order;
+- table statistics: row counts and rows-per-key from ``sqlite_stat1`` (written
+  by ``ANALYZE``; ``MAX(rowid)`` when missing, the partition catalog for a
+  partitioned ``user_days``);
+- the ``event_day_pst`` range the query asks for (bounds are evaluated by
+  SQLite itself, so ``date('now', '-7 day')`` works) against the range held in
+  the table, assuming rows are spread evenly over days. Only bounds that are
+  plain AND-ed conditions of a WHERE/ON/HAVING clause narrow the range; a
+  bound under OR or NOT leaves the full table range;
+
+into estimated rows scanned, result rows and milliseconds
+(``Config.COST_ROWS_PER_SECOND``, see ``benchmarks/cost_calibration.py``).
+Estimates above ``Config.COST_WARN_ROWS`` / ``COST_CONFIRM_ROWS`` get the
+level ``warn`` / ``confirm``; ``narrow_time_window`` rewrites a query to its
+last N days of data. What the app does with a ``confirm`` level is
+``Config.COST_POLICY``: ``warn``, ``confirm`` (ask first) or ``narrow``.
+
+Other database types get no estimate (``None``).
+"""
+
+import re
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from partitions import BASE_TABLE, CATALOG_TABLE, PARTITION_PREFIX
+from sql_parser import parse_sql
+from tracing import span
+
+DATE_COLUMN = "event_day_pst"
+# Rows a full-table read costs relative to a covering-index read
+COVERING_INDEX_FACTOR = 0.35
+DEFAULT_GROUP_CARDINALITY = 50
+
+_PLAN_ACCESS = re.compile(
+    r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?"
+    r"(?:\s+USING\s+(COVERING\s+)?(?:INDEX\s+(\S+)|INTEGER PRIMARY KEY|PRIMARY KEY))?"
+    r"(?:\s+\((.*)\))?",
+)
+_BOUND_END = {"AND", "OR", "GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "INTERSECT", "EXCEPT", "THEN", "WHEN", "ELSE", "END"}
+_COMPARISONS = {">=": "lo", ">": "lo_strict", "<=": "hi", "<": "hi_strict", "=": "eq", "==": "eq"}
+_FLIPPED = {">=": "<=", ">": "<", "<=": ">=", "<": ">", "=": "=", "==": "=="}
+_AGGREGATES = {"count", "sum", "avg", "min", "max", "total", "group_concat"}
+# Keywords that start a filter clause, and those that end one at the same depth
+_FILTER_START = {"WHERE", "ON", "HAVING"}
+_FILTER_END = {"GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "INTERSECT", "EXCEPT", "WHERE",
+               "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL"}
+# Tokens that, before a bound at its own depth, mean it is not a filter condition
+_NOT_A_FILTER = {"SELECT", "CASE", "WHEN", "THEN", "ELSE", "END", "BY", "FROM", ","}
+
+QueryFn = Callable[[str], List[Tuple[Any, ...]]]
+
+
+class CostEstimator:
+    """Estimates query cost against one SQLite database.
+
+    ``query_fn(sql)`` runs a statement and returns its rows as tuples; table
+    statistics are cached for ``Config.SCHEMA_CACHE_SECONDS``.
+    """
+
+    def __init__(self, query_fn: QueryFn):
+        self.query_fn = query_fn
+        self._stats: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Forget cached table statistics (after the data changed)."""
+        with self._lock:
+            self._stats.clear()
+
+    # -- statistics ---------------------------------------------------------------
+
+    def table_stats(self, table: str) -> Dict[str, Any]:
+        """Row count, per-index rows-per-key and the date range of ``table``."""
+        with self._lock:
+            cached = self._stats.get(table)
+            if cached and time.monotonic() - cached[0] < Config.SCHEMA_CACHE_SECONDS:
+                return cached[1]
+
+        stats: Dict[str, Any] = {"rows": None, "indexes": {}, "days": None}
+        if table == BASE_TABLE and self._partitioned_stats(stats):
+            with self._lock:
+                self._stats[table] = (time.monotonic(), stats)
+            return stats
+        try:
+            for idx, stat in self.query_fn(f"SELECT idx, stat FROM sqlite_stat1 WHERE tbl = '{table}'"):
+                numbers = [int(x) for x in str(stat).split() if x.isdigit()]
+                if numbers:
+                    stats["rows"] = max(stats["rows"] or 0, numbers[0])
+                    if idx and len(numbers) > 1:
+                        stats["indexes"][idx] = numbers[1:]
+        except Exception:
+            pass  # no ANALYZE statistics
+        if not stats["rows"]:
+            rows = self.query_fn(f'SELECT MAX(rowid) FROM "{table}"')
+            stats["rows"] = int(rows[0][0] or 0) if rows else 0
+        try:
+            lo, hi = self.query_fn(f'SELECT MIN({DATE_COLUMN}), MAX({DATE_COLUMN}) FROM "{table}"')[0]
+            if lo and hi:
+                stats["days"] = (_to_date(lo), _to_date(hi))
+        except Exception:
+            pass  # table has no date column
+
+        with self._lock:
+            self._stats[table] = (time.monotonic(), stats)
+        return stats
+
+    # -- estimation ---------------------------------------------------------------
+
+    def date_range(self, sql: str) -> Optional[Tuple[Optional[date], Optional[date]]]:
+        """Inclusive (first, last) day the query filters ``event_day_pst`` to; None if unfiltered.
+
+        Bounds under OR or NOT (``d = X OR platform = 'ios'``, ``NOT d >= X``)
+        can match days outside them, so they are ignored.
+        """
+        tokens = parse_sql(sql).tokens
+        lo: Optional[date] = None
+        hi: Optional[date] = None
+        found = False
+        for i, token in enumerate(tokens):
+            if token.kind != "word" or token.value.lower() != DATE_COLUMN:
+                continue
+            if not _is_conjunct(tokens, i):
+                continue
+            bounds: List[Tuple[str, str]] = []
+            following = tokens[i + 1] if i + 1 < len(tokens) else None
+            preceding = tokens[i - 1] if i else None
+            if following is not None and following.value in _COMPARISONS:
+                bounds.append((_COMPARISONS[following.value], self._expression(tokens, i + 2)[0]))
+            elif following is not None and following.is_keyword("BETWEEN"):
+                low, end = self._expression(tokens, i + 2)
+                high, _ = self._expression(tokens, end + 1)
+                bounds += [("lo", low), ("hi", high)]
+            elif preceding is not None and preceding.value in _COMPARISONS and i >= 2:
+                # '2024-01-01' <= event_day_pst
+                expr = self._expression_before(tokens, i - 1)
+                if expr:
+                    bounds.append((_COMPARISONS[_FLIPPED[preceding.value]], expr))
+            for kind, expr in bounds:
+                value = self._evaluate(expr)
+                if value is None:
+                    continue
+                found = True
+                if kind in ("lo", "lo_strict", "eq"):
+                    value_lo = value + timedelta(days=1) if kind == "lo_strict" else value
+                    lo = max(lo, value_lo) if lo else value_lo
+                if kind in ("hi", "hi_strict", "eq"):
+                    value_hi = value - timedelta(days=1) if kind == "hi_strict" else value
+                    hi = min(hi, value_hi) if hi else value_hi
+        return (lo, hi) if found else None
+
+    def estimate(self, sql: str) -> Optional[Dict[str, Any]]:
+        """Cost estimate for ``sql``; None when the plan cannot be obtained."""
+        with span("cost.estimate") as s:
+            try:
+                parsed = parse_sql(sql)
+                plan_rows = self.query_fn(f"EXPLAIN QUERY PLAN {sql}")
+            except Exception:
+                # Unparseable SQL or a database without EXPLAIN QUERY PLAN
+                return None
+
+            aliases = {alias: table for table, _, _, alias in parsed.table_refs if alias}
+            day_range = self.date_range(sql)
+            rows_scanned = 0.0
+            full_scans: List[str] = []
+            # Accesses under the same plan parent are nested loops, outermost first
+            loop_rows: Dict[Any, float] = {}
+            range_days: Optional[int] = None
+            plan = []
+            for row in plan_rows:
+                parent, detail = row[1], str(row[-1])
+                plan.append(detail)
+                m = _PLAN_ACCESS.match(detail)
+                if not m:
+                    continue
+                op, name, alias, covering, index, constraint = m.groups()
+                table = aliases.get(name.lower(), name.lower())
+                if table not in parsed.tables and not table.startswith(PARTITION_PREFIX):
+                    continue  # CTE, subquery or view materialized elsewhere in the plan
+                stats = self.table_stats(table)
+                if stats.get("partitioned"):
+                    continue  # the partitioned view; its partitions are listed separately
+                total = float(stats["rows"] or 0)
+                fraction = self._date_fraction(stats, day_range)
+                if stats["days"] and range_days is None:
+                    range_days = max(1, round(fraction * ((stats["days"][1] - stats["days"][0]).days + 1)))
+                if op == "SCAN":
+                    rows = total * (COVERING_INDEX_FACTOR if covering else 1.0)
+                    full_scans.append(table)
+                    out = total * fraction
+                elif not constraint:
+                    rows = out = 1.0  # MIN/MAX read from the end of an index
+                elif DATE_COLUMN in constraint:
+                    rows = out = total * fraction
+                elif constraint and index and index in stats["indexes"]:
+                    equalities = constraint.count("=")
+                    per_key = stats["indexes"][index]
+                    rows = out = float(per_key[min(equalities, len(per_key)) - 1] if equalities else total)
+                else:
+                    rows = out = 1.0 if "rowid" in constraint else total * fraction
+                outer = loop_rows.get(parent, 1.0)
+                rows_scanned += outer * rows
+                loop_rows[parent] = outer * max(out, 1.0)
+
+            result_rows = self._result_rows(parsed, rows_scanned, range_days)
+            estimate = {
+                "rows_scanned": int(rows_scanned),
+                "result_rows": int(result_rows),
+                "est_ms": round(rows_scanned / Config.COST_ROWS_PER_SECOND * 1000, 1),
+                "full_scan": bool(full_scans),
+                "full_scan_tables": sorted(set(full_scans)),
+                "date_range": [d.isoformat() if d else None for d in day_range] if day_range else None,
+                "plan": plan,
+                "level": _level(rows_scanned),
+            }
+            s.set(rows_scanned=estimate["rows_scanned"], level=estimate["level"])
+            return estimate
+
+    def narrow_time_window(self, sql: str, days: Optional[int] = None, table: str = "user_days") -> str:
+        """``sql`` restricted to the last ``days`` days of data in ``table``.
+
+        Every reference to ``table`` is replaced by a filtered subquery under
+        the same name, so the rest of the query is untouched and SQLite still
+        uses the date index.
+        """
+        days = days or Config.COST_NARROW_DAYS
+        stats = self.table_stats(table)
+        if not stats["days"]:
+            return sql
+        start = (stats["days"][1] - timedelta(days=days - 1)).isoformat()
+        parsed = parse_sql(sql)
+        pieces = []
+        position = 0
+        for name, ref_start, ref_end, alias in parsed.table_refs:
+            if name != table:
+                continue
+            pieces.append(sql[position:ref_start])
+            pieces.append(f"(SELECT * FROM {table} WHERE {DATE_COLUMN} >= '{start}')")
+            if alias is None:
+                pieces.append(f" AS {table}")
+            position = ref_end
+        pieces.append(sql[position:])
+        return "".join(pieces)
+
+    # -- helpers ------------------------------------------------------------------
+
+    def _partitioned_stats(self, stats: Dict[str, Any]) -> bool:
+        """Fill ``stats`` for the partitioned user_days view from the partition catalog."""
+        try:
+            # Checked first so an unpartitioned database does not log a failed query
+            if not self.query_fn(
+                f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{CATALOG_TABLE}'"
+            ):
+                return False
+            rows, lo, hi = self.query_fn(f"SELECT SUM(rows), MIN(first_day), MAX(last_day) FROM {CATALOG_TABLE}")[0]
+        except Exception:
+            return False  # not partitioned
+        stats["rows"] = int(rows or 0)
+        stats["partitioned"] = True
+        if lo and hi:
+            stats["days"] = (_to_date(lo), _to_date(hi))
+        return True
+
+    def _expression(self, tokens, start: int) -> Tuple[str, int]:
+        """Source text of the expression starting at ``start``; returns (text, end index)."""
+        if start >= len(tokens):
+            return "", start
+        nesting = 0
+        end = start
+        while end < len(tokens):
+            token = tokens[end]
+            if token.value == "(":
+                nesting += 1
+            elif token.value == ")":
+                if nesting == 0:
+                    break
+                nesting -= 1
+            elif nesting == 0 and (token.value in (",", ";") or (token.kind == "word" and token.upper in _BOUND_END)):
+                break
+            end += 1
+        if end == start:
+            return "", end
+        return self._text(tokens, start, end), end
+
+    def _expression_before(self, tokens, op_index: int) -> str:
+        end = op_index
+        start = end - 1
+        if start < 0:
+            return ""
+        if tokens[start].value == ")":
+            depth = tokens[start].depth
+            while start > 0 and not (tokens[start].value == "(" and tokens[start].depth == depth):
+                start -= 1
+            if start > 0 and tokens[start - 1].kind == "word" and not tokens[start - 1].is_keyword():
+                start -= 1  # function call such as date(...)
+        return self._text(tokens, start, end)
+
+    @staticmethod
+    def _text(tokens, start: int, end: int) -> str:
+        return " ".join(t.value for t in tokens[start:end])
+
+    def _evaluate(self, expr: str) -> Optional[date]:
+        """Evaluate a constant (or MIN/MAX-of-date subquery) bound with SQLite."""
+        if not expr:
+            return None
+        try:
+            if not parse_sql(f"SELECT {expr}").columns <= {DATE_COLUMN}:
+                return None
+            rows = self.query_fn(f"SELECT ({expr})")
+        except Exception:
+            return None
+        return _to_date(rows[0][0]) if rows and rows[0][0] else None
+
+    @staticmethod
+    def _date_fraction(stats: Dict[str, Any], day_range) -> float:
+        if not day_range or not stats["days"]:
+            return 1.0
+        first, last = stats["days"]
+        lo, hi = day_range
+        lo = max(lo or first, first)
+        hi = min(hi or last, last)
+        total_days = (last - first).days + 1
+        return max(0, (hi - lo).days + 1) / total_days if total_days > 0 else 1.0
+
+    def _result_rows(self, parsed, rows_scanned: float, range_days: Optional[int]) -> float:
+        statement = parsed.statements[0] if parsed.statements else []
+        outer_group = [i for i, t in enumerate(statement) if t.depth == 0 and t.is_keyword("GROUP")]
+        if outer_group:
+            cardinality = 1.0
+            clause = statement[outer_group[0] + 2:]
+            for i, t in enumerate(clause):
+                if t.depth == 0 and t.is_keyword("HAVING", "ORDER", "LIMIT", "WINDOW", "UNION"):
+                    break
+                qualifier = i + 1 < len(clause) and clause[i + 1].value == "."
+                if t.depth == 0 and t.kind in ("word", "number") and not t.is_keyword() and not qualifier:
+                    if t.value.lower() == DATE_COLUMN and range_days:
+                        cardinality *= range_days
+                    else:
+                        cardinality *= DEFAULT_GROUP_CARDINALITY
+            rows = min(cardinality, rows_scanned)
+        elif parsed.functions & _AGGREGATES:
+            rows = 1.0
+        else:
+            rows = rows_scanned
+        if parsed.limit is not None:
+            rows = min(rows, parsed.limit)
+        return rows
+
+
+def _is_conjunct(tokens, i: int) -> bool:
+    """Whether the condition at ``tokens[i]`` must hold for every row the clause keeps.
+
+    True when it is one of the top-level AND-ed conditions of a WHERE, ON or
+    HAVING clause, possibly inside parentheses that are themselves AND-ed; not
+    under OR, a boolean NOT, CASE or a function call.
+    """
+    n = len(tokens)
+    depth = tokens[i].depth
+    left = right = i
+    while True:
+        # Left to the start of the clause (or the enclosing parenthesis)
+        j = left - 1
+        seen_and = False
+        started = False
+        while j >= 0 and tokens[j].depth >= depth:
+            token = tokens[j]
+            if token.depth == depth:
+                upper = token.upper if token.kind == "word" else token.value
+                if upper == "OR" or upper in _NOT_A_FILTER:
+                    return False
+                if upper == "NOT" and not seen_and and (
+                    j == 0 or tokens[j - 1].value == "(" or tokens[j - 1].upper in _FILTER_START | {"AND", "OR", "NOT"}
+                ):
+                    return False  # boolean NOT over this condition
+                if upper == "AND":
+                    seen_and = True
+                if upper in _FILTER_START:
+                    started = True
+                    break
+            j -= 1
+        # Right to the end of the clause (or the closing parenthesis)
+        k = right + 1
+        while k < n and tokens[k].depth >= depth:
+            token = tokens[k]
+            if token.depth == depth:
+                upper = token.upper if token.kind == "word" else token.value
+                if upper == "OR" or upper in ("THEN", "WHEN", "ELSE", "END"):
+                    return False
+                if upper in _FILTER_END or token.value in (",", ";"):
+                    break
+            k += 1
+        if started:
+            return True
+        if j < 0:
+            return False
+        # tokens[j] opens the parentheses around the condition: they must be AND-ed in turn
+        before = tokens[j - 1] if j else None
+        if before is None or not (before.value == "(" or before.upper in _FILTER_START | {"AND"}):
+            return False
+        left, right, depth = j, k, depth - 1
+
+
+def _level(rows_scanned: float) -> str:
+    if rows_scanned >= Config.COST_CONFIRM_ROWS:
+        return "confirm"
+    if rows_scanned >= Config.COST_WARN_ROWS:
+        return "warn"
+    return "ok"
+
+
+def _to_date(value: Any) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def describe(estimate: Dict[str, Any]) -> str:
+    """One-line summary for the UI."""
+    text = f"~{estimate['rows_scanned']:,} rows scanned, ~{estimate['est_ms'] / 1000:.1f} s"
+    if estimate["full_scan"]:
+        text += f" (full scan of {', '.join(estimate['full_scan_tables'])})"
+    if estimate["date_range"]:
+        text += f", {estimate['date_range'][0] or '…'} to {estimate['date_range'][1] or '…'}"
+    return text
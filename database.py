@@ -1,18 +1,52 @@
+import logging
 import sqlite3
+import threading
 import pandas as pd
-from sqlalchemy import create_engine, text
 from typing import Optional, Dict, Any, List
-import streamlit as st
 import os
-import requests
 from config import Config
+from lazy import lazy_import
+from partitions import PARTITION_PREFIX
+from sketches import register_functions
+from tracing import span
+
+# Deferred until first use: headless callers never touch streamlit,
+# sqlalchemy is only needed once a query actually runs, and requests only
+# for the one-off database download.
+requests = lazy_import("requests")
+sqlalchemy = lazy_import("sqlalchemy")
+st = lazy_import("streamlit")
+
+logger = logging.getLogger(__name__)
+
 
 class DatabaseManager:
-    def __init__(self):
+    def __init__(self, ui: bool = True):
+        """``ui=False`` suppresses Streamlit output (headless service, batch jobs);
+        errors are then only logged and kept in ``last_error``."""
         self.config = Config()
+        self.ui = ui
         self.engine = None
         self.connection = None
+        self._state = threading.local()
+        self._engine_lock = threading.Lock()
         self._ensure_database()
+
+    @property
+    def last_error(self) -> Optional[str]:
+        """Error from the most recent call made by the current thread."""
+        return getattr(self._state, "error", None)
+
+    @last_error.setter
+    def last_error(self, value: Optional[str]):
+        self._state.error = value
+
+    def _report(self, message: str, level: str = "error"):
+        self.last_error = message
+        if self.ui:
+            getattr(st, level)(message)
+        else:
+            logger.warning(message)
     
     def _ensure_database(self):
         """Download analytics.db if it doesn't exist locally."""
@@ -20,57 +54,81 @@ class DatabaseManager:
         if os.path.exists(db_path):
             return
         if not self.config.DB_DOWNLOAD_URL:
-            st.warning("DB_DOWNLOAD_URL not set; analytics.db not found locally.")
+            self._report("DB_DOWNLOAD_URL not set; analytics.db not found locally.", level="warning")
             return
         try:
-            with st.spinner("Downloading analytics.db..."):
-                direct_url = Config.get_direct_drive_url(self.config.DB_DOWNLOAD_URL)
-                response = requests.get(direct_url, stream=True, timeout=60)
-                response.raise_for_status()
-
-                total = int(response.headers.get("content-length", 0))
-                progress_bar = st.progress(0) if total > 0 else None
-
-                downloaded = 0
-                with open(db_path, "wb") as f:
-                    for data in response.iter_content(chunk_size=8192):
-                        size = f.write(data)
-                        downloaded += size
-                        if total > 0 and progress_bar is not None:
-                            progress_bar.progress(min(downloaded / total, 1.0))
-
-            st.success("analytics.db downloaded successfully.")
+            if self.ui:
+                with st.spinner("Downloading analytics.db..."):
+                    self._download(db_path)
+                st.success("analytics.db downloaded successfully.")
+            else:
+                logger.info("Downloading analytics.db...")
+                self._download(db_path)
         except Exception as e:
-            st.error(f"Failed to download analytics.db: {e}")
+            self._report(f"Failed to download analytics.db: {e}")
+
+    def _download(self, db_path: str):
+        direct_url = Config.get_direct_drive_url(self.config.DB_DOWNLOAD_URL)
+        response = requests.get(direct_url, stream=True, timeout=60)
+        response.raise_for_status()
+
+        total = int(response.headers.get("content-length", 0))
+        progress_bar = st.progress(0) if self.ui and total > 0 else None
+
+        downloaded = 0
+        with open(db_path, "wb") as f:
+            for data in response.iter_content(chunk_size=8192):
+                size = f.write(data)
+                downloaded += size
+                if progress_bar is not None:
+                    progress_bar.progress(min(downloaded / total, 1.0))
         
     def connect(self) -> bool:
-        """Establish database connection"""
+        """Create the pooled engine and verify a connection can be opened"""
         try:
-            self.engine = create_engine(self.config.DATABASE_URL)
-            self.connection = self.engine.connect()
+            with self._engine_lock:
+                if self.engine is None:
+                    self.engine = sqlalchemy.create_engine(self.config.DATABASE_URL)
+                    if self.config.DATABASE_TYPE == "sqlite":
+                        # hll_merge / hll_count for queries over the daily sketches (sketches.py)
+                        sqlalchemy.event.listen(
+                            self.engine, "connect", lambda dbapi_conn, _: register_functions(dbapi_conn)
+                        )
+                if self.connection is None:
+                    self.connection = self.engine.connect()
             return True
         except Exception as e:
-            st.error(f"Database connection failed: {str(e)}")
+            self._report(f"Database connection failed: {str(e)}")
             return False
     
     def disconnect(self):
         """Close database connection"""
         if self.connection:
             self.connection.close()
+            self.connection = None
         if self.engine:
             self.engine.dispose()
+            self.engine = None
     
     def execute_query(self, query: str) -> Optional[pd.DataFrame]:
-        """Execute SQL query and return results as DataFrame"""
+        """Execute SQL query and return results as DataFrame.
+
+        Each call checks a connection out of the engine's pool, so concurrent
+        callers (service workers, batch jobs) never share a connection.
+        """
         try:
-            if not self.connection:
+            self.last_error = None
+            if not self.engine:
                 if not self.connect():
                     return None
-            
-            result = pd.read_sql_query(text(query), self.connection)
-            return result
+
+            with span("db.execute_query") as s:
+                with self.engine.connect() as conn:
+                    df = pd.read_sql_query(sqlalchemy.text(query), conn)
+                s.set(rows=len(df), columns=len(df.columns))
+            return df
         except Exception as e:
-            st.error(f"Query execution failed: {str(e)}")
+            self._report(f"Query execution failed: {str(e)}")
             return None
     
     def get_table_schema(self, table_name: str) -> Optional[Dict[str, Any]]:
@@ -92,14 +150,18 @@ class DatabaseManager:
             schema_df = self.execute_query(schema_query)
             return schema_df.to_dict('records') if schema_df is not None else None
         except Exception as e:
-            st.error(f"Schema retrieval failed: {str(e)}")
+            self._report(f"Schema retrieval failed: {str(e)}")
             return None
     
     def get_all_tables(self) -> List[str]:
         """Get list of all tables in the database"""
         try:
             if self.config.DATABASE_TYPE == "sqlite":
-                tables_query = "SELECT name FROM sqlite_master WHERE type='table'"
+                # Views included (a partitioned user_days is one); the monthly partitions behind it are not
+                tables_query = (
+                    "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') "
+                    f"AND name NOT GLOB '{PARTITION_PREFIX}[0-9]*'"
+                )
             elif self.config.DATABASE_TYPE == "mysql":
                 tables_query = "SHOW TABLES"
             elif self.config.DATABASE_TYPE == "postgresql":
@@ -110,36 +172,31 @@ class DatabaseManager:
             tables_df = self.execute_query(tables_query)
             return tables_df.iloc[:, 0].tolist() if tables_df is not None else []
         except Exception as e:
-            st.error(f"Table listing failed: {str(e)}")
+            self._report(f"Table listing failed: {str(e)}")
             return []
     
-    def create_sample_data(self):
-        """Create sample tables for demonstration"""
+    def create_sample_data(self, rows: int = 50_000):
+        """Create a synthetic ``user_days`` table for demonstration (see synthetic_data.py).
+
+        An existing ``user_days`` table is never overwritten.
+        """
         try:
-            # Sample sales data
-            sales_data = {
-                'id': range(1, 101),
-                'product': ['Product A', 'Product B', 'Product C'] * 33 + ['Product A'],
-                'sales_amount': [100 + i * 10 for i in range(100)],
-                'sales_date': pd.date_range('2023-01-01', periods=100, freq='D'),
-                'region': ['North', 'South', 'East', 'West'] * 25
-            }
-            
-            sales_df = pd.DataFrame(sales_data)
-            sales_df.to_sql('sales', self.engine, if_exists='replace', index=False)
-            
-            # Sample customer data
-            customer_data = {
-                'customer_id': range(1, 51),
-                'customer_name': [f'Customer {i}' for i in range(1, 51)],
-                'age': [25 + (i % 40) for i in range(50)],
-                'city': ['New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix'] * 10
-            }
-            
-            customer_df = pd.DataFrame(customer_data)
-            customer_df.to_sql('customers', self.engine, if_exists='replace', index=False)
-            
-            st.success("Sample data created successfully!")
-            
+            from synthetic_data import generate_frame, write_sqlite
+
+            if "user_days" in self.get_all_tables():
+                self._report("user_days already exists; sample data was not created.", level="warning")
+                return
+
+            if self.config.DATABASE_URL.startswith("sqlite:///"):
+                self.disconnect()
+                write_sqlite(self.config.DATABASE_URL[len("sqlite:///"):], rows)
+            else:
+                if not self.engine and not self.connect():
+                    return
+                generate_frame(rows).to_sql("user_days", self.engine, if_exists="fail", index=False, chunksize=10_000)
+
+            if self.ui:
+                st.success(f"Sample user_days data created ({rows:,} rows).")
+
         except Exception as e:
-            st.error(f"Sample data creation failed: {str(e)}")
+            self._report(f"Sample data creation failed: {str(e)}")
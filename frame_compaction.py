@@ -0,0 +1,113 @@
+"""
+Memory-compact result frames.
+
+Results from ``user_days`` repeat a handful of strings (``payer_type``,
+``platform``, ``country``) on every row and come back from SQLite as int64 /
+float64 even when the values are small. ``compact_frame`` shrinks a result
+once, as it is loaded, so every copy held in session state, the result cache
+and exports is smaller:
+
+- text columns with few distinct values become ``category``;
+- integer columns whose values fit in int32 are stored as int32;
+- float columns are stored as float32 when that round-trips exactly;
+- ``event_day_pst`` / ``install_first_date_pst`` are parsed to datetime64 once.
+
+Every conversion is lossless; a column is left alone when it is not. The
+savings are attached to the frame as ``df.attrs["memory"]``.
+
+``with_day_strings`` turns the parsed date columns back into ``YYYY-MM-DD``
+text for JSON payloads and SQLite tables, where datetime64 would otherwise be
+written with a time of day.
+"""
+
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from tracing import span
+
+DATE_COLUMNS = ("event_day_pst", "install_first_date_pst")
+DATE_FORMAT = "%Y-%m-%d"
+# int32, not the narrowest type that fits: derived columns (differences, products) keep headroom
+INT_DTYPE = np.int32
+# A text column becomes categorical only when at most this share of its values are distinct
+CATEGORY_MAX_DISTINCT_SHARE = 0.5
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """A copy of ``df`` with compact dtypes; ``attrs["memory"]`` reports the bytes saved."""
+    with span("frame.compact", rows=len(df)) as s:
+        before = frame_bytes(df)
+        result = df.copy(deep=False)
+        converted: Dict[str, str] = {}
+        for position in range(df.shape[1]):
+            series = df.iloc[:, position]
+            compact = _compact_column(str(df.columns[position]), series)
+            if compact is not None:
+                result.isetitem(position, compact)
+                converted[str(df.columns[position])] = f"{series.dtype} -> {compact.dtype}"
+        after = frame_bytes(result) if converted else before
+        result.attrs["memory"] = {"bytes_before": before, "bytes_after": after, "converted": converted}
+        s.set(bytes_before=before, bytes_after=after, converted=len(converted))
+    return result
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """Memory held by a frame, counting the Python strings in object columns."""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def memory_report(df: pd.DataFrame) -> Optional[Dict[str, Any]]:
+    """The ``compact_frame`` report of a result, or None if it was not compacted."""
+    return df.attrs.get("memory")
+
+
+def with_day_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """``df`` with datetime date columns rendered back as ``YYYY-MM-DD`` text."""
+    columns = [
+        position for position, name in enumerate(df.columns)
+        if name in DATE_COLUMNS and pd.api.types.is_datetime64_any_dtype(df.iloc[:, position])
+    ]
+    if not columns:
+        return df
+    result = df.copy(deep=False)
+    for position in columns:
+        result.isetitem(position, df.iloc[:, position].dt.strftime(DATE_FORMAT).astype(object))
+    return result
+
+
+def _compact_column(name: str, series: pd.Series) -> Optional[pd.Series]:
+    """The compact form of one column, or None when no lossless conversion saves memory."""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or pd.api.types.is_bool_dtype(dtype) or series.empty:
+        return None
+    if pd.api.types.is_integer_dtype(dtype):
+        if dtype.itemsize <= np.dtype(INT_DTYPE).itemsize or not isinstance(dtype, np.dtype):
+            return None
+        info = np.iinfo(INT_DTYPE)
+        if series.min() >= info.min and series.max() <= info.max:
+            return series.astype(INT_DTYPE)
+        return None
+    if pd.api.types.is_float_dtype(dtype):
+        if dtype != np.float64:
+            return None
+        narrow = series.astype(np.float32)
+        if np.array_equal(narrow.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+            return narrow
+        return None
+    if not (pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)):
+        return None
+    if pd.api.types.infer_dtype(series, skipna=True) != "string":
+        return None
+    if name in DATE_COLUMNS:
+        parsed = pd.to_datetime(series, format=DATE_FORMAT, errors="coerce")
+        if parsed.isna().sum() == series.isna().sum():
+            return parsed
+        return None
+    if series.nunique(dropna=True) > len(series) * CATEGORY_MAX_DISTINCT_SHARE:
+        return None
+    categorical = series.astype("category")
+    if categorical.memory_usage(index=False, deep=True) < series.memory_usage(index=False, deep=True):
+        return categorical
+    return None
@@ -0,0 +1,181 @@
+"""
+Persistent query history.
+
+Every executed question is recorded in a SQLite file under
+``Config.CACHE_DIR`` with its SQL, result fingerprint, row count and stage
+timings, partitioned by user (all reads filter on ``user`` through the
+``(user, created_at)`` index). An FTS5 index over the question and SQL text
+makes searching thousands of entries instant. When the SQLite build lacks FTS5,
+search falls back to ``LIKE``.
+
+Re-running an entry reuses its stored SQL and, while it is still cached, its
+result (see ``pipeline.load_result``), so neither the LLM nor the database is
+called.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY,
+        user TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        question TEXT NOT NULL,
+        sql TEXT NOT NULL,
+        fingerprint TEXT,
+        row_count INTEGER,
+        generate_ms REAL,
+        execute_ms REAL,
+        total_ms REAL,
+        source TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_history_user_time ON history (user, created_at DESC)",
+]
+
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+        question, sql, content='history', content_rowid='id', tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN
+        INSERT INTO history_fts (rowid, question, sql) VALUES (new.id, new.question, new.sql);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN
+        INSERT INTO history_fts (history_fts, rowid, question, sql) VALUES ('delete', old.id, old.question, old.sql);
+    END
+    """,
+]
+
+COLUMNS = "id, user, created_at, question, sql, fingerprint, row_count, generate_ms, execute_ms, total_ms, source"
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+class HistoryStore:
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(Config.CACHE_DIR, "history.sqlite")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self.fts = True
+        self._conn()
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite handles cross-process locking."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                for statement in SCHEMA:
+                    conn.execute(statement)
+                if self.fts:
+                    try:
+                        for statement in FTS_SCHEMA:
+                            conn.execute(statement)
+                    except sqlite3.OperationalError:
+                        # SQLite built without FTS5
+                        self.fts = False
+            self._local.conn = conn
+        return conn
+
+    def add(self, user: str, question: str, sql: str, fingerprint: Optional[str] = None,
+            row_count: Optional[int] = None, timings: Optional[Dict[str, float]] = None,
+            source: Optional[str] = None) -> int:
+        """Record an executed query and return its id."""
+        timings = timings or {}
+        conn = self._conn()
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO history (user, created_at, question, sql, fingerprint, row_count,"
+                " generate_ms, execute_ms, total_ms, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user, time.time(), question, sql, fingerprint, row_count,
+                    timings.get("generate_ms"), timings.get("execute_ms"), timings.get("total_ms"), source,
+                ),
+            )
+        return cur.lastrowid
+
+    def recent(self, user: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+        rows = self._conn().execute(
+            f"SELECT {COLUMNS} FROM history WHERE user = ? ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (user, limit, offset),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, user: str, text: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Entries whose question or SQL contain every word of ``text`` (prefix match), best first."""
+        tokens = _TOKEN.findall(text or "")
+        if not tokens:
+            return self.recent(user, limit)
+        conn = self._conn()
+        if self.fts:
+            match = " ".join(f'"{token}"*' for token in tokens)
+            rows = conn.execute(
+                f"SELECT {', '.join('h.' + c.strip() for c in COLUMNS.split(','))}"
+                " FROM history_fts JOIN history h ON h.id = history_fts.rowid"
+                " WHERE history_fts MATCH ? AND h.user = ?"
+                " ORDER BY bm25(history_fts), h.created_at DESC LIMIT ?",
+                (match, user, limit),
+            ).fetchall()
+        else:
+            clauses = " AND ".join("(question LIKE ? OR sql LIKE ?)" for _ in tokens)
+            params: List[Any] = [user]
+            for token in tokens:
+                params += [f"%{token}%", f"%{token}%"]
+            rows = conn.execute(
+                f"SELECT {COLUMNS} FROM history WHERE user = ? AND {clauses}"
+                " ORDER BY created_at DESC LIMIT ?",
+                (*params, limit),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, user: str, entry_id: int) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            f"SELECT {COLUMNS} FROM history WHERE user = ? AND id = ?", (user, entry_id)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def count(self, user: str) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM history WHERE user = ?", (user,)).fetchone()[0]
+
+    def delete(self, user: str, entry_id: int):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM history WHERE user = ? AND id = ?", (user, entry_id))
+
+    def clear(self, user: str) -> int:
+        """Delete every entry of one user and return how many were removed."""
+        conn = self._conn()
+        with conn:
+            cur = conn.execute("DELETE FROM history WHERE user = ?", (user,))
+        return cur.rowcount
+
+
+_store: Optional[HistoryStore] = None
+_store_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Process-wide shared history store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = HistoryStore()
+    return _store
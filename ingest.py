@@ -0,0 +1,326 @@
+"""
+Incremental daily refresh of analytics.db.
+
+Instead of re-downloading the whole database, ``refresh`` appends new
+``event_day_pst`` partitions from a delta source (``Config.INGEST_SOURCE``): a
+local directory or an HTTP(S) base URL serving ``manifest.json``::
+
+    {"days": [{"day": "2025-01-01", "file": "user_days_2025-01-01.csv.gz", "sha256": "..."}]}
+
+Each file holds exactly one day of ``user_days`` rows (CSV, optionally
+gzip-compressed, or Parquet when pyarrow is installed). A day is loaded when it
+is newer than the newest day in ``user_days``, or when it was ingested before
+and its ``sha256`` changed (a restatement: the day is replaced).
+
+Deltas are downloaded and parsed first; then a single transaction inserts the
+rows, brings the derived tables up to date (the ``approximate.py`` samples and
+the ``cohort_cube.py`` cube, the ``segment_index.py`` bitmaps and the
+``sketches.py`` HyperLogLog sketches),
+refreshes planner statistics with a bounded ``ANALYZE`` and records the
+refresh as a new row in ``data_versions``. Indexes are maintained by SQLite as
+rows are inserted; in a partitioned database (``partitions.py``) new days go
+to their month's partition and months past the seal window are sealed. Every
+step touches only the new days, so a refresh costs time proportional to the
+new data, not to the history.
+
+``pipeline.data_version`` reads ``data_versions`` so cached query results are
+only invalidated when a refresh touched the days they read.
+
+    python run.py refresh --source https://example.com/deltas/
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import urllib.parse
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from approximate import BASE_TABLE, BUCKET_COLUMN, BUCKETS, META_TABLE, user_bucket
+from cohort_cube import refresh_cube
+from config import Config
+from lazy import is_available, lazy_import
+from partitions import PartitionError, is_partitioned, latest_day, partition_for_day, record_rows, seal_partitions
+from segment_index import refresh_segments
+from sketches import refresh_sketches
+from tracing import span
+
+requests = lazy_import("requests")
+
+DATE_COLUMN = "event_day_pst"
+MANIFEST = "manifest.json"
+LOG_TABLE = "ingest_log"
+VERSION_TABLE = "data_versions"
+INSERT_BATCH_ROWS = 50_000
+
+
+class IngestError(Exception):
+    """The refresh could not be applied; the database is unchanged."""
+
+
+def ensure_tables(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {LOG_TABLE} ({DATE_COLUMN} TEXT PRIMARY KEY, rows INTEGER, "
+        "sha256 TEXT, source TEXT, version INTEGER, ingested_at TEXT)"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (version INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "first_day TEXT, last_day TEXT, rows INTEGER, refreshed_at TEXT)"
+    )
+
+
+def read_manifest(source: str) -> List[Dict[str, Any]]:
+    """Day entries of the source's manifest, oldest first."""
+    with span("ingest.manifest"):
+        if _is_url(source):
+            response = requests.get(_join(source, MANIFEST), timeout=60)
+            response.raise_for_status()
+            manifest = response.json()
+        else:
+            with open(os.path.join(source, MANIFEST)) as f:
+                manifest = json.load(f)
+    days = manifest.get("days") if isinstance(manifest, dict) else None
+    if not isinstance(days, list) or any("day" not in d or "file" not in d for d in days):
+        raise IngestError(f"{MANIFEST} must list days as {{\"day\", \"file\", \"sha256\"?}} objects")
+    return sorted(days, key=lambda d: d["day"])
+
+
+def pending_days(conn: sqlite3.Connection, manifest: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Manifest entries to load: days after the newest loaded day, plus restated days."""
+    ensure_tables(conn)
+    ingested = dict(conn.execute(f"SELECT {DATE_COLUMN}, sha256 FROM {LOG_TABLE}").fetchall())
+    watermark = latest_day(conn)
+    pending = []
+    for entry in manifest:
+        day = entry["day"]
+        if day in ingested:
+            if entry.get("sha256") and entry["sha256"] != ingested[day]:
+                pending.append({**entry, "restated": True})
+        elif watermark is None or day > str(watermark)[:10]:
+            pending.append({**entry, "restated": False})
+    return pending
+
+
+def fetch_day(source: str, entry: Dict[str, Any], directory: str) -> str:
+    """Local path of a day's delta file (downloaded into ``directory`` for HTTP sources), checksum verified."""
+    with span("ingest.fetch", day=entry["day"]):
+        if _is_url(source):
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, os.path.basename(entry["file"]))
+            with requests.get(_join(source, entry["file"]), stream=True, timeout=300) as response:
+                response.raise_for_status()
+                with open(path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=1 << 20):
+                        f.write(chunk)
+        else:
+            path = os.path.join(source, entry["file"])
+        if entry.get("sha256") and _sha256(path) != entry["sha256"]:
+            raise IngestError(f"Checksum mismatch for {entry['file']}")
+        return path
+
+
+def read_day(path: str, day: str, columns: List[str]) -> pd.DataFrame:
+    """Rows of one delta file, checked to belong to ``day`` and to the table's columns."""
+    with span("ingest.read", day=day) as s:
+        if path.endswith(".parquet"):
+            if not is_available("pyarrow"):
+                raise IngestError("Parquet deltas need pyarrow (pip install pyarrow)")
+            df = pd.read_parquet(path)
+        else:
+            df = pd.read_csv(path, dtype={DATE_COLUMN: str})
+        unknown = sorted(set(df.columns) - set(columns))
+        if unknown:
+            raise IngestError(f"{os.path.basename(path)} has columns not in {BASE_TABLE}: {', '.join(unknown)}")
+        if DATE_COLUMN not in df.columns or (df[DATE_COLUMN].astype(str).str[:10] != day).any():
+            raise IngestError(f"{os.path.basename(path)} must only contain rows for {day}")
+        s.set(rows=len(df))
+        return df
+
+
+def refresh(db_path: Optional[str] = None, source: Optional[str] = None,
+            dry_run: bool = False) -> Dict[str, Any]:
+    """Load the pending days from ``source`` into ``db_path`` in one transaction.
+
+    Returns a report with the new ``version`` (None when nothing changed), the
+    loaded and restated ``days``, inserted ``rows`` and timings.
+    """
+    db_path = db_path or _sqlite_path()
+    source = source or Config.INGEST_SOURCE
+    if not source:
+        raise IngestError("No delta source configured (set INGEST_SOURCE or pass --source)")
+    started = time.perf_counter()
+    with span("ingest.refresh") as s:
+        conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        conn.create_function("user_bucket", 1, user_bucket, deterministic=True)
+        try:
+            pending = pending_days(conn, read_manifest(source))
+            report: Dict[str, Any] = {
+                "version": None,
+                "days": [e["day"] for e in pending],
+                "restated": [e["day"] for e in pending if e["restated"]],
+                "rows": 0,
+            }
+            if not pending or dry_run:
+                report["seconds"] = round(time.perf_counter() - started, 3)
+                return report
+
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({BASE_TABLE})")]
+            download_dir = os.path.join(Config.CACHE_DIR, "ingest")
+            frames = [(e, read_day(fetch_day(source, e, download_dir), e["day"], columns)) for e in pending]
+            report["fetch_seconds"] = round(time.perf_counter() - started, 3)
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                base_delta = 0
+                for entry, df in frames:
+                    deleted = _load_day(conn, entry, df)
+                    report["rows"] += len(df)
+                    base_delta += len(df) - deleted
+                days = [entry["day"] for entry, _ in frames]
+                if is_partitioned(conn):
+                    report["sealed"] = seal_partitions(conn)
+                _refresh_samples(conn, days, base_delta)
+                refresh_cube(conn, days)
+                refresh_segments(conn, days)
+                refresh_sketches(conn, days)
+                _analyze(conn)
+                cursor = conn.execute(
+                    f"INSERT INTO {VERSION_TABLE} (first_day, last_day, rows, refreshed_at) VALUES (?, ?, ?, ?)",
+                    (min(days), max(days), report["rows"], _now()),
+                )
+                report["version"] = cursor.lastrowid
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {LOG_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+                    [(entry["day"], len(df), entry.get("sha256"), entry["file"], report["version"], _now())
+                     for entry, df in frames],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        s.set(days=len(report["days"]), rows=report["rows"], version=report["version"])
+        return report
+
+
+def publish_day(directory: str, df: pd.DataFrame, compress: bool = True) -> Dict[str, Any]:
+    """Write one day of rows as a delta file into ``directory`` and add it to the manifest.
+
+    For producers of a local delta source (and for testing refreshes).
+    """
+    days = df[DATE_COLUMN].astype(str).str[:10].unique()
+    if len(days) != 1:
+        raise IngestError("A delta file must contain exactly one day")
+    day = days[0]
+    os.makedirs(directory, exist_ok=True)
+    name = f"{BASE_TABLE}_{day}.csv" + (".gz" if compress else "")
+    path = os.path.join(directory, name)
+    df.to_csv(path, index=False)
+    entry = {"day": day, "file": name, "sha256": _sha256(path), "rows": int(len(df))}
+    manifest_path = os.path.join(directory, MANIFEST)
+    manifest = {"days": []}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    manifest["days"] = [d for d in manifest["days"] if d["day"] != day] + [entry]
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return entry
+
+
+# -- transaction steps ------------------------------------------------------------
+
+def _load_day(conn: sqlite3.Connection, entry: Dict[str, Any], df: pd.DataFrame) -> int:
+    """Insert a day's rows (replacing a restated day); returns the number of rows deleted.
+
+    In a partitioned database (see partitions.py) the rows go straight to the
+    day's monthly partition.
+    """
+    with span("ingest.load_day", day=entry["day"], rows=len(df)):
+        table = BASE_TABLE
+        if is_partitioned(conn):
+            try:
+                table = partition_for_day(conn, entry["day"])
+            except PartitionError as e:
+                raise IngestError(str(e))
+        deleted = 0
+        if entry["restated"]:
+            deleted = conn.execute(f"DELETE FROM {table} WHERE {DATE_COLUMN} = ?", (entry["day"],)).rowcount
+        names = ", ".join(df.columns)
+        placeholders = ", ".join("?" * len(df.columns))
+        values = df.astype(object).where(df.notna(), None)
+        for start in range(0, len(values), INSERT_BATCH_ROWS):
+            conn.executemany(
+                f"INSERT INTO {table} ({names}) VALUES ({placeholders})",
+                values.iloc[start:start + INSERT_BATCH_ROWS].itertuples(index=False, name=None),
+            )
+        if table != BASE_TABLE:
+            record_rows(conn, table, entry["day"], len(df) - deleted)
+        return deleted
+
+
+def _refresh_samples(conn: sqlite3.Connection, days: List[str], base_delta: int):
+    """Append the new days' sampled users to every sample table (see approximate.py).
+
+    Row counts in ``sample_meta`` are adjusted by the change instead of recounted.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (META_TABLE,)).fetchone()
+    if not exists:
+        return
+    columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({BASE_TABLE})"))
+    marks = ", ".join("?" * len(days))
+    for table, percent in conn.execute(f"SELECT table_name, percent FROM {META_TABLE}").fetchall():
+        with span("ingest.refresh_sample", table=table):
+            deleted = conn.execute(f"DELETE FROM {table} WHERE {DATE_COLUMN} IN ({marks})", days).rowcount
+            inserted = conn.execute(
+                f"INSERT INTO {table} ({columns}, {BUCKET_COLUMN}) "
+                f"SELECT * FROM (SELECT {columns}, user_bucket(user_id) AS {BUCKET_COLUMN} FROM {BASE_TABLE} "
+                f"WHERE {DATE_COLUMN} IN ({marks})) WHERE {BUCKET_COLUMN} < ?",
+                (*days, BUCKETS * percent // 100),
+            ).rowcount
+            conn.execute(
+                f"UPDATE {META_TABLE} SET base_rows = base_rows + ?, sample_rows = sample_rows + ? "
+                "WHERE table_name = ?",
+                (base_delta, inserted - deleted, table),
+            )
+
+
+def _analyze(conn: sqlite3.Connection):
+    """Refresh planner statistics from a bounded number of rows per index."""
+    with span("ingest.analyze"):
+        conn.execute(f"PRAGMA analysis_limit = {int(Config.INGEST_ANALYZE_LIMIT)}")
+        conn.execute("ANALYZE")
+
+
+# -- helpers ----------------------------------------------------------------------
+
+def _sqlite_path() -> str:
+    if not Config.DATABASE_URL.startswith("sqlite:///"):
+        raise IngestError("Incremental refresh needs a SQLite DATABASE_URL")
+    return Config.DATABASE_URL[len("sqlite:///"):]
+
+
+def _is_url(source: str) -> bool:
+    return source.startswith(("http://", "https://"))
+
+
+def _join(base: str, name: str) -> str:
+    return urllib.parse.urljoin(base.rstrip("/") + "/", name)
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
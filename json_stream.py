@@ -0,0 +1,201 @@
+"""
+Incremental, fault-tolerant parser for the insights/charts JSON response.
+
+The model is asked to return ``{"insights": [...], "charts": [...]}``. Rather
+than waiting for the whole completion, ``InsightStreamParser`` is fed the
+token stream chunk by chunk and emits each insight string and chart spec as
+soon as its closing quote/brace arrives. Leading prose or markdown fences are
+skipped, top-level keys may be unquoted, and each element is repaired (single
+quotes, trailing commas, bare keys, Python literals) and validated against the
+chart schema before being emitted.
+"""
+
+import ast
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+CHART_TYPES = {"bar", "pie", "line", "histogram"}
+CHART_FIELDS = ("x", "y", "names", "values", "title")
+REQUIRED_FIELDS = {
+    "bar": ("x", "y"),
+    "line": ("x", "y"),
+    "pie": ("names", "values"),
+    "histogram": ("x",),
+}
+
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_BARE_KEY = re.compile(r"([{,]\s*)([A-Za-z_][A-Za-z0-9_]*)\s*:")
+_JSON_LITERALS = {"null": "None", "true": "True", "false": "False"}
+_LITERAL_TOKEN = re.compile(r"\b(null|true|false)\b")
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, Any]
+
+
+def repair_json(raw: str) -> Any:
+    """Parse a JSON fragment, repairing common model mistakes. Returns None if hopeless."""
+    candidates = [raw, _TRAILING_COMMA.sub(r"\1", raw)]
+    candidates.append(_BARE_KEY.sub(r'\1"\2":', candidates[-1]))
+    for text in candidates:
+        try:
+            return json.loads(text)
+        except Exception:
+            pass
+    # Python-literal fallback for single quotes / None / True
+    python_text = _LITERAL_TOKEN.sub(lambda m: _JSON_LITERALS[m.group(1)], candidates[-1])
+    try:
+        return ast.literal_eval(python_text)
+    except Exception:
+        return None
+
+
+def validate_chart(spec: Any) -> Optional[Dict[str, Any]]:
+    """Normalise a chart spec to the schema, or return None if it cannot be rendered."""
+    if not isinstance(spec, dict):
+        return None
+    ctype = str(spec.get("type") or "").strip().lower()
+    if ctype not in CHART_TYPES:
+        return None
+    chart: Dict[str, Any] = {"type": ctype}
+    for field in CHART_FIELDS:
+        value = spec.get(field)
+        if value is None or (isinstance(value, str) and value.strip().lower() in ("", "null", "none")):
+            chart[field] = None
+        else:
+            chart[field] = str(value).strip()
+    if any(not chart[field] for field in REQUIRED_FIELDS[ctype]):
+        return None
+    return chart
+
+
+def validate_insight(value: Any) -> Optional[str]:
+    if isinstance(value, (int, float)):
+        value = str(value)
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    return value or None
+
+
+class InsightStreamParser:
+    """Feed model output chunks; collect completed insights and charts as they close."""
+
+    def __init__(self):
+        self.text = ""
+        self.insights: List[str] = []
+        self.charts: List[Dict[str, Any]] = []
+        self.rejected: List[str] = []
+        self._pos = 0
+        self._started = False
+        self._done = False
+        self._stack: List[str] = []
+        self._quote: Optional[str] = None
+        self._escape = False
+        self._string_start = 0
+        self._expect_key = False
+        self._key: Optional[str] = None
+        self._key_start = 0
+        self._element_start = 0
+
+    def feed(self, chunk: str) -> List[Event]:
+        """Consume a chunk of model output and return newly completed elements."""
+        self.text += chunk
+        events: List[Event] = []
+        text = self.text
+        while self._pos < len(text) and not self._done:
+            ch = text[self._pos]
+            i = self._pos
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._stack.append("{")
+                    self._expect_key = True
+                    self._key_start = self._pos
+                continue
+
+            if self._quote:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == self._quote:
+                    self._quote = None
+                    self._on_string(text[self._string_start : i + 1], events)
+                continue
+
+            if ch in ('"', "'"):
+                self._quote = ch
+                self._string_start = i
+            elif ch in "{[":
+                if ch == "{" and self._in_array("charts"):
+                    self._element_start = i
+                self._stack.append(ch)
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if ch == "}" and self._in_array("charts"):
+                    self._emit_chart(text[self._element_start : i + 1], events)
+                if not self._stack:
+                    self._done = True
+            elif ch == "," and len(self._stack) == 1:
+                self._expect_key = True
+                self._key_start = self._pos
+            elif ch == ":" and len(self._stack) == 1:
+                # Bare (unquoted) keys such as {insights: [...]}; quoted keys are set in _on_string
+                bare = text[self._key_start : i].strip()
+                if _IDENTIFIER.fullmatch(bare):
+                    self._key = bare.lower()
+                self._expect_key = False
+        return events
+
+    def finish(self) -> Dict[str, Any]:
+        """Return the full result once the stream has ended.
+
+        If nothing could be extracted incrementally, the whole response is
+        parsed in one go, and as a last resort used as a single insight.
+        """
+        if not self.insights and not self.charts:
+            start, end = self.text.find("{"), self.text.rfind("}")
+            parsed = repair_json(self.text[start : end + 1]) if 0 <= start < end else None
+            if isinstance(parsed, dict):
+                if parsed.get("insights") or parsed.get("charts"):
+                    logger.warning("Insights response could not be parsed incrementally; parsed it after the stream ended")
+                for item in parsed.get("insights") or []:
+                    insight = validate_insight(item)
+                    if insight:
+                        self.insights.append(insight)
+                for item in parsed.get("charts") or []:
+                    chart = validate_chart(item)
+                    if chart:
+                        self.charts.append(chart)
+            elif self.text.strip():
+                self.insights.append(self.text.strip())
+        return {"insights": list(self.insights), "charts": list(self.charts)}
+
+    def _in_array(self, key: str) -> bool:
+        return self._key == key and self._stack == ["{", "["]
+
+    def _on_string(self, raw: str, events: List[Event]):
+        if len(self._stack) == 1 and self._expect_key:
+            self._key = str(repair_json(raw) or "").strip().lower()
+        elif self._in_array("insights"):
+            insight = validate_insight(repair_json(raw))
+            if insight:
+                self.insights.append(insight)
+                events.append(("insight", insight))
+            else:
+                self.rejected.append(raw)
+
+    def _emit_chart(self, raw: str, events: List[Event]):
+        chart = validate_chart(repair_json(raw))
+        if chart:
+            self.charts.append(chart)
+            events.append(("chart", chart))
+        else:
+            self.rejected.append(raw)
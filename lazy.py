@@ -0,0 +1,59 @@
+"""
+Lazy imports for heavy optional dependencies.
+
+``lazy_import("plotly.express")`` returns a module object that is only
+imported on first attribute access, so importing our modules (worker start-up,
+Streamlit re-executions after a reload, the headless service) does not pay
+for plotly, openai, sqlalchemy or streamlit until they are actually used.
+"""
+
+import importlib
+import importlib.util
+import sys
+from types import ModuleType
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Return ``name`` as a lazily-imported module (or the real one if already imported).
+
+    If the module is not installed, the error is raised on first attribute
+    access instead, so headless callers need not install UI-only packages.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    # Only the top-level package is looked up: finding a submodule's spec imports its parents
+    if not is_available(name.partition(".")[0]):
+        # Optional dependency not installed: fail on first use, not at import
+        return _MissingModule(name)
+    return _LazyModule(name)
+
+
+class _LazyModule(ModuleType):
+    """Stand-in that imports the real module on first attribute access.
+
+    The import goes through ``importlib.import_module``, whose per-module lock
+    makes threads that arrive mid-import wait for it to finish.
+    (``importlib.util.LazyLoader`` hands them the half-executed module before
+    Python 3.12.3.)
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)  # later lookups skip __getattr__
+        return getattr(module, attr)
+
+
+class _MissingModule(ModuleType):
+    """Stand-in for a module that is not installed; any attribute access raises."""
+
+    def __getattr__(self, attr):
+        raise ModuleNotFoundError(f"No module named {self.__name__!r}", name=self.__name__)
+
+
+def is_available(name: str) -> bool:
+    """Check whether a module can be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
@@ -0,0 +1,103 @@
+"""
+Minimal OpenAI-compatible Chat Completions client (urllib, no SDK).
+
+Shared by ``SQLGenerator`` and the insights pipeline so every LLM call goes
+through one place. Errors are raised, never rendered, so this module is safe
+to use from the headless service as well as from Streamlit.
+"""
+
+import json
+import os
+import urllib.request
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import Config
+
+
+class LLMError(Exception):
+    """Raised when the model endpoint cannot be reached or returns an unusable response."""
+
+
+def resolve_api_key(api_key: Optional[str] = None) -> str:
+    """``api_key`` or ``OPENAI_API_KEY``; raises ``LLMError`` when neither is set."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise LLMError("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
+    return api_key
+
+
+def _request(api_key: Optional[str], payload: Dict[str, Any], base_url: Optional[str] = None) -> urllib.request.Request:
+    api_key = resolve_api_key(api_key)
+    return urllib.request.Request(
+        f"{base_url or Config.OPENAI_BASE_URL}/chat/completions",
+        data=json.dumps(payload).encode(),
+        headers={
+            "Authorization": f"Bearer {api_key.strip()}",
+            "Content-Type": "application/json",
+        },
+    )
+
+
+def chat_completion(
+    messages: List[Dict[str, str]],
+    model: str,
+    max_tokens: int = 1000,
+    temperature: float = 0.1,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Run a blocking chat completion. Returns {"content": str, "usage": dict}.
+
+    ``base_url`` and ``timeout`` default to ``Config.OPENAI_BASE_URL`` and
+    ``Config.OPENAI_TIMEOUT_SECONDS`` (model_router.py passes per-route values).
+    """
+    req = _request(api_key, {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }, base_url)
+    with urllib.request.urlopen(req, timeout=timeout or Config.OPENAI_TIMEOUT_SECONDS) as response:
+        result = json.loads(response.read().decode())
+    try:
+        content = result["choices"][0]["message"]["content"].strip()
+    except (KeyError, IndexError, TypeError) as e:
+        raise LLMError(f"Unexpected completion payload: {e}")
+    return {"content": content, "usage": result.get("usage") or {}}
+
+
+def stream_chat_completion(
+    messages: List[Dict[str, str]],
+    model: str,
+    max_tokens: int = 1000,
+    temperature: float = 0.1,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Iterator[str]:
+    """Yield content deltas from a streaming chat completion (server-sent events)."""
+    req = _request(api_key, {
+        "model": model,
+        "messages": messages,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "stream": True,
+    }, base_url)
+    with urllib.request.urlopen(req, timeout=timeout or Config.OPENAI_TIMEOUT_SECONDS) as response:
+        for line in response:
+            line = line.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            payload = line[len("data:"):].strip()
+            if payload == "[DONE]":
+                break
+            choices = json.loads(payload).get("choices") or []
+            delta = choices[0].get("delta", {}) if choices else {}
+            if delta.get("content"):
+                yield delta["content"]
+
+
+def strip_sql_fences(text: str) -> str:
+    """Remove markdown code fences the model sometimes wraps SQL in."""
+    return text.replace("```sql", "").replace("```", "").strip()
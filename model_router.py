@@ -0,0 +1,341 @@
+"""
+Latency-aware routing of LLM calls across models and endpoints.
+
+Every LLM call names a *purpose* (``sql``, ``schema_sql``, ``explain``,
+``insights``). Each purpose has its own model from config and shares the
+configured fast and fallback routes:
+
+- ``LLM_FAST_MODELS``: quick models, tried first for simple requests;
+- the purpose's model (``CASINO_SQL_MODEL``, ``OPENAI_MODEL`` or
+  ``INSIGHTS_MODEL``) and ``LLM_FALLBACK_MODELS``: strong models that serve
+  every complex request and back up the fast ones.
+
+A request is *complex* when its question mentions cohort, retention, LTV,
+percentile, ranking and similar analyses, when the question is long, or when
+the prompt is too big for a fast model (``LLM_FAST_MAX_PROMPT_TOKENS``).
+Complex requests never go to a fast route, so hard queries keep the strong
+model.
+
+Within a tier, candidates are ordered by each route's rolling statistics for
+the purpose: median latency of the last ``LLM_STATS_WINDOW`` calls, penalised
+by their error rate. Routes without enough calls yet come first, so new routes
+get measured; a route whose calls all failed goes after every route that
+answers. A fast route that measures worse than the best strong route loses
+its place ahead of the strong tier. A failed or timed-out call falls through
+to the next candidate. The time budget of a route that has a successor adapts
+to the p95 of its calls, failed ones counted at the time they took, so a
+stalled endpoint is abandoned early. After ``LLM_TRIP_ERRORS`` failures in a
+row a route is skipped for ``LLM_COOLDOWN_SECONDS``. ``dashboard()`` returns
+the per-route latency and error table shown in the app and served at
+``GET /models``.
+
+With no fast or fallback models configured, every call goes to the purpose's
+model exactly as before.
+"""
+
+import math
+import re
+import statistics
+import threading
+import time
+import urllib.error
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from config import Config
+from llm import LLMError, chat_completion, resolve_api_key, stream_chat_completion
+from tracing import record, span
+
+PURPOSE_MODELS = {
+    "sql": "CASINO_SQL_MODEL",
+    "schema_sql": "OPENAI_MODEL",
+    "explain": "OPENAI_MODEL",
+    "insights": "INSIGHTS_MODEL",
+}
+SIMPLE, COMPLEX = "simple", "complex"
+FAST, STRONG = "fast", "strong"
+# Calls a route needs before its statistics are trusted for ordering
+MIN_SAMPLES = 5
+# Error rate weight in the routing score: 10% errors cost as much as 40% more latency
+ERROR_PENALTY = 4.0
+# Floor of the adaptive time budget given to a route that has a successor
+MIN_ADAPTIVE_TIMEOUT_SECONDS = 5.0
+COMPLEX_TERMS = re.compile(
+    r"\b(cohorts?|retention|retained|ltv|lifetime|since install|days since|churn\w*|funnel|conversion|"
+    r"percentiles?|median|p\d\d|distribution|cumulative|running total|rolling|moving average|"
+    r"week over week|month over month|growth|compare|comparison|versus|vs|correlat\w*|"
+    r"per user|each user|repeat|reactivat\w*|rank\w*)\b",
+    re.IGNORECASE,
+)
+
+
+class Route:
+    """One model at one endpoint for one purpose, with its rolling call statistics."""
+
+    def __init__(self, purpose: str, model: str, base_url: str, tier: str, timeout: float):
+        self.purpose = purpose
+        self.model = model
+        self.base_url = base_url
+        self.tier = tier
+        self.timeout = timeout
+        self.name = model if base_url == Config.OPENAI_BASE_URL else f"{model}@{urlsplit(base_url).netloc}"
+        # (finished_at, latency_ms, first_chunk_ms, error kind or None)
+        self.calls: Deque[Tuple[float, float, Optional[float], Optional[str]]] = deque(maxlen=Config.LLM_STATS_WINDOW)
+        self.failures_in_row = 0
+        self.cooldown_until = 0.0
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def observe(self, latency_ms: float, first_chunk_ms: Optional[float] = None,
+                error: Optional[str] = None, message: Optional[str] = None):
+        with self._lock:
+            self.calls.append((time.time(), latency_ms, first_chunk_ms, error))
+            if error is None:
+                self.failures_in_row = 0
+                return
+            self.last_error = message or error
+            self.failures_in_row += 1
+            if self.failures_in_row >= Config.LLM_TRIP_ERRORS:
+                self.cooldown_until = time.monotonic() + Config.LLM_COOLDOWN_SECONDS
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self.calls)
+        latencies = [latency for _, latency, _, error in calls if error is None]
+        first_chunks = [first for _, _, first, error in calls if error is None and first is not None]
+        errors = sum(1 for call in calls if call[3] is not None)
+        return {
+            "calls": len(calls),
+            "errors": errors,
+            "timeouts": sum(1 for call in calls if call[3] == "timeout"),
+            "error_rate": errors / len(calls) if calls else 0.0,
+            "p50_ms": statistics.median(latencies) if latencies else None,
+            "p95_ms": _percentile(latencies, 95),
+            "attempt_p95_ms": _percentile([latency for _, latency, _, _ in calls], 95),
+            "first_chunk_p50_ms": statistics.median(first_chunks) if first_chunks else None,
+            "samples": len(latencies),
+        }
+
+    @property
+    def cooling_down(self) -> bool:
+        return time.monotonic() < self.cooldown_until
+
+    def score(self, stats: Dict[str, Any]) -> Optional[float]:
+        """Expected cost of a call (lower is better; infinite when every call failed),
+        or None before ``MIN_SAMPLES`` calls."""
+        if stats["calls"] < MIN_SAMPLES:
+            return None
+        if stats["p50_ms"] is None:
+            return math.inf
+        return stats["p50_ms"] * (1 + ERROR_PENALTY * stats["error_rate"])
+
+    def budget(self, stats: Dict[str, Any], has_successor: bool) -> float:
+        """Seconds to wait for this route: its configured timeout, shortened from the p95 of its
+        calls (failures included) when another candidate can take over."""
+        if not has_successor or stats["calls"] < MIN_SAMPLES:
+            return self.timeout
+        if stats["p50_ms"] is None:
+            return min(self.timeout, MIN_ADAPTIVE_TIMEOUT_SECONDS)  # it has never answered
+        return min(self.timeout, max(MIN_ADAPTIVE_TIMEOUT_SECONDS, 3 * stats["attempt_p95_ms"] / 1000))
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_routes(spec: str) -> List[Tuple[str, str]]:
+    """``"model, model@base_url"`` -> ``[(model, base_url), ...]``."""
+    routes = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        model, _, base_url = entry.partition("@")
+        routes.append((model.strip(), (base_url.strip() or Config.OPENAI_BASE_URL).rstrip("/")))
+    return routes
+
+
+def prompt_tokens(messages: List[Dict[str, str]]) -> int:
+    """Rough prompt size (~4 characters per token)."""
+    return sum(len(message.get("content") or "") for message in messages) // 4
+
+
+def classify(question: Optional[str], tokens: int) -> Tuple[str, str]:
+    """``(SIMPLE | COMPLEX, reason)`` for a request's question and prompt size."""
+    if tokens > Config.LLM_FAST_MAX_PROMPT_TOKENS:
+        return COMPLEX, "prompt_size"
+    if question:
+        if len(question.split()) > Config.LLM_SIMPLE_MAX_WORDS:
+            return COMPLEX, "long_question"
+        match = COMPLEX_TERMS.search(question)
+        if match:
+            return COMPLEX, f"term:{match.group(0).lower()}"
+    return SIMPLE, "template"
+
+
+def _error_kind(error: Exception) -> str:
+    if isinstance(error, TimeoutError) or isinstance(getattr(error, "reason", None), TimeoutError):
+        return "timeout"
+    if isinstance(error, urllib.error.HTTPError):
+        return f"http_{error.code}"
+    return type(error).__name__
+
+
+class ModelRouter:
+    """Chooses, calls and falls back across the configured routes of each purpose."""
+
+    def __init__(self):
+        fast = parse_routes(Config.LLM_FAST_MODELS)
+        fallback = parse_routes(Config.LLM_FALLBACK_MODELS)
+        self.routes: Dict[str, List[Route]] = {}
+        for purpose, setting in PURPOSE_MODELS.items():
+            strong = [(getattr(Config, setting), Config.OPENAI_BASE_URL)] + fallback
+            routes = [Route(purpose, model, url, FAST, Config.LLM_FAST_TIMEOUT_SECONDS) for model, url in fast]
+            routes += [Route(purpose, model, url, STRONG, Config.OPENAI_TIMEOUT_SECONDS)
+                       for model, url in dict.fromkeys(strong)]
+            self.routes[purpose] = routes
+
+    def plan(self, purpose: str, messages: List[Dict[str, str]],
+             question: Optional[str] = None) -> Tuple[str, str, List[Tuple[Route, float]]]:
+        """``(tier, reason, [(route, timeout seconds), ...])`` in the order they will be tried."""
+        tier, reason = classify(question, prompt_tokens(messages))
+        eligible = [r for r in self.routes[purpose] if tier == SIMPLE or r.tier == STRONG]
+        stats = {id(r): r.snapshot() for r in eligible}
+
+        scores = {id(r): r.score(stats[id(r)]) for r in eligible}
+        strong_scores = [scores[id(r)] for r in eligible if r.tier == STRONG and scores[id(r)] is not None]
+        best_strong = min(strong_scores) if strong_scores else None
+
+        def key(item: Tuple[int, Route]):
+            position, route = item
+            score = scores[id(route)]
+            # A fast route goes ahead of the strong tier unless it has measured worse than the best strong route
+            # or has only failed
+            demoted = route.tier == FAST and score is not None and (
+                score == math.inf or (best_strong is not None and score > best_strong)
+            )
+            tier_rank = 0 if route.tier == FAST and not demoted else 1
+            # Cooling-down routes last; within a tier, unmeasured routes first (configured order), then by score
+            return route.cooling_down, tier_rank, score is not None, score or 0.0, position
+
+        ordered = [route for _, route in sorted(enumerate(eligible), key=key)]
+        return tier, reason, [
+            (route, route.budget(stats[id(route)], has_successor=i < len(ordered) - 1))
+            for i, route in enumerate(ordered)
+        ]
+
+    def complete(self, purpose: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+                 question: Optional[str] = None, api_key: Optional[str] = None) -> Dict[str, Any]:
+        """Blocking completion from the best available route.
+
+        Returns ``{"content", "usage", "model", "route"}``; raises ``LLMError``
+        once every candidate has failed.
+        """
+        # A missing key fails every route alike; raise it before any route is charged with an error
+        api_key = resolve_api_key(api_key)
+        tier, reason, candidates = self.plan(purpose, messages, question)
+        with span("llm.route", purpose=purpose, tier=tier, reason=reason) as s:
+            failures = []
+            for attempt, (route, timeout) in enumerate(candidates, 1):
+                started = time.perf_counter()
+                try:
+                    with span("llm.chat_completion", model=route.model, route=route.name) as call:
+                        result = chat_completion(messages, route.model, max_tokens, temperature, api_key=api_key,
+                                                 base_url=route.base_url, timeout=timeout)
+                        usage = result["usage"]
+                        call.set(prompt_tokens=usage.get("prompt_tokens"),
+                                 completion_tokens=usage.get("completion_tokens"))
+                except Exception as e:
+                    route.observe((time.perf_counter() - started) * 1000, error=_error_kind(e), message=str(e))
+                    failures.append(f"{route.name}: {e}")
+                    continue
+                route.observe((time.perf_counter() - started) * 1000)
+                s.set(route=route.name, attempts=attempt)
+                return {**result, "model": route.model, "route": route.name}
+            s.set(attempts=len(candidates))
+            raise LLMError("All models failed: " + "; ".join(failures))
+
+    def stream(self, purpose: str, messages: List[Dict[str, str]], max_tokens: int, temperature: float,
+               question: Optional[str] = None, api_key: Optional[str] = None,
+               info: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Stream content deltas from the best available route.
+
+        Falls back to the next candidate only until the first delta has been
+        yielded; after that a failure is raised to the caller. ``info`` (if
+        given) receives the ``route``, ``model``, ``tier`` and ``attempts``.
+        """
+        api_key = resolve_api_key(api_key)
+        tier, reason, candidates = self.plan(purpose, messages, question)
+        info = info if info is not None else {}
+        info.update(tier=tier)
+        routed_at = time.perf_counter()
+        failures = []
+        # Timed with record() rather than a span: this generator yields to its caller mid-stream
+        for attempt, (route, timeout) in enumerate(candidates, 1):
+            info.update(route=route.name, model=route.model, attempts=attempt)
+            started = time.perf_counter()
+            first_chunk_ms = None
+            try:
+                for chunk in stream_chat_completion(messages, route.model, max_tokens, temperature,
+                                                    api_key=api_key, base_url=route.base_url, timeout=timeout):
+                    if first_chunk_ms is None:
+                        first_chunk_ms = (time.perf_counter() - started) * 1000
+                    yield chunk
+            except Exception as e:
+                route.observe((time.perf_counter() - started) * 1000, first_chunk_ms, _error_kind(e), str(e))
+                failures.append(f"{route.name}: {e}")
+                if first_chunk_ms is not None:
+                    record("llm.route", routed_at, purpose=purpose, tier=tier, reason=reason,
+                           route=route.name, attempts=attempt)
+                    raise
+                continue
+            route.observe((time.perf_counter() - started) * 1000, first_chunk_ms)
+            record("llm.route", routed_at, purpose=purpose, tier=tier, reason=reason,
+                   route=route.name, attempts=attempt)
+            return
+        record("llm.route", routed_at, purpose=purpose, tier=tier, reason=reason, attempts=len(candidates))
+        raise LLMError("All models failed: " + "; ".join(failures))
+
+    def dashboard(self) -> List[Dict[str, Any]]:
+        """Per purpose and route: rolling calls, errors, timeouts, latency percentiles and state."""
+        rows = []
+        for purpose, routes in self.routes.items():
+            for route in routes:
+                stats = route.snapshot()
+                rows.append({
+                    "purpose": purpose,
+                    "route": route.name,
+                    "tier": route.tier,
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "timeouts": stats["timeouts"],
+                    "error_rate": round(stats["error_rate"], 3),
+                    "p50_ms": _round(stats["p50_ms"]),
+                    "p95_ms": _round(stats["p95_ms"]),
+                    "first_chunk_p50_ms": _round(stats["first_chunk_p50_ms"]),
+                    "state": "cooling down" if route.cooling_down else ("ok" if stats["calls"] else "idle"),
+                    "last_error": route.last_error,
+                })
+        return rows
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_model_router() -> ModelRouter:
+    """Process-wide router, so every caller shares the learned statistics."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ModelRouter()
+    return _router
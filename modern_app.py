@@ -1,12 +1,12 @@
 import streamlit as st
-from openai import OpenAI
 from datetime import datetime
 import os
-from dotenv import load_dotenv
 import time
+from config import load_env
+from model_router import get_model_router
 
 # Load environment variables
-load_dotenv()
+load_env()
 
 # Page configuration
 st.set_page_config(
@@ -201,12 +201,6 @@ if 'selected_query' not in st.session_state:
 def generate_sql_query(user_query: str, custom_prompt: str = None, api_key: str = None) -> str:
     """Generate SQL query from natural language using OpenAI"""
     try:
-        # Initialize OpenAI client
-        if api_key:
-            client = OpenAI(api_key=api_key)
-        else:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
         if not (api_key or os.getenv("OPENAI_API_KEY")):
             st.error("OpenAI API key not provided!")
             return None
@@ -247,17 +241,20 @@ User Request: {user_query}
 SQL Query:
 """
         
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        # Model chosen per question by the router (see model_router.py)
+        response = get_model_router().complete(
+            "sql",
+            [
                 {"role": "system", "content": "You are a GSN Casino BigQuery SQL expert. Generate only optimized BigQuery SQL queries for GSN Casino data without any explanations or markdown formatting."},
                 {"role": "user", "content": prompt}
             ],
             max_tokens=1000,
-            temperature=0.1
+            temperature=0.1,
+            question=user_query,
+            api_key=api_key,
         )
         
-        sql_query = response.choices[0].message.content.strip()
+        sql_query = response["content"].strip()
         
         # Clean up the response (remove any markdown formatting)
         sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
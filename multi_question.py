@@ -0,0 +1,106 @@
+"""
+Multi-question fan-out: answer several related questions at once.
+
+The input is split into questions (one per line, bullets and numbering
+stripped; a single line is split on ``;`` and ``?``). SQL generation and
+execution for all of them run concurrently through the query client, so five
+questions cost roughly one LLM round trip plus the slowest query instead of
+five of each. Results are yielded as they finish. Each query passes the cost
+guardrail first; one that would need confirmation is reported as an error.
+"""
+
+import contextvars
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from pipeline import PipelineError
+from service_client import unattended_sql
+from tracing import span
+
+_ITEM_PREFIX = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+_INLINE_SPLIT = re.compile(r"(?<=\?)\s+|;\s*")
+
+
+def split_questions(text: str, limit: Optional[int] = None) -> Tuple[List[str], List[str]]:
+    """Split free-form input into distinct questions, in input order.
+
+    Returns ``(questions, skipped)``: the first ``limit`` (default
+    ``MULTI_QUESTION_MAX``) questions and those past the limit, which callers
+    should report rather than drop silently.
+    """
+    lines = [_ITEM_PREFIX.sub("", line).strip() for line in (text or "").splitlines()]
+    questions = [line for line in lines if line]
+    if len(questions) == 1:
+        questions = [part.strip() for part in _INLINE_SPLIT.split(questions[0]) if part.strip()]
+    unique = list(dict.fromkeys(questions))
+    limit = limit or Config.MULTI_QUESTION_MAX
+    return unique[:limit], unique[limit:]
+
+
+def run_questions(client, questions: List[str], concurrency: Optional[int] = None,
+                  db_concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Generate and execute every question concurrently; yield each result as it completes.
+
+    Each result has ``index`` (position in ``questions``), ``question``,
+    ``sql``, ``df``, ``fingerprint``, ``error`` and ``generate_ms`` /
+    ``execute_ms`` / ``total_ms``. At most ``concurrency`` questions are in
+    flight, and at most ``db_concurrency`` of them execute at once.
+    """
+    concurrency = concurrency or Config.MULTI_QUESTION_CONCURRENCY
+    db_slots = threading.BoundedSemaphore(db_concurrency or Config.SERVICE_DB_WORKERS)
+
+    def run_one(index: int, question: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "index": index, "question": question, "sql": None, "df": None, "fingerprint": None,
+            "error": None, "generate_ms": None, "execute_ms": None,
+        }
+        started = time.perf_counter()
+        with span("multi.question", index=index) as s:
+            try:
+                t0 = time.perf_counter()
+                result["sql"] = client.generate_sql(question)
+                result["generate_ms"] = _ms(t0)
+                t0 = time.perf_counter()
+                result["sql"] = unattended_sql(client, result["sql"])
+                with db_slots:
+                    result["df"], result["fingerprint"] = client.execute(result["sql"])
+                result["execute_ms"] = _ms(t0)
+                s.set(rows=len(result["df"]))
+            except PipelineError as e:
+                result["error"] = str(e)
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+        result["total_ms"] = _ms(started)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(questions))),
+                            thread_name_prefix="multi") as pool:
+        # One context copy per task so each question's span nests under the caller's
+        futures = [
+            pool.submit(contextvars.copy_context().run, run_one, i, question)
+            for i, question in enumerate(questions)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def timing_summary(results: List[Dict[str, Any]], wall_ms: float) -> Dict[str, Any]:
+    """Combined timings: wall clock vs. what running the questions one by one would have cost."""
+    serial_ms = sum(r.get("total_ms") or 0 for r in results)
+    return {
+        "questions": len(results),
+        "succeeded": sum(1 for r in results if not r.get("error")),
+        "wall_ms": round(wall_ms, 1),
+        "serial_ms": round(serial_ms, 1),
+        "speedup": round(serial_ms / wall_ms, 2) if wall_ms else None,
+        "generate_ms_max": max((r.get("generate_ms") or 0 for r in results), default=0),
+        "execute_ms_max": max((r.get("execute_ms") or 0 for r in results), default=0),
+    }
+
+
+def _ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 2)
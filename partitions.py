@@ -0,0 +1,501 @@
+"""
+Monthly partitions of user_days with partition pruning.
+
+``partition_database`` splits ``user_days`` into one table per month
+(``user_days_p202412``, each with its own day and user indexes) and replaces it
+with a ``UNION ALL`` view of the same name, so existing SQL keeps working.
+``partition_catalog`` records each partition's day range and row count.
+
+``PartitionPlanner.prune`` rewrites a query before execution: every
+``user_days`` reference is replaced by only the partitions its own SELECT can
+read, judged from that scope's ``event_day_pst`` predicates (comparisons,
+``BETWEEN``, ``=`` and ``IN`` lists ANDed into its WHERE clause; bounds are
+evaluated by SQLite). ``(SELECT MAX(event_day_pst) FROM user_days)`` reads
+just the newest partition. A "last 7 days" query therefore touches one or two
+month-sized indexes however long the history grows. References that cannot be
+narrowed safely (OR-ed predicates, ambiguous columns in joins) keep the view.
+
+Months that ended more than ``Config.PARTITION_SEAL_DAYS`` before the newest
+day are sealed: triggers reject writes, so they can be ``compact``-ed (rewritten
+in day/user order with fresh indexes and statistics) once and left alone.
+New days from ``ingest.py`` go to the open month's partition.
+
+    python run.py partition --compact
+"""
+
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import Config
+from sql_parser import parse_sql
+from tracing import span
+
+BASE_TABLE = "user_days"
+DATE_COLUMN = "event_day_pst"
+PARTITION_PREFIX = f"{BASE_TABLE}_p"
+CATALOG_TABLE = "partition_catalog"
+UNPARTITIONED_TABLE = f"{BASE_TABLE}_unpartitioned"
+
+_SCOPE_END = {"GROUP", "HAVING", "ORDER", "LIMIT", "WINDOW", "UNION", "INTERSECT", "EXCEPT"}
+_COMPARISONS = {">=": "ge", ">": "gt", "<=": "le", "<": "lt", "=": "eq", "==": "eq"}
+_FLIPPED = {"ge": "le", "gt": "lt", "le": "ge", "lt": "gt", "eq": "eq"}
+
+QueryFn = Callable[[str], List[Tuple[Any, ...]]]
+
+
+class PartitionError(Exception):
+    """The partition layout cannot be changed as requested."""
+
+
+# -- layout -------------------------------------------------------------------------
+
+def partition_name(day: str) -> str:
+    return f"{PARTITION_PREFIX}{day[:4]}{day[5:7]}"
+
+
+def is_partitioned(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (BASE_TABLE,)).fetchone()
+    return bool(row) and row[0] == "view"
+
+
+def latest_day(conn: sqlite3.Connection) -> Optional[str]:
+    """Newest event_day_pst, without scanning the view of a partitioned database."""
+    if is_partitioned(conn):
+        return conn.execute(f"SELECT MAX(last_day) FROM {CATALOG_TABLE}").fetchone()[0]
+    value = conn.execute(f"SELECT MAX({DATE_COLUMN}) FROM {BASE_TABLE}").fetchone()[0]
+    return str(value)[:10] if value else None
+
+
+def partition_database(db_path: str, keep_original: bool = False) -> List[Dict[str, Any]]:
+    """Split ``user_days`` into monthly partitions behind a ``UNION ALL`` view.
+
+    The original table is dropped, or renamed to ``user_days_unpartitioned``
+    with ``keep_original``. Returns the partition catalog.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        if is_partitioned(conn):
+            raise PartitionError(f"{BASE_TABLE} is already partitioned")
+        create_sql = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (BASE_TABLE,)
+        ).fetchone()
+        if not create_sql:
+            raise PartitionError(f"No {BASE_TABLE} table to partition")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            _ensure_catalog(conn)
+            # Walk the day index month by month instead of grouping the whole table
+            month = conn.execute(f"SELECT MIN({DATE_COLUMN}) FROM {BASE_TABLE}").fetchone()[0]
+            while month:
+                first = str(month)[:7] + "-01"
+                following = _next_month(first)
+                table = partition_name(first)
+                with span("partitions.create", table=table) as s:
+                    _create_partition(conn, table, create_sql[0])
+                    rows = conn.execute(
+                        f"INSERT INTO {table} SELECT * FROM {BASE_TABLE} "
+                        f"WHERE {DATE_COLUMN} >= ? AND {DATE_COLUMN} < ? ORDER BY {DATE_COLUMN}, user_id",
+                        (first, following),
+                    ).rowcount
+                    last = conn.execute(f"SELECT MAX({DATE_COLUMN}) FROM {table}").fetchone()[0]
+                    conn.execute(
+                        f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, 0, NULL)",
+                        (table, first[:7], str(month)[:10], str(last)[:10], rows),
+                    )
+                    s.set(rows=rows)
+                month = conn.execute(
+                    f"SELECT MIN({DATE_COLUMN}) FROM {BASE_TABLE} WHERE {DATE_COLUMN} >= ?", (following,)
+                ).fetchone()[0]
+            if keep_original:
+                conn.execute(f"ALTER TABLE {BASE_TABLE} RENAME TO {UNPARTITIONED_TABLE}")
+            else:
+                conn.execute(f"DROP TABLE {BASE_TABLE}")
+            refresh_view(conn)
+            seal_partitions(conn)
+            conn.execute("ANALYZE")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return partition_catalog(conn)
+    finally:
+        conn.close()
+
+
+def partition_catalog(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    cursor = conn.execute(f"SELECT * FROM {CATALOG_TABLE} ORDER BY month")
+    names = [d[0] for d in cursor.description]
+    return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+
+def refresh_view(conn: sqlite3.Connection):
+    """(Re)create the ``user_days`` view over every partition, oldest first."""
+    tables = [row[0] for row in conn.execute(f"SELECT table_name FROM {CATALOG_TABLE} ORDER BY month")]
+    conn.execute(f"DROP VIEW IF EXISTS {BASE_TABLE}")
+    conn.execute(f"CREATE VIEW {BASE_TABLE} AS " + " UNION ALL ".join(f"SELECT * FROM {t}" for t in tables))
+
+
+def partition_for_day(conn: sqlite3.Connection, day: str) -> str:
+    """Partition table that stores ``day``, created (and added to the view) if missing."""
+    table = partition_name(day)
+    row = conn.execute(f"SELECT sealed FROM {CATALOG_TABLE} WHERE table_name = ?", (table,)).fetchone()
+    if row is None:
+        template = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+            (conn.execute(f"SELECT table_name FROM {CATALOG_TABLE} ORDER BY month DESC LIMIT 1").fetchone()[0],),
+        ).fetchone()[0]
+        _create_partition(conn, table, template)
+        conn.execute(
+            f"INSERT INTO {CATALOG_TABLE} VALUES (?, ?, ?, ?, 0, 0, NULL)",
+            (table, day[:7], day, day),
+        )
+        refresh_view(conn)
+    elif row[0]:
+        raise PartitionError(f"Partition {table} is sealed; {day} can no longer be changed")
+    return table
+
+
+def record_rows(conn: sqlite3.Connection, table: str, day: str, delta: int):
+    """Adjust a partition's catalog entry after rows for ``day`` were added or removed."""
+    conn.execute(
+        f"UPDATE {CATALOG_TABLE} SET rows = rows + ?, first_day = MIN(first_day, ?), last_day = MAX(last_day, ?) "
+        "WHERE table_name = ?",
+        (delta, day, day, table),
+    )
+
+
+def seal_partitions(conn: sqlite3.Connection, seal_days: Optional[int] = None) -> List[str]:
+    """Seal every month that ended more than ``seal_days`` before the newest day; returns them."""
+    seal_days = Config.PARTITION_SEAL_DAYS if seal_days is None else seal_days
+    newest = latest_day(conn)
+    if not newest:
+        return []
+    cutoff = (date.fromisoformat(newest) - timedelta(days=seal_days)).isoformat()
+    sealed = []
+    for table, month in conn.execute(f"SELECT table_name, month FROM {CATALOG_TABLE} WHERE sealed = 0").fetchall():
+        if _next_month(month + "-01") <= cutoff:
+            _add_seal_triggers(conn, table)
+            conn.execute(f"UPDATE {CATALOG_TABLE} SET sealed = 1 WHERE table_name = ?", (table,))
+            sealed.append(table)
+    return sealed
+
+
+def compact_partitions(db_path: str) -> List[str]:
+    """Rewrite sealed, not yet compacted partitions in (day, user) order; returns them.
+
+    Each partition is rebuilt in its own transaction with fresh indexes and
+    statistics, so the work is bounded by one month of data at a time.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    compacted = []
+    try:
+        pending = conn.execute(
+            f"SELECT table_name FROM {CATALOG_TABLE} WHERE sealed = 1 AND compacted_at IS NULL ORDER BY month"
+        ).fetchall()
+        for (table,) in pending:
+            with span("partitions.compact", table=table):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    create_sql = conn.execute(
+                        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+                    ).fetchone()[0]
+                    scratch = f"{table}_compact"
+                    conn.execute(f"DROP TABLE IF EXISTS {scratch}")
+                    conn.execute(_renamed(create_sql, table, scratch))
+                    conn.execute(f"INSERT INTO {scratch} SELECT * FROM {table} ORDER BY {DATE_COLUMN}, user_id")
+                    # The view names the partition; drop it so the rename is not checked against it
+                    conn.execute(f"DROP VIEW {BASE_TABLE}")
+                    conn.execute(f"DROP TABLE {table}")
+                    conn.execute(f"ALTER TABLE {scratch} RENAME TO {table}")
+                    refresh_view(conn)
+                    _create_indexes(conn, table)
+                    _add_seal_triggers(conn, table)
+                    conn.execute(f"ANALYZE {table}")
+                    conn.execute(
+                        f"UPDATE {CATALOG_TABLE} SET compacted_at = ? WHERE table_name = ?",
+                        (time.strftime("%Y-%m-%dT%H:%M:%S"), table),
+                    )
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            compacted.append(table)
+        return compacted
+    finally:
+        conn.close()
+
+
+def _ensure_catalog(conn: sqlite3.Connection):
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {CATALOG_TABLE} (table_name TEXT PRIMARY KEY, month TEXT, "
+        "first_day TEXT, last_day TEXT, rows INTEGER, sealed INTEGER, compacted_at TEXT)"
+    )
+
+
+def _create_partition(conn: sqlite3.Connection, table: str, create_sql: str):
+    conn.execute(_renamed(create_sql, _table_in(create_sql), table))
+    _create_indexes(conn, table)
+
+
+def _create_indexes(conn: sqlite3.Connection, table: str):
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_day ON {table} ({DATE_COLUMN})")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table} (user_id)")
+
+
+def _add_seal_triggers(conn: sqlite3.Connection, table: str):
+    for action in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {table}_sealed_{action.lower()} BEFORE {action} ON {table} "
+            f"BEGIN SELECT RAISE(ABORT, 'partition {table} is sealed'); END"
+        )
+
+
+def _table_in(create_sql: str) -> str:
+    tokens = parse_sql(create_sql).tokens
+    return tokens[2].value.strip('"`[]')
+
+
+def _renamed(create_sql: str, old: str, new: str) -> str:
+    tokens = parse_sql(create_sql).tokens
+    name = tokens[2]
+    if name.value.strip('"`[]') != old:
+        raise PartitionError(f"Unexpected table definition: {create_sql[:60]}")
+    return create_sql[:name.start] + new + create_sql[name.end:]
+
+
+def _next_month(day: str) -> str:
+    year, month = int(day[:4]), int(day[5:7])
+    return f"{year + month // 12:04d}-{month % 12 + 1:02d}-01"
+
+
+# -- pruning ------------------------------------------------------------------------
+
+class PartitionPlanner:
+    """Rewrites queries to read only the partitions their day predicates allow.
+
+    ``query_fn(sql)`` runs a statement and returns rows as tuples. The
+    partition catalog is cached for ``Config.SCHEMA_CACHE_SECONDS``.
+    """
+
+    def __init__(self, query_fn: QueryFn):
+        self.query_fn = query_fn
+        self._partitions: Tuple[float, List[Dict[str, Any]]] = (0.0, [])
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._partitions = (0.0, [])
+
+    def partitions(self) -> List[Dict[str, Any]]:
+        """Non-empty partitions, oldest first; empty when the database is not partitioned."""
+        with self._lock:
+            loaded_at, partitions = self._partitions
+            if time.monotonic() - loaded_at < Config.SCHEMA_CACHE_SECONDS:
+                return partitions
+        partitions = []
+        try:
+            if self.query_fn(f"SELECT 1 FROM sqlite_master WHERE type = 'view' AND name = '{BASE_TABLE}'"):
+                rows = self.query_fn(
+                    f"SELECT table_name, first_day, last_day FROM {CATALOG_TABLE} WHERE rows > 0 ORDER BY month"
+                )
+                partitions = [{"table": t, "first_day": f, "last_day": l} for t, f, l in rows]
+        except Exception:
+            partitions = []  # no catalog: not partitioned
+        with self._lock:
+            self._partitions = (time.monotonic(), partitions)
+        return partitions
+
+    def prune(self, sql: str) -> str:
+        """``sql`` with each ``user_days`` reference narrowed to the partitions it can read."""
+        partitions = self.partitions()
+        if not partitions:
+            return sql
+        with span("partitions.prune") as s:
+            try:
+                parsed = parse_sql(sql)
+            except ValueError:
+                return sql
+            if len(parsed.statements) != 1:
+                return sql
+            tokens = parsed.statements[0]
+            edits = []
+            for name, ref_start, ref_end, alias in parsed.table_refs:
+                if name != BASE_TABLE or name in parsed.cte_names:
+                    continue
+                index = next(i for i, t in enumerate(tokens) if t.start == ref_start)
+                plan = self._select_partitions(sql, parsed, tokens, index, alias, partitions)
+                if plan is None or len(plan[0]) == len(partitions):
+                    continue
+                edits.append((ref_start, ref_end, _partition_source(*plan, partitions, alias)))
+            s.set(rewritten=len(edits))
+            if not edits:
+                return sql
+            pieces = []
+            position = 0
+            for start, end, text in edits:
+                pieces.append(sql[position:start])
+                pieces.append(text)
+                position = end
+            pieces.append(sql[position:])
+            return "".join(pieces)
+
+    def _select_partitions(self, sql: str, parsed, tokens, index: int, alias: Optional[str],
+                           partitions: List[Dict[str, Any]]) -> Optional[Tuple[List[Dict[str, Any]], str, str]]:
+        """Partitions the SELECT owning the reference at ``index`` can read, with the
+        (first, last) day bounds found ("" when unbounded); None for all of them."""
+        depth = tokens[index].depth
+        start = index
+        while start > 0 and not (tokens[start].depth == depth and tokens[start].is_keyword("SELECT")):
+            start -= 1
+        end = index
+        while end < len(tokens) and tokens[end].depth >= depth and not (
+            tokens[end].depth == depth and tokens[end].is_keyword("UNION", "INTERSECT", "EXCEPT")
+        ):
+            end += 1
+        scope = [i for i in range(start, end) if tokens[i].depth == depth]
+        where = next((i for i in scope if tokens[i].is_keyword("WHERE")), None)
+
+        # SELECT MIN/MAX(event_day_pst) FROM user_days: only the oldest/newest partition
+        if where is None and index == end - 1:
+            head = [t.value.lower() for t in tokens[start + 1:index]]
+            if head[0] in ("min", "max") and head[1:4] == ["(", DATE_COLUMN, ")"] and head[-1] == "from" \
+                    and len(head) <= 7 and "," not in head:
+                return [partitions[-1] if head[0] == "max" else partitions[0]], "", ""
+        if where is None:
+            return None
+
+        clause_end = next((i for i in scope if i > where and tokens[i].is_keyword(*_SCOPE_END)), end)
+        if any(tokens[i].is_keyword("OR") for i in scope if where < i < clause_end):
+            return None
+        ref_starts = {ref[1] for ref in parsed.table_refs}
+        refs_in_scope = sum(1 for i in scope if tokens[i].start in ref_starts)
+        qualifier = (alias or BASE_TABLE).lower()
+
+        bounds: List[Tuple[str, Optional[str]]] = []
+        for conjunct in _conjuncts(tokens, where + 1, clause_end, depth):
+            column, rest, operator = _predicate_column(conjunct)
+            if column is None:
+                continue
+            if column is ... and refs_in_scope > 1:
+                return None  # unqualified column in a join: cannot tell whose day it is
+            if column is not ... and column != qualifier:
+                continue
+            bounds.extend(self._bounds(sql, rest, operator, depth))
+        if not bounds:
+            return None
+        lo, hi = "", ""
+        for kind, value in bounds:
+            if value is None:
+                continue
+            if kind in ("ge", "gt", "eq"):
+                lo = max(lo, value)
+            if kind in ("le", "lt", "eq"):
+                hi = min(hi, value) if hi else value
+        selected = [p for p in partitions if p["last_day"] >= lo and (not hi or p["first_day"] <= hi)]
+        return selected, lo, hi
+
+    def _bounds(self, sql: str, rest, operator: Optional[str], depth: int) -> List[Tuple[str, Optional[str]]]:
+        """(kind, day) bounds from the tokens beside the column in one conjunct."""
+        if operator is not None:
+            return [(_FLIPPED[_COMPARISONS[operator]], self._evaluate(sql, rest))]
+        if not rest:
+            return []
+        head = rest[0]
+        if head.value in _COMPARISONS:
+            return [(_COMPARISONS[head.value], self._evaluate(sql, rest[1:]))]
+        if head.is_keyword("BETWEEN"):
+            split = next((j for j, t in enumerate(rest) if t.depth == depth and t.is_keyword("AND")), None)
+            if split is None:
+                return []
+            return [("ge", self._evaluate(sql, rest[1:split])), ("le", self._evaluate(sql, rest[split + 1:]))]
+        if head.is_keyword("IN") and len(rest) > 2 and rest[1].value == "(" and rest[-1].value == ")":
+            items = [t for t in rest[2:-1] if t.value != ","]
+            if items and all(t.kind == "string" for t in items):
+                values = [t.value[1:-1] for t in items]
+                return [("ge", min(values)), ("le", max(values))]
+        return []
+
+    def _evaluate(self, sql: str, expression) -> Optional[str]:
+        """Value of a constant (or subquery) bound expression as ``YYYY-MM-DD``; None if not constant."""
+        if not expression:
+            return None
+        expr = sql[expression[0].start:expression[-1].end]
+        try:
+            parsed = parse_sql(f"SELECT {expr}")
+            if parsed.columns - {DATE_COLUMN} or (DATE_COLUMN in parsed.columns and not parsed.tables):
+                return None  # refers to the outer row
+            rows = self.query_fn(f"SELECT ({self.prune(expr) if parsed.tables else expr})")
+        except Exception:
+            return None
+        value = rows[0][0] if rows else None
+        return str(value)[:10] if value else None
+
+
+def _conjuncts(tokens, start: int, end: int, depth: int):
+    """Token lists of the AND-ed terms between ``start`` and ``end`` (BETWEEN's own AND kept)."""
+    current = []
+    between = False
+    for token in tokens[start:end]:
+        if token.depth == depth and token.is_keyword("BETWEEN"):
+            between = True
+        elif token.depth == depth and token.is_keyword("AND"):
+            if not between:
+                yield current
+                current = []
+                continue
+            between = False
+        current.append(token)
+    if current:
+        yield current
+
+
+def _predicate_column(conjunct):
+    """Where ``event_day_pst`` sits in a conjunct.
+
+    Returns (qualifier, tokens after the column, None) for ``col ...`` and
+    (qualifier, tokens before the operator, operator) for ``expr OP col``; the
+    qualifier is ``...`` for an unqualified column and None when the conjunct
+    is not a plain predicate on the column.
+    """
+    def column_at(i: int):
+        if i + 2 < len(conjunct) and conjunct[i + 1].value == "." and conjunct[i + 2].value.lower() == DATE_COLUMN:
+            return conjunct[i].value.lower(), i + 3
+        if i < len(conjunct) and conjunct[i].kind == "word" and conjunct[i].value.lower() == DATE_COLUMN:
+            return ..., i + 1
+        return None, i
+
+    if not conjunct:
+        return None, [], None
+    column, after = column_at(0)
+    if column is not None:
+        return column, conjunct[after:], None
+    for width in (3, 1):
+        if len(conjunct) > width + 1:
+            column, after = column_at(len(conjunct) - width)
+            operator = conjunct[-width - 1].value
+            if column is not None and after == len(conjunct) and operator in _COMPARISONS:
+                return column, conjunct[:-width - 1], operator
+    return None, [], None
+
+
+def _partition_source(selected: List[Dict[str, Any]], lo: str, hi: str, partitions: List[Dict[str, Any]],
+                      alias: Optional[str]) -> str:
+    """Replacement text for a ``user_days`` reference that reads only ``selected``."""
+    suffix = "" if alias else f" AS {BASE_TABLE}"
+    if not selected:
+        return f"(SELECT * FROM {partitions[-1]['table']} WHERE 0){suffix}"
+    if len(selected) == 1:
+        return selected[0]["table"] + suffix
+    # SQLite does not push predicates with subqueries into a UNION ALL, so each
+    # arm repeats the evaluated bounds to keep its day index in use
+    conditions = []
+    if lo:
+        conditions.append(f"{DATE_COLUMN} >= '{lo}'")
+    if hi:
+        conditions.append(f"{DATE_COLUMN} <= '{hi}'")
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    arms = [f"SELECT * FROM {p['table']}{where}" for p in selected]
+    return "(" + " UNION ALL ".join(arms) + ")" + suffix
@@ -0,0 +1,759 @@
+"""
+Question-to-result pipeline shared by the Streamlit apps, the headless
+service (service.py) and batch jobs.
+
+Nothing here renders to Streamlit: failures raise ``PipelineError`` so each
+caller decides how to surface them. Database and LLM access go through
+``DatabaseManager`` and ``SQLGenerator`` instances created with ``ui=False``.
+"""
+
+import io
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from approximate import META_TABLE, NotApproximable, choose_sample, confidence_intervals, rewrite_for_sample
+from cache import get_cache, make_key, result_fingerprint
+from cohort_cube import CUBE_TABLE, CohortRouter
+from config import Config
+from cost_estimator import CostEstimator
+from database import DatabaseManager
+from frame_compaction import compact_frame, with_day_strings
+from ingest import VERSION_TABLE
+from json_stream import InsightStreamParser
+from model_router import get_model_router
+from partitions import PartitionPlanner
+from result_summary import summarize_result, format_summary_for_prompt
+from segment_index import SegmentIndex
+from single_flight import get_flight
+from sketches import META_TABLE as SKETCH_META_TABLE, NotSketchable, rewrite_for_sketches, with_error_bounds
+from sql_generator import SQLGenerator
+from sql_parser import SQLParseError, parse_sql
+from tracing import annotate, record, span
+
+EXPORT_FORMATS = ("csv", "json", "parquet")
+
+
+class PipelineError(Exception):
+    """A pipeline stage failed; the message is safe to show to the user."""
+
+
+_db_manager: Optional[DatabaseManager] = None
+_sql_generator: Optional[SQLGenerator] = None
+_cost_estimator: Optional[CostEstimator] = None
+_partition_planner: Optional[PartitionPlanner] = None
+_cohort_router: Optional[CohortRouter] = None
+_segment_index: Optional[SegmentIndex] = None
+_init_lock = threading.Lock()
+_catalog: Tuple[float, Dict[str, List[str]]] = (0.0, {})
+_samples: Tuple[float, List[Dict[str, Any]]] = (0.0, [])
+_sketches: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+# (checked at, current version, [(version, first_day, last_day)] of every refresh)
+_data_version: Tuple[float, int, List[Tuple[int, str, str]]] = (0.0, 0, [])
+
+
+def get_db_manager() -> DatabaseManager:
+    """Process-wide headless DatabaseManager (its engine pools connections)."""
+    global _db_manager
+    if _db_manager is None:
+        with _init_lock:
+            if _db_manager is None:
+                _db_manager = DatabaseManager(ui=False)
+    return _db_manager
+
+
+def get_sql_generator() -> SQLGenerator:
+    """Process-wide headless SQLGenerator."""
+    global _sql_generator
+    if _sql_generator is None:
+        with _init_lock:
+            if _sql_generator is None:
+                _sql_generator = SQLGenerator(ui=False)
+    return _sql_generator
+
+
+def get_cost_estimator() -> Optional[CostEstimator]:
+    """Process-wide cost estimator; None for databases other than SQLite."""
+    global _cost_estimator
+    if Config.DATABASE_TYPE != "sqlite":
+        return None
+    if _cost_estimator is None:
+        with _init_lock:
+            if _cost_estimator is None:
+                _cost_estimator = CostEstimator(_query_rows)
+    return _cost_estimator
+
+
+def get_partition_planner() -> Optional[PartitionPlanner]:
+    """Process-wide partition planner (see partitions.py); None for databases other than SQLite."""
+    global _partition_planner
+    if Config.DATABASE_TYPE != "sqlite":
+        return None
+    if _partition_planner is None:
+        with _init_lock:
+            if _partition_planner is None:
+                _partition_planner = PartitionPlanner(_query_rows)
+    return _partition_planner
+
+
+def get_cohort_router() -> Optional[CohortRouter]:
+    """Process-wide cohort cube router (see cohort_cube.py); None for databases other than SQLite."""
+    global _cohort_router
+    if Config.DATABASE_TYPE != "sqlite" or not Config.COHORT_CUBE_ENABLED:
+        return None
+    if _cohort_router is None:
+        with _init_lock:
+            if _cohort_router is None:
+                _cohort_router = CohortRouter(_query_rows)
+    return _cohort_router
+
+
+def get_segment_index() -> Optional[SegmentIndex]:
+    """Process-wide segment bitmap index (see segment_index.py); None for databases other than SQLite."""
+    global _segment_index
+    if Config.DATABASE_TYPE != "sqlite" or not Config.SEGMENT_INDEX_ENABLED:
+        return None
+    if _segment_index is None:
+        with _init_lock:
+            if _segment_index is None:
+                _segment_index = SegmentIndex(_query_rows)
+    return _segment_index
+
+
+def physical_sql(sql_query: str) -> str:
+    """``sql_query`` as it is executed: answered from the cohort cube when it can be, otherwise
+    narrowed to the partitions it reads when user_days is partitioned."""
+    router = get_cohort_router()
+    routed = router.route(sql_query) if router is not None else None
+    if routed is not None:
+        annotate(routed=CUBE_TABLE)
+        return routed
+    planner = get_partition_planner()
+    return planner.prune(sql_query) if planner is not None else sql_query
+
+
+def _query_rows(sql_query: str) -> List[Tuple[Any, ...]]:
+    db_manager = get_db_manager()
+    df = db_manager.execute_query(sql_query)
+    if df is None:
+        raise PipelineError(db_manager.last_error or "Query execution failed.")
+    return list(df.itertuples(index=False, name=None))
+
+
+def generate_sql_with_usage(
+    user_query: str,
+    custom_prompt: Optional[str] = None,
+    schema_prompt: bool = False,
+    use_cache: bool = True,
+) -> Tuple[str, Dict[str, Any]]:
+    """Generate SQL for a question and report token usage.
+
+    By default uses the GSN Casino ``user_days`` prompt (optionally a custom
+    template with a ``{user_query}`` placeholder); ``schema_prompt=True`` uses
+    the generic prompt built from the live database schema instead. Generated
+    SQL is cached on disk per (question, prompt, model); cache hits report
+    ``{"cached": True}`` as their usage, and so do callers that shared an
+    identical generation already in flight (``{"coalesced": True}``).
+    """
+    model = Config.OPENAI_MODEL if schema_prompt else Config.CASINO_SQL_MODEL
+    with span("pipeline.generate_sql", model=model) as s:
+        cache_key = make_key("sql", user_query.strip(), custom_prompt, schema_prompt, model)
+        if use_cache:
+            cached = get_cache().get(cache_key)
+            if cached is not None:
+                s.set(cached=True)
+                return cached, {"cached": True}
+
+        def generate() -> Tuple[str, Dict[str, Any]]:
+            generator = get_sql_generator()
+            if schema_prompt:
+                schema_info = get_schema()
+                if not schema_info:
+                    raise PipelineError("No database schema found. Please connect to database and create tables.")
+                sql_query = generator.generate_sql(user_query, schema_info)
+            else:
+                sql_query = generator.generate_casino_sql(user_query, custom_prompt)
+            if not sql_query:
+                raise PipelineError(generator.last_error or "Failed to generate SQL query.")
+            get_cache().set(cache_key, sql_query)
+            return sql_query, {**generator.last_usage, "cached": False}
+
+        # Identical prompts in flight (here or in another process) share one LLM call
+        lookup = (lambda: _cached_sql(cache_key)) if use_cache else None
+        (sql_query, usage), shared = get_flight("llm").do(cache_key, generate, lookup)
+        s.set(cached=False, coalesced=shared)
+        if shared:
+            return sql_query, {"cached": True, "coalesced": True}
+        return sql_query, usage
+
+
+def _cached_sql(cache_key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    sql_query = get_cache().get(cache_key)
+    return (sql_query, {"cached": True}) if sql_query is not None else None
+
+
+def generate_sql(user_query: str, custom_prompt: Optional[str] = None, schema_prompt: bool = False) -> str:
+    """Generate SQL for a question (see ``generate_sql_with_usage``)."""
+    return generate_sql_with_usage(user_query, custom_prompt, schema_prompt)[0]
+
+
+def explain_sql(sql_query: str) -> str:
+    generator = get_sql_generator()
+    with span("pipeline.explain_sql"):
+        explanation = generator.explain_sql(sql_query)
+    if not explanation:
+        raise PipelineError(generator.last_error or "Failed to explain SQL query.")
+    return explanation
+
+
+def validate_sql(sql_query: str, extra_tables: Optional[Dict[str, List[str]]] = None):
+    """Reject anything but a single read-only statement over known tables and columns.
+
+    ``extra_tables`` (name -> columns) adds tables that exist outside the
+    database catalog, e.g. a conversation's materialized results.
+    """
+    with span("pipeline.validate_sql"):
+        try:
+            parsed = parse_sql(sql_query)
+        except SQLParseError as e:
+            raise PipelineError(f"Could not parse the generated SQL: {e}")
+        error = parsed.read_only_error()
+        if error:
+            raise PipelineError(error)
+        catalog = schema_catalog()
+        if catalog:
+            problems = parsed.check_catalog({**catalog, **(extra_tables or {})})
+            if problems:
+                raise PipelineError("; ".join(problems))
+
+
+def schema_catalog() -> Dict[str, List[str]]:
+    """Table name -> column names, refreshed every ``Config.SCHEMA_CACHE_SECONDS``."""
+    global _catalog
+    loaded_at, catalog = _catalog
+    if time.monotonic() - loaded_at > Config.SCHEMA_CACHE_SECONDS:
+        catalog = {}
+        for table, columns in get_schema().items():
+            names = [c.get("name") or c.get("Field") or c.get("column_name") for c in columns if isinstance(c, dict)]
+            catalog[table] = [name for name in names if name]
+        _catalog = (time.monotonic(), catalog)
+    return catalog
+
+
+def clean_result(df: pd.DataFrame) -> pd.DataFrame:
+    """Reset the index and coerce numeric-looking object columns (e.g., totals returned as strings).
+
+    With ``Config.COMPACT_RESULTS`` the result is then stored with compact
+    dtypes (see frame_compaction.py); ``df.attrs["memory"]`` reports the saving.
+    """
+    with span("pipeline.coerce_types", rows=len(df)):
+        df = df.reset_index(drop=True)
+        for col in df.select_dtypes(include=["object"]).columns:
+            try:
+                series_str = df[col].astype(str).str.replace(",", "").str.strip()
+                converted = pd.to_numeric(series_str, errors="coerce")
+                if converted.notna().any():
+                    df[col] = converted
+            except Exception:
+                pass
+    if Config.COMPACT_RESULTS:
+        df = compact_frame(df)
+    return df
+
+
+def data_version() -> Tuple[int, List[Tuple[int, str, str]]]:
+    """Current data version and the day range of every refresh (see ingest.py).
+
+    Re-read every ``Config.DATA_VERSION_CHECK_SECONDS``; a new version also
+    drops the cached schema catalog, sample list, sketch metadata, table
+    statistics and partition catalog.
+    """
+    global _data_version, _catalog, _samples, _sketches
+    checked_at, version, changes = _data_version
+    if time.monotonic() - checked_at > Config.DATA_VERSION_CHECK_SECONDS and Config.DATABASE_TYPE == "sqlite":
+        try:
+            exists = _query_rows(f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{VERSION_TABLE}'")
+            changes = [tuple(row) for row in _query_rows(
+                f"SELECT version, first_day, last_day FROM {VERSION_TABLE} ORDER BY version"
+            )] if exists else []
+        except PipelineError:
+            changes = []
+        latest = changes[-1][0] if changes else 0
+        if latest != version and checked_at:
+            _catalog = (0.0, {})
+            _samples = (0.0, [])
+            _sketches = (0.0, None)
+            if _cost_estimator is not None:
+                _cost_estimator.invalidate()
+            if _partition_planner is not None:
+                _partition_planner.invalidate()
+            if _cohort_router is not None:
+                _cohort_router.invalidate()
+            if _segment_index is not None:
+                _segment_index.invalidate()
+        version = latest
+        _data_version = (time.monotonic(), version, changes)
+    return version, changes
+
+
+def _result_days(sql_query: str) -> Optional[List[Optional[str]]]:
+    """``[first, last]`` event_day_pst a query reads, when that range cannot move as data is added.
+
+    None (depends on every refresh) without an upper bound, when a subquery
+    could make the bounds data-dependent (``MAX(event_day_pst)``), when the
+    day bounds sit under OR/NOT (``date_range`` then ignores them) or when
+    they contradict each other.
+    """
+    estimator = get_cost_estimator()
+    if estimator is None:
+        return None
+    try:
+        parsed = parse_sql(sql_query)
+    except SQLParseError:
+        return None
+    if sum(1 for token in parsed.tokens if token.is_keyword("SELECT")) > 1:
+        return None
+    day_range = estimator.date_range(sql_query)
+    if not day_range or day_range[1] is None:
+        return None
+    if day_range[0] is not None and day_range[0] > day_range[1]:
+        return None
+    return [day.isoformat() if day else None for day in day_range]
+
+
+def _cached_query_result(sql_query: str) -> Optional[pd.DataFrame]:
+    """Cached result of a query, unless a refresh since then touched the days it read."""
+    entry = get_cache().get(query_cache_key(sql_query))
+    if not isinstance(entry, dict):
+        return None  # missing, or written before results carried a data version
+    version, changes = data_version()
+    if entry["version"] >= version:
+        return entry["df"]
+    if entry["days"] is None:
+        return None
+    first, last = entry["days"]
+    for changed_version, first_day, last_day in changes:
+        if changed_version > entry["version"] and last_day >= (first or "") and first_day <= last:
+            return None
+    return entry["df"]
+
+
+def query_cache_key(sql_query: str) -> str:
+    """Cache key for a query's result; formatting, comments and keyword case do not matter,
+    except in the outer select list, whose exact text names unaliased result columns."""
+    try:
+        parsed = parse_sql(sql_query)
+        canonical = parsed.normalized
+        statement = parsed.statements[0] if parsed.statements else []
+        select = next((i for i, t in enumerate(statement) if t.depth == 0 and t.is_keyword("SELECT")), None)
+        if select is not None:
+            end = next((t.start for t in statement[select + 1:] if t.depth == 0 and t.is_keyword("FROM")),
+                       statement[-1].end)
+            canonical += "\n" + sql_query[statement[select].end:end].strip()
+    except SQLParseError:
+        canonical = " ".join(sql_query.split())
+    return make_key("query", canonical)
+
+
+def execute_sql(sql_query: str, use_cache: bool = True) -> pd.DataFrame:
+    """Execute a validated query and return the cleaned result.
+
+    Results up to ``Config.RESULT_CACHE_MAX_ROWS`` rows are cached on disk by
+    SQL text, so re-running an unchanged query skips the database. Entries
+    carry the data version and the days the query read, so an incremental
+    refresh only invalidates results that include refreshed days. Identical
+    queries running at the same time share one execution (single_flight.py).
+    DAU-style counts are computed from the segment index when it can answer them.
+    """
+    with span("pipeline.execute_sql") as s:
+        if use_cache:
+            cached = _cached_query_result(sql_query)
+            if cached is not None:
+                s.set(cached=True, rows=len(cached))
+                return cached
+
+        def run() -> pd.DataFrame:
+            # Read before executing: a refresh that lands mid-query invalidates this result
+            version = data_version()[0]
+            db_manager = get_db_manager()
+            index = get_segment_index()
+            result_df = index.answer(sql_query) if index is not None else None
+            if result_df is not None:
+                annotate(routed="segment_index")
+            else:
+                result_df = db_manager.execute_query(physical_sql(sql_query))
+            if result_df is None:
+                raise PipelineError(db_manager.last_error or "Query execution failed.")
+            result_df = clean_result(result_df)
+            if len(result_df) <= Config.RESULT_CACHE_MAX_ROWS:
+                get_cache().set(
+                    query_cache_key(sql_query),
+                    {"df": result_df, "version": version, "days": _result_days(sql_query)},
+                )
+            return result_df
+
+        # Identical queries in flight (here or in another process) share one execution
+        lookup = (lambda: _cached_query_result(sql_query)) if use_cache else None
+        result_df, shared = get_flight("query").do(query_cache_key(sql_query), run, lookup)
+        if shared:
+            result_df = result_df.copy()  # callers may add columns to their result
+        s.set(cached=False, coalesced=shared, rows=len(result_df))
+        return result_df
+
+
+def available_samples() -> List[Dict[str, Any]]:
+    """``sample_meta`` rows of the user_days samples (see approximate.py), refreshed with the schema catalog."""
+    global _samples
+    loaded_at, samples = _samples
+    if time.monotonic() - loaded_at > Config.SCHEMA_CACHE_SECONDS:
+        samples = []
+        if META_TABLE in schema_catalog():
+            df = get_db_manager().execute_query(
+                f"SELECT table_name, percent, base_rows, sample_rows FROM {META_TABLE}"
+            )
+            samples = df.to_dict("records") if df is not None else []
+        _samples = (time.monotonic(), samples)
+    return samples
+
+
+def available_sketches() -> Optional[Dict[str, Any]]:
+    """``sketch_meta`` of the daily distinct-user sketches (see sketches.py), or None
+    when they have not been built or do not reach the latest day of user_days."""
+    global _sketches
+    loaded_at, meta = _sketches
+    if time.monotonic() - loaded_at > Config.SCHEMA_CACHE_SECONDS:
+        meta = None
+        if SKETCH_META_TABLE in schema_catalog():
+            try:
+                rows = _query_rows(f"SELECT first_day, last_day FROM {SKETCH_META_TABLE}")
+                latest = _query_rows(physical_sql("SELECT MAX(event_day_pst) FROM user_days"))
+            except PipelineError:
+                rows = latest = []
+            if rows and latest and rows[0][1] == latest[0][0]:
+                meta = {"first_day": rows[0][0], "last_day": rows[0][1]}
+        _sketches = (time.monotonic(), meta)
+    return meta
+
+
+def execute_approximate(sql_query: str, use_cache: bool = True) -> Tuple[Optional[pd.DataFrame], Dict[str, Any]]:
+    """Fast estimate of a validated aggregate query.
+
+    Distinct-user counts are merged from the daily HyperLogLog sketches when
+    they cover the query (``info["method"] == "sketch"``, with the sketches'
+    ``relative_error``); anything else is estimated from a user-hash sample
+    (``method`` ``"sample"``, with ``percent`` and ``sample_rows``).
+
+    Returns ``(df, info)``. ``df`` holds the estimates with
+    ``<column>_low`` / ``<column>_high`` 95% confidence bounds; ``info`` has
+    ``approximate``, ``method`` and ``estimated_columns``.
+    When the query cannot be estimated, ``df`` is None and ``info["reason"]``
+    says why, so the caller can run it exactly (through its usual guardrails).
+    """
+    with span("pipeline.execute_approximate") as s:
+        if available_sketches() is not None:
+            try:
+                sketch_query = rewrite_for_sketches(sql_query)
+            except (NotSketchable, SQLParseError):
+                sketch_query = None
+            if sketch_query is not None:
+                df = with_error_bounds(execute_sql(sketch_query.sql, use_cache), sketch_query)
+                s.set(approximate=True, method="sketch", rows=len(df))
+                return df, {
+                    "approximate": True,
+                    "method": "sketch",
+                    "relative_error": sketch_query.relative_error,
+                    "estimated_columns": list(sketch_query.estimate_columns),
+                }
+
+        sample = choose_sample(available_samples(), Config.APPROX_MIN_SAMPLE_ROWS)
+        if sample is None:
+            reason = "no samples have been built (python run.py sample)"
+        elif sample["base_rows"] <= Config.APPROX_MIN_SAMPLE_ROWS:
+            reason = "user_days is small enough to query exactly"
+        else:
+            try:
+                query = rewrite_for_sample(sql_query, int(sample["percent"]))
+                reason = None
+            except (NotApproximable, SQLParseError) as e:
+                reason = str(e)
+        if reason:
+            s.set(approximate=False)
+            return None, {"approximate": False, "reason": reason}
+
+        point = execute_sql(query.sql, use_cache)
+        replicates = execute_sql(query.replicate_sql, use_cache)
+        df = confidence_intervals(point, replicates, query)
+        s.set(approximate=True, method="sample", percent=query.percent, rows=len(df))
+        return df, {
+            "approximate": True,
+            "method": "sample",
+            "percent": query.percent,
+            "sample_rows": int(sample["sample_rows"]),
+            "estimated_columns": [column for column, _ in query.estimate_columns],
+        }
+
+
+def estimate_cost(sql_query: str) -> Optional[Dict[str, Any]]:
+    """Pre-execution cost estimate (see cost_estimator.py), or None when unavailable or
+    when the query is computed from the segment index without a scan.
+
+    The estimate is for the query as executed (see ``physical_sql``).
+    Estimates at the ``confirm`` level also carry ``narrowed_sql``: the query
+    restricted to the last ``Config.COST_NARROW_DAYS`` days, with its own
+    ``narrowed_rows_scanned``.
+    """
+    estimator = get_cost_estimator()
+    if estimator is None:
+        return None
+    index = get_segment_index()
+    if index is not None and index.plan(sql_query) is not None:
+        return None  # computed from the segment bitmaps, without scanning user_days
+    estimate = estimator.estimate(physical_sql(sql_query))
+    if estimate and estimate["level"] == "confirm" and "user_days" in parse_sql(sql_query).tables:
+        narrowed = estimator.narrow_time_window(sql_query)
+        narrowed_estimate = estimator.estimate(physical_sql(narrowed))
+        if narrowed != sql_query and narrowed_estimate:
+            estimate["narrowed_sql"] = narrowed
+            estimate["narrowed_days"] = Config.COST_NARROW_DAYS
+            estimate["narrowed_rows_scanned"] = narrowed_estimate["rows_scanned"]
+    return estimate
+
+
+def get_schema() -> Dict[str, List[Dict[str, Any]]]:
+    """Table name -> column descriptions for every table in the database."""
+    db_manager = get_db_manager()
+    schema_info = {}
+    for table in db_manager.get_all_tables():
+        schema_info[table] = db_manager.get_table_schema(table) or []
+    return schema_info
+
+
+def store_result(df: pd.DataFrame, fingerprint: Optional[str] = None) -> str:
+    """Keep a result in the shared cache so other requests can refer to it by fingerprint.
+
+    Like the query cache, results over ``Config.RESULT_CACHE_MAX_ROWS`` rows
+    are not written; their fingerprint is still returned.
+    """
+    fingerprint = fingerprint or result_fingerprint(df)
+    if len(df) <= Config.RESULT_CACHE_MAX_ROWS:
+        get_cache().set(f"result:{fingerprint}", df)
+    return fingerprint
+
+
+def load_result(fingerprint: str) -> Optional[pd.DataFrame]:
+    return get_cache().get(f"result:{fingerprint}")
+
+
+def rerun_query(sql_query: str, fingerprint: Optional[str] = None) -> Tuple[pd.DataFrame, bool]:
+    """Result of a previously executed query, for re-running it from the history.
+
+    Tries the stored result by fingerprint, then the query cache by SQL text,
+    and only then executes the (re-validated) SQL. Returns ``(df, from_cache)``.
+    """
+    with span("pipeline.rerun_query") as s:
+        df = load_result(fingerprint) if fingerprint else None
+        if df is None:
+            df = _cached_query_result(sql_query)
+        if df is not None:
+            s.set(cached=True, rows=len(df))
+            return df, True
+        validate_sql(sql_query)
+        df = execute_sql(sql_query, use_cache=False)
+        s.set(cached=False, rows=len(df))
+        return df, False
+
+
+def export_result(df: pd.DataFrame, fmt: str = "csv") -> bytes:
+    """Serialise a result for download."""
+    if fmt == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    if fmt == "json":
+        return with_day_strings(df).to_json(orient="records", date_format="iso").encode("utf-8")
+    if fmt == "parquet":
+        buffer = io.BytesIO()
+        df.to_parquet(buffer, index=False)
+        return buffer.getvalue()
+    raise PipelineError(f"Unsupported export format: {fmt}. Use one of {', '.join(EXPORT_FORMATS)}.")
+
+
+def stream_result_insights(df, user_query: str, fingerprint: str = None, use_cache: bool = True):
+    """Stream insights and chart specs for the query results as the model writes them.
+
+    Yields ``("insight", str)`` and ``("chart", dict)`` events as soon as each
+    element closes in the token stream (see ``json_stream.InsightStreamParser``),
+    then a final ``("done", dict)`` event with the complete spec, or a single
+    ``("error", str)`` event on failure.
+
+    Completed responses are cached on disk keyed by the result fingerprint and
+    the question, so re-analysing an identical result replays them without an
+    LLM call (unless ``use_cache`` is False).
+    """
+    try:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            yield "error", "OpenAI API key not configured. Cannot generate insights."
+            return
+
+        cache_key = make_key(
+            "insights",
+            fingerprint or result_fingerprint(df),
+            user_query.strip(),
+            Config.INSIGHTS_MODEL,
+        )
+        cached = get_cache().get(cache_key) if use_cache else None
+        if cached is not None:
+            for text in cached.get("insights") or []:
+                yield "insight", text
+            for chart in cached.get("charts") or []:
+                yield "chart", chart
+            yield "done", cached
+            return
+
+        # A bounded statistical digest of the full result, rather than the first rows
+        with span("pipeline.summarize_result", rows=len(df)):
+            result_summary = format_summary_for_prompt(summarize_result(df))
+        prompt = f"""
+You are a highly experienced senior data analyst.
+
+IMPORTANT RUNTIME CONTEXT
+- You are used strictly via an API that sends and receives **text only**.
+- You CANNOT return actual charts, images, or other media.
+- Instead, you must describe analytics as:
+  1) Quantitative insight sentences, and
+  2) A machine-readable chart specification that another tool will
+     use to render visualizations.
+
+INPUT YOU RECEIVE
+- The user's natural-language question about a dataset
+- A compact JSON summary of the full query result (row count, per-column
+  statistics, top categories with shares, day-over-day changes and trend
+  slopes for event_day_pst series, and outliers)
+
+WHAT YOU MUST RETURN
+Return a single **JSON object only** (no extra text) with these
+top-level keys:
+
+{{
+  "insights": [
+    "string insight 1",
+    "string insight 2"
+  ],
+  "charts": [
+    {{
+      "type": "bar" | "pie" | "line" | "histogram",
+      "x": "column_name (for bar/line) or null",
+      "y": "metric_column (for bar/line) or null",
+      "names": "column_name (for pie) or null",
+      "values": "metric_column (for pie) or null",
+      "title": "Human readable chart title"
+    }},
+    ...
+  ]
+}}
+
+Rules for INSIGHTS (text part):
+- Always be quantitative (shares, rankings, concentration, peaks/lows, etc.).
+- 4–6 short bullet-style sentences.
+- Each insight should mention numbers or percentages when possible.
+- Keep each insight under 160 characters.
+- Do NOT restate the table in a generic way (e.g., "Blue is the highest").
+
+Rules for CHART SPECS (for downstream visualization tools):
+- You are NOT drawing the charts yourself; you are specifying how
+  another system should draw them.
+- For categorical totals (e.g., payer-type revenue), output **two charts**:
+  1) Bar chart with type="bar", x = category column, y = metric column.
+  2) Pie chart with type="pie", names = category column, values = metric column.
+- For time-series data, use type="line" with x = date column, y = metric column.
+- For distributions of a single numeric metric, use type="histogram" with x = metric column.
+- Use column names exactly as they appear in the summary's "columns" list.
+- If a field (x, y, names, values) is not relevant to a chart type,
+  set it to null or omit it.
+
+OUTPUT FORMAT REQUIREMENTS
+- Return ONLY the JSON object described above.
+- Do NOT include markdown, explanations, natural-language text, or
+  any content outside of the JSON.
+
+User question:
+{user_query}
+
+Summary of the query results in JSON format:
+{result_summary}
+"""
+
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a senior data analyst that returns ONLY valid JSON following the requested schema. The entire response must fit comfortably within 600 tokens.",
+            },
+            {"role": "user", "content": prompt},
+        ]
+
+        # Parse the token stream incrementally so charts can render before the
+        # model has finished writing; prose or markdown fences are skipped.
+        # Timed with record() rather than a span: this generator yields to the
+        # caller mid-stream and a span would adopt the caller's own stages. The
+        # duration is wall time, including the caller's work between events.
+        parser = InsightStreamParser()
+        started = time.perf_counter()
+        first_event_ms = None
+        chunks = 0
+        route: Dict[str, Any] = {}
+        stream = get_model_router().stream("insights", messages, 600, 0.3, user_query, api_key, info=route)
+        for chunk in stream:
+            chunks += 1
+            for event in parser.feed(chunk):
+                if first_event_ms is None:
+                    first_event_ms = round((time.perf_counter() - started) * 1000, 1)
+                yield event
+
+        streamed = len(parser.insights) + len(parser.charts)
+        parsed = parser.finish()
+        record(
+            "llm.stream_insights",
+            started,
+            model=route.get("model"),
+            route=route.get("route"),
+            chunks=chunks,
+            first_event_ms=first_event_ms,
+            insights=len(parsed["insights"]),
+            charts=len(parsed["charts"]),
+        )
+        if streamed == 0:
+            # Nothing closed incrementally: emit what the whole-response fallback recovered
+            for text in parsed["insights"]:
+                yield "insight", text
+            for chart in parsed["charts"]:
+                yield "chart", chart
+        if parsed["insights"] or parsed["charts"]:
+            get_cache().set(cache_key, parsed)
+        yield "done", parsed
+
+    except Exception as e:
+        yield "error", f"Insight generation failed: {str(e)}"
+
+
+def generate_result_insights(df, user_query: str, fingerprint: str = None):
+    """Generate insights and chart specifications for the query results.
+
+    Returns a Python dict with at least:
+    {
+        "insights": ["..."],
+        "charts": [
+            {"type": "bar", "x": "Payer_type", "y": "total_revenue", "title": "..."},
+            {"type": "pie", "names": "Payer_type", "values": "total_revenue", "title": "..."},
+            ...
+        ]
+    }
+
+    If the model does not return valid JSON, a fallback dict with a single
+    free-form insight string is returned. On failure an error string is returned.
+    """
+    for kind, payload in stream_result_insights(df, user_query, fingerprint):
+        if kind in ("done", "error"):
+            return payload
+    return {"insights": [], "charts": []}
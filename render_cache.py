@@ -0,0 +1,138 @@
+"""
+Render helpers and a per-session memo for derived display artefacts.
+
+Every widget interaction re-executes ``simple_app.main``. Anything derived
+from the latest result (the cleaned plot frame, the trend series, the column
+profile, CSV bytes and Plotly figures) is memoised in a ``RenderCache`` keyed
+by the result fingerprint, so a rerun with unchanged inputs does no
+DataFrame work or figure construction.
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import numpy as np
+import pandas as pd
+
+from lazy import lazy_import
+from tracing import span
+
+px = lazy_import("plotly.express")
+
+
+class RenderCache:
+    """Bounded memo of render artefacts: fingerprint -> {key: value}."""
+
+    def __init__(self, max_results: int = 4):
+        self.max_results = max_results
+        self._entries: "OrderedDict[str, Dict[Hashable, Any]]" = OrderedDict()
+
+    def get(self, fingerprint: str, key: Hashable, build: Callable[[], Any]) -> Any:
+        """Return the memoised artefact, building it on first use."""
+        entry = self._entries.get(fingerprint)
+        if entry is None:
+            entry = self._entries[fingerprint] = {}
+            while len(self._entries) > self.max_results:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(fingerprint)
+        if key not in entry:
+            stage = key if isinstance(key, str) else str(key[0])
+            with span(f"render.{stage}", fingerprint=fingerprint[:12]):
+                entry[key] = build()
+        return entry[key]
+
+    def clear(self):
+        self._entries.clear()
+
+
+def is_index_like(series: pd.Series) -> bool:
+    """True if the non-null values are exactly 0..n-1 in order (a leaked positional index)."""
+    if not pd.api.types.is_integer_dtype(series):
+        return False
+    values = series.dropna().to_numpy()
+    n = len(values)
+    if n == 0:
+        return False
+    # Cheap endpoint checks first, then one vectorised pass over the diffs
+    if values[0] != 0 or values[-1] != n - 1:
+        return False
+    return bool(n == 1 or (np.diff(values) == 1).all())
+
+
+def prepare_plot_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop index-like columns and coerce numeric-looking text for charting."""
+    drop_cols = [
+        c for c in df.columns
+        if str(c).lower() == "index" or str(c).startswith("Unnamed") or is_index_like(df[c])
+    ]
+    plot_df = df.drop(columns=drop_cols) if drop_cols else df.copy()
+
+    # Best-effort: coerce any remaining numeric-looking object columns
+    for col in plot_df.select_dtypes(include=["object"]).columns:
+        try:
+            series_str = plot_df[col].astype(str).str.replace(",", "").str.strip()
+            converted = pd.to_numeric(series_str, errors="coerce")
+            if converted.notna().any():
+                plot_df[col] = converted
+        except Exception:
+            continue
+    return plot_df
+
+
+def build_trend_series(df: pd.DataFrame) -> Optional[pd.Series]:
+    """First numeric metric indexed by event_day_pst, or None if the result is not a time series."""
+    numeric_cols = df.select_dtypes(include=["number"]).columns.tolist()
+    if "event_day_pst" not in df.columns or not numeric_cols:
+        return None
+    try:
+        ts_df = df[["event_day_pst", numeric_cols[0]]].copy()
+        ts_df["event_day_pst"] = pd.to_datetime(ts_df["event_day_pst"], errors="coerce")
+        ts_df = ts_df.dropna(subset=["event_day_pst"]).sort_values("event_day_pst")
+        return ts_df.set_index("event_day_pst")[numeric_cols[0]]
+    except Exception:
+        return None
+
+
+def column_profile(df: pd.DataFrame, definitions: Dict[str, str]) -> pd.DataFrame:
+    """Per-column dtype, distinct count, sample values and known definition."""
+    summary_rows = []
+    for col in df.columns:
+        series = df[col]
+        samples = series.dropna().unique()[:5]
+        summary_rows.append({
+            "column": col,
+            "dtype": str(series.dtype),
+            "distinct_values": int(series.nunique(dropna=True)),
+            "sample_values": ", ".join(map(str, samples)),
+            "definition": definitions.get(col, ""),
+        })
+    return pd.DataFrame(summary_rows)
+
+
+def build_chart_figure(plot_df: pd.DataFrame, chart: dict):
+    """Build a Plotly figure for one chart spec, or None if the spec does not fit the data."""
+    ctype = str(chart.get("type", "")).lower()
+    title = chart.get("title")
+    if ctype in ("bar", "line"):
+        x_col = chart.get("x")
+        y_col = chart.get("y")
+        if not x_col or not y_col:
+            return None
+        if x_col in plot_df.columns and y_col in plot_df.columns:
+            plot_fn = px.bar if ctype == "bar" else px.line
+            return plot_fn(plot_df, x=x_col, y=y_col, title=title)
+    elif ctype == "pie":
+        names_col = chart.get("names")
+        values_col = chart.get("values")
+        if not names_col or not values_col:
+            return None
+        if names_col in plot_df.columns and values_col in plot_df.columns:
+            return px.pie(plot_df, names=names_col, values=values_col, title=title)
+    elif ctype == "histogram":
+        x_col = chart.get("x")
+        if not x_col:
+            return None
+        if x_col in plot_df.columns:
+            return px.histogram(plot_df, x=x_col, title=title)
+    return None
@@ -0,0 +1,262 @@
+"""
+Compact statistical digests of query results.
+
+The insights prompt used to embed ``df.head(50)`` as CSV, which is both
+token-heavy and unrepresentative of large results. ``summarize_result``
+computes a fixed-size digest of the *whole* result instead: per-column stats,
+top categories with shares, day-over-day deltas and trend slopes for
+``event_day_pst`` series, and IQR outliers. Every section is capped, so the
+prompt size no longer grows with the number of rows, and the whole digest is
+kept within ``MAX_DIGEST_TOKENS`` -- the size of the 50-row sample it
+replaced -- by dropping the least useful sections first.
+"""
+
+import json
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+DATE_COLUMN = "event_day_pst"
+MAX_COLUMNS = 20
+TOP_K = 3
+MAX_OUTLIERS = 2
+MAX_LABEL_CHARS = 40
+# About the size of the df.head(50) CSV sample the digest replaced
+MAX_DIGEST_TOKENS = 400
+
+
+def _label(value: Any) -> str:
+    """Render a category label, truncated so long strings cannot blow up the prompt."""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NULL"
+    if isinstance(value, pd.Timestamp) and value == value.normalize():
+        return value.strftime("%Y-%m-%d")  # dates parsed by frame_compaction.py
+    text = str(value)
+    if len(text) > MAX_LABEL_CHARS:
+        text = text[: MAX_LABEL_CHARS - 1] + "…"
+    return text
+
+
+def _num(value: Any) -> Optional[float]:
+    """Round a statistic to 4 significant digits (None for NaN/inf)."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value):
+        return None
+    if value == 0:
+        return 0.0
+    digits = 3 - int(math.floor(math.log10(abs(value))))
+    return round(value, max(digits, 0))
+
+
+def _share(value: Any) -> Optional[float]:
+    """A ratio rounded to 3 decimals; shares need less precision than totals."""
+    value = _num(value)
+    return None if value is None else round(value, 3)
+
+
+def _numeric_stats(numeric: pd.DataFrame) -> Dict[str, Dict[str, Any]]:
+    desc = numeric.describe(percentiles=[0.5]).T
+    sums = numeric.sum()
+    nulls = numeric.isna().sum()
+    stats = {}
+    for col in numeric.columns:
+        row = desc.loc[col]
+        entry = {
+            "sum": _num(sums[col]),
+            "mean": _num(row["mean"]),
+            "min": _num(row["min"]),
+            "median": _num(row["50%"]),
+            "max": _num(row["max"]),
+        }
+        if nulls[col]:
+            entry["nulls"] = int(nulls[col])
+        stats[str(col)] = entry
+    return stats
+
+
+def _outliers(numeric: pd.DataFrame, labels: Optional[pd.Series]) -> Dict[str, Dict[str, Any]]:
+    """Count values outside the 1.5*IQR fences and list the most extreme ones."""
+    q1 = numeric.quantile(0.25)
+    q3 = numeric.quantile(0.75)
+    iqr = q3 - q1
+    lower = q1 - 1.5 * iqr
+    upper = q3 + 1.5 * iqr
+    mask = numeric.lt(lower, axis=1) | numeric.gt(upper, axis=1)
+    counts = mask.sum()
+    median = numeric.median()
+
+    result = {}
+    for col in counts[counts > 0].index:
+        deviation = (numeric[col] - median[col]).abs().where(mask[col])
+        top_idx = deviation.nlargest(MAX_OUTLIERS).index
+        # [value, label] pairs when a label column exists, else bare values
+        examples = [
+            [_num(numeric.at[idx, col]), _label(labels.at[idx])] if labels is not None
+            else _num(numeric.at[idx, col])
+            for idx in top_idx
+        ]
+        result[str(col)] = {"count": int(counts[col]), "extremes": examples}
+    return result
+
+
+def _categorical_stats(
+    df: pd.DataFrame, columns: List[str], metric: Optional[str], top_k: int
+) -> Dict[str, Dict[str, Any]]:
+    stats = {}
+    total_rows = len(df)
+    metric_total = float(df[metric].sum()) if metric else 0.0
+    for col in columns:
+        counts = df[col].value_counts(dropna=False)
+        # Top values as [label, share of rows] / [label, share of the metric total] pairs
+        entry: Dict[str, Any] = {
+            "distinct": int(len(counts)),
+            "top": [[_label(value), _share(n / total_rows)] for value, n in counts.head(top_k).items()],
+        }
+        if metric and metric_total:
+            by_metric = df.groupby(col, dropna=False, observed=True)[metric].sum()
+            by_metric = by_metric.sort_values(ascending=False).head(top_k)
+            entry[f"top_by_{metric}"] = [
+                [_label(value), _share(total / metric_total)] for value, total in by_metric.items()
+            ]
+        stats[str(col)] = entry
+    return stats
+
+
+def _time_series(dates: pd.Series, numeric: pd.DataFrame) -> Optional[Dict[str, Any]]:
+    """Aggregate metrics per day and describe the latest change and overall trend."""
+    valid = dates.notna()
+    if valid.sum() == 0 or numeric.empty:
+        return None
+    daily = numeric[valid].groupby(dates[valid]).sum().sort_index()
+    if len(daily) < 2:
+        return None
+
+    # Least-squares slope per metric, vectorised over all columns at once.
+    x = (daily.index - daily.index[0]).days.to_numpy(dtype=float)
+    xc = x - x.mean()
+    denom = float(xc @ xc)
+    values = daily.to_numpy(dtype=float)
+    slopes = (xc @ np.nan_to_num(values - np.nanmean(values, axis=0))) / denom if denom else np.zeros(values.shape[1])
+
+    last, prev = daily.iloc[-1], daily.iloc[-2]
+    metrics = {}
+    for i, col in enumerate(daily.columns):
+        change = last[col] - prev[col]
+        metrics[str(col)] = {
+            "last": _num(last[col]),
+            "pct_vs_prev_day": _share(change / prev[col]) if prev[col] else None,
+            "slope_per_day": _num(slopes[i]),
+            "peak_day": str(daily[col].idxmax().date()),
+        }
+    return {
+        "column": DATE_COLUMN,
+        "days": int(len(daily)),
+        "start": str(daily.index[0].date()),
+        "end": str(daily.index[-1].date()),
+        "metrics": metrics,
+    }
+
+
+def summarize_result(df: pd.DataFrame, top_k: int = TOP_K, max_columns: int = MAX_COLUMNS) -> Dict[str, Any]:
+    """Build a bounded-size digest describing the full result DataFrame."""
+    columns = list(df.columns[:max_columns])
+    frame = df[columns]
+    summary: Dict[str, Any] = {
+        "rows": int(len(df)),
+        "columns": [str(c) for c in columns],
+    }
+    if df.shape[1] > max_columns:
+        summary["omitted_columns"] = int(df.shape[1] - max_columns)
+    if frame.empty:
+        return summary
+
+    numeric = frame.select_dtypes(include="number")
+    dates = None
+    if DATE_COLUMN in frame.columns:
+        dates = pd.to_datetime(frame[DATE_COLUMN], errors="coerce")
+        numeric = numeric.drop(columns=[DATE_COLUMN], errors="ignore")
+    categorical = [
+        c for c in columns
+        if c not in numeric.columns and c != DATE_COLUMN
+    ]
+
+    if not numeric.empty:
+        summary["numeric"] = _numeric_stats(numeric)
+        labels = frame[categorical[0]] if categorical else None
+        outliers = _outliers(numeric, labels)
+        if outliers:
+            summary["outliers"] = outliers
+
+    if categorical:
+        metric = str(numeric.columns[0]) if not numeric.empty else None
+        summary["categorical"] = _categorical_stats(frame, categorical, metric, top_k)
+
+    if dates is not None:
+        series = _time_series(dates, numeric)
+        if series:
+            summary["time_series"] = series
+
+    return _fit_budget(summary, MAX_DIGEST_TOKENS)
+
+
+def _fit_budget(summary: Dict[str, Any], max_tokens: int) -> Dict[str, Any]:
+    """Drop optional detail, least useful first, until the digest fits ``max_tokens``."""
+    trims = [
+        lambda s: s.pop("outliers", None),
+        lambda s: [entry.pop(key) for entry in s.get("categorical", {}).values()
+                   for key in [k for k in entry if k.startswith("top_by_")]],
+        lambda s: s.get("time_series", {}).pop("metrics", None),
+        lambda s: s.pop("categorical", None),
+    ]
+    for trim in trims:
+        if estimate_tokens(format_summary_for_prompt(summary)) <= max_tokens:
+            break
+        trim(summary)
+    return summary
+
+
+def format_summary_for_prompt(summary: Dict[str, Any]) -> str:
+    """Serialise a digest compactly for inclusion in an LLM prompt."""
+    return json.dumps(summary, separators=(",", ":"), default=str, ensure_ascii=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 characters per token for English/JSON text)."""
+    return int(math.ceil(len(text) / 4))
+
+
+def compare_prompt_payloads(df: pd.DataFrame, sample_rows: int = 50) -> Dict[str, Dict[str, float]]:
+    """Compare the legacy CSV sample payload against the statistical digest."""
+    start = time.perf_counter()
+    csv_payload = df.head(sample_rows).to_csv(index=False)
+    csv_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    digest_payload = format_summary_for_prompt(summarize_result(df))
+    digest_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        "csv_sample": {"chars": len(csv_payload), "tokens": estimate_tokens(csv_payload), "build_ms": round(csv_ms, 2)},
+        "digest": {"chars": len(digest_payload), "tokens": estimate_tokens(digest_payload), "build_ms": round(digest_ms, 2)},
+    }
+
+
+if __name__ == "__main__":
+    # Token/latency comparison on synthetic user_days-shaped results of growing size.
+    rng = np.random.default_rng(0)
+    for n in (50, 1_000, 100_000):
+        days = pd.date_range("2024-01-01", periods=90, freq="D")
+        demo = pd.DataFrame({
+            "event_day_pst": rng.choice(days, n).astype("datetime64[ns]"),
+            "payer_type": rng.choice(["Whale", "Dolphin", "Minnow", "Blue", None], n),
+            "platform": rng.choice(["ios", "android", "amazon", "web"], n),
+            "bookings": rng.gamma(0.5, 20.0, n).round(2),
+            "slot_spins": rng.poisson(120, n),
+        })
+        print(f"rows={n}: {json.dumps(compare_prompt_payloads(demo))}")
@@ -1,27 +1,38 @@
 #!/usr/bin/env python3
 """
 Analytics AI Tool - Startup Script
-Run this script to start the Streamlit application
+Run this script to start the Streamlit application (default) or one of the
+headless commands:
+
+    python run.py              # Streamlit app
+    python run.py serve        # headless query service (service.py)
+    python run.py batch FILE   # run a JSONL/CSV file of questions (batch.py)
+    python run.py sample       # build the user_days samples for fast estimates (approximate.py)
+    python run.py refresh      # append new days from INGEST_SOURCE (ingest.py)
+    python run.py partition    # split user_days into monthly partitions (partitions.py)
+    python run.py cube         # build the install-cohort × tenure cube (cohort_cube.py)
+    python run.py segments     # build the per-day user bitmaps for DAU counts (segment_index.py)
+    python run.py sketches     # build the daily HyperLogLog sketches for distinct users (sketches.py)
 """
 
+import argparse
 import subprocess
 import sys
 import os
 
+from lazy import is_available
+
+REQUIRED_PACKAGES = ["streamlit", "openai", "pandas", "plotly", "sqlalchemy"]
+
 def check_dependencies():
-    """Check if required packages are installed"""
-    try:
-        import streamlit
-        import openai
-        import pandas
-        import plotly
-        import sqlalchemy
-        print("✅ All dependencies are installed")
-        return True
-    except ImportError as e:
-        print(f"❌ Missing dependency: {e}")
+    """Check if required packages are installed (via find_spec, without importing them)"""
+    missing = [name for name in REQUIRED_PACKAGES if not is_available(name)]
+    if missing:
+        print(f"❌ Missing dependency: {', '.join(missing)}")
         print("Please run: pip install -r requirements.txt")
         return False
+    print("✅ All dependencies are installed")
+    return True
 
 def check_env_file():
     """Check if .env file exists"""
@@ -31,7 +42,7 @@ def check_env_file():
         return False
     return True
 
-def main():
+def run_app():
     print("🚀 Starting Analytics AI Tool...")
     
     # Check dependencies
@@ -50,5 +61,185 @@ def main():
     except subprocess.CalledProcessError as e:
         print(f"❌ Error starting application: {e}")
 
+def run_batch_command(args):
+    import time
+    from batch import run_batch
+
+    started = time.perf_counter()
+    try:
+        report = run_batch(
+            args.questions,
+            args.out,
+            fmt=args.format,
+            insights=args.insights,
+            llm_concurrency=args.llm_concurrency,
+            db_concurrency=args.db_concurrency,
+            use_cache=not args.no_cache,
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    failed = [r for r in report if r["status"] != "ok"]
+    print(f"✅ {len(report) - len(failed)}/{len(report)} questions succeeded in {time.perf_counter() - started:.1f}s")
+    for row in failed:
+        print(f"❌ {row['id']}: {row.get('error')}")
+    print(f"Results and report written to {args.out}/")
+    if failed:
+        sys.exit(1)
+
+def _sqlite_db_path(db_path, what):
+    """``--db`` if given, else the SQLite file of DATABASE_URL (exits for other databases)."""
+    from config import Config
+
+    if db_path is not None:
+        return db_path
+    if not Config.DATABASE_URL.startswith("sqlite:///"):
+        print(f"❌ {what} can only be built for SQLite databases (use --db PATH)")
+        sys.exit(1)
+    return Config.DATABASE_URL[len("sqlite:///"):]
+
+def run_sample_command(args):
+    from approximate import build_samples
+
+    db_path = _sqlite_db_path(args.db, "Samples")
+    print(f"Building user_days samples in {db_path}...")
+    for sample in build_samples(db_path, force=args.force):
+        print(f"✅ {sample['table_name']}: {sample['sample_rows']:,} of {sample['base_rows']:,} rows")
+
+def run_refresh_command(args):
+    from ingest import IngestError, refresh
+
+    try:
+        report = refresh(args.db, args.source, dry_run=args.dry_run)
+    except IngestError as e:
+        print(f"❌ Refresh failed: {e}")
+        sys.exit(1)
+    if not report["days"]:
+        print("✅ Already up to date")
+    elif args.dry_run:
+        print(f"Would load {len(report['days'])} day(s): {', '.join(report['days'])}")
+    else:
+        restated = f" ({len(report['restated'])} restated)" if report["restated"] else ""
+        print(f"✅ Loaded {len(report['days'])} day(s){restated}, {report['rows']:,} rows in "
+              f"{report['seconds']:.1f}s; data version {report['version']}")
+
+def run_partition_command(args):
+    import sqlite3
+    from partitions import (PartitionError, compact_partitions, is_partitioned, partition_catalog,
+                            partition_database, seal_partitions)
+
+    db_path = _sqlite_db_path(args.db, "Partitions")
+    with sqlite3.connect(db_path) as conn:
+        partitioned = is_partitioned(conn)
+    if not partitioned:
+        print(f"Partitioning user_days in {db_path} by month...")
+        try:
+            partition_database(db_path, keep_original=args.keep_original)
+        except PartitionError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            sealed = seal_partitions(conn)
+        if sealed:
+            print(f"🔒 Sealed {', '.join(sealed)}")
+        if args.compact:
+            for table in compact_partitions(db_path):
+                print(f"🗜️  Compacted {table}")
+        for p in partition_catalog(conn):
+            state = "compacted" if p["compacted_at"] else "sealed" if p["sealed"] else "open"
+            print(f"✅ {p['table_name']}: {p['rows']:,} rows, {p['first_day']} – {p['last_day']} ({state})")
+    finally:
+        conn.close()
+
+def run_cube_command(args):
+    from cohort_cube import build_cube
+
+    db_path = _sqlite_db_path(args.db, "The cohort cube")
+    print(f"Building the cohort cube in {db_path}...")
+    meta = build_cube(db_path, force=args.force)
+    print(f"✅ cohort_cube: {meta.get('cells', 0):,} cells through {meta['last_day']}")
+
+def run_segments_command(args):
+    from segment_index import build_segments
+
+    db_path = _sqlite_db_path(args.db, "The segment index")
+    print(f"Building the segment index in {db_path}...")
+    meta = build_segments(db_path, force=args.force)
+    print(f"✅ segment_bitmaps: {meta['bitmaps']:,} bitmaps ({meta['bytes'] / 1e6:.1f} MB) "
+          f"for {meta['users']:,} users, {meta['first_day']} to {meta['last_day']}")
+
+def run_sketches_command(args):
+    from sketches import build_sketches
+
+    db_path = _sqlite_db_path(args.db, "Sketches")
+    print(f"Building distinct-user sketches in {db_path}...")
+    meta = build_sketches(db_path, force=args.force)
+    print(f"✅ user_sketches: {meta['sketches']:,} sketches ({meta['bytes'] / 1e6:.1f} MB), "
+          f"{meta['first_day']} to {meta['last_day']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analytics AI Tool")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("app", help="Run the Streamlit app (default)")
+    serve_parser = subparsers.add_parser("serve", help="Run the headless query service")
+    serve_parser.add_argument("service_args", nargs=argparse.REMAINDER, help="Arguments passed to service.py")
+    batch_parser = subparsers.add_parser("batch", help="Run a JSONL/CSV file of questions unattended")
+    batch_parser.add_argument("questions", help="Path to a .jsonl or .csv file of questions")
+    batch_parser.add_argument("--out", default="batch_output", help="Output directory")
+    batch_parser.add_argument("--format", choices=["parquet", "csv"], default="parquet", help="Result file format")
+    batch_parser.add_argument("--insights", action="store_true", help="Also generate insights for each result")
+    batch_parser.add_argument("--llm-concurrency", type=int, default=None, help="Max concurrent LLM calls")
+    batch_parser.add_argument("--db-concurrency", type=int, default=None, help="Max concurrent DB queries")
+    batch_parser.add_argument("--no-cache", action="store_true", help="Bypass the SQL/result caches")
+    synth_parser = subparsers.add_parser("synth", help="Generate a synthetic user_days table for benchmarking")
+    synth_parser.add_argument("synth_args", nargs=argparse.REMAINDER, help="Arguments passed to synthetic_data.py")
+    sample_parser = subparsers.add_parser("sample", help="Build the 1%%/10%% user samples of user_days for fast estimates")
+    sample_parser.add_argument("--db", default=None, help="SQLite database path (default: from DATABASE_URL)")
+    sample_parser.add_argument("--force", action="store_true", help="Rebuild samples that already exist")
+    refresh_parser = subparsers.add_parser("refresh", help="Append new event_day_pst partitions from delta files")
+    refresh_parser.add_argument("--source", default=None, help="Delta directory or HTTP(S) URL (default: INGEST_SOURCE)")
+    refresh_parser.add_argument("--db", default=None, help="SQLite database path (default: from DATABASE_URL)")
+    refresh_parser.add_argument("--dry-run", action="store_true", help="Only list the days that would be loaded")
+    partition_parser = subparsers.add_parser("partition", help="Split user_days into monthly partitions; seal and compact old months")
+    partition_parser.add_argument("--db", default=None, help="SQLite database path (default: from DATABASE_URL)")
+    partition_parser.add_argument("--compact", action="store_true", help="Rewrite sealed partitions in day order")
+    partition_parser.add_argument("--keep-original", action="store_true",
+                                  help="Keep the unpartitioned table as user_days_unpartitioned")
+    cube_parser = subparsers.add_parser("cube", help="Build the install-cohort × tenure cube of user_days")
+    cube_parser.add_argument("--db", default=None, help="SQLite database path (default: from DATABASE_URL)")
+    cube_parser.add_argument("--force", action="store_true", help="Rebuild the cube if it already exists")
+    segments_parser = subparsers.add_parser("segments", help="Build per-day user bitmaps for fast DAU and segment counts")
+    segments_parser.add_argument("--db", default=None, help="SQLite database path (default: from DATABASE_URL)")
+    segments_parser.add_argument("--force", action="store_true", help="Rebuild the index if it already exists")
+    sketches_parser = subparsers.add_parser("sketches", help="Build daily HyperLogLog sketches for fast distinct-user estimates")
+    sketches_parser.add_argument("--db", default=None, help="SQLite database path (default: from DATABASE_URL)")
+    sketches_parser.add_argument("--force", action="store_true", help="Rebuild the sketches if they already exist")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        import service
+        service.main(args.service_args)
+    elif args.command == "batch":
+        run_batch_command(args)
+    elif args.command == "refresh":
+        run_refresh_command(args)
+    elif args.command == "sample":
+        run_sample_command(args)
+    elif args.command == "partition":
+        run_partition_command(args)
+    elif args.command == "cube":
+        run_cube_command(args)
+    elif args.command == "segments":
+        run_segments_command(args)
+    elif args.command == "sketches":
+        run_sketches_command(args)
+    elif args.command == "synth":
+        import synthetic_data
+        synthetic_data.main(args.synth_args)
+    else:
+        run_app()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,740 @@
+"""
+Compressed bitmap segment index for DAU-style counts over user_days.
+
+"Non-payer DAU on iOS in the last 7 days" or "regular users by platform" are
+counts over intersections of per-day user sets, which SQLite answers by
+scanning and de-duplicating user_days rows. ``build_segments`` gives every
+user a dense ordinal (``segment_users``) and stores, per event day, one
+bitmap of ordinals for each value of ``payer_type``, ``platform``,
+``country`` and ``engagement_7d``, plus one of all users active that day
+(``segment_bitmaps``). Like Roaring's containers, a bitmap is stored as a
+zlib-compressed sorted ordinal array when that is smaller than the packed
+bits, so rare values cost a few bytes a day.
+
+``SegmentIndex.answer`` computes a query from the bitmaps alone when it is a
+single SELECT on user_days made of:
+
+- ``COUNT(DISTINCT user_id)`` (users matching on any day of the range) and
+  ``COUNT(*)`` (matching user-days) select items;
+- WHERE conditions on ``event_day_pst`` AND-ed with any AND/OR/NOT
+  combination of conditions that each read one dimension column (=, IN, LIKE,
+  IS NULL, CASE...). Conditions are evaluated by SQLite over the day list or
+  the dimension's values, and combined with SQL's three-valued logic, so
+  NULLs behave as in the scan;
+- GROUP BY expressions of ``event_day_pst`` or of one dimension column, with
+  ORDER BY (select columns, aliases or positions) and LIMIT.
+
+Bitmaps record which users had a value on a day, not which row had it, so
+``COUNT(*)`` and intersections (AND, NOT, a filter with a dimension GROUP BY,
+or two dimension GROUP BYs) are only answered while user_days has at most one
+row per user and day; unions still are.
+
+Decoded bitmaps are kept in an LRU of ``Config.SEGMENT_CACHE_MB``. The index
+is only used while it covers the newest day; ``ingest.refresh`` re-indexes
+new and restated days in its transaction.
+
+    python run.py segments
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from sql_parser import SQLParseError, closing_paren, parse_sql, split_tokens, sql_literal
+from tracing import span
+
+BASE_TABLE = "user_days"
+DATE_COLUMN = "event_day_pst"
+USER_COLUMN = "user_id"
+DIMENSIONS = ("payer_type", "platform", "country", "engagement_7d")
+USERS_TABLE = "segment_users"
+BITMAP_TABLE = "segment_bitmaps"
+DAYS_TABLE = "segment_days"
+META_TABLE = "segment_meta"
+# segment_bitmaps.dimension of the bitmap of every user active that day
+ALL_USERS = "*"
+
+_CLAUSES = ("FROM", "WHERE", "GROUP", "HAVING", "ORDER", "LIMIT")
+_TYPE_NAME = re.compile(r"[A-Za-z][A-Za-z ]*(\(\s*\d+\s*(,\s*\d+\s*)?\))?$")
+
+QueryFn = Callable[[str], List[Tuple[Any, ...]]]
+
+if hasattr(np, "bitwise_count"):
+    def popcount(bitmaps: np.ndarray) -> np.ndarray:
+        """Set bits of each bitmap (row) of ``bitmaps``."""
+        return np.bitwise_count(bitmaps.view(np.uint64)).sum(axis=-1, dtype=np.int64)
+else:  # numpy < 2.0
+    _BYTE_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(bitmaps: np.ndarray) -> np.ndarray:
+        """Set bits of each bitmap (row) of ``bitmaps``."""
+        return _BYTE_COUNTS[bitmaps].sum(axis=-1, dtype=np.int64)
+
+
+class NotAnswerable(ValueError):
+    """The query cannot be computed from the segment bitmaps."""
+
+
+def bitmap_bytes(users: int) -> int:
+    """Length of a decoded bitmap for ``users`` ordinals (whole 64-bit words)."""
+    return max(8, -(-users // 64) * 8)
+
+
+def encode_bitmap(ordinals: np.ndarray, users: int) -> bytes:
+    """Compressed bitmap of sorted, unique ``ordinals``: an ordinal array or packed bits, whichever is smaller."""
+    size = bitmap_bytes(users)
+    if len(ordinals) * 4 < size:
+        return b"A" + zlib.compress(ordinals.astype("<u4").tobytes())
+    bits = np.zeros(size * 8, dtype=bool)
+    bits[ordinals] = True
+    return b"B" + zlib.compress(np.packbits(bits).tobytes())
+
+
+def decode_bitmap(blob: bytes, users: int) -> np.ndarray:
+    """Packed bits (uint8, ``bitmap_bytes(users)`` long) of an encoded bitmap."""
+    body = zlib.decompress(blob[1:])
+    size = bitmap_bytes(users)
+    if blob[:1] == b"A":
+        bits = np.zeros(size * 8, dtype=bool)
+        bits[np.frombuffer(body, dtype="<u4")] = True
+        return np.packbits(bits)
+    packed = np.zeros(size, dtype=np.uint8)
+    stored = np.frombuffer(body, dtype=np.uint8)
+    packed[:len(stored)] = stored  # written when there were fewer users
+    return packed
+
+
+# -- building -----------------------------------------------------------------------
+
+def segments_exist(conn: sqlite3.Connection) -> bool:
+    return bool(conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (META_TABLE,)
+    ).fetchone())
+
+
+def build_segments(db_path: str, force: bool = False) -> Dict[str, Any]:
+    """Create (or with ``force`` rebuild) the segment index in one transaction; returns its metadata."""
+    conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+    try:
+        if segments_exist(conn) and not force:
+            return segment_meta(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table in (USERS_TABLE, BITMAP_TABLE, DAYS_TABLE, META_TABLE):
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            _create_tables(conn)
+            conn.execute(
+                f"INSERT INTO {USERS_TABLE} (user_id, ordinal) "
+                f"SELECT user_id, ROW_NUMBER() OVER (ORDER BY user_id) - 1 "
+                f"FROM (SELECT DISTINCT {USER_COLUMN} AS user_id FROM {BASE_TABLE})"
+            )
+            conn.execute(f"INSERT INTO {META_TABLE} VALUES (0, NULL, NULL, 1, ?)", (_now(),))
+            days = [row[0] for row in conn.execute(f"SELECT DISTINCT {DATE_COLUMN} FROM {BASE_TABLE} ORDER BY 1")]
+            _index_days(conn, days)
+            conn.execute(f"ANALYZE {BITMAP_TABLE}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return segment_meta(conn)
+    finally:
+        conn.close()
+
+
+def refresh_segments(conn: sqlite3.Connection, days: List[str]):
+    """Re-index ``days`` (new or restated) inside the caller's transaction."""
+    if days and segments_exist(conn):
+        _index_days(conn, sorted(days))
+
+
+def segment_meta(conn: sqlite3.Connection) -> Dict[str, Any]:
+    cursor = conn.execute(f"SELECT * FROM {META_TABLE}")
+    row = cursor.fetchone()
+    meta = dict(zip([d[0] for d in cursor.description], row)) if row else {}
+    meta["bitmaps"], meta["bytes"] = conn.execute(
+        f"SELECT COUNT(*), TOTAL(LENGTH(bitmap)) FROM {BITMAP_TABLE}"
+    ).fetchone()
+    return meta
+
+
+def _create_tables(conn: sqlite3.Connection):
+    conn.execute(f"CREATE TABLE {USERS_TABLE} (user_id INTEGER PRIMARY KEY, ordinal INTEGER NOT NULL UNIQUE)")
+    # value has no declared type so payer_type stays text and engagement_7d an integer
+    conn.execute(
+        f"CREATE TABLE {BITMAP_TABLE} (day TEXT NOT NULL, dimension TEXT NOT NULL, value, "
+        "cardinality INTEGER NOT NULL, bitmap BLOB NOT NULL)"
+    )
+    conn.execute(f"CREATE INDEX idx_{BITMAP_TABLE}_day ON {BITMAP_TABLE} (day, dimension)")
+    conn.execute(f"CREATE TABLE {DAYS_TABLE} (day TEXT PRIMARY KEY, users INTEGER NOT NULL, rows INTEGER NOT NULL)")
+    conn.execute(
+        f"CREATE TABLE {META_TABLE} (users INTEGER, first_day TEXT, last_day TEXT, "
+        "unique_user_days INTEGER, built_at TEXT)"
+    )
+
+
+def _index_days(conn: sqlite3.Connection, days: List[str]):
+    """(Re)write the bitmaps of ``days``, giving users seen for the first time the next ordinals."""
+    known = pd.read_sql_query(f"SELECT user_id, ordinal FROM {USERS_TABLE} ORDER BY ordinal", conn)
+    ordinals = pd.Index(known["user_id"])
+    unique = True
+    for day in days:
+        with span("segment_index.index_day", day=day) as s:
+            df = pd.read_sql_query(
+                f"SELECT {USER_COLUMN}, {', '.join(DIMENSIONS)} FROM {BASE_TABLE} WHERE {DATE_COLUMN} = ?",
+                conn, params=(day,),
+            )
+            new_users = pd.unique(df[USER_COLUMN][ordinals.get_indexer(df[USER_COLUMN]) < 0])
+            if len(new_users):
+                conn.executemany(
+                    f"INSERT INTO {USERS_TABLE} (user_id, ordinal) VALUES (?, ?)",
+                    zip(map(int, new_users), range(len(ordinals), len(ordinals) + len(new_users))),
+                )
+                ordinals = ordinals.append(pd.Index(new_users))
+            df["ordinal"] = ordinals.get_indexer(df[USER_COLUMN])
+            users = len(ordinals)
+
+            conn.execute(f"DELETE FROM {BITMAP_TABLE} WHERE day = ?", (day,))
+            everyone = np.unique(df["ordinal"].to_numpy())
+            rows = [(day, ALL_USERS, None, len(everyone), encode_bitmap(everyone, users))]
+            for dimension in DIMENSIONS:
+                for value, positions in df.groupby(dimension, dropna=False, sort=False).indices.items():
+                    members = np.unique(df["ordinal"].to_numpy()[positions])
+                    rows.append((day, dimension, _value(value), len(members), encode_bitmap(members, users)))
+            conn.executemany(f"INSERT INTO {BITMAP_TABLE} VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute(f"INSERT OR REPLACE INTO {DAYS_TABLE} VALUES (?, ?, ?)", (day, len(everyone), len(df)))
+            unique = unique and len(everyone) == len(df)
+            s.set(rows=len(df), users=len(everyone), new_users=len(new_users), bitmaps=len(rows))
+    conn.execute(
+        f"UPDATE {META_TABLE} SET users = ?, first_day = (SELECT MIN(day) FROM {DAYS_TABLE}), "
+        f"last_day = (SELECT MAX(day) FROM {DAYS_TABLE}), unique_user_days = unique_user_days AND ?",
+        (len(ordinals), int(unique)),
+    )
+
+
+# -- querying -----------------------------------------------------------------------
+
+class SegmentQuery:
+    """A query planned against the segment index."""
+
+    def __init__(self, days: List[str], columns: List[str]):
+        self.days = days
+        # Result column names, in select order
+        self.columns = columns
+        # Filter tree: ("leaf", dimension, true values, false values), ("const", bool or None),
+        # ("and" | "or", [nodes]) or ("not", node); None keeps every user
+        self.filter: Optional[Tuple] = None
+        # GROUP BY items in order: ("day", {day: key}) or ("dimension", name, {value: key})
+        self.groups: List[Tuple] = []
+        # Select items: ("group", index into groups), ("users",) or ("rows",)
+        self.items: List[Tuple] = []
+        # (select index, descending) for ORDER BY, then LIMIT / OFFSET
+        self.order: List[Tuple[int, bool]] = []
+        self.limit: Optional[int] = None
+        self.offset = 0
+
+    @property
+    def dimensions(self) -> Set[str]:
+        names = {group[1] for group in self.groups if group[0] == "dimension"}
+
+        def walk(node):
+            if node is None:
+                return
+            if node[0] == "leaf":
+                names.add(node[1])
+            elif node[0] in ("and", "or"):
+                for child in node[1]:
+                    walk(child)
+            elif node[0] == "not":
+                walk(node[1])
+        walk(self.filter)
+        return names
+
+    @property
+    def intersects(self) -> bool:
+        """Whether the plan intersects bitmaps (AND, NOT, a filter plus a dimension group, or
+        several dimension groups). A user then counts once their rows of a day match between
+        them, even if no single row matches."""
+
+        def unions_only(node) -> bool:
+            if node is None or node[0] in ("leaf", "const"):
+                return True
+            return node[0] == "or" and all(unions_only(child) for child in node[1])
+
+        dimension_groups = sum(1 for group in self.groups if group[0] == "dimension")
+        filtered = self.filter is not None and self.filter[0] != "const"
+        return not unions_only(self.filter) or dimension_groups + filtered > 1
+
+
+class SegmentIndex:
+    """Answers DAU and segment-intersection queries from ``segment_bitmaps``.
+
+    ``query_fn(sql)`` runs a statement and returns rows as tuples. Metadata is
+    cached for ``Config.SCHEMA_CACHE_SECONDS``; the index is only used while
+    it covers the newest day in user_days.
+    """
+
+    def __init__(self, query_fn: QueryFn):
+        self.query_fn = query_fn
+        self._meta: Tuple[float, Optional[Dict[str, Any]]] = (0.0, None)
+        # (day, dimension) -> ({value: row}, packed bits per value), least recently used first
+        self._bitmaps: "OrderedDict[Tuple[str, str], Tuple[Dict[Any, int], np.ndarray]]" = OrderedDict()
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._meta = (0.0, None)
+            self._bitmaps.clear()
+            self._cached_bytes = 0
+
+    def meta(self) -> Optional[Dict[str, Any]]:
+        """Index metadata (users, days, values per dimension) while it is current, otherwise None."""
+        with self._lock:
+            loaded_at, meta = self._meta
+            if time.monotonic() - loaded_at < Config.SCHEMA_CACHE_SECONDS:
+                return meta
+        meta = None
+        try:
+            rows = self.query_fn(
+                f"SELECT users, last_day, unique_user_days FROM {META_TABLE}"
+            ) if self.query_fn(f"SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '{META_TABLE}'") else []
+            if rows and rows[0][1] and rows[0][1] == self._latest_day():
+                values: Dict[str, List[Any]] = {dimension: [] for dimension in DIMENSIONS}
+                for dimension, value in self.query_fn(
+                    f"SELECT DISTINCT dimension, value FROM {BITMAP_TABLE} WHERE dimension != '{ALL_USERS}'"
+                ):
+                    values[dimension].append(_value(value))
+                meta = {
+                    "users": int(rows[0][0]),
+                    "unique_user_days": bool(rows[0][2]),
+                    "days": [row[0] for row in self.query_fn(f"SELECT day FROM {DAYS_TABLE} ORDER BY day")],
+                    "values": values,
+                    # Declared types of user_days, so literals compare with the columns' affinity
+                    "types": dict(self.query_fn(f"SELECT name, type FROM pragma_table_info('{BASE_TABLE}')")),
+                }
+        except Exception:
+            meta = None  # no index
+        with self._lock:
+            if self._meta[1] is not None and meta is not None and self._meta[1]["users"] != meta["users"]:
+                self._bitmaps.clear()  # decoded for fewer users
+                self._cached_bytes = 0
+            self._meta = (time.monotonic(), meta)
+        return meta
+
+    def plan(self, sql: str) -> Optional[SegmentQuery]:
+        """The query as bitmap operations, or None when it has to run on user_days."""
+        meta = self.meta()
+        if meta is None:
+            return None
+        with span("segment_index.plan") as s:
+            try:
+                plan = _Planner(sql, meta, self.query_fn).plan()
+            except (NotAnswerable, SQLParseError) as e:
+                s.set(answerable=False, reason=str(e))
+                return None
+            s.set(answerable=True, days=len(plan.days))
+            return plan
+
+    def answer(self, sql: str) -> Optional[pd.DataFrame]:
+        """Result of ``sql`` computed from the bitmaps, or None when it has to run on user_days."""
+        plan = self.plan(sql)
+        return self.execute(plan) if plan is not None else None
+
+    def execute(self, plan: SegmentQuery) -> pd.DataFrame:
+        meta = self.meta()
+        if meta is None:
+            raise NotAnswerable("segment index is not current")
+        with span("segment_index.execute", days=len(plan.days)) as s:
+            size = bitmap_bytes(meta["users"])
+            bitmaps = self._load(plan.days, [ALL_USERS, *sorted(plan.dimensions)], meta["users"])
+            wants_users = any(item[0] == "users" for item in plan.items)
+            # Per dimension GROUP BY: its keys in SQLite order and each value's key position
+            splits = []
+            for group in plan.groups:
+                if group[0] == "dimension":
+                    keys = sorted({_value(key) for key in group[2].values()}, key=_sort_key)
+                    positions = {key: i for i, key in enumerate(keys)}
+                    splits.append((group[1], keys, {v: positions[_value(k)] for v, k in group[2].items()}))
+            # day GROUP BY key -> [users bitmaps, user-days] per combination of dimension keys
+            cells: Dict[Tuple, List[Any]] = {}
+            for day in plan.days:
+                everyone = bitmaps[(day, ALL_USERS)][1][0]
+                matching = everyone if plan.filter is None else _evaluate(plan.filter, bitmaps, day, everyone)[0]
+                members = matching[None, :]
+                for dimension, keys, key_of in splits:
+                    rows, matrix = bitmaps[(day, dimension)]
+                    by_key = np.zeros((len(keys), size), dtype=np.uint8)
+                    if rows:
+                        positions = np.array([key_of[value] for value in rows])
+                        if len(np.unique(positions)) == len(positions):
+                            by_key[positions] = matrix
+                        else:  # several values share a key (CASE groups)
+                            for position in np.unique(positions):
+                                by_key[position] = np.bitwise_or.reduce(matrix[positions == position], axis=0)
+                    members = (members[:, None, :] & by_key[None, :, :]).reshape(-1, size)
+                day_key = tuple(group[1].get(day) for group in plan.groups if group[0] == "day")
+                cell = cells.get(day_key)
+                if cell is None:
+                    cells[day_key] = [members.copy() if wants_users else None, popcount(members)]
+                else:
+                    if wants_users:
+                        np.bitwise_or(cell[0], members, out=cell[0])
+                    cell[1] += popcount(members)
+
+            shape = [len(keys) for _, keys, _ in splits]
+            results = []
+            for day_key, (users, user_days) in cells.items():
+                distinct = popcount(users) if users is not None else None
+                for combination in np.flatnonzero(user_days):
+                    dimension_key = [keys[i] for (_, keys, _), i in
+                                     zip(splits, np.unravel_index(combination, shape) if shape else ())]
+                    day_parts, dimension_parts = iter(day_key), iter(dimension_key)
+                    key = tuple(next(day_parts) if g[0] == "day" else next(dimension_parts) for g in plan.groups)
+                    results.append((key, int(distinct[combination]) if distinct is not None else 0,
+                                    int(user_days[combination])))
+            if not plan.groups and not results:
+                results.append(((), 0, 0))  # an aggregate without GROUP BY always returns one row
+            results.sort(key=lambda result: tuple(_sort_key(v) for v in result[0]))
+
+            rows_out = []
+            for key, distinct, user_days in results:
+                rows_out.append([key[item[1]] if item[0] == "group" else distinct if item[0] == "users" else user_days
+                                 for item in plan.items])
+            for index, descending in reversed(plan.order):
+                rows_out.sort(key=lambda row: _sort_key(row[index]), reverse=descending)
+            end = None if plan.limit is None or plan.limit < 0 else plan.offset + plan.limit
+            rows_out = rows_out[plan.offset:end]
+            s.set(rows=len(rows_out))
+            return pd.DataFrame(rows_out, columns=plan.columns)
+
+    def _load(self, days: List[str], dimensions: List[str], users: int) -> Dict[Tuple[str, str], Tuple[Dict[Any, int], np.ndarray]]:
+        """Decoded bitmaps of ``days`` × ``dimensions`` as ({value: row}, matrix), from the LRU or the database."""
+        found: Dict[Tuple[str, str], Tuple[Dict[Any, int], np.ndarray]] = {}
+        with self._lock:
+            for key in ((day, dimension) for day in days for dimension in dimensions):
+                if key in self._bitmaps:
+                    self._bitmaps.move_to_end(key)
+                    found[key] = self._bitmaps[key]
+        missing = [(day, dimension) for day in days for dimension in dimensions if (day, dimension) not in found]
+        if not missing:
+            return found
+        with span("segment_index.load", bitmaps=len(missing)):
+            decoded: Dict[Tuple[str, str], Dict[Any, np.ndarray]] = {key: {} for key in missing}
+            missing_days = sorted({day for day, _ in missing})
+            names = ", ".join(sql_literal(dimension) for dimension in dimensions)
+            for start in range(0, len(missing_days), 500):
+                chunk = ", ".join(sql_literal(day) for day in missing_days[start:start + 500])
+                for day, dimension, value, blob in self.query_fn(
+                    f"SELECT day, dimension, value, bitmap FROM {BITMAP_TABLE} "
+                    f"WHERE day IN ({chunk}) AND dimension IN ({names})"
+                ):
+                    if (day, dimension) in decoded:
+                        decoded[(day, dimension)][_value(value)] = decode_bitmap(bytes(blob), users)
+            loaded = {}
+            for key, values in decoded.items():
+                matrix = np.stack(list(values.values())) if values else np.zeros((0, bitmap_bytes(users)), np.uint8)
+                loaded[key] = ({value: i for i, value in enumerate(values)}, matrix)
+        budget = Config.SEGMENT_CACHE_MB * 1024 * 1024
+        with self._lock:
+            for key, stack in loaded.items():
+                if key not in self._bitmaps:
+                    self._bitmaps[key] = stack
+                    self._cached_bytes += stack[1].nbytes
+            while self._cached_bytes > budget and len(self._bitmaps) > 1:
+                _, evicted = self._bitmaps.popitem(last=False)
+                self._cached_bytes -= evicted[1].nbytes
+        found.update(loaded)
+        return found
+
+    def _latest_day(self) -> Optional[str]:
+        if self.query_fn("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'partition_catalog'"):
+            # Partitioned databases know their newest day without scanning the view
+            value = self.query_fn("SELECT MAX(last_day) FROM partition_catalog")[0][0]
+        else:
+            value = self.query_fn(f"SELECT MAX({DATE_COLUMN}) FROM {BASE_TABLE}")[0][0]
+        return str(value)[:10] if value else None
+
+
+def _evaluate(node: Tuple, bitmaps, day: str, everyone: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(true, false) user bitmaps of a filter node on one day; users in neither are NULL (unknown)."""
+    kind = node[0]
+    if kind == "leaf":
+        rows, matrix = bitmaps[(day, node[1])]
+        return (_union(matrix, [rows[v] for v in node[2] if v in rows], everyone),
+                _union(matrix, [rows[v] for v in node[3] if v in rows], everyone))
+    if kind == "const":
+        empty = np.zeros_like(everyone)
+        return (everyone, empty) if node[1] else (empty, everyone) if node[1] is False else (empty, empty)
+    if kind == "not":
+        true, false = _evaluate(node[1], bitmaps, day, everyone)
+        return false, true
+    parts = [_evaluate(child, bitmaps, day, everyone) for child in node[1]]
+    true, false = parts[0]
+    true, false = true.copy(), false.copy()
+    for child_true, child_false in parts[1:]:
+        if kind == "and":
+            np.bitwise_and(true, child_true, out=true)
+            np.bitwise_or(false, child_false, out=false)
+        else:
+            np.bitwise_or(true, child_true, out=true)
+            np.bitwise_and(false, child_false, out=false)
+    return true, false
+
+
+def _union(matrix: np.ndarray, rows: List[int], like: np.ndarray) -> np.ndarray:
+    if not rows:
+        return np.zeros_like(like)
+    return np.bitwise_or.reduce(matrix[rows], axis=0)
+
+
+class _Planner:
+    """Translates one query to a SegmentQuery (raises NotAnswerable)."""
+
+    def __init__(self, sql: str, meta: Dict[str, Any], query_fn: QueryFn):
+        self.sql = sql
+        self.meta = meta
+        self.query_fn = query_fn
+
+    def plan(self) -> SegmentQuery:
+        parsed = parse_sql(self.sql)
+        if len(parsed.statements) != 1 or BASE_TABLE not in parsed.tables:
+            raise NotAnswerable("only single queries on user_days")
+        tokens = self.tokens = parsed.statements[0]
+        if not tokens[0].is_keyword("SELECT") or (len(tokens) > 1 and tokens[1].is_keyword("DISTINCT", "ALL")):
+            raise NotAnswerable("only plain SELECT statements")
+        clauses: Dict[str, int] = {}
+        for i, token in enumerate(tokens):
+            if token.depth == 0 and token.is_keyword(*_CLAUSES, "UNION", "INTERSECT", "EXCEPT", "WINDOW", "OVER"):
+                if token.upper not in _CLAUSES or token.upper in clauses:
+                    raise NotAnswerable(f"{token.upper} is not supported")
+                clauses[token.upper] = i
+        if "FROM" not in clauses or "HAVING" in clauses:
+            raise NotAnswerable("FROM user_days without HAVING is required")
+        bounds = sorted(clauses.values()) + [len(tokens)]
+
+        def clause(name: str, skip: int = 1) -> List[int]:
+            if name not in clauses:
+                return []
+            start = clauses[name]
+            return list(range(start + skip, bounds[bounds.index(start) + 1]))
+
+        source = [tokens[i] for i in clause("FROM")]
+        if not source or source[0].value.lower() != BASE_TABLE or len(source) > 3 or (
+            len(source) > 1 and not all(t.kind == "word" for t in source)
+        ):
+            raise NotAnswerable("only FROM user_days, without joins")
+        if any(tokens[i].value == "." for i in range(len(tokens)) if tokens[i].depth == 0):
+            raise NotAnswerable("qualified columns")
+
+        select = [self._split_alias(item) for item in split_tokens(tokens, list(range(1, clauses["FROM"])), ",")]
+        aliases = {alias.lower(): expr for expr, alias in select if alias}
+        days = self.meta["days"]
+        day_conditions = []
+        filters = []
+        where = clause("WHERE")
+        conjuncts = split_tokens(tokens, where, "AND")
+        if len(split_tokens(tokens, where, "OR")) > 1:
+            # AND binds tighter than OR: day conditions can only restrict the days when AND-ed with the rest
+            if DATE_COLUMN in self._columns(where):
+                raise NotAnswerable("day conditions under a top-level OR")
+            conjuncts = [where]
+        for conjunct in conjuncts:
+            if self._columns(conjunct) == {DATE_COLUMN}:
+                day_conditions.append(self._text(conjunct))
+            else:
+                filters.append(self._filter(conjunct, 0))
+        if day_conditions:
+            days = [day for day, keep in zip(days, self._evaluate(
+                DATE_COLUMN, days, _boolean(" AND ".join(f"({c})" for c in day_conditions))
+            )) if keep]
+
+        plan = SegmentQuery(days, [alias or self._text(expr) for expr, alias in select])
+        if filters:
+            plan.filter = filters[0] if len(filters) == 1 else ("and", filters)
+        group_texts = []
+        for item in split_tokens(tokens, clause("GROUP", 2), ","):
+            expr = self._resolve(item, select, aliases)
+            group_texts.append(_key(tokens, expr))
+            columns = self._columns(expr)
+            if len(columns) != 1:
+                raise NotAnswerable("GROUP BY expressions must read one column")
+            column = columns.pop()
+            if column == DATE_COLUMN:
+                keys = self._evaluate(DATE_COLUMN, self.meta["days"], self._text(expr))
+                plan.groups.append(("day", dict(zip(self.meta["days"], keys))))
+            elif column in DIMENSIONS:
+                values = self.meta["values"][column]
+                plan.groups.append(("dimension", column, dict(zip(values, self._evaluate(column, values, self._text(expr))))))
+            else:
+                raise NotAnswerable(f"cannot group by {column}")
+
+        for expr, _ in select:
+            words = [tokens[i].value.lower() for i in expr]
+            if words == ["count", "(", "distinct", USER_COLUMN, ")"]:
+                plan.items.append(("users",))
+            elif words in (["count", "(", "*", ")"], ["count", "(", "1", ")"], ["count", "(", USER_COLUMN, ")"]):
+                if not self.meta["unique_user_days"]:
+                    raise NotAnswerable("user_days has several rows per user and day")
+                plan.items.append(("rows",))
+            elif _key(tokens, expr) in group_texts:
+                plan.items.append(("group", group_texts.index(_key(tokens, expr))))
+            else:
+                raise NotAnswerable("select items must be GROUP BY expressions, COUNT(*) or COUNT(DISTINCT user_id)")
+        if not any(item[0] != "group" for item in plan.items):
+            raise NotAnswerable("no COUNT in the select list")
+        if ("users",) in plan.items and plan.intersects and not self.meta["unique_user_days"]:
+            # Like COUNT(*), exact only with at most one row per user and day
+            raise NotAnswerable("user_days has several rows per user and day")
+
+        for item in split_tokens(tokens, clause("ORDER", 2), ","):
+            descending = tokens[item[-1]].is_keyword("DESC")
+            if len(item) > 1 and tokens[item[-1]].is_keyword("ASC", "DESC"):
+                item = item[:-1]
+            expr = self._resolve(item, select, aliases)
+            matches = [i for i, (e, _) in enumerate(select) if _key(tokens, e) == _key(tokens, expr)]
+            if not matches:
+                raise NotAnswerable("ORDER BY must name select columns")
+            plan.order.append((matches[0], descending))
+
+        limit = [tokens[i] for i in clause("LIMIT")]
+        shape = [t.value if t.kind != "number" else "n" for t in limit]
+        if shape == ["n"]:
+            plan.limit = int(limit[0].value)
+        elif [v.upper() for v in shape] == ["N", "OFFSET", "N"]:
+            plan.limit, plan.offset = int(limit[0].value), int(limit[2].value)
+        elif shape == ["n", ",", "n"]:
+            plan.offset, plan.limit = int(limit[0].value), int(limit[2].value)
+        elif limit:
+            raise NotAnswerable("LIMIT must be a number")
+        return plan
+
+    def _filter(self, item: List[int], depth: int) -> Tuple:
+        """Filter tree of a boolean expression that reads dimension columns."""
+        tokens = self.tokens
+        for operator in ("OR", "AND"):
+            parts = split_tokens(tokens, item, operator, depth)
+            if len(parts) > 1:
+                return (operator.lower(), [self._filter(part, depth) for part in parts])
+        if tokens[item[0]].is_keyword("NOT") and not (len(item) > 1 and tokens[item[1]].is_keyword("EXISTS")):
+            return ("not", self._filter(item[1:], depth))
+        if tokens[item[0]].value == "(" and closing_paren(tokens, item[0]) == item[-1] \
+                and not tokens[item[1]].is_keyword("SELECT"):
+            return self._filter(item[1:-1], depth + 1)
+        columns = self._columns(item)
+        if not columns:
+            value = self._evaluate(None, [None], _boolean(self._text(item)))[0]
+            return ("const", value)
+        if len(columns) > 1 or not columns <= set(DIMENSIONS):
+            raise NotAnswerable(f"condition on {', '.join(sorted(columns))}")
+        column = columns.pop()
+        values = self.meta["values"][column]
+        results = self._evaluate(column, values, _boolean(self._text(item)))
+        return ("leaf", column,
+                {v for v, r in zip(values, results) if r},
+                {v for v, r in zip(values, results) if r is not None and not r})
+
+    def _columns(self, item: List[int]) -> Set[str]:
+        """Columns an expression reads from user_days (not counting subqueries)."""
+        tokens = self.tokens
+        columns = set()
+        i = item[0] if item else 0
+        while item and i <= item[-1]:
+            token = tokens[i]
+            if token.value == "(" and i + 1 < len(tokens) and tokens[i + 1].is_keyword("SELECT"):
+                i = closing_paren(tokens, i) + 1
+                continue
+            if token.kind == "quoted" or (token.kind == "word" and not token.is_keyword()
+                                          and not (i + 1 < len(tokens) and tokens[i + 1].value == "(")):
+                columns.add(token.value.strip('"`[]').lower())
+            i += 1
+        return columns
+
+    def _evaluate(self, column: Optional[str], values: List[Any], expression: str) -> List[Any]:
+        """``expression`` evaluated by SQLite for each value of ``column``."""
+        if not values:
+            return []
+        rows = ", ".join(f"({i}, {sql_literal(value)})" for i, value in enumerate(values))
+        name = column or "_value"
+        # A VALUES column takes the affinity of its first row: a typed NULL gives it the column's
+        declared = self.meta["types"].get(column) or ""
+        if _TYPE_NAME.match(declared):
+            rows = f"(-1, CAST(NULL AS {declared})), {rows}"
+        try:
+            result = self.query_fn(
+                f"WITH _segment_values(_i, {name}) AS (VALUES {rows}) "
+                f"SELECT _i, ({expression}) FROM _segment_values WHERE _i >= 0"
+            )
+        except Exception:
+            raise NotAnswerable(f"could not evaluate {expression}")
+        out: List[Any] = [None] * len(values)
+        for i, value in result:
+            out[int(i)] = _value(value)
+        return out
+
+    def _resolve(self, item: List[int], select, aliases) -> List[int]:
+        """Select-list expression an alias or position refers to; ``item`` itself otherwise."""
+        if len(item) == 1:
+            token = self.tokens[item[0]]
+            if token.kind == "number" and token.value.isdigit() and 1 <= int(token.value) <= len(select):
+                return select[int(token.value) - 1][0]
+            name = token.value.strip('"`[]').lower()
+            if token.kind in ("word", "quoted") and name in aliases and name not in DIMENSIONS + (DATE_COLUMN,):
+                return aliases[name]
+        return item
+
+    def _split_alias(self, item: List[int]) -> Tuple[List[int], Optional[str]]:
+        tokens = self.tokens
+        last = tokens[item[-1]]
+        if len(item) > 2 and last.kind in ("word", "quoted") and tokens[item[-2]].is_keyword("AS"):
+            return item[:-2], last.value.strip('"`[]')
+        if len(item) > 1 and last.kind in ("word", "quoted") and not last.is_keyword():
+            before = tokens[item[-2]]
+            if before.value == ")" or (before.kind in ("word", "quoted") and not before.is_keyword()):
+                return item[:-1], last.value.strip('"`[]')
+        return item, None
+
+    def _text(self, item: List[int]) -> str:
+        return self.sql[self.tokens[item[0]].start:self.tokens[item[-1]].end]
+
+
+def _boolean(expression: str) -> str:
+    """SQLite's truth value of ``expression``: 1, 0 or NULL."""
+    return f"CASE WHEN ({expression}) THEN 1 WHEN NOT ({expression}) THEN 0 END"
+
+
+def _key(tokens, expr: List[int]) -> str:
+    return "".join(tokens[i].value.lower() for i in expr)
+
+
+def _value(value: Any) -> Any:
+    """Plain Python value of a database value (pandas returns NaN for NULL, numpy scalars)."""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _sort_key(value: Any) -> Tuple:
+    """SQLite's ordering of values: NULL, numbers, text, blobs."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, bytes(value))
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S")
@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+"""
+Headless query service.
+
+Exposes the question-to-result pipeline (pipeline.py) over a small JSON/HTTP
+API built directly on asyncio streams, so other clients can use it and so
+SQL generation and execution can scale independently of the Streamlit UI.
+Blocking work runs in two bounded thread pools: one for database queries and
+one for LLM calls.
+
+Endpoints:
+    GET  /health         (includes single-flight counters, see single_flight.py)
+    GET  /schema
+    POST /generate-sql   {"question", "custom_prompt"?, "schema_prompt"?, "extra_tables"?}
+    POST /explain-sql    {"sql"}
+    POST /execute        {"sql", "max_rows"?}
+    POST /execute-approximate {"sql", "max_rows"?}  (sample-based estimate with confidence bounds)
+    POST /ask            {"question", "custom_prompt"?, "max_rows"?}
+    POST /estimate       {"sql"}  (pre-execution cost estimate)
+    POST /rerun          {"sql", "fingerprint"?, "max_rows"?}  (cached result when available)
+    POST /results        {"columns", "data"}  (keep a client-computed result, e.g. a follow-up turn)
+    POST /insights       {"fingerprint", "question"}  -> NDJSON event stream
+    GET  /export?fingerprint=...&format=csv|json|parquet
+    GET  /metrics        Prometheus text format (per-stage timings, see tracing.py)
+    GET  /models         rolling latency and errors per LLM route (see model_router.py)
+
+Run with ``python service.py`` (or ``python run.py serve``).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import pipeline
+import single_flight
+from config import Config
+from frame_compaction import with_day_strings
+from model_router import get_model_router
+from pipeline import PipelineError
+from tracing import PROMETHEUS_CONTENT_TYPE, annotate, prometheus_text, span
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1 << 20
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+CONTENT_TYPES = {"csv": "text/csv", "json": "application/json", "parquet": "application/octet-stream"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def frame_payload(df, max_rows: Optional[int] = None) -> Dict[str, Any]:
+    """JSON-safe column/row payload for a result DataFrame."""
+    shown = df if max_rows is None else df.head(max_rows)
+    split = json.loads(with_day_strings(shown).to_json(orient="split", date_format="iso", index=False))
+    return {
+        "columns": split["columns"],
+        "data": split["data"],
+        "row_count": int(len(df)),
+        "truncated": len(shown) < len(df),
+    }
+
+
+class QueryService:
+    """Async facade over the pipeline with separate bounded DB and LLM worker pools."""
+
+    def __init__(self, db_workers: Optional[int] = None, llm_workers: Optional[int] = None):
+        self.db_pool = ThreadPoolExecutor(db_workers or Config.SERVICE_DB_WORKERS, thread_name_prefix="service-db")
+        self.llm_pool = ThreadPoolExecutor(llm_workers or Config.SERVICE_LLM_WORKERS, thread_name_prefix="service-llm")
+
+    async def _run(self, pool: ThreadPoolExecutor, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Run in a copy of the request's context so pipeline spans nest under it
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(pool, functools.partial(ctx.run, fn, *args, **kwargs))
+
+    async def generate_sql(self, question: str, custom_prompt: Optional[str] = None, schema_prompt: bool = False,
+                           extra_tables: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+        sql = await self._run(self.llm_pool, pipeline.generate_sql, question, custom_prompt, schema_prompt)
+        # Off the event loop: the catalog check may have to reload the schema
+        await self._run(self.db_pool, pipeline.validate_sql, sql, extra_tables)
+        return {"sql": sql}
+
+    async def explain_sql(self, sql: str) -> Dict[str, Any]:
+        return {"explanation": await self._run(self.llm_pool, pipeline.explain_sql, sql)}
+
+    async def execute(self, sql: str, max_rows: Optional[int] = None) -> Dict[str, Any]:
+        def run():
+            pipeline.validate_sql(sql)
+            df = pipeline.execute_sql(sql)
+            return df, pipeline.store_result(df)
+
+        df, fingerprint = await self._run(self.db_pool, run)
+        return {"sql": sql, "fingerprint": fingerprint, **frame_payload(df, max_rows)}
+
+    async def execute_approximate(self, sql: str, max_rows: Optional[int] = None) -> Dict[str, Any]:
+        def run():
+            pipeline.validate_sql(sql)
+            df, info = pipeline.execute_approximate(sql)
+            return df, (pipeline.store_result(df) if df is not None else None), info
+
+        df, fingerprint, info = await self._run(self.db_pool, run)
+        if df is None:
+            return {"sql": sql, "approximation": info}
+        return {"sql": sql, "fingerprint": fingerprint, "approximation": info, **frame_payload(df, max_rows)}
+
+    async def estimate(self, sql: str) -> Dict[str, Any]:
+        def run():
+            pipeline.validate_sql(sql)
+            return pipeline.estimate_cost(sql)
+
+        return {"estimate": await self._run(self.db_pool, run)}
+
+    async def rerun(self, sql: str, fingerprint: Optional[str] = None, max_rows: Optional[int] = None) -> Dict[str, Any]:
+        def run():
+            df, cached = pipeline.rerun_query(sql, fingerprint)
+            return df, pipeline.store_result(df), cached
+
+        df, fingerprint, cached = await self._run(self.db_pool, run)
+        return {"sql": sql, "fingerprint": fingerprint, "cached": cached, **frame_payload(df, max_rows)}
+
+    async def store(self, columns: List[str], data: List[List[Any]]) -> Dict[str, Any]:
+        def run():
+            return pipeline.store_result(pipeline.clean_result(pd.DataFrame(data, columns=columns)))
+
+        return {"fingerprint": await self._run(self.db_pool, run)}
+
+    async def ask(self, question: str, custom_prompt: Optional[str] = None, max_rows: Optional[int] = None) -> Dict[str, Any]:
+        generated = await self.generate_sql(question, custom_prompt)
+        return await self.execute(generated["sql"], max_rows)
+
+    async def schema(self) -> Dict[str, Any]:
+        return {"tables": await self._run(self.db_pool, pipeline.get_schema)}
+
+    async def export(self, fingerprint: str, fmt: str = "csv") -> bytes:
+        df = await self._run(self.db_pool, pipeline.load_result, fingerprint)
+        if df is None:
+            raise HTTPError(404, f"Unknown or expired result: {fingerprint}")
+        return await self._run(self.db_pool, pipeline.export_result, df, fmt)
+
+    async def stream_insights(self, fingerprint: str, question: str) -> AsyncIterator[Tuple[str, Any]]:
+        """Relay insight events from the (blocking) LLM stream as they are produced."""
+        df = await self._run(self.db_pool, pipeline.load_result, fingerprint)
+        if df is None:
+            raise HTTPError(404, f"Unknown or expired result: {fingerprint}")
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        # Set when the client goes away, so the producer stops asking the LLM for more
+        cancelled = threading.Event()
+
+        def produce():
+            events = pipeline.stream_result_insights(df, question, fingerprint)
+            try:
+                for event in events:
+                    if cancelled.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, event)
+            finally:
+                events.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        future = self.llm_pool.submit(contextvars.copy_context().run, produce)
+        try:
+            while True:
+                event = await queue.get()
+                if event is done:
+                    break
+                yield event
+        finally:
+            cancelled.set()
+            future.cancel()  # not started yet
+
+    def close(self):
+        self.db_pool.shutdown(wait=False)
+        self.llm_pool.shutdown(wait=False)
+
+
+class HTTPServer:
+    """Minimal HTTP/1.1 JSON server (keep-alive, Content-Length bodies, chunked streaming)."""
+
+    def __init__(self, service: QueryService):
+        self.service = service
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # The body cannot be skipped without a valid length, so the connection ends here
+                    await self._send_json(writer, 400, {"error": "Invalid Content-Length header"}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._send_json(writer, 413, {"error": "Request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                with span("service.request", method=method.upper(), path=urlsplit(target).path):
+                    await self._dispatch(method.upper(), target, body, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, target: str, body: bytes, writer, keep_alive: bool):
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise HTTPError(400, "Request body must be a JSON object")
+            route = (method, url.path.rstrip("/") or "/")
+
+            if route == ("GET", "/health"):
+                result = {"status": "ok", "single_flight": single_flight.stats()}
+            elif route == ("GET", "/metrics"):
+                await self._send(writer, 200, prometheus_text().encode("utf-8"), PROMETHEUS_CONTENT_TYPE, keep_alive)
+                return
+            elif route == ("GET", "/models"):
+                result = {"models": get_model_router().dashboard()}
+            elif route == ("GET", "/schema"):
+                result = await self.service.schema()
+            elif route == ("POST", "/generate-sql"):
+                result = await self.service.generate_sql(
+                    _required(payload, "question"), payload.get("custom_prompt"), bool(payload.get("schema_prompt")),
+                    payload.get("extra_tables"),
+                )
+            elif route == ("POST", "/explain-sql"):
+                result = await self.service.explain_sql(_required(payload, "sql"))
+            elif route == ("POST", "/execute"):
+                result = await self.service.execute(_required(payload, "sql"), _max_rows(payload))
+            elif route == ("POST", "/execute-approximate"):
+                result = await self.service.execute_approximate(_required(payload, "sql"), _max_rows(payload))
+            elif route == ("POST", "/estimate"):
+                result = await self.service.estimate(_required(payload, "sql"))
+            elif route == ("POST", "/rerun"):
+                result = await self.service.rerun(
+                    _required(payload, "sql"), payload.get("fingerprint"), _max_rows(payload)
+                )
+            elif route == ("POST", "/results"):
+                result = await self.service.store(_required(payload, "columns"), payload.get("data") or [])
+            elif route == ("POST", "/ask"):
+                result = await self.service.ask(
+                    _required(payload, "question"), payload.get("custom_prompt"), _max_rows(payload)
+                )
+            elif route == ("POST", "/insights"):
+                events = self.service.stream_insights(_required(payload, "fingerprint"), _required(payload, "question"))
+                await self._send_stream(writer, events, keep_alive)
+                return
+            elif route == ("GET", "/export"):
+                fmt = query.get("format", "csv")
+                data = await self.service.export(_required(query, "fingerprint"), fmt)
+                await self._send(writer, 200, data, CONTENT_TYPES.get(fmt, "application/octet-stream"), keep_alive)
+                return
+            else:
+                raise HTTPError(404, f"No route for {method} {url.path}")
+            await self._send_json(writer, 200, result, keep_alive)
+        except HTTPError as e:
+            await self._send_json(writer, e.status, {"error": str(e)}, keep_alive)
+        except (PipelineError, ValueError) as e:
+            await self._send_json(writer, 400, {"error": str(e)}, keep_alive)
+        except ConnectionError:
+            # Client gone, or a stream aborted after its headers: nothing more can be sent
+            raise
+        except Exception as e:
+            logger.exception("Unhandled error for %s %s", method, target)
+            await self._send_json(writer, 500, {"error": str(e)}, keep_alive)
+
+    async def _send(self, writer, status: int, data: bytes, content_type: str, keep_alive: bool):
+        annotate(status=status, bytes=len(data))
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def _send_json(self, writer, status: int, payload: Any, keep_alive: bool = True):
+        data = json.dumps(payload, default=str).encode("utf-8")
+        await self._send(writer, status, data, "application/json", keep_alive)
+
+    async def _send_stream(self, writer, events: AsyncIterator[Tuple[str, Any]], keep_alive: bool):
+        """Write events as NDJSON lines using chunked transfer encoding."""
+        # Resolve the first event before committing to a 200 so lookup errors
+        # (unknown fingerprint) still produce a proper status code.
+        iterator = events.__aiter__()
+        try:
+            first = await iterator.__anext__()
+        except StopAsyncIteration:
+            first = None
+        annotate(status=200, streamed=True)
+        writer.write(
+            (
+                "HTTP/1.1 200 OK\r\n"
+                "Content-Type: application/x-ndjson\r\n"
+                "Transfer-Encoding: chunked\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+            ).encode("latin-1")
+        )
+
+        async def write_event(event):
+            line = json.dumps({"event": event[0], "data": event[1]}, default=str).encode("utf-8") + b"\n"
+            writer.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            await writer.drain()
+
+        try:
+            if first is not None:
+                await write_event(first)
+                async for event in iterator:
+                    await write_event(event)
+        except ConnectionError:
+            # Client gone: close the events so their producer stops
+            await iterator.aclose()
+            raise
+        except Exception as e:
+            # The 200 is already sent: end the body with an error event, then drop the connection
+            logger.exception("Insight stream failed")
+            await write_event(("error", str(e)))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+            raise ConnectionAbortedError("stream aborted") from e
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+def _required(payload: Dict[str, Any], key: str) -> Any:
+    value = payload.get(key)
+    if value in (None, ""):
+        raise HTTPError(400, f"Missing required field: {key}")
+    return value
+
+
+def _max_rows(payload: Dict[str, Any]) -> Optional[int]:
+    value = payload.get("max_rows")
+    if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 0):
+        raise HTTPError(400, "max_rows must be a non-negative integer")
+    return value
+
+
+async def serve(host: Optional[str] = None, port: Optional[int] = None, service: Optional[QueryService] = None,
+                ready: Optional[threading.Event] = None):
+    """Run the HTTP server until cancelled."""
+    service = service or QueryService()
+    http = HTTPServer(service)
+    server = await asyncio.start_server(http.handle, host or Config.SERVICE_HOST, port or Config.SERVICE_PORT)
+    sockets = ", ".join(str(s.getsockname()) for s in server.sockets)
+    logger.info("Query service listening on %s", sockets)
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless Casino Analytics query service")
+    parser.add_argument("--host", default=Config.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVICE_PORT)
+    parser.add_argument("--db-workers", type=int, default=Config.SERVICE_DB_WORKERS)
+    parser.add_argument("--llm-workers", type=int, default=Config.SERVICE_LLM_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    service = QueryService(args.db_workers, args.llm_workers)
+    try:
+        asyncio.run(serve(args.host, args.port, service))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Clients used by the Streamlit apps to talk to the query pipeline.
+
+``get_query_client()`` returns an HTTP client for the headless service when
+``QUERY_SERVICE_URL`` is configured, otherwise an in-process client that calls
+pipeline.py directly. Both expose the same methods and raise
+``PipelineError`` on failure, so the UI code does not care which one it has.
+"""
+
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+import pipeline
+from config import Config
+from cost_estimator import describe as describe_cost
+from frame_compaction import with_day_strings
+from model_router import get_model_router
+from pipeline import PipelineError
+from tracing import span
+
+
+class LocalQueryClient:
+    """Runs the pipeline in the calling process."""
+
+    def generate_sql(self, question: str, custom_prompt: Optional[str] = None, schema_prompt: bool = False,
+                     extra_tables: Optional[Dict[str, List[str]]] = None) -> str:
+        sql = pipeline.generate_sql(question, custom_prompt, schema_prompt)
+        pipeline.validate_sql(sql, extra_tables)
+        return sql
+
+    def explain_sql(self, sql: str) -> str:
+        return pipeline.explain_sql(sql)
+
+    def execute(self, sql: str) -> Tuple[pd.DataFrame, str]:
+        pipeline.validate_sql(sql)
+        df = pipeline.execute_sql(sql)
+        return df, pipeline.store_result(df)
+
+    def store_result(self, df: pd.DataFrame) -> str:
+        """Keep a result computed elsewhere (e.g. a follow-up turn); returns its fingerprint."""
+        return pipeline.store_result(df)
+
+    def execute_approximate(self, sql: str) -> Tuple[Optional[pd.DataFrame], Optional[str], Dict[str, Any]]:
+        """Sample-based estimate; ``(None, None, info)`` when the query has to run exactly."""
+        pipeline.validate_sql(sql)
+        df, info = pipeline.execute_approximate(sql)
+        return df, (pipeline.store_result(df) if df is not None else None), info
+
+    def estimate(self, sql: str) -> Optional[Dict[str, Any]]:
+        return pipeline.estimate_cost(sql)
+
+    def rerun(self, sql: str, fingerprint: Optional[str] = None) -> Tuple[pd.DataFrame, str, bool]:
+        df, cached = pipeline.rerun_query(sql, fingerprint)
+        return df, pipeline.store_result(df), cached
+
+    def schema(self) -> Dict[str, List[Dict[str, Any]]]:
+        return pipeline.get_schema()
+
+    def models(self) -> List[Dict[str, Any]]:
+        return get_model_router().dashboard()
+
+    def stream_insights(self, df: pd.DataFrame, question: str, fingerprint: str) -> Iterator[Tuple[str, Any]]:
+        return pipeline.stream_result_insights(df, question, fingerprint)
+
+    def export(self, df: pd.DataFrame, fingerprint: str, fmt: str = "csv") -> bytes:
+        return pipeline.export_result(df, fmt)
+
+
+class QueryServiceClient:
+    """Thin HTTP client for service.py."""
+
+    def __init__(self, base_url: str, timeout: float = 300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _open(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=data,
+            method=method,
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            return urllib.request.urlopen(req, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode("utf-8")).get("error")
+            except Exception:
+                message = None
+            raise PipelineError(message or f"Query service error: HTTP {e.code}")
+        except urllib.error.URLError as e:
+            raise PipelineError(f"Query service unreachable at {self.base_url}: {e.reason}")
+
+    def _json(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        with span("client.request", method=method, path=path):
+            with self._open(method, path, payload) as response:
+                return json.loads(response.read().decode("utf-8"))
+
+    def generate_sql(self, question: str, custom_prompt: Optional[str] = None, schema_prompt: bool = False,
+                     extra_tables: Optional[Dict[str, List[str]]] = None) -> str:
+        payload = {"question": question, "custom_prompt": custom_prompt, "schema_prompt": schema_prompt,
+                   "extra_tables": extra_tables}
+        return self._json("POST", "/generate-sql", payload)["sql"]
+
+    def explain_sql(self, sql: str) -> str:
+        return self._json("POST", "/explain-sql", {"sql": sql})["explanation"]
+
+    def execute(self, sql: str) -> Tuple[pd.DataFrame, str]:
+        result = self._json("POST", "/execute", {"sql": sql})
+        df = pipeline.clean_result(pd.DataFrame(result["data"], columns=result["columns"]))
+        return df, result["fingerprint"]
+
+    def store_result(self, df: pd.DataFrame) -> str:
+        split = json.loads(with_day_strings(df).to_json(orient="split", date_format="iso", index=False))
+        return self._json("POST", "/results", {"columns": split["columns"], "data": split["data"]})["fingerprint"]
+
+    def execute_approximate(self, sql: str) -> Tuple[Optional[pd.DataFrame], Optional[str], Dict[str, Any]]:
+        result = self._json("POST", "/execute-approximate", {"sql": sql})
+        if "data" not in result:
+            return None, None, result["approximation"]
+        df = pipeline.clean_result(pd.DataFrame(result["data"], columns=result["columns"]))
+        return df, result["fingerprint"], result["approximation"]
+
+    def estimate(self, sql: str) -> Optional[Dict[str, Any]]:
+        return self._json("POST", "/estimate", {"sql": sql})["estimate"]
+
+    def rerun(self, sql: str, fingerprint: Optional[str] = None) -> Tuple[pd.DataFrame, str, bool]:
+        result = self._json("POST", "/rerun", {"sql": sql, "fingerprint": fingerprint})
+        df = pipeline.clean_result(pd.DataFrame(result["data"], columns=result["columns"]))
+        return df, result["fingerprint"], result["cached"]
+
+    def schema(self) -> Dict[str, List[Dict[str, Any]]]:
+        return self._json("GET", "/schema")["tables"]
+
+    def models(self) -> List[Dict[str, Any]]:
+        return self._json("GET", "/models")["models"]
+
+    def stream_insights(self, df: pd.DataFrame, question: str, fingerprint: str) -> Iterator[Tuple[str, Any]]:
+        try:
+            with self._open("POST", "/insights", {"fingerprint": fingerprint, "question": question}) as response:
+                for line in response:
+                    if line.strip():
+                        event = json.loads(line)
+                        yield event["event"], event["data"]
+        except PipelineError as e:
+            yield "error", str(e)
+
+    def export(self, df: pd.DataFrame, fingerprint: str, fmt: str = "csv") -> bytes:
+        query = urllib.parse.urlencode({"fingerprint": fingerprint, "format": fmt})
+        with span("client.request", method="GET", path="/export"):
+            with self._open("GET", f"/export?{query}") as response:
+                return response.read()
+
+
+def unattended_sql(client, sql: str) -> str:
+    """The cost guardrail (``Config.COST_POLICY``) for queries nobody is there to confirm
+    (follow-ups against user_days, multi-question fan-out).
+
+    Returns the SQL to run, narrowed to recent days under ``narrow``; raises
+    ``PipelineError`` for a query that would need confirmation.
+    """
+    if Config.COST_POLICY == "off":
+        return sql
+    try:
+        with span("client.estimate_cost"):
+            estimate = client.estimate(sql)
+    except PipelineError:
+        estimate = None
+    if not estimate or estimate["level"] != "confirm" or Config.COST_POLICY == "warn":
+        return sql
+    if Config.COST_POLICY == "narrow" and estimate.get("narrowed_sql"):
+        return estimate["narrowed_sql"]
+    raise PipelineError(f"Expensive query not run: {describe_cost(estimate)}. Ask it on its own to confirm it.")
+
+
+def get_query_client():
+    """Service client if QUERY_SERVICE_URL is configured, otherwise in-process."""
+    if Config.QUERY_SERVICE_URL:
+        return QueryServiceClient(Config.QUERY_SERVICE_URL)
+    return LocalQueryClient()
@@ -1,17 +1,36 @@
 import streamlit as st
 from datetime import datetime
 import os
+import time
 import json
-import ast
-import urllib.request
-import urllib.parse
 import pandas as pd
-import plotly.express as px
-from dotenv import load_dotenv
-from database import DatabaseManager
+from cache import get_cache, make_key, result_fingerprint
+from pipeline import PipelineError
+from render_cache import (
+    RenderCache,
+    build_chart_figure,
+    build_trend_series,
+    column_profile,
+    prepare_plot_frame,
+)
+from service_client import get_query_client
+from config import Config, load_env
+from conversation import Conversation
+from cost_estimator import describe as describe_cost
+from frame_compaction import memory_report
+from history_store import get_history_store
+from lazy import lazy_import
+from multi_question import run_questions, split_questions, timing_summary
+from tracing import span, span_rows, start_metrics_server
+
+pio = lazy_import("plotly.io")
 
 # Load environment variables
-load_dotenv()
+load_env()
+
+# Optional standalone Prometheus endpoint for this process's stage timings
+if Config.METRICS_PORT:
+    start_metrics_server(Config.METRICS_PORT)
 
 # Authentication configuration
 LOGIN_USERNAME = os.getenv("LOGIN_USERNAME", "analytics_user")
@@ -224,16 +243,27 @@ st.markdown(
 )
 
 # Initialize session state
-if 'query_history' not in st.session_state:
-    st.session_state.query_history = []
-if 'db_manager' not in st.session_state:
-    st.session_state.db_manager = DatabaseManager()
+if 'query_client' not in st.session_state:
+    st.session_state.query_client = get_query_client()
 if 'last_result_df' not in st.session_state:
     st.session_state.last_result_df = None
+if 'last_result_fingerprint' not in st.session_state:
+    st.session_state.last_result_fingerprint = None
+if 'last_insights' not in st.session_state:
+    st.session_state.last_insights = None
+if 'render_cache' not in st.session_state:
+    st.session_state.render_cache = RenderCache()
 if 'last_user_query' not in st.session_state:
     st.session_state.last_user_query = ""
 if 'user_query_input' not in st.session_state:
     st.session_state.user_query_input = ""
+if 'multi_results' not in st.session_state:
+    st.session_state.multi_results = None
+if 'approximations' not in st.session_state:
+    # Result fingerprint -> sample info for results that are fast estimates
+    st.session_state.approximations = {}
+if 'conversation' not in st.session_state:
+    st.session_state.conversation = Conversation(st.session_state.query_client)
 
 # Optional: column definitions for known tables (used in debug view)
 COLUMN_DEFINITIONS = {
@@ -306,6 +336,7 @@ def login() -> bool:
     if sign_in_clicked:
         if username == LOGIN_USERNAME and password == LOGIN_PASSWORD:
             st.session_state["authenticated"] = True
+            st.session_state["user"] = username
             st.rerun()
         else:
             st.error("Invalid username or password")
@@ -313,262 +344,49 @@ def login() -> bool:
     return False
 
 def generate_sql_query(user_query: str, custom_prompt: str = None) -> str:
-    """Generate SQL query from natural language using OpenAI.
+    """Generate SQL query from natural language via the query client.
 
-    The OpenAI API key is read from the OPENAI_API_KEY environment variable only
-    and is never exposed in the UI.
+    The OpenAI API key is read from the OPENAI_API_KEY environment variable
+    (by the service or the in-process pipeline) and is never exposed in the UI.
+    The GSN Casino prompt lives in ``sql_generator.CASINO_SQL_PROMPT``.
     """
     try:
-        # Read API key from environment
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            st.error("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
-            return None
-
-        # Use custom prompt or GSN Casino specific prompt
-        if custom_prompt:
-            prompt = custom_prompt.replace("{user_query}", user_query)
-        else:
-            prompt = f"""
-You are a GSN Casino SQL expert. Generate optimized SQL queries for GSN Casino data stored in a local SQLite database.
-
-RULES:
-- Always reference the table: user_days
-- Always filter by event_day_pst to limit scanned data when a time range is implied
-- Add LIMIT 100 only at the final display step, not during intermediate aggregations
-- Use clear, standard SQL that is compatible with SQLite (no BigQuery-specific functions like DATE_SUB or INTERVAL)
-- Always treat NULL payer_type as the string 'Non-Payer' by using COALESCE(payer_type, 'Non-Payer') in SELECT and GROUP BY when segmenting by payer type for **active payer** status.
-- Interpreting payer status:
-  * Active payer vs active non-payer (last 12 weeks) is determined by payer_type (NULL => not an active payer).
-  * **Lifetime non-payers** are users with bookings_lifetime = 0 (they have never paid).
-  * **Lifetime payers** are users with bookings_lifetime > 0 (they have paid at least once).
-  * Whenever the user asks about "lifetime" payer or non-payer metrics, you MUST use bookings_lifetime (0 vs > 0) instead of payer_type filters.
-- Provide ONLY the SQL query, no explanations or commentary
-
-TABLE SCHEMA (user_days):
-- event_day_pst: Snapshot date.
-- user_id: Unique user id.
-- bookings: User's revenue for that day.
-- transactions: Number of transactions.
-- bookings_lifetime: Lifetime revenue (LTV) or lifetime value of a user up to event_day_pst.
-- balance_coins_begin: Tokens/coins balance when the user logged in.
-- balance_coins_end: Tokens/coins balance at the end of the day.
-- install_first_date_pst: Date of install. Can be used to calculate tenure. Users older than 365 days are called older players.
-- country: Country of the user (demographic information).
-- payer_type: Type of payer (payer_type, DolphinLapse, WhaleLapse, BassLapse, Whale, Bass, MinnowLapse, Dolphin, Blue, Minnow, OrcaLapse, BlueLapse, NULL for Non-Payer).
-- slot_spins: Number of spins in a day.
-- slot_coins_used: Tokens/coins used in a day.
-- slot_coins_gained: Tokens/coins gained in a day.
-- platform: ios, android, amazon are mobile platforms; others are web/webstore.
-- engagement_7d: Count of days the user was active in the last 7 days including today (7 = regular users).
-
-PAYER GROUPS:
-- High Payer: Blue, BlueLapse, Orca, OrcaLapse, Whale, WhaleLapse
-- Low Payer: Bass, BassLapse, Dolphin, DolphinLapse, Minnow, MinnowLapse
-- Non-Payer: NULL (always surfaced as the label 'Non-Payer' using COALESCE)
-
-User Request: {user_query}
-
-SQL Query:
-"""
-        
-        # Prepare HTTP request to OpenAI Chat Completions API
-        headers = {
-            "Authorization": f"Bearer {api_key.strip()}",
-            "Content-Type": "application/json",
-        }
-
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a GSN Casino BigQuery SQL expert. Generate only optimized BigQuery SQL queries for GSN Casino data without any explanations or markdown formatting.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            "max_tokens": 1000,
-            "temperature": 0.1,
-        }
-
-        req = urllib.request.Request(
-            "https://api.openai.com/v1/chat/completions",
-            data=json.dumps(data).encode(),
-            headers=headers,
-        )
-
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            sql_query = result["choices"][0]["message"]["content"].strip()
-        
-        # Clean up the response (remove any markdown formatting)
-        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
-        
-        return sql_query
-        
-    except Exception as e:
-        st.error(f"SQL generation failed: {str(e)}")
+        return st.session_state.query_client.generate_sql(user_query, custom_prompt)
+    except PipelineError as e:
+        st.error(str(e))
         return None
 
-def generate_result_insights(df, user_query: str):
-    """Generate insights and chart specifications for the query results.
 
-    Returns a Python dict with at least:
-    {
-        "insights": ["..."],
-        "charts": [
-            {"type": "bar", "x": "Payer_type", "y": "total_revenue", "title": "..."},
-            {"type": "pie", "names": "Payer_type", "values": "total_revenue", "title": "..."},
-            ...
-        ]
-    }
+def cached_chart_figure(plot_df: pd.DataFrame, chart: dict, fingerprint: str):
+    """Return the figure for a chart spec.
 
-    If the model does not return valid JSON, a fallback dict with a single
-    free-form insight string is returned.
+    Figures are memoised per session (no work at all on reruns) and their
+    serialized JSON is shared through the disk cache across sessions.
     """
-    try:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            return "OpenAI API key not configured. Cannot generate insights."
-
-        sample_csv = df.head(50).to_csv(index=False)
-        prompt = f"""
-You are a highly experienced senior data analyst.
-
-IMPORTANT RUNTIME CONTEXT
-- You are used strictly via an API that sends and receives **text only**.
-- You CANNOT return actual charts, images, or other media.
-- Instead, you must describe analytics as:
-  1) Quantitative insight sentences, and
-  2) A machine-readable chart specification that another tool will
-     use to render visualizations.
-
-INPUT YOU RECEIVE
-- The user's natural-language question about a dataset
-- A small CSV sample of the query results
-
-WHAT YOU MUST RETURN
-Return a single **JSON object only** (no extra text) with these
-top-level keys:
-
-{{
-  "insights": [
-    "string insight 1",
-    "string insight 2"
-  ],
-  "charts": [
-    {{
-      "type": "bar" | "pie" | "line" | "histogram",
-      "x": "column_name (for bar/line) or null",
-      "y": "metric_column (for bar/line) or null",
-      "names": "column_name (for pie) or null",
-      "values": "metric_column (for pie) or null",
-      "title": "Human readable chart title"
-    }},
-    ...
-  ]
-}}
-
-Rules for INSIGHTS (text part):
-- Always be quantitative (shares, rankings, concentration, peaks/lows, etc.).
-- 4–6 short bullet-style sentences.
-- Each insight should mention numbers or percentages when possible.
-- Keep each insight under 160 characters.
-- Do NOT restate the table in a generic way (e.g., "Blue is the highest").
-
-Rules for CHART SPECS (for downstream visualization tools):
-- You are NOT drawing the charts yourself; you are specifying how
-  another system should draw them.
-- For categorical totals (e.g., payer-type revenue), output **two charts**:
-  1) Bar chart with type="bar", x = category column, y = metric column.
-  2) Pie chart with type="pie", names = category column, values = metric column.
-- For time-series data, use type="line" with x = date column, y = metric column.
-- For distributions of a single numeric metric, use type="histogram" with x = metric column.
-- Use column names exactly as they appear in the CSV sample.
-- If a field (x, y, names, values) is not relevant to a chart type,
-  set it to null or omit it.
-
-OUTPUT FORMAT REQUIREMENTS
-- Return ONLY the JSON object described above.
-- Do NOT include markdown, explanations, natural-language text, or
-  any content outside of the JSON.
-
-User question:
-{user_query}
-
-Sample rows from the query results in CSV format:
-{sample_csv}
-"""
-
-        # Prepare HTTP request to OpenAI Chat Completions API
-        headers = {
-            "Authorization": f"Bearer {api_key.strip()}",
-            "Content-Type": "application/json",
-        }
-
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a senior data analyst that returns ONLY valid JSON following the requested schema. The entire response must fit comfortably within 600 tokens.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            "max_tokens": 600,
-            "temperature": 0.3,
-        }
-
-        req = urllib.request.Request(
-            "https://api.openai.com/v1/chat/completions",
-            data=json.dumps(data).encode(),
-            headers=headers,
-        )
-
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode())
-            raw = result["choices"][0]["message"]["content"].strip()
-
-        # Try to extract a clean JSON object even if the model wrapped it
-        # in markdown fences or extra explanation text.
-        cleaned = raw
-
-        # If there are markdown code fences, take the content inside the first pair
-        if "```" in cleaned:
-            parts = cleaned.split("```")
-            # Heuristic: pick the largest chunk that looks like JSON
-            json_like_chunks = [p for p in parts if "{" in p and "}" in p]
-            if json_like_chunks:
-                cleaned = max(json_like_chunks, key=len).strip()
-
-        # Trim to the outermost JSON object if there is extra text
-        start = cleaned.find("{")
-        end = cleaned.rfind("}")
-        if start != -1 and end != -1 and end > start:
-            cleaned = cleaned[start : end + 1]
-
-        # Try to parse the cleaned response as JSON, with a Python-literal
-        # fallback if the model used single quotes or minor JSON mistakes.
-        try:
-            parsed = json.loads(cleaned)
-        except Exception:
-            try:
-                parsed = ast.literal_eval(cleaned)
-            except Exception:
-                parsed = None
-
-        if isinstance(parsed, dict):
-            if "insights" not in parsed:
-                parsed["insights"] = []
-            if "charts" not in parsed:
-                parsed["charts"] = []
-            return parsed
-        else:
-            # Fallback: treat the whole text as a single insight string
-            return {"insights": [raw], "charts": []}
+    def build():
+        cache = get_cache()
+        key = make_key("figure", fingerprint, chart)
+        fig_json = cache.get(key)
+        if fig_json is not None:
+            return pio.from_json(fig_json)
+        fig = build_chart_figure(plot_df, chart)
+        if fig is not None:
+            cache.set(key, fig.to_json())
+        return fig
+
+    spec_key = ("figure", json.dumps(chart, sort_keys=True, default=str))
+    return st.session_state.render_cache.get(fingerprint, spec_key, build)
+
+
+def render_trend(result_df: pd.DataFrame, fingerprint: str):
+    """Time-series visualization (event_day_pst + first numeric metric), memoised per result."""
+    trend = st.session_state.render_cache.get(
+        fingerprint, "trend", lambda: build_trend_series(result_df)
+    )
+    if trend is not None:
+        st.subheader("📈 Trend over time")
+        st.line_chart(trend)
 
-    except Exception as e:
-        return f"Insight generation failed: {str(e)}"
 
 def _set_query_from_example():
     """Update the main query input when a preset example is chosen."""
@@ -577,11 +395,301 @@ def _set_query_from_example():
         st.session_state.user_query_input = selected
 
 
-def main():
-    # Require authentication before showing the main UI
-    if not login():
+def check_cost(user_query: str, sql_query: str):
+    """Cost guardrail before execution (``Config.COST_POLICY``).
+
+    Returns the SQL to run now (possibly narrowed to recent days), or None
+    when the query waits for confirmation in ``render_pending_query``.
+    """
+    st.session_state.pop("pending_query", None)
+    if Config.COST_POLICY == "off":
+        return sql_query
+    try:
+        with span("ui.estimate_cost"):
+            estimate = st.session_state.query_client.estimate(sql_query)
+    except PipelineError:
+        estimate = None
+    if not estimate or estimate["level"] == "ok":
+        return sql_query
+
+    summary = describe_cost(estimate)
+    if estimate["level"] == "warn" or Config.COST_POLICY == "warn":
+        st.warning(f"⚠️ Expensive query: {summary}")
+        return sql_query
+    if Config.COST_POLICY == "narrow" and estimate.get("narrowed_sql"):
+        st.info(f"⚠️ {summary}. Restricted to the last {estimate['narrowed_days']} days of data:")
+        st.code(estimate["narrowed_sql"], language="sql")
+        return estimate["narrowed_sql"]
+    st.session_state.pending_query = {"question": user_query, "sql": sql_query, "estimate": estimate}
+    return None
+
+
+def run_pending_query(narrow: bool):
+    """Button callback: run the query held back by the cost guardrail."""
+    pending = st.session_state.pop("pending_query", None)
+    if not pending:
+        return
+    sql_query = pending["estimate"]["narrowed_sql"] if narrow else pending["sql"]
+    try:
+        with span("ui.execute") as execute_span:
+            result_df, fingerprint = st.session_state.query_client.execute(sql_query)
+    except PipelineError as e:
+        st.session_state.notice = ("error", str(e))
+        return
+    st.session_state.last_result_df = result_df
+    st.session_state.last_result_fingerprint = fingerprint
+    st.session_state.last_user_query = pending["question"]
+    st.session_state.notice = ("info", f"Query executed in {execute_span.duration_ms / 1000:.1f} s.")
+    get_history_store().add(
+        current_user(),
+        pending["question"],
+        sql_query,
+        fingerprint=fingerprint,
+        row_count=len(result_df),
+        timings={"execute_ms": execute_span.duration_ms, "total_ms": execute_span.duration_ms},
+        source="simple_app",
+    )
+
+
+def render_pending_query():
+    """Confirmation panel for a query over the cost threshold."""
+    pending = st.session_state.get("pending_query")
+    if not pending:
+        return
+    estimate = pending["estimate"]
+    st.warning(f"⚠️ This query looks expensive: {describe_cost(estimate)}. Run it anyway?")
+    run_col, narrow_col, cancel_col = st.columns(3)
+    with run_col:
+        st.button("Run anyway", on_click=run_pending_query, args=(False,), use_container_width=True)
+    with narrow_col:
+        if estimate.get("narrowed_sql"):
+            st.button(
+                f"Last {estimate['narrowed_days']} days only (~{estimate['narrowed_rows_scanned']:,} rows)",
+                on_click=run_pending_query,
+                args=(True,),
+                use_container_width=True,
+            )
+    with cancel_col:
+        if st.button("Cancel", use_container_width=True):
+            st.session_state.pop("pending_query", None)
+            st.rerun()
+
+
+def run_follow_up(user_query: str):
+    """Follow-up mode: answer from the previous result when possible (see conversation.py)."""
+    conversation = st.session_state.conversation
+    with st.spinner("Generating SQL query..."):
+        try:
+            with span("ui.follow_up") as follow_up_span:
+                result_df, turn = conversation.ask(user_query)
+        except PipelineError as e:
+            st.error(str(e))
+            return
+
+    st.subheader("✨ Generated SQL Query")
+    st.code(turn["sql"], language="sql")
+    if turn["source"] == "prev_result":
+        st.caption(f"⚡ Answered from the previous result in {turn['ms']:.0f} ms (no table scan).")
+    else:
+        st.caption(f"Executed against user_days in {turn['ms']:.0f} ms.")
+
+    if result_df.empty:
+        st.info("Query executed but returned no rows.")
+    else:
+        st.session_state.last_result_df = result_df
+        st.session_state.last_result_fingerprint = turn["fingerprint"]
+        st.session_state.last_user_query = user_query
+
+    get_history_store().add(
+        current_user(),
+        user_query,
+        turn["replay_sql"],
+        fingerprint=turn["fingerprint"],
+        row_count=turn["rows"],
+        timings={"total_ms": follow_up_span.duration_ms},
+        source="simple_app:follow_up",
+    )
+
+
+def render_multi_panel(result: dict):
+    """One question's panel in multi-question mode."""
+    st.markdown(f"**{result['index'] + 1}. {result['question']}**")
+    if result["error"]:
+        st.error(result["error"])
+        return
+    with st.expander("SQL", expanded=False):
+        st.code(result["sql"], language="sql")
+    df = result["df"]
+    if df.empty:
+        st.info("Query executed but returned no rows.")
+    else:
+        with span("render.dataframe", rows=len(df)):
+            st.dataframe(df, use_container_width=True, hide_index=True)
+    st.caption(
+        f"{len(df):,} rows · generate {result['generate_ms'] or 0:.0f} ms · "
+        f"execute {result['execute_ms'] or 0:.0f} ms · total {result['total_ms']:.0f} ms"
+    )
+
+
+def render_multi_summary(results: list, summary: dict):
+    st.caption(
+        f"⏱️ {summary['succeeded']}/{summary['questions']} questions answered in "
+        f"{summary['wall_ms'] / 1000:.1f} s wall clock (vs {summary['serial_ms'] / 1000:.1f} s one by one, "
+        f"{summary['speedup'] or 0:.1f}x)"
+    )
+    with st.expander("Timing per question", expanded=False):
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "question": r["question"],
+                    "status": "error" if r["error"] else "ok",
+                    "rows": None if r["df"] is None else len(r["df"]),
+                    "generate_ms": r["generate_ms"],
+                    "execute_ms": r["execute_ms"],
+                    "total_ms": r["total_ms"],
+                }
+                for r in results
+            ]),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+
+def run_multi_questions(text: str):
+    """Multi-question mode: generate and execute all questions concurrently, rendering each as it finishes."""
+    questions, skipped = split_questions(text)
+    st.markdown("---")
+    st.subheader(f"🧮 {len(questions)} Questions")
+    if skipped:
+        st.warning(
+            f"Only the first {len(questions)} questions are run at once; skipped {len(skipped)}: "
+            + "; ".join(skipped)
+        )
+    summary_slot = st.empty()
+    # Panels in input order, filled in completion order
+    panels = [st.container() for _ in questions]
+    results = []
+    started = time.perf_counter()
+    with span("ui.multi_question", questions=len(questions)):
+        for result in run_questions(st.session_state.query_client, questions):
+            results.append(result)
+            with panels[result["index"]]:
+                render_multi_panel(result)
+            summary_slot.caption(f"{len(results)}/{len(questions)} done…")
+            if not result["error"]:
+                get_history_store().add(
+                    current_user(),
+                    result["question"],
+                    result["sql"],
+                    fingerprint=result["fingerprint"],
+                    row_count=len(result["df"]),
+                    timings={k: result[k] for k in ("generate_ms", "execute_ms", "total_ms")},
+                    source="simple_app:multi",
+                )
+    results.sort(key=lambda r: r["index"])
+    summary = timing_summary(results, (time.perf_counter() - started) * 1000)
+    with summary_slot.container():
+        render_multi_summary(results, summary)
+    st.session_state.multi_results = {"results": results, "summary": summary}
+
+
+def render_multi_results():
+    """Results of the last multi-question run, shown again on later reruns."""
+    stored = st.session_state.multi_results
+    if not stored:
         return
+    st.markdown("---")
+    st.subheader(f"🧮 {len(stored['results'])} Questions")
+    render_multi_summary(stored["results"], stored["summary"])
+    for result in stored["results"]:
+        render_multi_panel(result)
+
+
+def current_user() -> str:
+    """History owner for this session (the signed-in username)."""
+    return st.session_state.get("user") or LOGIN_USERNAME
+
+
+def rerun_from_history(entry: dict):
+    """Show a history entry's result again, from the result cache when possible."""
+    try:
+        result_df, fingerprint, cached = st.session_state.query_client.rerun(entry["sql"], entry["fingerprint"])
+    except PipelineError as e:
+        st.session_state.notice = ("error", str(e))
+        return
+    st.session_state.last_result_df = result_df
+    st.session_state.last_result_fingerprint = fingerprint
+    st.session_state.last_user_query = entry["question"]
+    source = "cached result" if cached else "re-executed"
+    st.session_state.notice = ("info", f"Showing history entry ({source}): {entry['question']}")
+
+
+def render_history():
+    """Persistent, searchable query history with one-click re-runs."""
+    store = get_history_store()
+    user = current_user()
+    total = store.count(user)
+    if not total:
+        return
+
+    st.markdown("---")
+    st.subheader("📚 Query History")
+    search = st.text_input("Search history", key="history_search", placeholder="e.g. revenue ios")
+    with span("ui.history", search=bool(search)):
+        entries = store.search(user, search, limit=20) if search else store.recent(user, limit=20)
+    st.caption(f"Showing {len(entries)} of {total} queries")
+
+    for entry in entries:
+        created = datetime.fromtimestamp(entry["created_at"])
+        label = f"{created.strftime('%Y-%m-%d %H:%M')} - {entry['question'][:80]}"
+        with st.expander(label):
+            col_a, col_b = st.columns([1, 2])
+            with col_a:
+                st.write("**Natural Language:**")
+                st.write(entry["question"])
+                if entry["row_count"] is not None:
+                    st.caption(f"{entry['row_count']:,} rows · {entry['total_ms'] or 0:.0f} ms")
+                st.button(
+                    "↻ Re-run",
+                    key=f"history_rerun_{entry['id']}",
+                    on_click=rerun_from_history,
+                    args=(entry,),
+                )
+            with col_b:
+                st.write("**Generated SQL:**")
+                st.code(entry["sql"], language="sql")
+
+    # Clear history button
+    if st.button("🗑️ Clear History"):
+        store.clear(user)
+        st.rerun()
+
+
+def render_timings(run_span):
+    """Collapsible per-stage timing breakdown for the current run."""
+    with st.expander("⏱️ Timings", expanded=False):
+        rows = span_rows(run_span)
+        if len(rows) > 1:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption(f"No pipeline stages ran in this run ({run_span.duration_ms:.0f} ms total).")
 
+
+def render_model_routes():
+    """Rolling latency and error rates of each LLM route (see model_router.py)."""
+    with st.expander("🧭 Model routing", expanded=False):
+        try:
+            rows = [row for row in st.session_state.query_client.models() if row["calls"]]
+        except PipelineError as e:
+            st.caption(f"Model statistics unavailable: {e}")
+            return
+        if rows:
+            st.dataframe(pd.DataFrame(rows), use_container_width=True, hide_index=True)
+        else:
+            st.caption("No LLM calls yet.")
+
+
+def render_page():
     # Header (restore small spacer so logo is not flush with the top)
     st.markdown("<div style='margin-top: 0.4rem'></div>", unsafe_allow_html=True)
     header_logo_col, header_text_col = st.columns([1, 3])
@@ -652,6 +760,27 @@ def main():
 
         show_prompt = st.checkbox("📋 Show generated prompt", value=False)
         copy_to_clipboard = st.checkbox("📋 Enable copy to clipboard", value=True)
+        follow_up_mode = st.checkbox(
+            "💬 Follow-up mode",
+            value=False,
+            help="Treat questions as follow-ups: refinements run against the previous result instead of re-scanning user_days.",
+        )
+        multi_mode = st.checkbox(
+            "🧮 Multiple questions",
+            value=False,
+            help="One question per line (or separated by ';'). All of them are generated and executed concurrently.",
+        )
+        fast_estimate = st.radio(
+            "⚡ Execution",
+            ["Exact", "Fast estimate"],
+            horizontal=True,
+            help="Fast estimate answers aggregate questions from a 1% or 10% user sample, "
+                 "with 95% confidence bounds. Other queries still run exactly.",
+        ) == "Fast estimate"
+        if follow_up_mode and st.session_state.conversation.turns:
+            turns = len(st.session_state.conversation.turns)
+            if st.button(f"↺ New conversation ({turns} turn{'s' if turns != 1 else ''})"):
+                st.session_state.conversation.reset()
 
         st.markdown("---")
 
@@ -670,7 +799,14 @@ def main():
             )
     
     # Generate query button
-    if st.button("Run query & show results", type="primary", use_container_width=True):
+    run_clicked = st.button("Run query & show results", type="primary", use_container_width=True)
+    if run_clicked and multi_mode and user_query.strip():
+        run_multi_questions(user_query)
+    elif multi_mode:
+        render_multi_results()
+    elif run_clicked and follow_up_mode and user_query.strip():
+        run_follow_up(user_query)
+    elif run_clicked:
         if not user_query.strip():
             st.warning("Please enter a query!")
             return
@@ -687,43 +823,43 @@ def main():
                 st.text_area("Prompt sent to OpenAI:", display_prompt, height=100)
             
             # Generate SQL
-            sql_query = generate_sql_query(
-                user_query,
-                custom_prompt if use_custom_prompt else None,
-            )
+            with span("ui.generate_sql") as generate_span:
+                sql_query = generate_sql_query(
+                    user_query,
+                    custom_prompt if use_custom_prompt else None,
+                )
             
             if sql_query:
-                # Basic safety check to prevent destructive operations
-                upper_sql = sql_query.upper()
-                dangerous_keywords = ["DROP", "DELETE", "TRUNCATE", "ALTER", "CREATE", "INSERT", "UPDATE"]
-                if any(keyword in upper_sql for keyword in dangerous_keywords):
-                    st.error("Generated query contains potentially destructive operations and will not be executed.")
-                    return
-
-                # Display generated SQL
+                # Display generated SQL (already validated as read-only by the client)
                 st.subheader("✨ Generated SQL Query")
                 st.code(sql_query, language="sql")
 
-                # Execute against local database and store results in session_state
-                result_df = st.session_state.db_manager.execute_query(sql_query)
+                result_df, fingerprint, approximation, run_sql = None, None, None, None
+                try:
+                    if fast_estimate:
+                        with span("ui.execute_approximate") as execute_span:
+                            result_df, fingerprint, approximation = (
+                                st.session_state.query_client.execute_approximate(sql_query)
+                            )
+                        if result_df is None:
+                            st.caption(f"⚡ No fast estimate: {approximation['reason']}. Running exactly.")
+                        else:
+                            run_sql = sql_query
+                            st.session_state.approximations[fingerprint] = approximation
+                    if result_df is None:
+                        # Execute against the database (unless the cost guardrail holds it back)
+                        run_sql = check_cost(user_query, sql_query)
+                        if run_sql is not None:
+                            with span("ui.execute") as execute_span:
+                                result_df, fingerprint = st.session_state.query_client.execute(run_sql)
+                except PipelineError as e:
+                    st.error(str(e))
                 if result_df is not None and not result_df.empty:
-                    # Remove any existing index so it is never treated as a data column
-                    result_df = result_df.reset_index(drop=True)
-
-                    # Coerce numeric-looking object columns (e.g., totals returned as strings)
-                    for col in result_df.select_dtypes(include=["object"]).columns:
-                        try:
-                            series_str = result_df[col].astype(str).str.replace(",", "").str.strip()
-                            converted = pd.to_numeric(series_str, errors="coerce")
-                            if converted.notna().any():
-                                result_df[col] = converted
-                        except Exception:
-                            pass
-
                     # Persist the cleaned result and query for later display/insights
                     st.session_state.last_result_df = result_df
+                    st.session_state.last_result_fingerprint = fingerprint
                     st.session_state.last_user_query = user_query
-                else:
+                elif result_df is not None:
                     st.info("Query executed but returned no rows.")
                 
                 # Copy to clipboard option
@@ -735,11 +871,21 @@ def main():
                     )
                 
                 # Save to history
-                st.session_state.query_history.append({
-                    'timestamp': datetime.now(),
-                    'input': user_query,
-                    'sql': sql_query
-                })
+                if result_df is not None:
+                    get_history_store().add(
+                        current_user(),
+                        user_query,
+                        run_sql,
+                        # Estimates are not kept for re-runs: those show the exact result
+                        fingerprint=None if approximation and approximation["approximate"] else fingerprint,
+                        row_count=len(result_df),
+                        timings={
+                            "generate_ms": generate_span.duration_ms,
+                            "execute_ms": execute_span.duration_ms,
+                            "total_ms": generate_span.duration_ms + execute_span.duration_ms,
+                        },
+                        source="simple_app",
+                    )
                 
                 # Download option
                 st.download_button(
@@ -750,50 +896,69 @@ def main():
                     key="download_sql"
                 )
                 
-                st.success("✅ SQL query generated and executed successfully!")
+                if result_df is not None:
+                    st.success("✅ SQL query generated and executed successfully!")
+
+    render_pending_query()
+
+    # Outcome of a button callback (history re-run, confirmed query) from before this rerun
+    notice = st.session_state.pop("notice", None)
+    if notice:
+        level, message = notice
+        (st.error if level == "error" else st.info)(message)
 
     # Separate section: always show latest query results (if any)
     if st.session_state.last_result_df is not None and not st.session_state.last_result_df.empty:
+        # Index was already reset when the result was stored
         result_df = st.session_state.last_result_df
+        fingerprint = st.session_state.last_result_fingerprint or result_fingerprint(result_df)
+        render_cache = st.session_state.render_cache
 
         st.markdown("---")
         st.subheader("📊 Latest Query Results")
+        approximation = st.session_state.approximations.get(fingerprint)
+        if approximation and approximation.get("method") == "sketch":
+            st.caption(
+                "⚡ Fast estimate from daily HyperLogLog sketches: distinct-user counts are within "
+                f"±{approximation['relative_error']:.1%} (95%), shown by the `_low` / `_high` columns."
+            )
+        elif approximation:
+            st.caption(
+                f"⚡ Fast estimate from a {approximation['percent']}% user sample "
+                f"({approximation['sample_rows']:,} rows): sums and counts are scaled up, and the "
+                "`_low` / `_high` columns are 95% confidence bounds."
+            )
         st.markdown('<div class="gsn-card">', unsafe_allow_html=True)
-        # Ensure index is clean and hidden for display
-        result_df = result_df.reset_index(drop=True)
-        try:
-            st.dataframe(result_df, use_container_width=True, hide_index=True)
-        except TypeError:
-            # Fallback for older Streamlit versions without hide_index
-            st.dataframe(result_df, use_container_width=True)
+        with span("render.dataframe", rows=len(result_df)):
+            try:
+                st.dataframe(result_df, use_container_width=True, hide_index=True)
+            except TypeError:
+                # Fallback for older Streamlit versions without hide_index
+                st.dataframe(result_df, use_container_width=True)
 
         # Show detected dtypes and per-column summary
         with st.expander("📂 Result details & column profile", expanded=False):
             st.write("Raw dtypes:")
             st.write(result_df.dtypes.astype(str))
+            memory = memory_report(result_df)
+            if memory:
+                saved = memory["bytes_before"] - memory["bytes_after"]
+                st.caption(
+                    f"In memory: {memory['bytes_after'] / 1e6:,.2f} MB "
+                    f"({saved / 1e6:,.2f} MB saved by compact dtypes, "
+                    f"{saved / max(memory['bytes_before'], 1):.0%})"
+                )
 
             st.write("\nColumn summary:")
-            summary_rows = []
-            for col in result_df.columns:
-                series = result_df[col]
-                dtype = str(series.dtype)
-                distinct = int(series.nunique(dropna=True))
-                samples = series.dropna().unique()[:5]
-                samples_display = ", ".join(map(str, samples))
-                definition = COLUMN_DEFINITIONS.get(col, "")
-                summary_rows.append({
-                    "column": col,
-                    "dtype": dtype,
-                    "distinct_values": distinct,
-                    "sample_values": samples_display,
-                    "definition": definition,
-                })
-
-            if summary_rows:
-                st.dataframe(pd.DataFrame(summary_rows))
-
-        csv_str = result_df.to_csv(index=False)
-        csv_data = csv_str.encode("utf-8")
+            profile_df = render_cache.get(
+                fingerprint, "profile", lambda: column_profile(result_df, COLUMN_DEFINITIONS)
+            )
+            if not profile_df.empty:
+                st.dataframe(profile_df)
+
+        csv_data = render_cache.get(
+            fingerprint, "csv", lambda: st.session_state.query_client.export(result_df, fingerprint, "csv")
+        )
 
         # Place download and copy buttons side by side
         btn_col1, btn_col2 = st.columns(2)
@@ -828,146 +993,66 @@ def main():
             user_query = st.session_state.last_user_query
 
             with st.spinner("🎰 Spinning up reels, crunching coins, and drawing charts..."):
-                # Time-series visualization (event_day_pst + numeric metrics)
-                numeric_cols = result_df.select_dtypes(include=["number"]).columns.tolist()
-                if "event_day_pst" in result_df.columns and numeric_cols:
-                    ts_df = result_df.copy()
-                    try:
-                        ts_df["event_day_pst"] = pd.to_datetime(ts_df["event_day_pst"], errors="coerce")
-                        ts_df = ts_df.dropna(subset=["event_day_pst"])
-                        ts_df = ts_df.sort_values("event_day_pst")
-
-                        st.subheader("📈 Trend over time")
-                        st.line_chart(ts_df.set_index("event_day_pst")[numeric_cols[0]])
-                    except Exception:
-                        pass
-
-                insight_spec = generate_result_insights(result_df, user_query)
-                if isinstance(insight_spec, dict):
-                    insights_list = insight_spec.get("insights") or []
-                    charts_spec = insight_spec.get("charts") or []
-
-                    if insights_list:
-                        st.subheader("🔍 Insights")
-                        bullets = "\n".join(f"- {text}" for text in insights_list)
-                        st.markdown(bullets)
-
-                    # Render any charts requested by the agent spec using a cleaned DataFrame
-                    plot_df = result_df.copy()
-
-                    # Drop obvious index-like columns by name
-                    drop_cols = [
-                        c for c in plot_df.columns
-                        if c.lower() == "index" or c.startswith("Unnamed")
-                    ]
-
-                    # Also drop any column that is a simple positional index (0..n-1)
-                    for c in list(plot_df.columns):
-                        series = plot_df[c]
-                        try:
-                            # Non-null part equals range(len) -> looks like index
-                            non_null = series.dropna()
-                            if (
-                                pd.api.types.is_integer_dtype(non_null) and
-                                non_null.reset_index(drop=True).equals(pd.Series(range(len(non_null))))
-                            ):
-                                drop_cols.append(c)
-                        except Exception:
-                            continue
-
-                    if drop_cols:
-                        plot_df = plot_df.drop(columns=list(set(drop_cols)))
-
-                    # Best-effort: coerce any remaining numeric-looking object columns
-                    for col in plot_df.select_dtypes(include=["object"]).columns:
-                        try:
-                            series_str = plot_df[col].astype(str).str.replace(",", "").str.strip()
-                            converted = pd.to_numeric(series_str, errors="coerce")
-                            if converted.notna().any():
-                                plot_df[col] = converted
-                        except Exception:
-                            continue
-
-                    for chart in charts_spec:
-                        ctype = str(chart.get("type", "")).lower()
-                        title = chart.get("title")
-                        try:
-                            if ctype == "bar":
-                                x_col = chart.get("x")
-                                y_col = chart.get("y")
-                                if not x_col or not y_col:
-                                    continue
-                                if x_col in plot_df.columns and y_col in plot_df.columns:
-                                    fig = px.bar(
-                                        plot_df,
-                                        x=x_col,
-                                        y=y_col,
-                                        title=title,
-                                    )
-                                    st.plotly_chart(fig, use_container_width=True)
-
-                            elif ctype == "pie":
-                                names_col = chart.get("names")
-                                values_col = chart.get("values")
-                                if not names_col or not values_col:
-                                    continue
-                                if names_col in plot_df.columns and values_col in plot_df.columns:
-                                    fig = px.pie(
-                                        plot_df,
-                                        names=names_col,
-                                        values=values_col,
-                                        title=title,
-                                    )
-                                    st.plotly_chart(fig, use_container_width=True)
-
-                            elif ctype == "line":
-                                x_col = chart.get("x")
-                                y_col = chart.get("y")
-                                if not x_col or not y_col:
-                                    continue
-                                if x_col in plot_df.columns and y_col in plot_df.columns:
-                                    fig = px.line(
-                                        plot_df,
-                                        x=x_col,
-                                        y=y_col,
-                                        title=title,
-                                    )
-                                    st.plotly_chart(fig, use_container_width=True)
-
-                            elif ctype == "histogram":
-                                x_col = chart.get("x")
-                                if not x_col:
-                                    continue
-                                if x_col in plot_df.columns:
-                                    fig = px.histogram(
-                                        plot_df,
-                                        x=x_col,
-                                        title=title,
-                                    )
-                                    st.plotly_chart(fig, use_container_width=True)
-                        except Exception:
-                            continue
-
-    # Display query history
-    if st.session_state.query_history:
-        st.markdown("---")
-        st.subheader("📚 Query History")
-        
-        # Show recent queries in main area
-        for i, item in enumerate(reversed(st.session_state.query_history)):
-            with st.expander(f"Query {len(st.session_state.query_history) - i} - {item['timestamp'].strftime('%H:%M:%S')}"):
-                col_a, col_b = st.columns([1, 2])
-                with col_a:
-                    st.write("**Natural Language:**")
-                    st.write(item['input'])
-                with col_b:
-                    st.write("**Generated SQL:**")
-                    st.code(item['sql'], language="sql")
-        
-        # Clear history button
-        if st.button("🗑️ Clear History"):
-            st.session_state.query_history = []
-            st.rerun()
+                render_trend(result_df, fingerprint)
+                plot_df = render_cache.get(fingerprint, "plot_df", lambda: prepare_plot_frame(result_df))
+
+                # Render insights and charts as each one arrives from the token stream
+                insights_header = st.empty()
+                insights_box = st.empty()
+                insights_list = []
+                events = st.session_state.query_client.stream_insights(result_df, user_query, fingerprint)
+                with span("ui.insights"):
+                    for kind, payload in events:
+                        if kind == "insight":
+                            insights_list.append(payload)
+                            insights_header.subheader("🔍 Insights")
+                            insights_box.markdown("\n".join(f"- {text}" for text in insights_list))
+                        elif kind == "chart":
+                            try:
+                                fig = cached_chart_figure(plot_df, payload, fingerprint)
+                                if fig is not None:
+                                    with span("render.plotly_chart", type=payload.get("type")):
+                                        st.plotly_chart(fig, use_container_width=True)
+                            except Exception:
+                                continue
+                        elif kind == "done":
+                            st.session_state.last_insights = {"fingerprint": fingerprint, "spec": payload}
+                        elif kind == "error":
+                            st.warning(payload)
+
+        elif (
+            st.session_state.last_insights
+            and st.session_state.last_insights["fingerprint"] == fingerprint
+        ):
+            # Rerun with unchanged inputs: replay memoised insights and figures
+            insight_spec = st.session_state.last_insights["spec"]
+            render_trend(result_df, fingerprint)
+            if insight_spec.get("insights"):
+                st.subheader("🔍 Insights")
+                st.markdown("\n".join(f"- {text}" for text in insight_spec["insights"]))
+            plot_df = render_cache.get(fingerprint, "plot_df", lambda: prepare_plot_frame(result_df))
+            for chart in insight_spec.get("charts") or []:
+                try:
+                    fig = cached_chart_figure(plot_df, chart, fingerprint)
+                    if fig is not None:
+                        with span("render.plotly_chart", type=chart.get("type")):
+                            st.plotly_chart(fig, use_container_width=True)
+                except Exception:
+                    continue
+
+    render_history()
+
+
+def main():
+    # Require authentication before showing the main UI
+    if not login():
+        return
+
+    with span("simple_app.run") as run_span:
+        render_page()
+    render_timings(run_span)
+    render_model_routes()
+
 
 if __name__ == "__main__":
     main()
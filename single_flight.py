@@ -0,0 +1,177 @@
+"""
+Single-flight coalescing of identical in-flight work.
+
+When the same example query is clicked by several analysts at once, every
+request would otherwise send the same prompt to the LLM and run the same scan.
+``SingleFlight.do(key, compute, lookup)`` runs ``compute`` once per key at a
+time: concurrent callers with the same key in this process wait for the
+running call and share its result (or its exception).
+
+Across processes (service workers, Streamlit instances on one host) the
+running call holds an ``flock`` on a per-key lock file under
+``Config.CACHE_DIR``. A process that finds the lock taken waits for it and
+then calls ``lookup`` to read the result the other process left in the shared
+disk cache, computing itself only when there is none. Lock files are not
+available on Windows, where coalescing is per process only.
+
+Keys are the pipeline's cache keys: the prompt hash for SQL generation and
+the canonical SQL for queries. ``stats()`` reports how many calls were
+collapsed; callers also mark shared results with ``coalesced=True`` on their
+span, which tracing counts in ``analytics_coalesced_calls_total``.
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from config import Config
+from tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+LOCK_POLL_SECONDS = 0.05
+# Lock files untouched for this long are removed when a new one is created
+STALE_LOCK_SECONDS = 24 * 3600
+
+
+class _Call:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one computation."""
+
+    def __init__(self, name: str, lock_dir: Optional[str] = None):
+        self.name = name
+        self.lock_dir = lock_dir or os.path.join(Config.CACHE_DIR, "single_flight", name)
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "executed": 0, "coalesced": 0, "coalesced_remote": 0}
+
+    def do(self, key: str, compute: Callable[[], Any],
+           lookup: Optional[Callable[[], Any]] = None) -> Tuple[Any, bool]:
+        """Return ``(value, shared)``: ``compute()``'s result, or that of an identical call in flight.
+
+        ``lookup`` reads a result another process stored (None when there is
+        none); without it only calls in this process are shared.
+        """
+        if not Config.SINGLE_FLIGHT_ENABLED:
+            return compute(), False
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            with span("single_flight.wait", flight=self.name):
+                call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        try:
+            call.value, shared = self._run(key, compute, lookup)
+            return call.value, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
+
+    def _run(self, key: str, compute: Callable[[], Any],
+             lookup: Optional[Callable[[], Any]]) -> Tuple[Any, bool]:
+        """Compute under the cross-process lock for ``key`` (or read the result its holder stored)."""
+        handle = self._open_lock(key) if lookup is not None else None
+        if handle is None:
+            return self._compute(compute), False
+        try:
+            if not _try_lock(handle):
+                with span("single_flight.wait_remote", flight=self.name):
+                    deadline = time.monotonic() + Config.SINGLE_FLIGHT_WAIT_SECONDS
+                    while not _try_lock(handle) and time.monotonic() < deadline:
+                        time.sleep(LOCK_POLL_SECONDS)
+                value = lookup()
+                if value is not None:
+                    with self._lock:
+                        self._stats["coalesced_remote"] += 1
+                    return value, True
+            return self._compute(compute), False
+        finally:
+            handle.close()  # releases the lock
+
+    def _compute(self, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._stats["executed"] += 1
+        return compute()
+
+    def _open_lock(self, key: str):
+        if fcntl is None:
+            return None
+        try:
+            os.makedirs(self.lock_dir, exist_ok=True)
+            path = os.path.join(self.lock_dir, key.replace(":", "_") + ".lock")
+            if not os.path.exists(path):
+                self._remove_stale_locks()
+            handle = open(path, "a+")
+            os.utime(path)
+            return handle
+        except OSError:
+            return None  # unwritable cache directory: coalesce in this process only
+
+    def _remove_stale_locks(self):
+        cutoff = time.time() - STALE_LOCK_SECONDS
+        for entry in os.scandir(self.lock_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _try_lock(handle) -> bool:
+    try:
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+_flights: Dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_flight(name: str) -> SingleFlight:
+    """Process-wide SingleFlight for one kind of work (``"llm"``, ``"query"``)."""
+    flight = _flights.get(name)
+    if flight is None:
+        with _flights_lock:
+            flight = _flights.get(name)
+            if flight is None:
+                flight = _flights[name] = SingleFlight(name)
+    return flight
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Per-flight counters: calls, executed, coalesced (in process), coalesced_remote, in_flight."""
+    with _flights_lock:
+        flights = dict(_flights)
+    return {name: flight.stats() for name, flight in flights.items()}
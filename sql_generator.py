@@ -1,20 +1,113 @@
-import urllib.request
-import urllib.parse
-import json
+import logging
+import threading
 from typing import Optional, Dict, Any, List
-import streamlit as st
 from config import Config
-import os
+from lazy import lazy_import
+from llm import strip_sql_fences
+from model_router import get_model_router
+from sql_parser import SQLParseError, parse_sql
+from tracing import span
+
+logger = logging.getLogger(__name__)
+st = lazy_import("streamlit")
+
+# GSN Casino prompt used by simple_app and the headless service. The
+# ``{user_query}`` placeholder is substituted with str.replace, so the
+# template may contain other braces freely.
+CASINO_SQL_PROMPT = """
+You are a GSN Casino SQL expert. Generate optimized SQL queries for GSN Casino data stored in a local SQLite database.
+
+RULES:
+- Always reference the table: user_days
+- Always filter by event_day_pst to limit scanned data when a time range is implied
+- Add LIMIT 100 only at the final display step, not during intermediate aggregations
+- Use clear, standard SQL that is compatible with SQLite (no BigQuery-specific functions like DATE_SUB or INTERVAL)
+- Always treat NULL payer_type as the string 'Non-Payer' by using COALESCE(payer_type, 'Non-Payer') in SELECT and GROUP BY when segmenting by payer type for **active payer** status.
+- Interpreting payer status:
+  * Active payer vs active non-payer (last 12 weeks) is determined by payer_type (NULL => not an active payer).
+  * **Lifetime non-payers** are users with bookings_lifetime = 0 (they have never paid).
+  * **Lifetime payers** are users with bookings_lifetime > 0 (they have paid at least once).
+  * Whenever the user asks about "lifetime" payer or non-payer metrics, you MUST use bookings_lifetime (0 vs > 0) instead of payer_type filters.
+- Provide ONLY the SQL query, no explanations or commentary
+
+TABLE SCHEMA (user_days):
+- event_day_pst: Snapshot date.
+- user_id: Unique user id.
+- bookings: User's revenue for that day.
+- transactions: Number of transactions.
+- bookings_lifetime: Lifetime revenue (LTV) or lifetime value of a user up to event_day_pst.
+- balance_coins_begin: Tokens/coins balance when the user logged in.
+- balance_coins_end: Tokens/coins balance at the end of the day.
+- install_first_date_pst: Date of install. Can be used to calculate tenure. Users older than 365 days are called older players.
+- country: Country of the user (demographic information).
+- payer_type: Type of payer (payer_type, DolphinLapse, WhaleLapse, BassLapse, Whale, Bass, MinnowLapse, Dolphin, Blue, Minnow, OrcaLapse, BlueLapse, NULL for Non-Payer).
+- slot_spins: Number of spins in a day.
+- slot_coins_used: Tokens/coins used in a day.
+- slot_coins_gained: Tokens/coins gained in a day.
+- platform: ios, android, amazon are mobile platforms; others are web/webstore.
+- engagement_7d: Count of days the user was active in the last 7 days including today (7 = regular users).
+
+PAYER GROUPS:
+- High Payer: Blue, BlueLapse, Orca, OrcaLapse, Whale, WhaleLapse
+- Low Payer: Bass, BassLapse, Dolphin, DolphinLapse, Minnow, MinnowLapse
+- Non-Payer: NULL (always surfaced as the label 'Non-Payer' using COALESCE)
+
+User Request: {user_query}
+
+SQL Query:
+"""
+
+CASINO_SYSTEM_PROMPT = (
+    "You are a GSN Casino BigQuery SQL expert. Generate only optimized BigQuery SQL "
+    "queries for GSN Casino data without any explanations or markdown formatting."
+)
+
 
 class SQLGenerator:
-    def __init__(self):
+    def __init__(self, ui: bool = True):
+        """``ui=False`` suppresses Streamlit output; errors are then only kept in ``last_error``."""
         self.config = Config()
+        self.ui = ui
+        self._state = threading.local()
         self.api_key = self.config.API_KEY
-        st.write(f"[DEBUG] API_KEY loaded: {bool(self.api_key)}")
-        if self.api_key:
-            st.write(f"[DEBUG] API_KEY starts with: {self.api_key[:7]}...")
+        if self.ui:
+            st.write(f"[DEBUG] API_KEY loaded: {bool(self.api_key)}")
+            if self.api_key:
+                st.write(f"[DEBUG] API_KEY starts with: {self.api_key[:7]}...")
+            else:
+                st.write("[DEBUG] API_KEY is None or empty")
+
+    @property
+    def last_error(self) -> Optional[str]:
+        """Error from the most recent call made by the current thread."""
+        return getattr(self._state, "error", None)
+
+    @last_error.setter
+    def last_error(self, value: Optional[str]):
+        self._state.error = value
+
+    @property
+    def last_usage(self) -> Dict[str, Any]:
+        """Token usage of the most recent completion made by the current thread."""
+        return getattr(self._state, "usage", {})
+
+    @last_usage.setter
+    def last_usage(self, value: Dict[str, Any]):
+        self._state.usage = value
+
+    def _report(self, message: str, level: str = "error"):
+        self.last_error = message
+        if self.ui:
+            getattr(st, level)(message)
         else:
-            st.write("[DEBUG] API_KEY is None or empty")
+            logger.warning(message)
+
+    def _chat(self, messages: List[Dict[str, str]], purpose: str, max_tokens: int, temperature: float,
+              question: Optional[str] = None) -> str:
+        """Completion from the model the router picks for ``purpose`` (see model_router.py)."""
+        result = get_model_router().complete(purpose, messages, max_tokens, temperature, question, self.api_key)
+        self.last_usage = {**result["usage"], "model": result["model"]}
+        return result["content"]
         
     def generate_sql_prompt(self, user_query: str, schema_info: Dict[str, Any]) -> str:
         """Generate the prompt for OpenAI to convert natural language to SQL"""
@@ -56,71 +149,73 @@ SQL Query:
         return prompt
     
     def generate_sql(self, user_query: str, schema_info: Dict[str, Any]) -> Optional[str]:
-        """Generate SQL query from natural language using OpenAI via urllib"""
+        """Generate SQL query from natural language using the schema-driven prompt"""
         try:
+            self.last_error = None
             if not self.api_key:
-                st.error("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
+                self._report("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
                 return None
             
-            prompt = self.generate_sql_prompt(user_query, schema_info)
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key.strip()}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.config.OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": "You are an expert SQL query generator. Generate only valid SQL queries without any explanations or markdown formatting."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": self.config.MAX_TOKENS,
-                "temperature": self.config.TEMPERATURE
-            }
-            
-            req = urllib.request.Request(
-                "https://api.openai.com/v1/chat/completions",
-                data=json.dumps(data).encode(),
-                headers=headers
-            )
-            
-            st.write(f"[DEBUG] Request URL: {req.full_url}")
-            st.write(f"[DEBUG] Request headers: {req.headers}")
-            st.write(f"[DEBUG] Request data: {json.dumps(data, indent=2)}")
-            
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode())
-                st.write(f"[DEBUG] Response status: {response.status}")
-                st.write(f"[DEBUG] Response body: {json.dumps(result, indent=2)}")
-                sql_query = result["choices"][0]["message"]["content"].strip()
-            
+            with span("sql.build_prompt", tables=len(schema_info)):
+                prompt = self.generate_sql_prompt(user_query, schema_info)
+            messages = [
+                {"role": "system", "content": "You are an expert SQL query generator. Generate only valid SQL queries without any explanations or markdown formatting."},
+                {"role": "user", "content": prompt}
+            ]
+            if self.ui:
+                st.write(f"[DEBUG] Request URL: {self.config.OPENAI_BASE_URL}/chat/completions")
+                st.write(f"[DEBUG] Request messages: {messages}")
+
+            sql_query = self._chat(messages, "schema_sql", self.config.MAX_TOKENS, self.config.TEMPERATURE, user_query)
+            if self.ui:
+                st.write(f"[DEBUG] Response usage: {self.last_usage}")
+
             # Clean up the response (remove any markdown formatting)
-            sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
-            
-            return sql_query
+            return strip_sql_fences(sql_query)
             
         except Exception as e:
-            st.error(f"SQL generation failed: {str(e)}")
+            self._report(f"SQL generation failed: {str(e)}")
+            return None
+
+    def generate_casino_sql(self, user_query: str, custom_prompt: Optional[str] = None) -> Optional[str]:
+        """Generate SQL for the GSN Casino user_days table (or from a custom prompt template)"""
+        try:
+            self.last_error = None
+            if not self.api_key:
+                self._report("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
+                return None
+
+            with span("sql.build_prompt", custom=bool(custom_prompt)):
+                template = custom_prompt or CASINO_SQL_PROMPT
+                prompt = template.replace("{user_query}", user_query)
+            messages = [
+                {"role": "system", "content": CASINO_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ]
+            sql_query = self._chat(messages, "sql", 1000, 0.1, user_query)
+            return strip_sql_fences(sql_query)
+
+        except Exception as e:
+            self._report(f"SQL generation failed: {str(e)}")
             return None
     
     def validate_sql(self, sql_query: str) -> bool:
-        """Basic SQL validation to prevent destructive operations"""
-        dangerous_keywords = ['DROP', 'DELETE', 'TRUNCATE', 'ALTER', 'CREATE', 'INSERT', 'UPDATE']
-        
-        sql_upper = sql_query.upper()
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                st.warning(f"Query contains potentially dangerous keyword: {keyword}")
-                return False
-        
+        """Check that the query is a single read-only statement (see sql_parser)"""
+        try:
+            error = parse_sql(sql_query).read_only_error()
+        except SQLParseError as e:
+            error = f"Could not parse SQL: {e}"
+        if error:
+            self._report(error, level="warning")
+            return False
         return True
     
     def explain_sql(self, sql_query: str) -> Optional[str]:
-        """Generate explanation for the SQL query using OpenAI via urllib"""
+        """Generate explanation for the SQL query"""
         try:
+            self.last_error = None
             if not self.api_key:
-                st.error("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
+                self._report("OpenAI API key not configured. Please set OPENAI_API_KEY in your environment.")
                 return None
 
             prompt = f"""
@@ -130,32 +225,12 @@ Explain this SQL query in simple terms:
 
 Provide a clear, concise explanation of what this query does.
 """
-            
-            headers = {
-                "Authorization": f"Bearer {self.api_key.strip()}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": self.config.OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": "You are an SQL expert. Explain SQL queries in simple, clear terms."},
-                    {"role": "user", "content": prompt}
-                ],
-                "max_tokens": 300,
-                "temperature": 0.3
-            }
-            
-            req = urllib.request.Request(
-                "https://api.openai.com/v1/chat/completions",
-                data=json.dumps(data).encode(),
-                headers=headers
-            )
-            
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode())
-                return result["choices"][0]["message"]["content"].strip()
+            messages = [
+                {"role": "system", "content": "You are an SQL expert. Explain SQL queries in simple, clear terms."},
+                {"role": "user", "content": prompt}
+            ]
+            return self._chat(messages, "explain", 300, 0.3)
             
         except Exception as e:
-            st.error(f"SQL explanation failed: {str(e)}")
+            self._report(f"SQL explanation failed: {str(e)}")
             return None
@@ -0,0 +1,531 @@
+"""
+SQL tokenizer and light-weight statement analysis.
+
+``parse_sql`` turns a query into a ``ParsedQuery``: the token stream (comments
+dropped, string literals and quoted identifiers kept whole) plus what the
+pipeline needs to know about it — statement count and type, referenced
+tables, CTE names, aliases and bare column references. It is not a full SQL
+grammar, but because it works on tokens, keywords inside names
+(``created_at``, ``last_updated``) or inside string literals are no longer
+mistaken for statements.
+
+Used for read-only validation, catalog checks (unknown tables and columns),
+outer ``LIMIT`` injection/tightening and canonical SQL text for cache keys.
+"""
+
+import difflib
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+READ_STATEMENTS = {"SELECT", "WITH", "VALUES"}
+WRITE_KEYWORDS = {
+    "INSERT", "UPDATE", "DELETE", "REPLACE", "MERGE", "CREATE", "DROP", "ALTER", "TRUNCATE",
+    "ATTACH", "DETACH", "PRAGMA", "VACUUM", "REINDEX", "ANALYZE", "GRANT", "REVOKE", "INTO",
+}
+KEYWORDS = WRITE_KEYWORDS | {
+    "SELECT", "WITH", "RECURSIVE", "VALUES", "FROM", "WHERE", "GROUP", "BY", "HAVING", "ORDER",
+    "LIMIT", "OFFSET", "UNION", "ALL", "INTERSECT", "EXCEPT", "DISTINCT", "AS", "ON", "USING",
+    "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "OUTER", "CROSS", "NATURAL", "AND", "OR", "NOT",
+    "IS", "NULL", "IN", "BETWEEN", "LIKE", "GLOB", "REGEXP", "MATCH", "ESCAPE", "EXISTS", "CASE",
+    "WHEN", "THEN", "ELSE", "END", "CAST", "COLLATE", "NOCASE", "BINARY", "RTRIM", "ASC", "DESC",
+    "NULLS", "FIRST", "LAST", "OVER", "PARTITION", "WINDOW", "FILTER", "ROWS", "RANGE", "GROUPS",
+    "PRECEDING", "FOLLOWING", "UNBOUNDED", "CURRENT", "ROW", "EXCLUDE", "TIES", "OTHERS", "NO",
+    "MATERIALIZED", "TRUE", "FALSE", "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP",
+    "INTERVAL", "DAY", "DAYS", "WEEK", "MONTH", "YEAR", "HOUR", "MINUTE", "SECOND", "INTEGER",
+    "INT", "REAL", "TEXT", "NUMERIC", "FLOAT", "DOUBLE", "DECIMAL", "VARCHAR", "CHAR", "BOOLEAN",
+    "DATE", "TIMESTAMP", "BLOB", "TOP", "FETCH", "NEXT", "ONLY", "SET", "DO", "NOTHING",
+}
+# Clause keywords that end a FROM list at the same parenthesis depth
+_FROM_END = {"WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "UNION", "INTERSECT", "EXCEPT", "WINDOW"}
+_IMPLICIT_COLUMNS = {"rowid", "_rowid_", "oid"}
+# Columns of SQLite's table-valued functions (FROM json_each(...))
+_TABLE_FUNCTION_COLUMNS = {
+    "json_each": {"key", "value", "type", "atom", "id", "parent", "fullkey", "path", "json", "root"},
+    "json_tree": {"key", "value", "type", "atom", "id", "parent", "fullkey", "path", "json", "root"},
+    "generate_series": {"value", "start", "stop", "step"},
+    "pragma_table_info": {"cid", "name", "type", "notnull", "dflt_value", "pk"},
+}
+# Keywords kept apart from a following "(" in normalized text ("IN (", "AS (")
+_SPACED_BEFORE_PAREN = {
+    "AS", "IN", "FROM", "JOIN", "ON", "USING", "AND", "OR", "NOT", "WHERE", "SELECT", "OVER",
+    "VALUES", "EXISTS", "WHEN", "THEN", "ELSE", "BY", "HAVING", "UNION", "ALL", "INTERSECT", "EXCEPT",
+}
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*"|`(?:[^`]|``)*`|\[[^\]]*\])
+    | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[^\W\d]\w*)
+    | (?P<param>\?\d*|[:@$][^\W\d]\w*)
+    | (?P<punct>[(),;.])
+    | (?P<op>\|\||<<|>>|<=|>=|==|!=|<>|->>|->|[-+*/%<>=~&|])
+    """,
+    re.VERBOSE | re.DOTALL | re.UNICODE,
+)
+
+
+class SQLParseError(ValueError):
+    """The text could not be tokenized (unterminated literal, unbalanced parentheses, ...)."""
+
+
+class Token:
+    __slots__ = ("kind", "value", "start", "end", "depth")
+
+    def __init__(self, kind: str, value: str, start: int, end: int, depth: int):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+        self.depth = depth
+
+    @property
+    def upper(self) -> str:
+        return self.value.upper()
+
+    def is_keyword(self, *words: str) -> bool:
+        return self.kind == "word" and self.value.upper() in (words or KEYWORDS)
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.value!r})"
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Significant tokens of ``sql`` with their parenthesis depth (whitespace and comments dropped)."""
+    tokens: List[Token] = []
+    depth = 0
+    pos = 0
+    while pos < len(sql):
+        m = _TOKEN_RE.match(sql, pos)
+        if not m:
+            if sql[pos] in "'\"`[":
+                raise SQLParseError(f"Unterminated literal or identifier at position {pos}")
+            raise SQLParseError(f"Unexpected character {sql[pos]!r} at position {pos}")
+        kind = m.lastgroup
+        value = m.group()
+        if kind not in ("ws", "comment"):
+            if value == ")":
+                depth -= 1
+                if depth < 0:
+                    raise SQLParseError(f"Unbalanced ')' at position {pos}")
+            tokens.append(Token(kind, value, pos, m.end(), depth))
+            if value == "(":
+                depth += 1
+        pos = m.end()
+    if depth:
+        raise SQLParseError("Unbalanced parentheses")
+    return tokens
+
+
+def closing_paren(tokens: List[Token], open_index: int) -> int:
+    """Index of the ``)`` matching the ``(`` at ``open_index``."""
+    depth = tokens[open_index].depth
+    for i in range(open_index + 1, len(tokens)):
+        if tokens[i].value == ")" and tokens[i].depth == depth:
+            return i
+    raise SQLParseError("Unbalanced parentheses")
+
+
+def split_tokens(tokens: List[Token], indexes: List[int], separator: str, depth: int = 0) -> List[List[int]]:
+    """Split token indexes on a separator (``,``, ``AND``, ``OR``) at ``depth``, keeping BETWEEN's AND."""
+    parts: List[List[int]] = []
+    current: List[int] = []
+    between = False
+    for i in indexes:
+        token = tokens[i]
+        if token.depth == depth and token.is_keyword("BETWEEN"):
+            between = True
+        elif token.depth == depth and (token.value == separator or token.is_keyword(separator)):
+            if separator == "AND" and between:
+                between = False
+            else:
+                parts.append(current)
+                current = []
+                continue
+        current.append(i)
+    if current or parts:
+        parts.append(current)
+    if any(not part for part in parts):
+        raise SQLParseError(f"Empty expression around {separator!r}")
+    return parts
+
+
+def sql_literal(value) -> str:
+    """SQLite literal for a Python value (NULL, number, text or blob)."""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "X'" + bytes(value).hex() + "'"
+    raise SQLParseError(f"Unsupported literal of type {type(value).__name__}")
+
+
+def _unquote(token: Token) -> str:
+    if token.kind == "quoted":
+        return token.value[1:-1]
+    return token.value
+
+
+class ParsedQuery:
+    """Tokens of a query plus the structural facts derived from them."""
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.tokens = tokenize(sql)
+        self.statements: List[List[Token]] = []
+        current: List[Token] = []
+        for token in self.tokens:
+            if token.value == ";":
+                if current:
+                    self.statements.append(current)
+                current = []
+            else:
+                current.append(token)
+        if current:
+            self.statements.append(current)
+
+        self.tables: Set[str] = set()
+        self.cte_names: Set[str] = set()
+        self.aliases: Set[str] = set()
+        self.columns: Set[str] = set()
+        self.functions: Set[str] = set()
+        # Table-valued functions read in FROM lists (their columns are known)
+        self.table_functions: Set[str] = set()
+        # (table, start, end, alias) for every FROM/JOIN reference, in text order
+        self.table_refs: List[Tuple[str, int, int, Optional[str]]] = []
+        for statement in self.statements:
+            self._analyse(statement)
+        # References to CTEs are not base tables
+        self.tables -= self.cte_names
+
+    # -- facts ---------------------------------------------------------------------
+
+    @property
+    def statement_type(self) -> Optional[str]:
+        if not self.statements:
+            return None
+        first = self.statements[0][0]
+        return first.upper if first.kind == "word" else None
+
+    @property
+    def write_keywords(self) -> Set[str]:
+        """Data-changing keywords used as keywords (not as function names like ``replace(...)``)."""
+        found = set()
+        for statement in self.statements:
+            for i, token in enumerate(statement):
+                if token.kind != "word" or token.upper not in WRITE_KEYWORDS:
+                    continue
+                follows = statement[i + 1] if i + 1 < len(statement) else None
+                precedes = statement[i - 1] if i else None
+                if (follows is not None and follows.value == "(") or (precedes is not None and precedes.value == "."):
+                    continue
+                found.add(token.upper)
+        return found
+
+    @property
+    def is_read_only(self) -> bool:
+        return (
+            len(self.statements) == 1
+            and self.statement_type in READ_STATEMENTS
+            and not self.write_keywords
+        )
+
+    def read_only_error(self) -> Optional[str]:
+        """Why the query is not a single read-only statement, or None if it is."""
+        if not self.statements:
+            return "Query is empty."
+        if len(self.statements) > 1:
+            return "Only a single SQL statement can be executed."
+        if self.statement_type not in READ_STATEMENTS:
+            return f"Only SELECT queries can be executed (got {self.statement_type or self.statements[0][0].value})."
+        if self.write_keywords:
+            return f"Query contains data-changing keyword(s): {', '.join(sorted(self.write_keywords))}"
+        return None
+
+    def check_catalog(self, catalog: Dict[str, Iterable[str]]) -> List[str]:
+        """Problems with tables/columns not present in ``catalog`` (table -> column names)."""
+        known_tables = {name.lower(): {c.lower() for c in cols} for name, cols in catalog.items()}
+        problems = []
+        unknown_tables = sorted(t for t in self.tables if t not in known_tables)
+        if unknown_tables:
+            problems.append(
+                f"Unknown table(s): {', '.join(unknown_tables)}"
+                + _suggest(unknown_tables, known_tables)
+            )
+        known_columns = set(_IMPLICIT_COLUMNS)
+        for table in self.tables:
+            known_columns |= known_tables.get(table, set())
+        for function in self.table_functions:
+            known_columns |= _TABLE_FUNCTION_COLUMNS.get(function, set())
+        unknown_columns = sorted(
+            c for c in self.columns
+            if c not in known_columns and c not in self.aliases and c not in self.cte_names
+        )
+        if unknown_columns and not unknown_tables:
+            problems.append(
+                f"Unknown column(s): {', '.join(unknown_columns)}"
+                + _suggest(unknown_columns, known_columns)
+            )
+        return problems
+
+    # -- rewriting -----------------------------------------------------------------
+
+    @property
+    def normalized(self) -> str:
+        """Canonical text: comments and extra whitespace removed, keywords upper-cased,
+        trailing semicolon dropped. Identifiers keep their spelling: it names the result columns."""
+        parts: List[str] = []
+        previous: Optional[Token] = None
+        for statement_index, statement in enumerate(self.statements):
+            if statement_index:
+                parts.append("; ")
+                previous = None
+            for token in statement:
+                if token.kind == "word" and token.upper in KEYWORDS and not (
+                    previous is not None and previous.is_keyword("AS")
+                ):
+                    text = token.upper
+                else:
+                    text = token.value
+                if previous is not None and not (
+                    token.value in (")", ",", ".") or previous.value in ("(", ".")
+                    or (token.value == "(" and previous.kind == "word" and previous.upper not in _SPACED_BEFORE_PAREN)
+                ):
+                    parts.append(" ")
+                parts.append(text)
+                previous = token
+        return "".join(parts)
+
+    def with_limit(self, max_rows: int) -> str:
+        """SQL whose outer query returns at most ``max_rows`` rows.
+
+        Adds ``LIMIT`` when the outermost query has none (a ``LIMIT`` inside a
+        subquery or CTE does not count), lowers a larger literal limit, and
+        wraps the query when its limit is not a literal.
+        """
+        if len(self.statements) != 1:
+            raise SQLParseError("LIMIT can only be applied to a single statement.")
+        statement = self.statements[0]
+        body = self.sql[statement[0].start:statement[-1].end]
+        offset = statement[0].start
+        found, count = self._outer_limit()
+        if not found:
+            return f"{body} LIMIT {int(max_rows)}"
+        if count is not None:
+            if int(count.value) <= max_rows:
+                return body
+            return body[:count.start - offset] + str(int(max_rows)) + body[count.end - offset:]
+        return f"SELECT * FROM ({body}) LIMIT {int(max_rows)}"
+
+    @property
+    def limit(self) -> Optional[int]:
+        """Literal row limit of the outermost query, if any."""
+        _, count = self._outer_limit()
+        return int(count.value) if count is not None else None
+
+    def _outer_limit(self) -> Tuple[bool, Optional[Token]]:
+        """Whether the outer query of the first statement has a LIMIT, and its literal count token."""
+        if not self.statements:
+            return False, None
+        statement = self.statements[0]
+        limit_index = None
+        for i, token in enumerate(statement):
+            if token.depth == 0 and token.is_keyword("LIMIT"):
+                limit_index = i
+        if limit_index is None:
+            return False, None
+        clause = statement[limit_index + 1:]
+        stop = next((i for i, t in enumerate(clause) if t.is_keyword("OFFSET")), len(clause))
+        count_tokens = clause[:stop]
+        commas = [i for i, t in enumerate(count_tokens) if t.value == "," and t.depth == 0]
+        if commas:
+            # SQLite's "LIMIT offset, count"
+            count_tokens = count_tokens[commas[0] + 1:]
+        if len(count_tokens) == 1 and count_tokens[0].kind == "number" and count_tokens[0].value.isdigit():
+            return True, count_tokens[0]
+        return True, None
+
+    # -- analysis ------------------------------------------------------------------
+
+    def _analyse(self, tokens: List[Token]):
+        n = len(tokens)
+        structural: Set[int] = set()  # token indexes that name tables, CTEs or aliases
+        select_stack = [False]
+        # Depths of the FROM lists currently open; a subquery in a FROM list opens a nested one
+        from_depths: List[int] = []
+        expect_table = False
+
+        def read_name(i: int) -> Tuple[Optional[str], int]:
+            """Qualified name starting at ``i``; returns (last part, index after it)."""
+            if i >= n or tokens[i].kind not in ("word", "quoted") or tokens[i].is_keyword():
+                return None, i
+            name = _unquote(tokens[i])
+            structural.add(i)
+            i += 1
+            while i + 1 < n and tokens[i].value == "." and tokens[i + 1].kind in ("word", "quoted"):
+                name = _unquote(tokens[i + 1])
+                structural.add(i + 1)
+                i += 2
+            return name.lower(), i
+
+        i = 0
+        while i < n:
+            token = tokens[i]
+            upper = token.upper if token.kind == "word" else None
+
+            if token.value == "(":
+                select_stack.append(False)
+            elif token.value == ")":
+                select_stack.pop()
+                while from_depths and token.depth < from_depths[-1]:
+                    from_depths.pop()
+            elif upper == "SELECT":
+                select_stack[-1] = True
+            elif upper == "WITH":
+                i = self._read_ctes(tokens, i + 1, structural)
+                continue
+            elif upper == "FROM" and select_stack[-1] and not (i and tokens[i - 1].is_keyword("DISTINCT")):
+                from_depths.append(token.depth)
+                expect_table = True
+            elif upper == "JOIN":
+                expect_table = True
+            elif upper in _FROM_END and from_depths and from_depths[-1] == token.depth:
+                from_depths.pop()
+            if upper == "WINDOW":
+                self._read_windows(tokens, i + 1, structural)
+            elif upper == "OVER" and i + 1 < n and tokens[i + 1].kind in ("word", "quoted"):
+                # OVER w: a window defined in the WINDOW clause
+                self.aliases.add(_unquote(tokens[i + 1]).lower())
+                structural.add(i + 1)
+            elif token.value == "," and from_depths and from_depths[-1] == token.depth:
+                expect_table = True
+
+            if expect_table and upper not in ("FROM", "JOIN") and token.value != ",":
+                expect_table = False
+                if token.value != "(":
+                    name, after = read_name(i)
+                    if name is not None:
+                        if after < n and tokens[after].value == "(":
+                            # Table-valued function such as json_each(...)
+                            self.functions.add(name)
+                            self.table_functions.add(name)
+                        else:
+                            self.tables.add(name)
+                            alias_index = after + 1 if after < n and tokens[after].is_keyword("AS") else after
+                            alias = None
+                            if alias_index < n and (
+                                tokens[alias_index].kind == "quoted"
+                                or (tokens[alias_index].kind == "word" and not tokens[alias_index].is_keyword())
+                            ):
+                                alias = _unquote(tokens[alias_index]).lower()
+                            self.table_refs.append((name, token.start, tokens[after - 1].end, alias))
+                        i = after
+                        continue
+            i += 1
+
+        for i, token in enumerate(tokens):
+            if token.kind not in ("word", "quoted") or i in structural:
+                continue
+            if token.kind == "word" and token.is_keyword():
+                continue
+            name = _unquote(token).lower()
+            previous = tokens[i - 1] if i else None
+            following = tokens[i + 1] if i + 1 < n else None
+            if previous is not None and previous.is_keyword("AS"):
+                self.aliases.add(name)
+            elif previous is not None and previous.value != "." and (
+                previous.kind in ("number", "string", "quoted")
+                or previous.value == ")"
+                or (previous.kind == "word" and not previous.is_keyword())
+            ):
+                # Implicit alias: "SUM(x) total", "FROM user_days u"
+                self.aliases.add(name)
+            elif following is not None and following.value == "(":
+                self.functions.add(name)
+            elif following is not None and following.value == ".":
+                continue  # qualifier (table or alias)
+            elif token.kind == "word":
+                # Double-quoted names are left alone: SQLite also reads them as strings
+                self.columns.add(name)
+
+    def _read_windows(self, tokens: List[Token], i: int, structural: Set[int]):
+        """Record the window names of ``WINDOW w AS (...), ...`` as aliases (their bodies are analysed as usual)."""
+        n = len(tokens)
+        while i + 1 < n and tokens[i].kind in ("word", "quoted") and tokens[i + 1].is_keyword("AS"):
+            self.aliases.add(_unquote(tokens[i]).lower())
+            structural.add(i)
+            i += 2
+            if i >= n or tokens[i].value != "(":
+                return
+            depth = tokens[i].depth
+            i += 1
+            while i < n and not (tokens[i].value == ")" and tokens[i].depth == depth):
+                i += 1
+            if i + 1 < n and tokens[i + 1].value == ",":
+                i += 2
+            else:
+                return
+
+    def _read_ctes(self, tokens: List[Token], i: int, structural: Set[int]) -> int:
+        """Record the CTE names of a WITH clause; returns where the main analysis resumes.
+
+        That is the first CTE body, so bodies and the final query are still
+        analysed (CTE names and column lists are marked as structural).
+        """
+        n = len(tokens)
+        if i < n and tokens[i].is_keyword("RECURSIVE"):
+            i += 1
+        resume = None
+        while i < n and tokens[i].kind in ("word", "quoted"):
+            self.cte_names.add(_unquote(tokens[i]).lower())
+            structural.add(i)
+            i += 1
+            if i < n and tokens[i].value == "(":
+                # Column list: its names become aliases
+                depth = tokens[i].depth
+                i += 1
+                while i < n and not (tokens[i].value == ")" and tokens[i].depth == depth):
+                    if tokens[i].kind in ("word", "quoted"):
+                        self.aliases.add(_unquote(tokens[i]).lower())
+                        structural.add(i)
+                    i += 1
+                i += 1
+            while i < n and tokens[i].is_keyword("AS", "NOT", "MATERIALIZED"):
+                i += 1
+            if i >= n or tokens[i].value != "(":
+                break
+            if resume is None:
+                resume = i
+            depth = tokens[i].depth
+            i += 1
+            while i < n and not (tokens[i].value == ")" and tokens[i].depth == depth):
+                i += 1
+            if i + 1 < n and tokens[i + 1].value == ",":
+                i += 2
+            else:
+                break
+        return i if resume is None else resume
+
+
+def _suggest(names: List[str], candidates: Iterable[str]) -> str:
+    candidates = sorted(candidates)
+    hints = []
+    for name in names:
+        match = difflib.get_close_matches(name, candidates, n=1, cutoff=0.75)
+        if match:
+            hints.append(match[0])
+    return f" (did you mean {', '.join(hints)}?)" if hints else ""
+
+
+@lru_cache(maxsize=512)
+def parse_sql(sql: str) -> ParsedQuery:
+    """Parse (and memoize) a query. Raises ``SQLParseError`` for untokenizable text."""
+    return ParsedQuery(sql)
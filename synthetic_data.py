@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Synthetic ``user_days`` generator for benchmarking at production scale.
+
+Simulates a fixed user population day by day, fully vectorised with NumPy:
+every user has a platform, country, install date, spend tier and activity
+propensity; each simulated day samples exactly ``rows / days`` active users
+(weighted by propensity, never before their install date) and updates their
+running state: coin balance, lifetime bookings, last purchase day and a
+7-day activity bitmask for ``engagement_7d``. ``payer_type`` follows the
+dataset rules: the tier name for a purchase in the last 28 days, ``<tier>Lapse``
+within 12 weeks, NULL otherwise (``bookings_lifetime`` keeps lifetime payers
+identifiable).
+
+Output is one day-sized chunk at a time, so memory stays flat at any size:
+
+- SQLite through ``executemany`` in a single transaction with bulk-load pragmas,
+  indexes and ``ANALYZE`` run after the load
+- Parquet through ``pyarrow.parquet.ParquetWriter`` (one row group per day)
+
+The same seed and arguments always produce the same rows.
+
+    python synthetic_data.py --rows 10000000 --db bench.db
+    python synthetic_data.py --rows 100000000 --parquet user_days.parquet
+"""
+
+import argparse
+import math
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+from itertools import repeat
+from typing import Any, Dict, Iterator
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = [
+    "event_day_pst", "user_id", "bookings", "transactions", "bookings_lifetime",
+    "balance_coins_begin", "balance_coins_end", "install_first_date_pst", "country",
+    "payer_type", "slot_spins", "slot_coins_used", "slot_coins_gained", "platform",
+    "engagement_7d",
+]
+
+CREATE_TABLE_SQL = """
+CREATE TABLE {table} (
+    event_day_pst TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    bookings REAL NOT NULL,
+    transactions INTEGER NOT NULL,
+    bookings_lifetime REAL NOT NULL,
+    balance_coins_begin INTEGER NOT NULL,
+    balance_coins_end INTEGER NOT NULL,
+    install_first_date_pst TEXT NOT NULL,
+    country TEXT,
+    payer_type TEXT,
+    slot_spins INTEGER NOT NULL,
+    slot_coins_used INTEGER NOT NULL,
+    slot_coins_gained INTEGER NOT NULL,
+    platform TEXT,
+    engagement_7d INTEGER NOT NULL
+)
+"""
+
+PLATFORMS = np.array(["ios", "android", "amazon", "web", "webstore"], dtype=object)
+PLATFORM_SHARE = [0.36, 0.38, 0.06, 0.15, 0.05]
+
+COUNTRIES = np.array(["US", "CA", "GB", "AU", "DE", "FR", "IL", "PH", "MX", "BR", "IN", "JP", "NZ"], dtype=object)
+COUNTRY_SHARE = [0.58, 0.06, 0.07, 0.05, 0.04, 0.03, 0.02, 0.03, 0.03, 0.03, 0.02, 0.02, 0.02]
+
+# Spend tiers; index 0 never pays. Per-tier: share of users, purchase chance
+# per active day, median purchase (USD), activity boost, median bet (coins).
+TIERS = [None, "Minnow", "Bass", "Dolphin", "Blue", "Orca", "Whale"]
+TIER_SHARE = np.array([0.900, 0.040, 0.025, 0.015, 0.010, 0.006, 0.004])
+TIER_PURCHASE_P = np.array([0.0, 0.05, 0.08, 0.12, 0.18, 0.25, 0.35])
+TIER_PURCHASE_USD = np.array([0.0, 2.0, 5.0, 12.0, 30.0, 80.0, 250.0])
+TIER_ACTIVITY = np.array([1.0, 1.3, 1.5, 1.7, 2.0, 2.2, 2.5])
+TIER_BET = np.array([100, 200, 500, 1_000, 3_000, 8_000, 20_000])
+
+# Non-payers convert to Minnow with this chance per active day
+CONVERSION_P = 0.002
+ACTIVE_WINDOW_DAYS = 28
+LAPSE_WINDOW_DAYS = 84
+COINS_PER_USD = 100_000
+DAILY_BONUS_COINS = 20_000
+SPINS_MEAN = 120.0
+# Share of the population that installs during the simulated window
+IN_WINDOW_INSTALL_SHARE = 0.15
+
+# payer_type labels by code: 0 = NULL, 1..6 = tier, 7..12 = tier + "Lapse"
+PAYER_LABELS = np.array([None] + TIERS[1:] + [f"{t}Lapse" for t in TIERS[1:]], dtype=object)
+# popcount of a 7-bit activity mask
+POPCOUNT = np.array([bin(i).count("1") for i in range(128)], dtype=np.int8)
+
+
+class UserDaysGenerator:
+    """Day-by-day simulation of a user population producing ``user_days`` rows."""
+
+    def __init__(self, rows: int, days: int = 90, end_date: str = "2024-12-31",
+                 seed: int = 42, mean_activity: float = 0.3):
+        if rows <= 0 or days <= 0:
+            raise ValueError("rows and days must be positive")
+        self.rows = rows
+        self.days = days
+        self.end = date.fromisoformat(end_date)
+        self.start = self.end - timedelta(days=days - 1)
+        self.rng = np.random.default_rng(seed)
+        # Enough users that the busiest day can still be filled from installed users
+        self.users = max(int(math.ceil(rows / days / mean_activity / (1 - IN_WINDOW_INSTALL_SHARE))), 1)
+        self._init_population()
+
+    def _init_population(self):
+        rng, n = self.rng, self.users
+        self.platform = rng.choice(len(PLATFORMS), size=n, p=PLATFORM_SHARE).astype(np.int8)
+        self.country = rng.choice(len(COUNTRIES), size=n, p=COUNTRY_SHARE).astype(np.int8)
+        self.tier = rng.choice(len(TIERS), size=n, p=TIER_SHARE).astype(np.int8)
+
+        # Install day relative to the window start (negative = before the window)
+        tenure = np.minimum(rng.exponential(500.0, size=n), 3650).astype(np.int32) + 1
+        in_window = rng.random(n) < IN_WINDOW_INSTALL_SHARE
+        self.install_day = np.where(in_window, rng.integers(0, self.days, size=n), -tenure).astype(np.int32)
+
+        self.activity = rng.beta(0.6, 1.4, size=n) * TIER_ACTIVITY[self.tier]
+
+        # History before the window: payers get lifetime spend and a last purchase
+        payer = self.tier > 0
+        self.last_purchase = np.full(n, -10_000, dtype=np.int32)
+        days_ago = rng.exponential(30.0, size=n).astype(np.int32) + 1
+        had_history = payer & (self.install_day < 0)
+        self.last_purchase[had_history] = -np.minimum(days_ago[had_history], -self.install_day[had_history])
+        self.lifetime = np.zeros(n, dtype=np.float64)
+        self.lifetime[had_history] = np.round(
+            TIER_PURCHASE_USD[self.tier[had_history]]
+            * rng.lognormal(2.0, 1.0, size=int(had_history.sum())), 2
+        )
+
+        self.balance = rng.lognormal(11.0, 1.5, size=n).astype(np.int64)
+        # Bit i set = active i+1 days before the current day; seeded from the
+        # propensity for users installed before the window
+        self.mask = np.zeros(n, dtype=np.uint8)
+        existing = self.install_day < 0
+        p_active = np.minimum(self.activity, 1.0)
+        for bit in range(6):
+            self.mask |= ((rng.random(n) < p_active) & existing).astype(np.uint8) << bit
+
+        # ISO date strings for every install day, looked up by offset
+        self._install_offset = int(self.install_day.min())
+        self._date_strings = np.array(
+            [(self.start + timedelta(days=d)).isoformat() for d in range(self._install_offset, self.days)],
+            dtype=object,
+        )
+
+    def _rows_on(self, day: int) -> int:
+        base, extra = divmod(self.rows, self.days)
+        return base + (1 if day < extra else 0)
+
+    def iter_days(self) -> Iterator[Dict[str, Any]]:
+        """Yield one dict of column arrays per simulated day, in date order."""
+        rng = self.rng
+        for day in range(self.days):
+            # Weighted sampling without replacement (Efraimidis-Spirakis keys)
+            eligible = self.install_day <= day
+            weights = np.where(eligible, self.activity, 0.0)
+            k = min(self._rows_on(day), int(eligible.sum()))
+            with np.errstate(divide="ignore"):
+                keys = np.log(rng.random(self.users)) / weights
+            idx = np.sort(np.argpartition(-keys, k - 1)[:k]) if k else np.empty(0, dtype=np.int64)
+
+            active = np.zeros(self.users, dtype=np.uint8)
+            active[idx] = 1
+            self.mask = ((self.mask << 1) & 0x7E).astype(np.uint8) | active
+            engagement = POPCOUNT[self.mask[idx]]
+
+            tier = self.tier[idx]
+            convert = (tier == 0) & (rng.random(k) < CONVERSION_P)
+            tier = np.where(convert, 1, tier).astype(np.int8)
+            self.tier[idx] = tier
+
+            purchased = rng.random(k) < np.where(convert, 1.0, TIER_PURCHASE_P[tier])
+            amount = np.maximum(np.round(TIER_PURCHASE_USD[tier] * rng.lognormal(0.0, 0.8, size=k), 2), 0.99)
+            bookings = np.where(purchased, amount, 0.0)
+            transactions = np.where(purchased, 1 + rng.poisson(0.3 * tier), 0).astype(np.int32)
+            self.lifetime[idx] += bookings
+            self.last_purchase[idx] = np.where(purchased, day, self.last_purchase[idx])
+
+            since = day - self.last_purchase[idx]
+            payer_code = np.where(
+                (tier > 0) & (since <= ACTIVE_WINDOW_DAYS), tier,
+                np.where((tier > 0) & (since <= LAPSE_WINDOW_DAYS), tier + 6, 0),
+            )
+
+            begin = self.balance[idx] + DAILY_BONUS_COINS
+            available = begin + (bookings * COINS_PER_USD).astype(np.int64)
+            spins = rng.poisson(rng.gamma(1.5, SPINS_MEAN * TIER_ACTIVITY[tier] / 1.5)).astype(np.int64)
+            bet = (TIER_BET[tier] * rng.lognormal(0.0, 0.5, size=k)).astype(np.int64) + 1
+            # Spins stop when the balance runs out
+            used = np.minimum(spins * bet, available)
+            spins = np.minimum(spins, -(-used // bet))
+            gained = (used * np.clip(rng.normal(0.94, 0.15, size=k), 0.0, 3.0)).astype(np.int64)
+            end = available - used + gained
+            self.balance[idx] = end
+
+            yield {
+                "day": self.start + timedelta(days=day),
+                "user_id": idx.astype(np.int64) + 1,
+                "bookings": bookings,
+                "transactions": transactions,
+                "bookings_lifetime": np.round(self.lifetime[idx], 2),
+                "balance_coins_begin": begin,
+                "balance_coins_end": end,
+                "install_first_date_pst": self._date_strings[self.install_day[idx] - self._install_offset],
+                "country": COUNTRIES[self.country[idx]],
+                "payer_type": PAYER_LABELS[payer_code],
+                "slot_spins": spins,
+                "slot_coins_used": used,
+                "slot_coins_gained": gained,
+                "platform": PLATFORMS[self.platform[idx]],
+                "engagement_7d": engagement,
+            }
+
+
+def _sqlite_rows(chunk: Dict[str, Any]) -> Iterator[tuple]:
+    """Row tuples for executemany (``tolist()`` converts to Python scalars in C)."""
+    day = chunk["day"].isoformat()
+    return zip(repeat(day, len(chunk["user_id"])), *(chunk[c].tolist() for c in COLUMNS[1:]))
+
+
+def write_sqlite(path: str, rows: int, table: str = "user_days", replace: bool = False,
+                 indexes: bool = True, **generator_args) -> Dict[str, Any]:
+    """Generate ``rows`` rows straight into a SQLite table. Returns load statistics."""
+    started = time.perf_counter()
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        for pragma in (
+            "journal_mode = OFF", "synchronous = OFF", "temp_store = MEMORY",
+            "cache_size = -262144", "locking_mode = EXCLUSIVE",
+        ):
+            conn.execute(f"PRAGMA {pragma}")
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).fetchone()
+        if exists and not replace:
+            raise ValueError(f"Table {table} already exists in {path}; pass replace=True to overwrite it.")
+
+        conn.execute("BEGIN")
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.execute(CREATE_TABLE_SQL.format(table=table))
+        insert = f"INSERT INTO {table} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        written = 0
+        for chunk in UserDaysGenerator(rows, **generator_args).iter_days():
+            conn.executemany(insert, _sqlite_rows(chunk))
+            written += len(chunk["user_id"])
+        conn.execute("COMMIT")
+        load_s = time.perf_counter() - started
+
+        if indexes:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_day ON {table} (event_day_pst)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user ON {table} (user_id)")
+            conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    total_s = time.perf_counter() - started
+    return {"rows": written, "load_s": round(load_s, 2), "total_s": round(total_s, 2),
+            "rows_per_s": round(written / load_s) if load_s else None, "path": path}
+
+
+def write_parquet(path: str, rows: int, compression: str = "zstd", **generator_args) -> Dict[str, Any]:
+    """Generate ``rows`` rows into a Parquet file, one row group per day (requires pyarrow)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    started = time.perf_counter()
+    writer = None
+    written = 0
+    try:
+        for chunk in UserDaysGenerator(rows, **generator_args).iter_days():
+            n = len(chunk["user_id"])
+            columns = {"event_day_pst": pa.array(np.full(n, np.datetime64(chunk["day"], "D")))}
+            for name in COLUMNS[1:]:
+                values = chunk[name]
+                if name == "install_first_date_pst":
+                    columns[name] = pa.array(values.astype("datetime64[D]"))
+                elif values.dtype == object:
+                    columns[name] = pa.array(values, type=pa.string()).dictionary_encode()
+                else:
+                    columns[name] = pa.array(values)
+            table = pa.table(columns)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression=compression)
+            writer.write_table(table)
+            written += n
+    finally:
+        if writer is not None:
+            writer.close()
+    elapsed = time.perf_counter() - started
+    return {"rows": written, "total_s": round(elapsed, 2),
+            "rows_per_s": round(written / elapsed) if elapsed else None, "path": path}
+
+
+def generate_frame(rows: int, **generator_args):
+    """Small samples as a single pandas DataFrame (demo data)."""
+    frames = []
+    for chunk in UserDaysGenerator(rows, **generator_args).iter_days():
+        frame = pd.DataFrame({c: chunk[c] for c in COLUMNS[1:]})
+        frame.insert(0, "event_day_pst", chunk["day"].isoformat())
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic user_days table")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--end-date", default="2024-12-31", help="Last event_day_pst (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=42)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--db", help="SQLite database file to load (default: synthetic.db)")
+    target.add_argument("--parquet", help="Write a Parquet file instead of loading SQLite")
+    parser.add_argument("--table", default="user_days")
+    parser.add_argument("--replace", action="store_true", help="Overwrite an existing table")
+    parser.add_argument("--no-index", action="store_true", help="Skip index creation and ANALYZE")
+    args = parser.parse_args(argv)
+
+    generator_args = {"days": args.days, "end_date": args.end_date, "seed": args.seed}
+    if args.parquet:
+        stats = write_parquet(args.parquet, args.rows, **generator_args)
+    else:
+        db_path = args.db or "synthetic.db"
+        if os.path.abspath(db_path) == os.path.abspath("analytics.db") and not args.replace:
+            parser.error("refusing to write into analytics.db without --replace")
+        stats = write_sqlite(db_path, args.rows, table=args.table, replace=args.replace,
+                             indexes=not args.no_index, **generator_args)
+    print(", ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
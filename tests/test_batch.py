@@ -0,0 +1,27 @@
+import json
+
+import pytest
+
+from batch import _slug, load_questions
+
+
+def _write(tmp_path, items):
+    path = tmp_path / "questions.jsonl"
+    path.write_text("\n".join(json.dumps(item) for item in items), encoding="utf-8")
+    return str(path)
+
+
+def test_ids_that_slug_alike_get_distinct_file_names():
+    assert _slug("weekly_dau") == "weekly_dau"
+    assert len({_slug("a/b"), _slug("a b"), _slug("a_b")}) == 3
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    path = _write(tmp_path, [{"id": "dau", "question": "DAU?"}, {"id": "dau", "question": "MAU?"}])
+    with pytest.raises(ValueError, match="dau"):
+        load_questions(path)
+
+
+def test_missing_ids_are_numbered(tmp_path):
+    path = _write(tmp_path, [{"question": "DAU?"}, {"question": "MAU?", "sql": "SELECT 1"}])
+    assert [(q["id"], q["sql"]) for q in load_questions(path)] == [("q001", None), ("q002", "SELECT 1")]
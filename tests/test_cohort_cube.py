@@ -0,0 +1,63 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from cohort_cube import CohortRouter, build_cube
+
+FIRST_DAY = date(2024, 1, 1)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """user_days over 60 days, where every fourth user has no install date."""
+    path = tmp_path / "analytics.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE user_days (user_id INTEGER, event_day_pst TEXT, install_first_date_pst TEXT, "
+        "payer_type TEXT, platform TEXT, bookings REAL, transactions INTEGER, bookings_lifetime REAL)"
+    )
+    rows = []
+    for user in range(40):
+        installed = FIRST_DAY + timedelta(days=user)
+        for day in range(user, 60, 3):
+            rows.append((
+                user, (FIRST_DAY + timedelta(days=day)).isoformat(),
+                None if user % 4 == 0 else installed.isoformat(),
+                "Whale" if user % 5 == 0 else None, "ios" if user % 2 else "android",
+                float(user % 7), user % 3, float(user),
+            ))
+    conn.executemany("INSERT INTO user_days VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    build_cube(str(path))
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def router(conn):
+    return CohortRouter(lambda sql: conn.execute(sql).fetchall())
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT platform, SUM(bookings) FROM user_days GROUP BY platform",
+    "SELECT julianday(event_day_pst) - julianday(install_first_date_pst) AS dsi, SUM(bookings) "
+    "FROM user_days GROUP BY dsi",
+    "SELECT platform, SUM(bookings) FROM user_days WHERE install_first_date_pst IS NULL GROUP BY platform",
+    "SELECT platform, SUM(bookings) FROM user_days "
+    "WHERE install_first_date_pst >= '2024-01-01' OR platform = 'ios' GROUP BY platform",
+])
+def test_queries_that_keep_rows_without_install_date_are_not_routed(router, sql):
+    assert router.route(sql) is None
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT platform, SUM(bookings) FROM user_days WHERE install_first_date_pst >= '2024-01-01' GROUP BY platform",
+    "SELECT julianday(event_day_pst) - julianday(install_first_date_pst) AS dsi, SUM(bookings), COUNT(*) "
+    "FROM user_days WHERE julianday(event_day_pst) - julianday(install_first_date_pst) <= 14 GROUP BY dsi",
+])
+def test_routed_queries_match_the_scan(conn, router, sql):
+    routed = router.route(sql)
+    assert routed is not None and "cohort_cube" in routed
+    expected = sorted(conn.execute(sql).fetchall())
+    assert sorted(conn.execute(routed).fetchall()) == expected
@@ -0,0 +1,106 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+import multi_question
+
+from cache import result_fingerprint
+from config import Config
+from conversation import PREV_RESULT, Conversation
+from pipeline import PipelineError, clean_result
+from sql_parser import parse_sql
+
+
+class FakeClient:
+    """Answers with queued SQL and runs it on an in-memory user_days."""
+
+    def __init__(self, conn, sql, store_fails=False, estimate=None):
+        self.conn = conn
+        self.sql = list(sql)
+        self.store_fails = store_fails
+        self.cost = estimate
+        self.stored = {}
+        self.executed = []
+
+    def generate_sql(self, question, custom_prompt=None, schema_prompt=False, extra_tables=None):
+        return self.sql.pop(0)
+
+    def estimate(self, sql):
+        return self.cost
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        df = clean_result(pd.read_sql_query(sql, self.conn))
+        return df, self.store_result(df, force=True)
+
+    def store_result(self, df, force=False):
+        if self.store_fails and not force:
+            raise PipelineError("Request body too large")
+        fingerprint = result_fingerprint(df)
+        self.stored[fingerprint] = df
+        return fingerprint
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.execute("CREATE TABLE user_days (user_id INTEGER, event_day_pst TEXT, platform TEXT, bookings REAL)")
+    conn.executemany("INSERT INTO user_days VALUES (?, ?, ?, ?)", [
+        (user, f"2024-01-0{day}", "ios" if user % 2 else "android", float(user * day))
+        for user in range(20) for day in range(1, 4)
+    ])
+    yield conn
+    conn.close()
+
+
+SQL = [
+    "SELECT platform, event_day_pst, SUM(bookings) AS bookings FROM user_days GROUP BY 1, 2",
+    f"SELECT event_day_pst, bookings FROM {PREV_RESULT} WHERE platform = 'ios';",
+    f"WITH top AS (SELECT * FROM {PREV_RESULT} ORDER BY bookings DESC LIMIT 2) SELECT SUM(bookings) AS total FROM top",
+]
+
+
+def test_follow_ups_are_stored_and_replayable_without_the_session(conn):
+    client = FakeClient(conn, SQL)
+    conversation = Conversation(client)
+    for question in ("bookings by platform and day", "now just ios", "top two days"):
+        df, turn = conversation.ask(question)
+        assert turn["fingerprint"] in client.stored
+        assert parse_sql(turn["replay_sql"]).tables == {"user_days"}
+        replayed = clean_result(pd.read_sql_query(turn["replay_sql"], conn))
+        pd.testing.assert_frame_equal(replayed.astype(object), df.astype(object))
+    assert turn["source"] == PREV_RESULT and turn["sql"] == SQL[2]
+    assert client.executed == [SQL[0]]
+
+
+def test_follow_up_too_large_to_store_is_computed_by_the_client(conn):
+    client = FakeClient(conn, SQL[:2], store_fails=True)
+    conversation = Conversation(client)
+    conversation.ask("bookings by platform and day")
+    _, turn = conversation.ask("now just ios")
+    assert turn["source"] == PREV_RESULT
+    assert client.executed[-1] == turn["replay_sql"]
+    assert turn["fingerprint"] in client.stored
+
+
+EXPENSIVE = {"level": "confirm", "rows_scanned": 50_000_000, "est_ms": 30_000, "full_scan": True,
+             "full_scan_tables": ["user_days"], "date_range": None, "narrowed_sql": SQL[0] + " LIMIT 1",
+             "narrowed_days": 30, "narrowed_rows_scanned": 1_000_000}
+
+
+@pytest.mark.parametrize("policy, executed", [("confirm", None), ("narrow", SQL[0] + " LIMIT 1"), ("warn", SQL[0])])
+def test_unattended_queries_pass_the_cost_guardrail(conn, monkeypatch, policy, executed):
+    monkeypatch.setattr(Config, "COST_POLICY", policy)
+    client = FakeClient(conn, [SQL[0]] * 2, estimate=dict(EXPENSIVE))
+    result = next(multi_question.run_questions(client, ["bookings by platform and day"]))
+    assert result["sql"] == (executed or SQL[0])
+    assert (result["error"] is not None) == (executed is None)
+
+    conversation = Conversation(client)
+    if executed is None:
+        with pytest.raises(PipelineError, match="Expensive query"):
+            conversation.ask("bookings by platform and day")
+    else:
+        assert conversation.ask("bookings by platform and day")[1]["sql"] == executed
+    assert client.executed == ([executed] * 2 if executed else [])
@@ -0,0 +1,76 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from cost_estimator import COVERING_INDEX_FACTOR, CostEstimator
+
+FIRST_DAY = date(2024, 11, 1)
+DAYS = 61  # 2024-11-01 .. 2024-12-31
+ROWS_PER_DAY = 10
+
+
+@pytest.fixture
+def estimator():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE user_days (user_id INTEGER, event_day_pst TEXT, platform TEXT, bookings REAL)")
+    conn.executemany(
+        "INSERT INTO user_days VALUES (?, ?, ?, ?)",
+        [
+            (user, (FIRST_DAY + timedelta(days=day)).isoformat(), "ios" if user % 2 else "android", 1.0)
+            for day in range(DAYS)
+            for user in range(ROWS_PER_DAY)
+        ],
+    )
+    conn.execute("CREATE INDEX idx_day ON user_days (event_day_pst)")
+    return CostEstimator(lambda sql: conn.execute(sql).fetchall())
+
+
+def test_and_bounds_narrow_the_range(estimator):
+    sql = ("SELECT COUNT(*) FROM user_days "
+           "WHERE event_day_pst >= '2024-12-01' AND platform = 'ios' AND event_day_pst < '2024-12-08'")
+    assert estimator.date_range(sql) == (date(2024, 12, 1), date(2024, 12, 7))
+
+
+def test_bounds_in_parenthesised_conjunct_narrow_the_range(estimator):
+    sql = ("SELECT COUNT(*) FROM user_days WHERE (platform = 'ios' OR platform = 'web') "
+           "AND (event_day_pst BETWEEN '2024-12-01' AND '2024-12-07')")
+    assert estimator.date_range(sql) == (date(2024, 12, 1), date(2024, 12, 7))
+
+
+@pytest.mark.parametrize("where", [
+    "event_day_pst >= '2024-12-30' OR event_day_pst <= '2024-12-01'",
+    "event_day_pst = '2024-12-30' OR event_day_pst = '2024-11-01'",
+    "event_day_pst = '2024-11-05' OR platform = 'ios'",
+    "(event_day_pst >= '2024-12-01' OR platform = 'ios') AND bookings > 0",
+    "NOT event_day_pst >= '2024-12-01'",
+    "NOT (platform = 'ios' AND event_day_pst >= '2024-12-01')",
+])
+def test_or_and_not_bounds_use_the_full_table(estimator, where):
+    sql = f"SELECT COUNT(*) FROM user_days WHERE {where}"
+    assert estimator.date_range(sql) is None
+    estimate = estimator.estimate(sql)
+    assert estimate["date_range"] is None
+    # The whole table is read (through the day index when SQLite uses it as a covering index)
+    assert estimate["rows_scanned"] >= int(COVERING_INDEX_FACTOR * DAYS * ROWS_PER_DAY)
+
+
+def test_or_elsewhere_keeps_an_and_bound(estimator):
+    sql = ("SELECT COUNT(*) FROM user_days "
+           "WHERE event_day_pst >= '2024-12-01' AND (platform = 'ios' OR event_day_pst = '2024-11-02')")
+    assert estimator.date_range(sql) == (date(2024, 12, 1), None)
+
+
+def test_is_not_null_is_not_a_boolean_not(estimator):
+    sql = "SELECT COUNT(*) FROM user_days WHERE platform IS NOT NULL AND event_day_pst >= '2024-12-01'"
+    assert estimator.date_range(sql) == (date(2024, 12, 1), None)
+
+
+def test_case_condition_is_not_a_filter(estimator):
+    sql = "SELECT SUM(CASE WHEN event_day_pst >= '2024-12-01' THEN bookings END) FROM user_days"
+    assert estimator.date_range(sql) is None
+
+
+def test_single_day_estimate_scans_about_one_day(estimator):
+    estimate = estimator.estimate("SELECT COUNT(*) FROM user_days WHERE event_day_pst = '2024-12-01'")
+    assert 0 < estimate["rows_scanned"] <= 2 * ROWS_PER_DAY
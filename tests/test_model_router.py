@@ -0,0 +1,105 @@
+import pytest
+
+import model_router
+from benchmarks.app_load import SQL_ANCHOR, StubLLM
+from config import Config
+from model_router import (COMPLEX, FAST, MIN_ADAPTIVE_TIMEOUT_SECONDS, MIN_SAMPLES, SIMPLE, STRONG,
+                          ModelRouter, classify)
+
+DEAD = "dead@http://127.0.0.1:1"
+MESSAGES = [{"role": "user", "content": f"{SQL_ANCHOR} DAU yesterday"}]
+
+
+@pytest.fixture
+def stub_url(monkeypatch):
+    stub = StubLLM(first_token_ms=5, tokens_per_second=100_000, jitter=0)
+    url = stub.start()
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(Config, "OPENAI_BASE_URL", url)
+    monkeypatch.setattr(Config, "LLM_FAST_MODELS", "")
+    monkeypatch.setattr(Config, "LLM_FALLBACK_MODELS", "")
+    monkeypatch.setattr(Config, "LLM_TRIP_ERRORS", 3)
+    monkeypatch.setattr(Config, "LLM_COOLDOWN_SECONDS", 60)
+    monkeypatch.setattr(model_router, "_router", None)
+    yield url
+    stub.stop()
+
+
+def _names(plan):
+    return [route.name for route, _ in plan[2]]
+
+
+@pytest.mark.parametrize("question, tokens, expected", [
+    ("DAU yesterday", 100, (SIMPLE, "template")),
+    (None, 100, (SIMPLE, "template")),
+    ("7-day retention by install cohort", 100, (COMPLEX, "term:retention")),
+    ("revenue " * 30, 100, (COMPLEX, "long_question")),
+    ("DAU yesterday", 10_000, (COMPLEX, "prompt_size")),
+])
+def test_classify(question, tokens, expected):
+    assert classify(question, tokens) == expected
+
+
+def test_simple_requests_try_fast_routes_first_and_complex_ones_skip_them(stub_url, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_FAST_MODELS", "quick")
+    monkeypatch.setattr(Config, "LLM_FALLBACK_MODELS", "backup")
+    router = ModelRouter()
+    assert _names(router.plan("sql", MESSAGES, "DAU yesterday")) == ["quick", Config.CASINO_SQL_MODEL, "backup"]
+    tier, reason, candidates = router.plan("sql", MESSAGES, "retention by cohort")
+    assert (tier, reason) == (COMPLEX, "term:retention")
+    assert [route.tier for route, _ in candidates] == [STRONG, STRONG]
+
+
+def test_failed_route_falls_through_to_the_next(stub_url, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_FAST_MODELS", DEAD)
+    router = ModelRouter()
+    result = router.complete("sql", MESSAGES, 100, 0.1, question="DAU yesterday")
+    assert result["route"] == Config.CASINO_SQL_MODEL
+    assert result["content"]
+    dead = router.routes["sql"][0]
+    assert dead.tier == FAST and dead.snapshot()["errors"] == 1
+
+
+def test_route_cools_down_after_errors_in_a_row(stub_url, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_FAST_MODELS", DEAD)
+    monkeypatch.setattr(Config, "LLM_TRIP_ERRORS", 2)
+    router = ModelRouter()
+    for _ in range(2):
+        router.complete("sql", MESSAGES, 100, 0.1, question="DAU yesterday")
+    dead = router.routes["sql"][0]
+    assert dead.cooling_down
+    assert _names(router.plan("sql", MESSAGES, "DAU yesterday"))[-1] == dead.name
+
+
+def test_route_that_only_fails_goes_behind_healthy_routes_after_cooldown(stub_url, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_FAST_MODELS", DEAD)
+    monkeypatch.setattr(Config, "LLM_COOLDOWN_SECONDS", 0)
+    router = ModelRouter()
+    for _ in range(MIN_SAMPLES):
+        router.complete("sql", MESSAGES, 100, 0.1, question="DAU yesterday")
+    dead = router.routes["sql"][0]
+    assert not dead.cooling_down
+    assert dead.score(dead.snapshot()) == float("inf")
+
+    assert _names(router.plan("sql", MESSAGES, "DAU yesterday")) == [Config.CASINO_SQL_MODEL, dead.name]
+
+
+def test_budget_of_a_route_that_only_fails_shrinks_when_it_has_a_successor(stub_url, monkeypatch):
+    monkeypatch.setattr(Config, "LLM_FAST_MODELS", DEAD)
+    router = ModelRouter()
+    dead = router.routes["sql"][0]
+    for _ in range(MIN_SAMPLES):
+        dead.observe(dead.timeout * 1000, error="timeout")
+    stats = dead.snapshot()
+    assert dead.budget(stats, has_successor=True) == MIN_ADAPTIVE_TIMEOUT_SECONDS
+    assert dead.budget(stats, has_successor=False) == dead.timeout
+
+
+def test_budget_counts_failed_calls(stub_url):
+    route = ModelRouter().routes["sql"][0]
+    for _ in range(10):
+        route.observe(1000)
+    assert route.budget(route.snapshot(), has_successor=True) == MIN_ADAPTIVE_TIMEOUT_SECONDS
+    for _ in range(2):
+        route.observe(20_000, error="timeout")
+    assert route.budget(route.snapshot(), has_successor=True) == min(route.timeout, 60)
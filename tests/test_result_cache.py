@@ -0,0 +1,136 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import cache
+import ingest
+import pipeline
+from config import Config
+
+FIRST_DAY = date(2024, 10, 1)
+DAYS = 10
+
+
+def _day_rows(day: str, bookings: float) -> pd.DataFrame:
+    return pd.DataFrame({
+        "user_id": [1, 2, 3],
+        "event_day_pst": [day] * 3,
+        "platform": ["ios", "android", "web"],
+        "bookings": [bookings] * 3,
+    })
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """A small user_days database loaded by one refresh, wired into the pipeline."""
+    db_path = tmp_path / "analytics.db"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE user_days (user_id INTEGER, event_day_pst TEXT, platform TEXT, bookings REAL)")
+    conn.close()
+
+    monkeypatch.setattr(Config, "DATABASE_URL", f"sqlite:///{db_path}")
+    monkeypatch.setattr(Config, "DATABASE_TYPE", "sqlite")
+    monkeypatch.setattr(Config, "DB_DOWNLOAD_URL", "")
+    monkeypatch.setattr(Config, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(Config, "DATA_VERSION_CHECK_SECONDS", -1)
+    monkeypatch.setattr(Config, "SEGMENT_INDEX_ENABLED", False)
+    monkeypatch.setattr(Config, "COHORT_CUBE_ENABLED", False)
+    monkeypatch.setattr(cache, "_cache", None)
+    for name in ("_db_manager", "_cost_estimator", "_partition_planner", "_cohort_router", "_segment_index"):
+        monkeypatch.setattr(pipeline, name, None)
+    monkeypatch.setattr(pipeline, "_catalog", (0.0, {}))
+    monkeypatch.setattr(pipeline, "_data_version", (0.0, 0, []))
+
+    deltas = tmp_path / "deltas"
+    for offset in range(DAYS):
+        ingest.publish_day(str(deltas), _day_rows((FIRST_DAY + timedelta(days=offset)).isoformat(), 1.0))
+    ingest.refresh(str(db_path), str(deltas))
+    return db_path, deltas
+
+
+def _restate(db_path, deltas, day: str, bookings: float):
+    ingest.publish_day(str(deltas), _day_rows(day, bookings))
+    report = ingest.refresh(str(db_path), str(deltas))
+    assert report["restated"] == [day]
+
+
+def _total(sql: str) -> float:
+    return float(pipeline.execute_sql(sql).iloc[0, 0])
+
+
+@pytest.mark.parametrize("where, restated", [
+    # Once recorded as 2024-10-05..2024-10-05
+    ("event_day_pst = '2024-10-05' OR platform = 'ios'", "2024-10-02"),
+    # Once recorded as the inverted range 2024-10-09..2024-10-05
+    ("event_day_pst = '2024-10-09' OR event_day_pst = '2024-10-05'", "2024-10-05"),
+    ("NOT event_day_pst >= '2024-10-03'", "2024-10-02"),
+])
+def test_restating_a_day_outside_or_bounds_invalidates_the_entry(database, where, restated):
+    sql = f"SELECT SUM(bookings) FROM user_days WHERE {where}"
+    before = _total(sql)
+    # Entries whose day bounds sit under OR/NOT depend on every day
+    assert pipeline._result_days(sql) is None
+    _restate(*database, restated, 100.0)
+    assert pipeline._cached_query_result(sql) is None
+    assert _total(sql) != before
+
+
+def test_restating_a_day_outside_and_bounds_keeps_the_entry(database):
+    sql = "SELECT SUM(bookings) FROM user_days WHERE event_day_pst >= '2024-10-05' AND event_day_pst <= '2024-10-06'"
+    assert pipeline._result_days(sql) == ["2024-10-05", "2024-10-06"]
+    before = _total(sql)
+    _restate(*database, "2024-10-02", 100.0)
+    assert pipeline._cached_query_result(sql) is not None
+    assert _total(sql) == before
+
+
+def test_restating_a_day_inside_and_bounds_invalidates_the_entry(database):
+    sql = "SELECT SUM(bookings) FROM user_days WHERE event_day_pst BETWEEN '2024-10-01' AND '2024-10-03'"
+    before = _total(sql)
+    _restate(*database, "2024-10-02", 100.0)
+    assert pipeline._cached_query_result(sql) is None
+    assert _total(sql) != before
+
+
+def test_contradictory_bounds_are_not_recorded(database):
+    sql = "SELECT COUNT(*) FROM user_days WHERE event_day_pst >= '2024-10-08' AND event_day_pst <= '2024-10-02'"
+    assert pipeline._result_days(sql) is None
+
+
+def test_local_client_stores_results_for_history_reruns(database, monkeypatch):
+    from service_client import LocalQueryClient
+
+    sql = "SELECT platform, COUNT(*) AS n FROM user_days GROUP BY platform"
+    df, fingerprint = LocalQueryClient().execute(sql)
+    assert pipeline.load_result(fingerprint) is not None
+    # Even without the query cache entry, the re-run does not touch the database
+    monkeypatch.setattr(pipeline, "_cached_query_result", lambda sql_query: None)
+    monkeypatch.setattr(pipeline, "execute_sql", lambda *args, **kwargs: pytest.fail("executed"))
+    rerun, cached = pipeline.rerun_query(sql, fingerprint)
+    assert cached and rerun.equals(df)
+
+
+def test_results_over_the_row_cap_are_not_stored(database, monkeypatch):
+    monkeypatch.setattr(Config, "RESULT_CACHE_MAX_ROWS", 2)
+    df = pipeline.execute_sql("SELECT * FROM user_days")
+    fingerprint = pipeline.store_result(df)
+    assert fingerprint and pipeline.load_result(fingerprint) is None
+    assert pipeline.load_result(pipeline.store_result(df.head(2))) is not None
+
+
+@pytest.mark.parametrize("first, second", [
+    ("SELECT platform FROM user_days", "SELECT Platform FROM user_days"),
+    ("SELECT SUM(bookings) FROM user_days", "SELECT sum(bookings) FROM user_days"),
+    ("SELECT SUM(bookings) FROM user_days", "SELECT SUM( bookings ) FROM user_days"),
+])
+def test_queries_naming_columns_differently_do_not_share_an_entry(database, first, second):
+    assert pipeline.query_cache_key(first) != pipeline.query_cache_key(second)
+    pipeline.execute_sql(first)
+    assert list(pipeline.execute_sql(second).columns) == list(pipeline.execute_sql(second, use_cache=False).columns)
+
+
+def test_formatting_and_keyword_case_share_an_entry():
+    assert pipeline.query_cache_key("select platform\n  from user_days where bookings > 0 -- x") == \
+        pipeline.query_cache_key("SELECT platform FROM user_days WHERE bookings > 0;")
@@ -0,0 +1,106 @@
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from segment_index import SegmentIndex, build_segments
+
+FIRST_DAY = date(2024, 1, 1)
+
+INTERSECTING = [
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE payer_type = 'Whale' AND platform = 'ios'",
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE NOT platform = 'ios'",
+    "SELECT platform, COUNT(DISTINCT user_id) FROM user_days WHERE payer_type = 'Whale' GROUP BY platform",
+    "SELECT platform, payer_type, COUNT(DISTINCT user_id) FROM user_days GROUP BY platform, payer_type",
+]
+UNIONS = [
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE payer_type = 'Whale' OR platform = 'ios'",
+    "SELECT platform, COUNT(DISTINCT user_id) FROM user_days GROUP BY platform",
+    "SELECT event_day_pst, COUNT(DISTINCT user_id) FROM user_days WHERE platform = 'ios' "
+    "GROUP BY event_day_pst ORDER BY event_day_pst",
+]
+
+
+def _database(tmp_path, rows_per_user_day):
+    """user_days over 20 days; with two rows per user and day, each row has one of the user's platforms."""
+    path = tmp_path / "analytics.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE user_days (user_id INTEGER, event_day_pst TEXT, payer_type TEXT, "
+        "platform TEXT, country TEXT, engagement_7d INTEGER)"
+    )
+    rows = []
+    for user in range(50):
+        for day in range(user % 3, 20, 2):
+            for row in range(rows_per_user_day):
+                rows.append((
+                    user, (FIRST_DAY + timedelta(days=day)).isoformat(),
+                    "Whale" if (user + row) % 4 == 0 else "Non-payer",
+                    "ios" if (user + row) % 2 else "android", "US", day % 7,
+                ))
+    conn.executemany("INSERT INTO user_days VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    build_segments(str(path))
+    return conn
+
+
+def _index(conn):
+    return SegmentIndex(lambda sql: conn.execute(sql).fetchall())
+
+
+def _rows(df):
+    return sorted(tuple(row) for row in df.itertuples(index=False))
+
+
+@pytest.mark.parametrize("sql", INTERSECTING + UNIONS)
+def test_answers_match_the_scan_with_one_row_per_user_and_day(tmp_path, sql):
+    conn = _database(tmp_path, 1)
+    answer = _index(conn).answer(sql)
+    assert answer is not None
+    assert _rows(answer) == sorted(conn.execute(sql).fetchall())
+
+
+@pytest.mark.parametrize("sql", INTERSECTING)
+def test_intersections_are_refused_with_several_rows_per_user_and_day(tmp_path, sql):
+    conn = _database(tmp_path, 2)
+    assert _index(conn).plan(sql) is None
+
+
+@pytest.mark.parametrize("sql", UNIONS)
+def test_unions_match_the_scan_with_several_rows_per_user_and_day(tmp_path, sql):
+    conn = _database(tmp_path, 2)
+    answer = _index(conn).answer(sql)
+    assert answer is not None
+    assert _rows(answer) == sorted(conn.execute(sql).fetchall())
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(DISTINCT user_id) FROM user_days "
+    "WHERE event_day_pst = '2024-01-05' AND payer_type = 'Whale' OR payer_type = 'Non-payer'",
+    "SELECT COUNT(DISTINCT user_id) FROM user_days "
+    "WHERE platform = 'ios' OR country = 'US' AND event_day_pst = '2024-01-05'",
+])
+def test_day_conditions_under_a_top_level_or_run_on_user_days(tmp_path, sql):
+    conn = _database(tmp_path, 1)
+    assert _index(conn).plan(sql) is None
+
+
+def test_top_level_or_binds_looser_than_and(tmp_path):
+    sql = ("SELECT COUNT(DISTINCT user_id) FROM user_days "
+           "WHERE payer_type = 'Whale' AND platform = 'ios' OR platform = 'android' AND engagement_7d = 3")
+    conn = _database(tmp_path, 1)
+    answer = _index(conn).answer(sql)
+    assert answer is not None
+    assert _rows(answer) == sorted(conn.execute(sql).fetchall())
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE engagement_7d = '3'",
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE engagement_7d IN ('3', '4')",
+    "SELECT COUNT(*) FROM user_days WHERE engagement_7d > '5'",
+])
+def test_text_literals_take_the_column_affinity(tmp_path, sql):
+    conn = _database(tmp_path, 1)
+    answer = _index(conn).answer(sql)
+    assert answer is not None
+    assert _rows(answer) == sorted(conn.execute(sql).fetchall()) != [(0,)]
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import pipeline
+from service import HTTPError, QueryService, _max_rows
+
+
+@pytest.mark.parametrize("value", ["10", -1, 1.5, True, [10]])
+def test_invalid_max_rows_is_a_bad_request(value):
+    with pytest.raises(HTTPError) as raised:
+        _max_rows({"max_rows": value})
+    assert raised.value.status == 400
+
+
+@pytest.mark.parametrize("value", [None, 0, 25])
+def test_valid_max_rows(value):
+    assert _max_rows({"max_rows": value} if value is not None else {}) == value
+
+
+def test_insight_producer_stops_when_the_client_goes_away(monkeypatch):
+    produced = []
+    closed = threading.Event()
+
+    def stream(df, question, fingerprint):
+        try:
+            for i in range(100):
+                produced.append(i)
+                yield "insight", str(i)
+                time.sleep(0.01)
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(pipeline, "load_result", lambda fingerprint: pd.DataFrame({"x": [1]}))
+    monkeypatch.setattr(pipeline, "stream_result_insights", stream)
+    service = QueryService(1, 1)
+
+    async def read_one():
+        events = service.stream_insights("f", "q")
+        assert await events.__anext__() == ("insight", "0")
+        await events.aclose()
+
+    try:
+        asyncio.run(read_one())
+        assert closed.wait(2)
+        assert len(produced) < 100
+    finally:
+        service.close()
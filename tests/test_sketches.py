@@ -0,0 +1,73 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from sketches import (RELATIVE_ERROR_95, STANDARD_ERROR, build_sketches, estimate, register_functions,
+                      registers_of, rewrite_for_sketches)
+
+CARDINALITIES = [10_000, 20_000, 40_000, 60_000, 100_000, 300_000, 1_000_000]
+TRIALS = 20
+
+
+def _errors(cardinality, ids):
+    return np.array([estimate(registers_of(ids(trial))) / cardinality - 1 for trial in range(TRIALS)])
+
+
+def _sequential(cardinality):
+    return lambda trial: np.arange(trial * cardinality, (trial + 1) * cardinality, dtype=np.uint64)
+
+
+def _random(cardinality):
+    return lambda trial: np.random.default_rng(trial).choice(2 ** 62, cardinality, replace=False).astype(np.uint64)
+
+
+@pytest.mark.parametrize("ids", [_sequential, _random], ids=["sequential", "random"])
+@pytest.mark.parametrize("cardinality", CARDINALITIES)
+def test_estimates_are_unbiased_and_within_the_95_bound(cardinality, ids):
+    errors = _errors(cardinality, ids(cardinality))
+    assert abs(errors.mean()) < STANDARD_ERROR / 2
+    assert np.mean(np.abs(errors) <= RELATIVE_ERROR_95) >= 0.9
+
+
+@pytest.mark.parametrize("cardinality", [0, 1, 10, 1000])
+def test_small_cardinalities_are_exact_or_close(cardinality):
+    ids = np.arange(cardinality, dtype=np.uint64)
+    assert estimate(registers_of(ids)) == pytest.approx(cardinality, rel=0.01, abs=0.5)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """user_days over 10 days of 5000 users, with engagement_7d declared INTEGER."""
+    path = tmp_path / "analytics.db"
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE user_days (user_id INTEGER, event_day_pst TEXT, payer_type TEXT, platform TEXT, "
+        "country TEXT, engagement_7d INTEGER)"
+    )
+    conn.executemany("INSERT INTO user_days VALUES (?, ?, ?, ?, ?, ?)", [
+        (user, f"2024-01-{day:02d}", None, "ios" if user % 2 else "android", "US", user % 8)
+        for user in range(5000) for day in range(1, 11) if (user + day) % 3
+    ])
+    conn.commit()
+    build_sketches(str(path))
+    register_functions(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE engagement_7d = '7'",
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE engagement_7d IN ('7', '6') AND event_day_pst > '2024-01-03'",
+    "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE engagement_7d = 7",
+])
+def test_literals_convert_as_against_user_days(conn, sql):
+    exact = conn.execute(sql).fetchone()[0]
+    estimated = conn.execute(rewrite_for_sketches(sql).sql).fetchone()[0]
+    assert exact > 0
+    assert estimated == pytest.approx(exact, rel=RELATIVE_ERROR_95)
+
+
+def test_no_matching_sketches_count_zero_users(conn):
+    sql = "SELECT COUNT(DISTINCT user_id) FROM user_days WHERE platform = 'web'"
+    assert conn.execute(rewrite_for_sketches(sql).sql).fetchone()[0] == 0
@@ -0,0 +1,106 @@
+import pytest
+
+from sql_parser import SQLParseError, closing_paren, parse_sql, split_tokens, sql_literal, tokenize
+
+CATALOG = {"user_days": ["user_id", "event_day_pst", "platform", "payer_type", "bookings"]}
+
+
+def test_keywords_inside_names_and_strings_are_not_statements():
+    parsed = parse_sql("SELECT last_updated, 'DROP TABLE x' AS note FROM user_days")
+    assert parsed.is_read_only
+    assert parsed.read_only_error() is None
+
+
+def test_write_statements_are_rejected():
+    assert parse_sql("SELECT 1; DELETE FROM user_days").read_only_error() == (
+        "Only a single SQL statement can be executed."
+    )
+    assert parse_sql("DELETE FROM user_days").read_only_error() == "Only SELECT queries can be executed (got DELETE)."
+
+
+def test_unknown_table_and_column():
+    assert parse_sql("SELECT platform FROM user_dayz").check_catalog(CATALOG) == [
+        "Unknown table(s): user_dayz (did you mean user_days?)"
+    ]
+    problems = parse_sql("SELECT platfrom FROM user_days").check_catalog(CATALOG)
+    assert problems == ["Unknown column(s): platfrom (did you mean platform?)"]
+
+
+def test_comma_join_after_derived_table_alias_is_a_table():
+    parsed = parse_sql("SELECT a.platform FROM (SELECT platform FROM user_days) a, user_days b")
+    assert parsed.tables == {"user_days"}
+    assert [ref[3] for ref in parsed.table_refs] == [None, "b"]
+    assert parsed.check_catalog(CATALOG) == []
+
+
+def test_comma_join_after_derived_table_checks_the_table_name():
+    parsed = parse_sql("SELECT x FROM (SELECT platform AS x FROM user_days WHERE bookings > 0) t, user_dayz")
+    assert parsed.tables == {"user_days", "user_dayz"}
+
+
+def test_subquery_in_where_does_not_reopen_the_from_list():
+    parsed = parse_sql(
+        "SELECT platform FROM user_days WHERE user_id IN (SELECT user_id FROM user_days) ORDER BY platform"
+    )
+    assert parsed.check_catalog(CATALOG) == []
+
+
+def test_cte_names_are_not_tables():
+    parsed = parse_sql("WITH d AS (SELECT platform FROM user_days) SELECT platform FROM d")
+    assert parsed.tables == {"user_days"}
+    assert parsed.check_catalog(CATALOG) == []
+
+
+def test_with_limit_adds_tightens_and_wraps():
+    assert parse_sql("SELECT platform FROM user_days").with_limit(10).endswith("LIMIT 10")
+    assert parse_sql("SELECT platform FROM user_days LIMIT 500").with_limit(10).endswith("LIMIT 10")
+    assert parse_sql("SELECT platform FROM user_days LIMIT 5").with_limit(10).endswith("LIMIT 5")
+    assert parse_sql("SELECT platform FROM user_days LIMIT ?").with_limit(10).startswith("SELECT * FROM (")
+
+
+def test_unbalanced_parentheses_raise():
+    with pytest.raises(SQLParseError):
+        parse_sql("SELECT (platform FROM user_days")
+
+
+def test_named_windows_are_not_columns():
+    parsed = parse_sql(
+        "SELECT platform, SUM(bookings) OVER w AS running, RANK() OVER w2 FROM user_days "
+        "WINDOW w AS (PARTITION BY platform ORDER BY event_day_pst), w2 AS (ORDER BY bookings)"
+    )
+    assert parsed.check_catalog(CATALOG) == []
+
+
+def test_named_window_bodies_are_still_checked():
+    parsed = parse_sql("SELECT SUM(bookings) OVER w FROM user_days WINDOW w AS (PARTITION BY platfrom)")
+    assert parsed.check_catalog(CATALOG) == ["Unknown column(s): platfrom (did you mean platform?)"]
+
+
+def test_table_valued_function_columns_are_known():
+    parsed = parse_sql("SELECT j.key, value FROM user_days, json_each('[1, 2]') AS j WHERE j.type = 'integer'")
+    assert parsed.tables == {"user_days"}
+    assert parsed.check_catalog(CATALOG) == []
+    assert parse_sql("SELECT valu FROM json_each('[1]')").check_catalog(CATALOG) == [
+        "Unknown column(s): valu (did you mean value?)"
+    ]
+
+
+def test_normalized_folds_keyword_case_only():
+    assert parse_sql("select  Platform, count(*) as Users  -- note\nfrom user_days;").normalized == \
+        "SELECT Platform, count(*) AS Users FROM user_days"
+    assert parse_sql("SELECT platform FROM user_days").normalized != \
+        parse_sql("SELECT Platform FROM user_days").normalized
+    assert parse_sql("SELECT x AS Last FROM t").normalized != parse_sql("SELECT x AS last FROM t").normalized
+
+
+def test_token_helpers():
+    tokens = tokenize("a BETWEEN 1 AND 2 AND (b = 1 OR c = 2), d")
+    parts = split_tokens(tokens, list(range(len(tokens))), "AND")
+    assert [" ".join(tokens[i].value for i in part) for part in parts] == [
+        "a BETWEEN 1 AND 2", "( b = 1 OR c = 2 ) , d"
+    ]
+    assert closing_paren(tokens, 6) == 14
+    with pytest.raises(SQLParseError):
+        split_tokens(tokenize("a, , b"), [0, 1, 2, 3], ",")
+    assert sql_literal("it's") == "'it''s'"
+    assert [sql_literal(v) for v in (None, True, 3, 1.5, b"\x01")] == ["NULL", "1", "3", "1.5", "X'01'"]
@@ -0,0 +1,297 @@
+"""
+Lightweight span tracing for the question-to-chart pipeline.
+
+``with span("db.execute_query") as s: ...; s.set(rows=len(df))`` times a
+stage and nests it under whichever span is current in the calling context
+(a ``contextvars.ContextVar``, so nesting follows threads that run with a
+copied context, e.g. the service worker pools). When an outermost span
+finishes it is exported:
+
+- appended as one JSON line (the whole span tree) to ``Config.TRACE_LOG_PATH``
+- folded into in-process stage metrics, rendered in Prometheus text format by
+  ``prometheus_text()`` (served at ``/metrics`` by service.py, or on
+  ``Config.METRICS_PORT`` via ``start_metrics_server``)
+
+Attributes named ``rows``, ``prompt_tokens`` and ``completion_tokens`` are
+also counted in the metrics, as are spans marked ``coalesced=True``. Tracing
+never raises into the traced code.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed stage; ``children`` are the stages it contained."""
+
+    __slots__ = ("name", "attrs", "children", "started_at", "duration_ms", "error", "_t0")
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attrs: Dict[str, Any] = {}
+        self.children: List["Span"] = []
+        self.started_at = time.time()
+        self.duration_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self._t0 = time.perf_counter()
+        self.set(**(attrs or {}))
+
+    def set(self, **attrs):
+        """Attach attributes (row counts, token counts, cache hits...); None values are dropped."""
+        self.attrs.update({k: v for k, v in attrs.items() if v is not None})
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._t0) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {
+            "name": self.name,
+            "start": round(self.started_at, 6),
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.error:
+            data["error"] = self.error
+        if self.children:
+            data["children"] = [child.to_dict() for child in self.children]
+        return data
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def annotate(**attrs):
+    """Set attributes on the current span, if any."""
+    active = _current.get()
+    if active is not None:
+        active.set(**attrs)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Span]:
+    """Time the enclosed block as a stage nested under the current span."""
+    parent = _current.get()
+    active = Span(name, attrs)
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        active.finish()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Exited from a different context than it was entered in
+            _current.set(parent)
+        _attach(parent, active)
+
+
+def record(name: str, started: float, **attrs) -> Span:
+    """Record an already-finished stage that began at ``time.perf_counter() == started``.
+
+    For work that cannot sit inside a ``with`` block, such as a generator
+    that yields to its caller between chunks.
+    """
+    finished = Span(name, attrs)
+    finished.duration_ms = (time.perf_counter() - started) * 1000
+    finished.started_at -= finished.duration_ms / 1000
+    _attach(_current.get(), finished)
+    return finished
+
+
+def _attach(parent: Optional[Span], finished: Span):
+    if parent is not None:
+        parent.children.append(finished)
+    else:
+        export(finished)
+
+
+def span_rows(root: Span) -> List[Dict[str, Any]]:
+    """Flatten a span tree into display rows (indented stage, ms, share of the root, details)."""
+    total = root.duration_ms or 0.0
+    rows: List[Dict[str, Any]] = []
+
+    def walk(node: Span, depth: int):
+        details = [f"{k}={v}" for k, v in node.attrs.items()]
+        if node.error:
+            details.append(f"error={node.error}")
+        rows.append({
+            "stage": "  " * depth + node.name,
+            "ms": round(node.duration_ms or 0.0, 1),
+            "share": f"{(node.duration_ms or 0.0) / total:.0%}" if total else "",
+            "details": ", ".join(details),
+        })
+        for child in node.children:
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return rows
+
+
+class StageMetrics:
+    """Per-stage duration histograms and row/token/error counters."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, List[float]] = {}
+        self._counters: Dict[tuple, float] = {}
+
+    def observe(self, root: Span):
+        with self._lock:
+            self._observe(root)
+
+    def _observe(self, node: Span):
+        seconds = (node.duration_ms or 0.0) / 1000
+        # Layout: one count per bucket, then +Inf count, then sum
+        hist = self._histograms.setdefault(node.name, [0.0] * (len(self.BUCKETS) + 2))
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+        hist[-2] += 1
+        hist[-1] += seconds
+
+        attrs = node.attrs
+        if isinstance(attrs.get("rows"), (int, float)):
+            self._inc(("analytics_stage_rows_total", node.name, None), attrs["rows"])
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if isinstance(attrs.get(kind), (int, float)):
+                self._inc(("analytics_llm_tokens_total", node.name, kind.split("_")[0]), attrs[kind])
+        if attrs.get("coalesced") is True:
+            self._inc(("analytics_coalesced_calls_total", node.name, None), 1)
+        if node.error:
+            self._inc(("analytics_stage_errors_total", node.name, None), 1)
+        for child in node.children:
+            self._observe(child)
+
+    def _inc(self, key: tuple, value: float):
+        self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = [
+            "# HELP analytics_stage_duration_seconds Time spent in each pipeline stage.",
+            "# TYPE analytics_stage_duration_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+            counters = dict(self._counters)
+        for name in sorted(histograms):
+            values = histograms[name]
+            label = _escape(name)
+            for bound, count in zip(self.BUCKETS, values):
+                lines.append(f'analytics_stage_duration_seconds_bucket{{stage="{label}",le="{bound}"}} {count:g}')
+            lines.append(f'analytics_stage_duration_seconds_bucket{{stage="{label}",le="+Inf"}} {values[-2]:g}')
+            lines.append(f'analytics_stage_duration_seconds_sum{{stage="{label}"}} {values[-1]:.6f}')
+            lines.append(f'analytics_stage_duration_seconds_count{{stage="{label}"}} {values[-2]:g}')
+
+        helps = {
+            "analytics_stage_rows_total": "Rows produced by each stage.",
+            "analytics_llm_tokens_total": "LLM tokens used by each stage.",
+            "analytics_stage_errors_total": "Stages that raised.",
+            "analytics_coalesced_calls_total": "Calls answered by an identical call already in flight.",
+        }
+        for metric, help_text in helps.items():
+            series = sorted((k, v) for k, v in counters.items() if k[0] == metric)
+            if not series:
+                continue
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for (_, stage, kind), value in series:
+                labels = f'stage="{_escape(stage)}"' + (f',kind="{kind}"' if kind else "")
+                lines.append(f"{metric}{{{labels}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = StageMetrics()
+_sink_lock = threading.Lock()
+
+
+def export(root: Span):
+    """Send a finished outermost span to the metrics and the JSONL sink."""
+    if not Config.TRACE_ENABLED:
+        return
+    try:
+        METRICS.observe(root)
+        if Config.TRACE_LOG_PATH:
+            line = json.dumps({"trace_id": uuid.uuid4().hex[:16], **root.to_dict()}, default=str)
+            with _sink_lock:
+                _write_line(Config.TRACE_LOG_PATH, line)
+    except Exception as e:
+        logger.warning("Trace export failed: %s", e)
+
+
+def _write_line(path: str, line: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Keep a single previous generation once the log reaches its size limit
+    if os.path.exists(path) and os.path.getsize(path) >= Config.TRACE_LOG_MAX_BYTES:
+        os.replace(path, path + ".1")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(line + "\n")
+
+
+def prometheus_text() -> str:
+    return METRICS.render()
+
+
+_metrics_server = None
+_metrics_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> bool:
+    """Serve ``GET /metrics`` from a daemon thread (idempotent). Returns False if the port is taken."""
+    global _metrics_server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0].rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug("metrics: " + format, *args)
+
+    with _metrics_server_lock:
+        if _metrics_server is not None:
+            return True
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+            return False
+        threading.Thread(target=_metrics_server.serve_forever, name="metrics", daemon=True).start()
+        return True